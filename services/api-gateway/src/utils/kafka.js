@@ -1,3 +1,4 @@
+const crypto = require('crypto');
 const { Kafka } = require('kafkajs');
 
 const KAFKA_BROKERS = (process.env.KAFKA_BOOTSTRAP_SERVERS || 'kafka:9092').split(',');
@@ -34,7 +35,8 @@ async function publishToKafka(topic, message) {
       topic,
       messages: [
         {
-          value: JSON.stringify(message),
+          // Unique id per event so consumers can drop redelivered duplicates
+          value: JSON.stringify({ event_id: crypto.randomUUID(), ...message }),
           timestamp: Date.now().toString()
         }
       ]
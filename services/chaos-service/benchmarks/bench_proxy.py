@@ -0,0 +1,91 @@
+"""
+Benchmark: chaos proxy overhead with no fault firing
+Starts a minimal upstream and the chaos service as separate uvicorn processes,
+then compares sequential request latency direct vs through /proxy
+
+Run with: python benchmarks/bench_proxy.py [requests] [body_bytes]
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+BODY_BYTES = int(os.getenv('BENCH_BODY_BYTES', 1024))
+
+
+async def upstream_app(scope, receive, send):
+    """Fixed-size response, as cheap as an upstream can be"""
+    if scope["type"] != "http":
+        return
+    body = b"x" * BODY_BYTES
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/octet-stream"),
+                            (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(app, port, app_dir, env=None):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--app-dir", app_dir, "--log-level", "warning"],
+        env={**os.environ, **(env or {})}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{app} did not start on port {port}")
+
+
+def measure(client, url, count):
+    for _ in range(min(200, count)):  # warm up connections
+        client.get(url)
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        client.get(url).raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    body_bytes = sys.argv[2] if len(sys.argv) > 2 else str(BODY_BYTES)
+
+    upstream_port, chaos_port = free_port(), free_port()
+    upstream = start_server("bench_proxy:upstream_app", upstream_port, BENCH_DIR, {"BENCH_BODY_BYTES": body_bytes})
+    chaos = start_server("main:app", chaos_port, SERVICE_DIR, {
+        "PROXY_UPSTREAMS": f"bench=http://127.0.0.1:{upstream_port}",
+        "KAFKA_BOOTSTRAP_SERVERS": "127.0.0.1:1",
+    })
+    try:
+        with httpx.Client() as client:
+            direct = measure(client, f"http://127.0.0.1:{upstream_port}/data", count)
+            proxied = measure(client, f"http://127.0.0.1:{chaos_port}/proxy/bench/data", count)
+    finally:
+        upstream.terminate()
+        chaos.terminate()
+
+    print(f"{'path':<10}{'requests':>9}{'p50 ms':>9}{'p99 ms':>9}")
+    print(f"{'direct':<10}{count:>9}{direct[0] * 1000:>9.3f}{direct[1] * 1000:>9.3f}")
+    print(f"{'proxied':<10}{count:>9}{proxied[0] * 1000:>9.3f}{proxied[1] * 1000:>9.3f}")
+    print(f"proxy overhead p50: {(proxied[0] - direct[0]) * 1000:.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
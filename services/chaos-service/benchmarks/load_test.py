@@ -0,0 +1,74 @@
+"""
+Load test: concurrent delayed requests against the chaos service
+Fires `concurrency` simultaneous requests at /chaos/test/slow with a fixed
+delay and reports wall time, throughput and latency percentiles. With async
+handlers the wall time stays close to a single delay; with sleeping sync
+handlers it grows with concurrency / threadpool size.
+
+Run in-process:        python benchmarks/load_test.py [concurrency] [delay_ms]
+Against a live service: python benchmarks/load_test.py 5000 500 http://localhost:8004
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+async def run(concurrency, delay_ms, base_url=None):
+    if base_url:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        client = httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60)
+    else:
+        from main import app
+        client = httpx.AsyncClient(app=app, base_url="http://chaos", timeout=60)
+
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            response = await client.get("/chaos/test/slow", params={"min_ms": delay_ms, "max_ms": delay_ms})
+            response.raise_for_status()
+        except httpx.HTTPError:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - start)
+
+    async with client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+    return wall, sorted(latencies), errors
+
+
+def main():
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    delay_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    base_url = sys.argv[3] if len(sys.argv) > 3 else None
+
+    wall, latencies, errors = asyncio.run(run(concurrency, delay_ms, base_url))
+
+    print(f"{'requests':>9}{'delay ms':>10}{'errors':>8}{'wall s':>9}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    if latencies:
+        print(f"{concurrency:>9}{delay_ms:>10}{errors:>8}{wall:>9.2f}{len(latencies) / wall:>9.0f}"
+              f"{percentile(latencies, 50) * 1000:>9.0f}{percentile(latencies, 99) * 1000:>9.0f}"
+              f"{latencies[-1] * 1000:>9.0f}")
+    else:
+        print(f"{concurrency:>9}{delay_ms:>10}{errors:>8}{wall:>9.2f}{'-':>9}{'-':>9}{'-':>9}{'-':>9}")
+
+
+if __name__ == '__main__':
+    main()
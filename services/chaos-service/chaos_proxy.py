@@ -0,0 +1,279 @@
+"""
+Traffic-shaping reverse proxy for the chaos service
+Forwards /proxy/<upstream>/<path> to a configured upstream service and applies
+the fault profile of the first matching route: latency, errors, bandwidth
+throttling and dropped connections
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import httpx
+from pydantic import BaseModel
+
+import prometheus_metrics
+from kafka_producer import publish_event_nowait
+
+logger = logging.getLogger(__name__)
+
+# Connection-level headers that must not be forwarded (RFC 9110 section 7.6.1)
+HOP_BY_HOP_HEADERS = frozenset({
+    b'connection', b'keep-alive', b'proxy-authenticate', b'proxy-authorization',
+    b'proxy-connection', b'te', b'trailer', b'transfer-encoding', b'upgrade',
+})
+
+# Largest piece of body sent at once while throttling, in seconds of bandwidth
+THROTTLE_SLICE_SECONDS = 0.05
+
+
+class LatencyProfile(BaseModel):
+    """Delay added before a request is forwarded.
+
+    normal: gauss(mean_ms, stddev_ms); pareto: scale_ms * paretovariate(shape),
+    a heavy tail whose minimum is scale_ms; uniform: between min_ms and max_ms.
+    Samples are clamped to [min_ms, max_ms].
+    """
+    distribution: str = "normal"  # normal, pareto or uniform
+    probability: float = 1.0
+    mean_ms: float = 100
+    stddev_ms: float = 25
+    scale_ms: float = 50
+    shape: float = 1.5
+    min_ms: float = 0
+    max_ms: float = 30000
+
+    def sample_ms(self):
+        if self.distribution == "pareto":
+            delay = self.scale_ms * random.paretovariate(self.shape)
+        elif self.distribution == "uniform":
+            delay = random.uniform(self.min_ms, self.max_ms)
+        else:
+            delay = random.gauss(self.mean_ms, self.stddev_ms)
+        return min(max(delay, self.min_ms), self.max_ms)
+
+
+class RouteFault(BaseModel):
+    """Faults for requests to one upstream route.
+
+    A route matches on upstream name ("*" for any), path prefix and method
+    (empty for any). A dropped connection forwards the upstream status,
+    headers and the first `reset_after_bytes` body bytes, then closes the
+    connection without completing the response.
+    """
+    upstream: str = "*"
+    path_prefix: str = "/"
+    methods: List[str] = []
+    latency: Optional[LatencyProfile] = None
+    error_rate: float = 0.0
+    error_codes: List[int] = [500, 502, 503, 504]
+    reset_rate: float = 0.0
+    reset_after_bytes: int = 0
+    bandwidth_bytes_per_second: Optional[int] = None
+
+    def matches(self, upstream, method, path):
+        return ((self.upstream == "*" or self.upstream == upstream)
+                and path.startswith(self.path_prefix)
+                and (not self.methods or method in self.methods))
+
+
+def parse_upstreams(value):
+    """Parse "name=url,name=url" into {name: url}"""
+    upstreams = {}
+    for item in value.split(','):
+        if '=' in item:
+            name, url = item.split('=', 1)
+            upstreams[name.strip()] = url.strip().rstrip('/')
+    return upstreams
+
+
+class ChaosProxy:
+    """ASGI app proxying /<upstream>/<path> to the named upstream.
+
+    `get_config()` returns (enabled, routes) and is called once per request,
+    so config updates apply to the next request. While chaos is enabled and
+    `scenarios` has a run active, its fault for the request takes precedence
+    over the route profile. Bodies are streamed in both
+    directions chunk by chunk, exactly as received; with no fault firing a
+    request costs a route lookup and the forwarding itself.
+    """
+
+    def __init__(self, upstreams, get_config, timeout_seconds=30.0, max_connections=1000,
+                 transport=None, scenarios=None):
+        self.upstreams = upstreams
+        self.get_config = get_config
+        self.scenarios = scenarios
+        self._transport = transport
+        self._timeout = httpx.Timeout(timeout_seconds).as_dict()
+        self._limits = httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections)
+
+    @property
+    def transport(self):
+        # Requests go straight to the connection pool: a Client would add
+        # cookie persistence shared between callers, redirects and logging
+        # per request. Created on first use to bind to the server's event loop.
+        if self._transport is None:
+            self._transport = httpx.AsyncHTTPTransport(limits=self._limits)
+        return self._transport
+
+    async def aclose(self):
+        if self._transport is not None:
+            await self._transport.aclose()
+            self._transport = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+
+        upstream, _, path = scope["path"].partition("/")[2].partition("/")
+        path = "/" + path
+        base_url = self.upstreams.get(upstream)
+        if base_url is None:
+            await send_json(send, 404, b'{"detail":"Unknown upstream"}')
+            return
+
+        method = scope["method"]
+        enabled, routes = self.get_config()
+        fault = planned = None
+        if enabled:
+            if self.scenarios is not None:
+                planned = self.scenarios.next_fault()
+            if planned is None:
+                for route in routes:
+                    if route.matches(upstream, method, path):
+                        fault = route
+                        break
+
+        start = time.perf_counter()
+        if planned is not None and planned.kind != 'latency':
+            status = await inject_planned(planned, send)
+        else:
+            if planned is not None:
+                await asyncio.sleep(planned.delay_ms / 1000)
+            status = await self._forward(upstream, base_url, path, method, scope, receive, send, fault)
+        prometheus_metrics.record_proxy_request(upstream, status, time.perf_counter() - start)
+
+    async def _forward(self, upstream, base_url, path, method, scope, receive, send, fault):
+        reset = False
+        if fault is not None:
+            if fault.latency is not None and random.random() < fault.latency.probability:
+                delay_ms = fault.latency.sample_ms()
+                prometheus_metrics.record_proxy_delay(upstream, delay_ms)
+                await asyncio.sleep(delay_ms / 1000)
+            if fault.error_rate and random.random() < fault.error_rate:
+                error_code = random.choice(fault.error_codes)
+                record_fault(upstream, 'error', method, path, f'HTTP {error_code}')
+                await send_json(send, error_code, b'{"detail":"Chaos proxy injected error"}')
+                return str(error_code)
+            reset = bool(fault.reset_rate) and random.random() < fault.reset_rate
+
+        url = base_url + path
+        if scope["query_string"]:
+            url += "?" + scope["query_string"].decode("latin-1")
+        headers = [(k, v) for k, v in scope["headers"] if k not in HOP_BY_HOP_HEADERS and k != b'host']
+        if scope.get("client"):
+            headers.append((b'x-forwarded-for', scope["client"][0].encode("latin-1")))
+        has_body = any(k in (b'content-length', b'transfer-encoding') for k, _ in scope["headers"])
+
+        request = httpx.Request(
+            method, url, headers=headers, content=stream_request_body(receive) if has_body else None,
+            extensions={"timeout": self._timeout},
+        )
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TimeoutException:
+            await send_json(send, 504, b'{"detail":"Upstream timed out"}')
+            return "504"
+        except httpx.HTTPError as e:
+            logger.warning(f"Proxy request to {upstream} failed: {e}")
+            await send_json(send, 502, b'{"detail":"Upstream unavailable"}')
+            return "502"
+
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [(k, v) for k, v in response.headers.raw if k.lower() not in HOP_BY_HOP_HEADERS],
+            })
+            if reset:
+                record_fault(upstream, 'reset', method, path, f'Connection dropped after {fault.reset_after_bytes} bytes')
+                await forward_body(response, send, limit=fault.reset_after_bytes)
+                # Returning without the final body message makes the server close the connection
+                return "reset"
+            if fault is not None and fault.bandwidth_bytes_per_second:
+                prometheus_metrics.record_proxy_fault(upstream, 'throttle')
+            await forward_body(response, send, fault.bandwidth_bytes_per_second if fault else None)
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await response.aclose()
+        return str(response.status_code)
+
+
+async def stream_request_body(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body = message.get("body", b"")
+        if body:
+            yield body
+        if not message.get("more_body", False):
+            return
+
+
+async def forward_body(response, send, bytes_per_second=None, limit=None):
+    """Relay upstream body chunks, paced to `bytes_per_second` and cut at `limit` bytes"""
+    sent = 0
+    start = time.monotonic()
+    async for chunk in response.stream:
+        if limit is not None and sent + len(chunk) >= limit:
+            chunk = chunk[:limit - sent]
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            return
+        if not bytes_per_second:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            sent += len(chunk)
+            continue
+
+        step = max(1, int(bytes_per_second * THROTTLE_SLICE_SECONDS))
+        view = memoryview(chunk)
+        for offset in range(0, len(view), step):
+            piece = view[offset:offset + step]
+            await send({"type": "http.response.body", "body": bytes(piece), "more_body": True})
+            sent += len(piece)
+            ahead = sent / bytes_per_second - (time.monotonic() - start)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+
+async def inject_planned(planned, send):
+    """Answer with a scenario's error or timeout instead of forwarding"""
+    if planned.kind == 'timeout':
+        await asyncio.sleep(planned.delay_ms / 1000)
+        await send_json(send, 504, b'{"detail":"Chaos scenario timeout"}')
+    else:
+        await send_json(send, planned.status, b'{"detail":"Chaos scenario error"}')
+    return str(planned.status)
+
+
+async def send_json(send, status, body):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def record_fault(upstream, fault, method, path, details):
+    prometheus_metrics.record_proxy_fault(upstream, fault)
+    publish_event_nowait('chaos.injected', {
+        'chaos_type': f'proxy_{fault}',
+        'service': upstream,
+        'details': f'{method} {path}: {details}',
+        'timestamp': datetime.utcnow().isoformat()
+    })
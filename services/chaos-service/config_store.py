@@ -0,0 +1,252 @@
+"""
+Chaos config shared by every chaos-service replica
+Updates are stored with a version number in Redis and pushed to all replicas
+over pub/sub; each replica applies them to its local copy, so request handlers
+never wait on the network. Versions count up within an epoch, an id the
+store picks when it has no config yet, so a flushed or failed-over Redis
+starts a new epoch instead of replaying old version numbers.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import prometheus_metrics
+
+logger = logging.getLogger(__name__)
+
+# Identifies this replica in published updates
+REPLICA_ID = os.getenv('HOSTNAME') or uuid.uuid4().hex[:12]
+
+# Bumps the version, stores the document and announces it in one atomic step,
+# so replicas see updates in version order. ARGV[1] becomes the epoch if the
+# key has none (first update, or the key was lost). Then come (field, JSON
+# value, overwrite) triples: each field is kept in its own hash field, and one
+# with overwrite '0' only fills in a value the store does not have yet.
+PUBLISH_SCRIPT = """
+redis.call('HSETNX', KEYS[1], 'epoch', ARGV[1])
+local epoch = redis.call('HGET', KEYS[1], 'epoch')
+local parts = {}
+for i = 2, #ARGV, 3 do
+    local field = 'field:' .. ARGV[i]
+    if ARGV[i + 2] == '1' then
+        redis.call('HSET', KEYS[1], field, ARGV[i + 1])
+    else
+        redis.call('HSETNX', KEYS[1], field, ARGV[i + 1])
+    end
+    parts[#parts + 1] = '"' .. ARGV[i] .. '": ' .. redis.call('HGET', KEYS[1], field)
+end
+local doc = '{' .. table.concat(parts, ', ') .. '}'
+local version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('HSET', KEYS[1], 'doc', doc)
+redis.call('PUBLISH', KEYS[2], version .. ':' .. epoch .. ':' .. doc)
+return {version, epoch, doc}
+"""
+
+
+def new_epoch():
+    return uuid.uuid4().hex[:12]
+
+
+class MemoryConfigBus:
+    """In-process stand-in for Redis, for a single replica and for tests.
+
+    Replicas sharing one instance behave like replicas sharing a Redis:
+    publish() merges the document into the stored one under the next version
+    and hands it to every subscriber. reset() drops the stored config like a
+    Redis flush.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._epoch = None
+            self._version = 0
+            self._doc = None
+
+    def load(self):
+        """The current (version, document, epoch), or None before the first update"""
+        with self._lock:
+            return (self._version, json.loads(self._doc), self._epoch) if self._doc else None
+
+    def publish(self, doc, changed=None):
+        """Store and announce a document; returns its (version, epoch, stored document).
+
+        Fields not in `changed` (default: every field) keep their stored value.
+        """
+        with self._lock:
+            self._epoch = self._epoch or new_epoch()
+            self._version += 1
+            version, epoch = self._version, self._epoch
+            stored = json.loads(self._doc) if self._doc else {}
+            merged = {field: stored[field] if changed is not None and field not in changed and field in stored
+                      else value for field, value in doc.items()}
+            self._doc = encoded = json.dumps(merged)
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(version, json.loads(encoded), epoch)
+        return version, epoch, json.loads(encoded)
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def close(self):
+        self._subscribers.clear()
+
+
+class RedisConfigBus:
+    """Config document in a Redis hash, updates announced on a channel.
+
+    The subscriber thread reloads the stored document whenever it
+    (re)subscribes, so updates published while it was disconnected are not
+    lost.
+    """
+
+    def __init__(self, client, key='chaos-service:config', channel='chaos-service:config-updates',
+                 retry_seconds=1.0):
+        self.client = client
+        self.key = key
+        self.channel = channel
+        self.retry_seconds = retry_seconds
+        self._publish = client.register_script(PUBLISH_SCRIPT)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def load(self):
+        version, doc, epoch = self.client.hmget(self.key, ['version', 'doc', 'epoch'])
+        if doc is None:
+            return None
+        return int(version), json.loads(doc), epoch.decode('utf-8') if epoch else None
+
+    def publish(self, doc, changed=None):
+        args = [new_epoch()]
+        for field, value in doc.items():
+            args += [field, json.dumps(value), '1' if changed is None or field in changed else '0']
+        version, epoch, stored = self._publish(keys=[self.key, self.channel], args=args)
+        return int(version), epoch.decode('utf-8'), json.loads(stored)
+
+    def subscribe(self, callback):
+        self._thread = threading.Thread(target=self._listen, args=(callback,),
+                                        name="config-subscriber", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(5)
+
+    def _listen(self, callback):
+        while not self._stop_event.is_set():
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                loaded = self.load()
+                if loaded:
+                    callback(*loaded)
+                while not self._stop_event.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message['type'] == 'message':
+                        version, epoch, doc = message['data'].decode('utf-8').split(':', 2)
+                        callback(int(version), json.loads(doc), epoch)
+            except Exception as e:
+                logger.warning(f"Config subscription failed, retrying: {e}")
+                prometheus_metrics.record_config_sync_error()
+                self._stop_event.wait(self.retry_seconds)
+            finally:
+                pubsub.close()
+
+
+class ReplicatedConfig:
+    """This replica's cached copy of the shared chaos config.
+
+    `apply(enabled, config)` installs a document locally; it runs for every
+    newer version of the current epoch, whether published here or by another
+    replica. Repeated versions are ignored. For an older version or another
+    epoch the stored config decides: a stale message (the pub/sub message
+    and the reload on resubscribe racing) leaves it unchanged, while a store
+    that was flushed or failed over is followed from its new state.
+    """
+
+    def __init__(self, bus, apply, replica_id=REPLICA_ID):
+        self.bus = bus
+        self.apply = apply
+        self.replica_id = replica_id
+        self.version = 0
+        self.epoch = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Load the current shared config, then follow updates"""
+        try:
+            loaded = self.bus.load()
+            if loaded:
+                self.receive(*loaded)
+        except Exception as e:
+            logger.warning(f"Could not load shared chaos config, using local defaults: {e}")
+            prometheus_metrics.record_config_sync_error()
+        self.bus.subscribe(self.receive)
+
+    def publish(self, enabled, config, changed=('enabled', 'config')):
+        """Store a new config for all replicas and apply it here; returns its version.
+
+        Only the `changed` fields overwrite the shared config, the others
+        keep their stored value: replicas changing different fields at the
+        same time do not undo each other with stale local copies.
+        """
+        doc = {
+            'enabled': enabled,
+            'config': config,
+            'replica': self.replica_id,
+            'updated_at': time.time(),
+        }
+        version, epoch, doc = self.bus.publish(doc, {*changed, 'replica', 'updated_at'})
+        self.receive(version, doc, epoch)
+        return version
+
+    def receive(self, version, doc, epoch=None):
+        with self._lock:
+            if (version, epoch) == (self.version, self.epoch):
+                return
+            if self.epoch is not None and (epoch != self.epoch or version < self.version):
+                try:
+                    loaded = self.bus.load()
+                except Exception as e:
+                    logger.warning(f"Could not reload shared chaos config: {e}")
+                    prometheus_metrics.record_config_sync_error()
+                    return
+                if loaded is None or (loaded[0], loaded[2]) == (self.version, self.epoch):
+                    return  # stale message
+                version, doc, epoch = loaded
+                if epoch != self.epoch:
+                    logger.warning(f"Shared chaos config store restarted at version {version} "
+                                   f"(epoch {epoch}, was {self.epoch})")
+            try:
+                self.apply(doc['enabled'], doc['config'])
+            except Exception as e:
+                logger.error(f"Ignoring invalid chaos config version {version}: {e}")
+                prometheus_metrics.record_config_sync_error()
+                return
+            self.version = version
+            self.epoch = epoch
+        prometheus_metrics.set_config_version(version)
+        if doc.get('replica') != self.replica_id:
+            # Wall clocks of different pods: skew shows up in this latency
+            prometheus_metrics.record_config_propagation(max(0.0, time.time() - doc['updated_at']))
+        logger.info(f"Applied chaos config version {version} from {doc.get('replica')}")
+
+    def close(self):
+        self.bus.close()
+
+
+def build_config_bus(redis_url=None):
+    """A Redis bus when a URL is configured, otherwise the in-process stand-in"""
+    if not redis_url:
+        return MemoryConfigBus()
+    import redis  # only needed when replicas share config
+    return RedisConfigBus(redis.Redis.from_url(redis_url))
@@ -1,13 +1,22 @@
 from kafka import KafkaProducer
 import json
 import os
+import uuid
+import queue
+import threading
+import time
 import logging
+import prometheus_metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'kafka:9092').split(',')
 
+# Events queued for the background publisher; when full, new events are dropped
+# rather than making a request wait for Kafka
+PUBLISH_QUEUE_SIZE = int(os.getenv('PUBLISH_QUEUE_SIZE', 10000))
+
 try:
     producer = KafkaProducer(
         bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
@@ -19,7 +28,13 @@ except Exception as e:
     logger.error(f"Failed to connect Kafka producer: {e}")
     producer = None
 
+_publish_queue = queue.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+_publisher_thread = None
+_publisher_lock = threading.Lock()
+
 def publish_event(topic: str, message: dict):
+    # Unique id per event so consumers can drop redelivered duplicates
+    message = {'event_id': str(uuid.uuid4()), **message}
     if producer:
         try:
             future = producer.send(topic, value=message)
@@ -29,3 +44,60 @@ def publish_event(topic: str, message: dict):
             logger.error(f"Failed to publish event to {topic}: {e}")
     else:
         logger.warning(f"Kafka producer not available, skipping event: {topic}")
+
+def publish_event_nowait(topic: str, message: dict):
+    """Queue an event for the background publisher and return immediately.
+
+    Safe to call from async handlers: it never blocks on Kafka metadata,
+    broker acks or a full queue.
+    """
+    if not producer:
+        logger.warning(f"Kafka producer not available, skipping event: {topic}")
+        return
+    _ensure_publisher()
+    message = {'event_id': str(uuid.uuid4()), **message}
+    try:
+        _publish_queue.put_nowait((topic, message, time.perf_counter()))
+    except queue.Full:
+        logger.warning(f"Publish queue full, dropping event: {topic}")
+        prometheus_metrics.record_kafka_dropped()
+        return
+    prometheus_metrics.set_kafka_queue_depth(_publish_queue.qsize())
+
+def flush_events(timeout=10):
+    """Hand every queued event to Kafka and wait for delivery (shutdown)"""
+    if not producer:
+        return
+    deadline = time.monotonic() + timeout
+    while _publish_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+    producer.flush(timeout=max(0, deadline - time.monotonic()))
+
+def _ensure_publisher():
+    global _publisher_thread
+    if _publisher_thread is None:
+        with _publisher_lock:
+            if _publisher_thread is None:
+                _publisher_thread = threading.Thread(target=_publish_loop, name="kafka-publisher", daemon=True)
+                _publisher_thread.start()
+
+def _publish_loop():
+    while True:
+        topic, message, queued_at = _publish_queue.get()
+        try:
+            future = producer.send(topic, value=message)
+            future.add_callback(_on_sent, topic, message, queued_at)
+            future.add_errback(_on_error, topic)
+        except Exception as e:
+            _on_error(topic, e)
+        finally:
+            _publish_queue.task_done()
+            prometheus_metrics.set_kafka_queue_depth(_publish_queue.qsize())
+
+def _on_sent(topic, message, queued_at, record_metadata):
+    prometheus_metrics.record_kafka_publish(topic, success=True, latency=time.perf_counter() - queued_at)
+    logger.info(f"Published event to {topic}: {message}")
+
+def _on_error(topic, error):
+    prometheus_metrics.record_kafka_publish(topic, success=False)
+    logger.error(f"Failed to publish event to {topic}: {error}")
@@ -1,13 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+import asyncio
 import random
 import time
 import os
 from datetime import datetime
-from kafka_producer import publish_event
+from kafka_producer import publish_event_nowait, flush_events
+from chaos_proxy import ChaosProxy, RouteFault, parse_upstreams
+from scenarios import ScenarioError, ScenarioRunner, list_scenarios
+from config_store import ReplicatedConfig, build_config_bus
+from resource_pressure import PressureConflictError, PressureLimitError, PressureManager
+import chaos_middleware
 import prometheus_metrics
 
 app = FastAPI(title="Chaos Service", version="1.0.0")
@@ -21,6 +27,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Fault injection via the X-Chaos-Fault header (off unless CHAOS_MIDDLEWARE_ENABLED).
+# Only the request boundary applies here: Kafka publishing is off the request path.
+app.add_middleware(chaos_middleware.ChaosASGIMiddleware)
+chaos_middleware.on_fault(prometheus_metrics.record_middleware_fault)
+
 CHAOS_ENABLED = os.getenv("CHAOS_ENABLED", "true").lower() == "true"
 
 class ChaosConfig(BaseModel):
@@ -28,9 +39,82 @@ class ChaosConfig(BaseModel):
     latency_min_ms: int = 100
     latency_max_ms: int = 3000
     timeout_rate: float = 0.05  # 5% chance
+    routes: List[RouteFault] = []  # fault profiles for /proxy routes
 
 chaos_config = ChaosConfig()
 
+# chaos_config and CHAOS_ENABLED are this replica's copy of the shared config:
+# updates are published to every replica through CONFIG_REDIS_URL (or kept
+# in-process when unset) and applied here by apply_shared_config
+CONFIG_REDIS_URL = os.getenv("CONFIG_REDIS_URL", "")
+
+def apply_shared_config(enabled: bool, config: dict):
+    global CHAOS_ENABLED, chaos_config
+    chaos_config = ChaosConfig(**config)
+    CHAOS_ENABLED = enabled
+
+shared_config = ReplicatedConfig(build_config_bus(CONFIG_REDIS_URL), apply_shared_config)
+
+def publish_config(enabled: bool, config: ChaosConfig, changed=('enabled', 'config')):
+    """Publish the `changed` fields to all replicas; returns the new version"""
+    try:
+        return shared_config.publish(enabled, config.dict(), changed)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Could not store chaos config: {e}")
+
+# Set CHAOS_SEED to make ad-hoc random chaos reproducible
+chaos_random = random.Random(os.getenv("CHAOS_SEED"))
+
+# Seeded scenario timelines and the event logs of their runs
+SCENARIO_DIR = os.getenv("SCENARIO_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios"))
+SCENARIO_LOG_DIR = os.getenv("SCENARIO_LOG_DIR", "/tmp/chaos-runs")
+
+scenarios = ScenarioRunner(SCENARIO_DIR, SCENARIO_LOG_DIR)
+
+# CPU, memory, disk and descriptor pressure, limited by the PRESSURE_* settings
+pressure = PressureManager()
+
+# Reverse proxy mode: /proxy/<name>/<path> is forwarded to the upstream <name>,
+# e.g. PROXY_UPSTREAMS="product-service=http://product-service:8002"
+PROXY_UPSTREAMS = parse_upstreams(os.getenv("PROXY_UPSTREAMS", ""))
+PROXY_TIMEOUT_SECONDS = float(os.getenv("PROXY_TIMEOUT_SECONDS", 30))
+PROXY_MAX_CONNECTIONS = int(os.getenv("PROXY_MAX_CONNECTIONS", 1000))
+
+proxy = ChaosProxy(
+    PROXY_UPSTREAMS,
+    lambda: (CHAOS_ENABLED, chaos_config.routes),
+    timeout_seconds=PROXY_TIMEOUT_SECONDS,
+    max_connections=PROXY_MAX_CONNECTIONS,
+    scenarios=scenarios,
+)
+app.mount("/proxy", proxy)
+
+@app.on_event("startup")
+def start_config_sync():
+    shared_config.start()
+
+@app.on_event("shutdown")
+def stop_config_sync():
+    shared_config.close()
+
+@app.on_event("shutdown")
+def flush_kafka_events():
+    """Deliver events still queued for Kafka before exiting"""
+    flush_events(timeout=10)
+
+@app.on_event("shutdown")
+async def close_proxy():
+    await proxy.aclose()
+
+@app.on_event("shutdown")
+def release_pressure():
+    pressure.stop_all()
+
+@app.on_event("shutdown")
+def stop_scenario():
+    """Close the event log of a run still in progress"""
+    scenarios.stop()
+
 @app.get("/health")
 def health_check():
     return {
@@ -52,18 +136,19 @@ def metrics():
 def get_chaos_config():
     return {
         "enabled": CHAOS_ENABLED,
-        "config": chaos_config.dict()
+        "config": chaos_config.dict(),
+        "version": shared_config.version,
+        "proxy_upstreams": PROXY_UPSTREAMS
     }
 
 @app.put("/chaos/config")
 def update_chaos_config(config: ChaosConfig):
-    global chaos_config
-    chaos_config = config
+    version = publish_config(CHAOS_ENABLED, config, changed=('config',))
     prometheus_metrics.record_config_update()
-    return {"message": "Chaos config updated", "config": chaos_config.dict()}
+    return {"message": "Chaos config updated", "config": chaos_config.dict(), "version": version}
 
 @app.post("/chaos/inject/latency")
-def inject_latency(min_ms: int = 100, max_ms: int = 1000):
+async def inject_latency(min_ms: int = 100, max_ms: int = 1000):
     """Inject latency delay"""
     start_time = time.time()
     
@@ -74,7 +159,7 @@ def inject_latency(min_ms: int = 100, max_ms: int = 1000):
         return {"message": "Chaos is disabled"}
     
     delay_ms = random.randint(min_ms, max_ms)
-    time.sleep(delay_ms / 1000)
+    await asyncio.sleep(delay_ms / 1000)
     
     # Record metrics
     prometheus_metrics.chaos_injections_total.labels(
@@ -83,7 +168,7 @@ def inject_latency(min_ms: int = 100, max_ms: int = 1000):
     prometheus_metrics.latency_injections_total.inc()
     prometheus_metrics.latency_injection_duration_ms.observe(delay_ms)
     
-    publish_event('chaos.injected', {
+    publish_event_nowait('chaos.injected', {
         'chaos_type': 'latency',
         'details': f'Injected {delay_ms}ms delay',
         'timestamp': datetime.utcnow().isoformat()
@@ -120,7 +205,7 @@ def inject_error(error_code: int = 500, message: str = "Chaos-induced error"):
     ).inc()
     prometheus_metrics.error_injections_total.labels(error_code=str(error_code)).inc()
     
-    publish_event('chaos.injected', {
+    publish_event_nowait('chaos.injected', {
         'chaos_type': 'error',
         'details': f'HTTP {error_code}: {message}',
         'timestamp': datetime.utcnow().isoformat()
@@ -137,19 +222,29 @@ def inject_error(error_code: int = 500, message: str = "Chaos-induced error"):
     raise HTTPException(status_code=error_code, detail=message)
 
 @app.post("/chaos/inject/random")
-def inject_random_chaos():
+async def inject_random_chaos():
     """Inject random chaos based on configuration"""
     if not CHAOS_ENABLED:
         return {"message": "Chaos is disabled"}
     
-    rand = random.random()
+    # A running scenario decides instead of the random config
+    planned = scenarios.next_fault()
+    if planned is not None:
+        return await inject_scenario_fault(planned)
+    if scenarios.active:
+        return {
+            "chaos_type": "none",
+            "message": "No chaos injected this time"
+        }
+    
+    rand = chaos_random.random()
     
     # Random error
     if rand < chaos_config.error_rate:
         error_codes = [400, 500, 502, 503, 504]
-        error_code = random.choice(error_codes)
+        error_code = chaos_random.choice(error_codes)
         
-        publish_event('chaos.injected', {
+        publish_event_nowait('chaos.injected', {
             'chaos_type': 'random_error',
             'details': f'HTTP {error_code}',
             'timestamp': datetime.utcnow().isoformat()
@@ -162,13 +257,13 @@ def inject_random_chaos():
     
     # Random latency
     elif rand < chaos_config.error_rate + 0.2:  # 20% latency
-        delay_ms = random.randint(
+        delay_ms = chaos_random.randint(
             chaos_config.latency_min_ms,
             chaos_config.latency_max_ms
         )
-        time.sleep(delay_ms / 1000)
+        await asyncio.sleep(delay_ms / 1000)
         
-        publish_event('chaos.injected', {
+        publish_event_nowait('chaos.injected', {
             'chaos_type': 'random_latency',
             'details': f'{delay_ms}ms delay',
             'timestamp': datetime.utcnow().isoformat()
@@ -186,11 +281,91 @@ def inject_random_chaos():
         "message": "No chaos injected this time"
     }
 
+async def inject_scenario_fault(fault):
+    """Inject a fault decided by the running scenario"""
+    publish_event_nowait('chaos.injected', {
+        'chaos_type': f'scenario_{fault.kind}',
+        'details': f'Request {fault.seq} at {fault.offset_ms}ms: {fault.delay_ms}ms delay, status {fault.status}',
+        'timestamp': datetime.utcnow().isoformat()
+    })
+    
+    if fault.kind == 'error':
+        raise HTTPException(status_code=fault.status, detail=f"Scenario chaos error: {fault.status}")
+    
+    await asyncio.sleep(fault.delay_ms / 1000)
+    if fault.kind == 'timeout':
+        raise HTTPException(status_code=504, detail=f"Scenario chaos timeout after {fault.delay_ms}ms")
+    
+    return {
+        "chaos_type": "latency",
+        "delay_ms": fault.delay_ms,
+        "message": f"Scenario latency: {fault.delay_ms}ms"
+    }
+
+@app.get("/chaos/scenarios")
+def get_scenarios():
+    """List scenario files and the active run"""
+    return {
+        "scenarios": list_scenarios(SCENARIO_DIR),
+        "status": scenarios.status()
+    }
+
+@app.post("/chaos/scenarios/{name}/start")
+def start_scenario(name: str, seed: Optional[int] = None):
+    """Start a scenario, optionally overriding its seed"""
+    try:
+        run_id = scenarios.start(name, seed)
+    except ScenarioError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"message": "Scenario started", "run_id": run_id, "status": scenarios.status()}
+
+@app.post("/chaos/scenarios/stop")
+def stop_scenario_run():
+    """Stop the active scenario or replay"""
+    status = scenarios.stop()
+    return {"message": "Scenario stopped" if status else "No scenario running", "status": status}
+
+@app.get("/chaos/scenarios/runs")
+def get_scenario_runs():
+    """List recorded event logs"""
+    return {"runs": scenarios.list_runs()}
+
+@app.get("/chaos/scenarios/runs/{run_id}")
+def get_scenario_run(run_id: str):
+    """Download the event log of a run"""
+    try:
+        log = scenarios.read_log(run_id)
+    except ScenarioError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(content=log, media_type="application/x-ndjson")
+
+@app.post("/chaos/scenarios/runs/{run_id}/replay")
+def replay_scenario_run(run_id: str):
+    """Replay the exact fault sequence of a recorded run"""
+    try:
+        run = scenarios.replay(scenarios.read_log(run_id).splitlines())
+    except ScenarioError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"message": "Replay started", "run_id": run, "status": scenarios.status()}
+
+@app.post("/chaos/scenarios/replay")
+async def replay_uploaded_run(request: Request):
+    """Replay an event log sent as the request body, e.g. one from another build"""
+    body = (await request.body()).decode("utf-8")
+    try:
+        run = scenarios.replay(body.splitlines())
+    except (ValueError, KeyError) as e:  # includes ScenarioError and bad JSON
+        raise HTTPException(status_code=400, detail=f"Invalid event log: {e}")
+    return {"message": "Replay started", "run_id": run, "status": scenarios.status()}
+
 @app.get("/chaos/test/slow")
-def slow_endpoint():
-    """Always slow endpoint for testing"""
-    delay_ms = random.randint(2000, 5000)
-    time.sleep(delay_ms / 1000)
+async def slow_endpoint(min_ms: int = Query(2000, ge=0, le=chaos_middleware.settings.max_delay_ms),
+                        max_ms: int = Query(5000, ge=0, le=chaos_middleware.settings.max_delay_ms)):
+    """Always slow endpoint for testing (delays capped by CHAOS_MAX_DELAY_MS)"""
+    if min_ms > max_ms:
+        raise HTTPException(status_code=400, detail=f"min_ms ({min_ms}) is greater than max_ms ({max_ms})")
+    delay_ms = random.randint(min_ms, max_ms)
+    await asyncio.sleep(delay_ms / 1000)
     
     return {
         "message": "This endpoint is intentionally slow",
@@ -200,7 +375,7 @@ def slow_endpoint():
 @app.get("/chaos/test/error")
 def error_endpoint():
     """Always returns error for testing"""
-    publish_event('chaos.injected', {
+    publish_event_nowait('chaos.injected', {
         'chaos_type': 'test_error',
         'details': 'Intentional test error',
         'timestamp': datetime.utcnow().isoformat()
@@ -219,24 +394,85 @@ def memory_leak_endpoint():
         "items_created": len(large_list)
     }
 
+def start_pressure(kind: str, start, **params):
+    """Start a pressure injector, mapping limit and conflict errors to HTTP"""
+    if not CHAOS_ENABLED:
+        return {"message": "Chaos is disabled"}
+    try:
+        injection = start(**params)
+    except PressureLimitError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PressureConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    prometheus_metrics.chaos_injections_total.labels(
+        injection_type=f'pressure_{kind}', status='success'
+    ).inc()
+    publish_event_nowait('chaos.injected', {
+        'chaos_type': f'pressure_{kind}',
+        'details': f'{injection["params"]} for {params["duration_seconds"]}s',
+        'timestamp': datetime.utcnow().isoformat()
+    })
+    return {"message": f"{kind} pressure started", "injection": injection}
+
+@app.post("/chaos/pressure/cpu")
+def cpu_pressure(workers: int = 1, load: float = 1.0, duration_seconds: int = 30):
+    """Burn CPU in `workers` processes at `load` (0-1) each"""
+    return start_pressure('cpu', pressure.start_cpu, workers=workers, load=load,
+                          duration_seconds=duration_seconds)
+
+@app.post("/chaos/pressure/memory")
+def memory_pressure(target_mb: int = 64, duration_seconds: int = 30):
+    """Hold `target_mb` of resident memory"""
+    return start_pressure('memory', pressure.start_memory, target_mb=target_mb,
+                          duration_seconds=duration_seconds)
+
+@app.post("/chaos/pressure/disk")
+def disk_pressure(block_kb: int = 1024, max_file_mb: int = 256, sync: bool = True, duration_seconds: int = 30):
+    """Saturate disk I/O by rewriting a scratch file"""
+    return start_pressure('disk', pressure.start_disk, block_kb=block_kb, max_file_mb=max_file_mb,
+                          sync=sync, duration_seconds=duration_seconds)
+
+@app.post("/chaos/pressure/fds")
+def fd_pressure(count: int = 1000, target: Optional[str] = None, duration_seconds: int = 30):
+    """Hold `count` descriptors: idle connections to `target` (host:port) or open files"""
+    return start_pressure('fds', pressure.start_fds, count=count, target=target,
+                          duration_seconds=duration_seconds)
+
+@app.get("/chaos/pressure")
+def get_pressure():
+    """List running pressure injectors"""
+    return {"active": pressure.active()}
+
+@app.delete("/chaos/pressure")
+def release_all_pressure():
+    """Release every pressure injector"""
+    return {"released": pressure.stop_all()}
+
+@app.delete("/chaos/pressure/{kind}")
+def release_pressure_kind(kind: str):
+    """Release the pressure injector of one kind"""
+    released = pressure.stop(kind)
+    if released is None:
+        raise HTTPException(status_code=404, detail=f"No {kind} pressure running")
+    return {"released": released}
+
 @app.post("/chaos/enable")
 def enable_chaos():
     """Enable chaos injection"""
-    global CHAOS_ENABLED
-    CHAOS_ENABLED = True
-    return {"message": "Chaos enabled", "enabled": CHAOS_ENABLED}
+    version = publish_config(True, chaos_config, changed=('enabled',))
+    return {"message": "Chaos enabled", "enabled": CHAOS_ENABLED, "version": version}
 
 @app.post("/chaos/disable")
 def disable_chaos():
     """Disable chaos injection"""
-    global CHAOS_ENABLED
-    CHAOS_ENABLED = False
-    return {"message": "Chaos disabled", "enabled": CHAOS_ENABLED}
+    version = publish_config(False, chaos_config, changed=('enabled',))
+    return {"message": "Chaos disabled", "enabled": CHAOS_ENABLED, "version": version}
 
 @app.post("/chaos/event-publish")
 def publish_chaos_event(event: dict):
     """Publish custom chaos event to Kafka"""
-    publish_event('chaos.injected', event)
+    publish_event_nowait('chaos.injected', event)
     return {
         "message": "Chaos event published",
         "event": event
@@ -105,6 +105,124 @@ kafka_latency_seconds = Histogram(
     registry=registry
 )
 
+kafka_publish_queue_depth = Gauge(
+    'chaos_kafka_publish_queue_depth',
+    'Events waiting to be handed to the Kafka producer',
+    registry=registry
+)
+
+kafka_publish_dropped_total = Counter(
+    'chaos_kafka_publish_dropped_total',
+    'Events dropped because the publish queue was full',
+    registry=registry
+)
+
+# Config Propagation Metrics
+config_version = Gauge(
+    'chaos_config_version',
+    'Version of the shared chaos config applied on this replica',
+    registry=registry
+)
+
+config_propagation_seconds = Histogram(
+    'chaos_config_propagation_seconds',
+    'Time from a config update on one replica to it being applied on another',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    registry=registry
+)
+
+config_sync_errors_total = Counter(
+    'chaos_config_sync_errors_total',
+    'Failures loading, following or applying the shared chaos config',
+    registry=registry
+)
+
+# Proxy Metrics
+proxy_requests_total = Counter(
+    'chaos_proxy_requests_total',
+    'Requests forwarded by the chaos proxy',
+    labelnames=['upstream', 'status'],
+    registry=registry
+)
+
+proxy_request_duration_seconds = Histogram(
+    'chaos_proxy_request_duration_seconds',
+    'Chaos proxy request duration including injected faults',
+    labelnames=['upstream'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    registry=registry
+)
+
+proxy_injected_delay_ms = Histogram(
+    'chaos_proxy_injected_delay_ms',
+    'Latency injected by the chaos proxy',
+    labelnames=['upstream'],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000),
+    registry=registry
+)
+
+proxy_faults_total = Counter(
+    'chaos_proxy_faults_total',
+    'Faults injected by the chaos proxy',
+    labelnames=['upstream', 'fault'],
+    registry=registry
+)
+
+# Scenario Metrics
+scenario_active = Gauge(
+    'chaos_scenario_active',
+    'Whether a chaos scenario or replay is running (1) or not (0)',
+    labelnames=['scenario'],
+    registry=registry
+)
+
+scenario_faults_total = Counter(
+    'chaos_scenario_faults_total',
+    'Faults injected by chaos scenarios',
+    labelnames=['scenario', 'fault'],
+    registry=registry
+)
+
+# Middleware Metrics
+middleware_faults_injected_total = Counter(
+    'chaos_middleware_faults_injected_total',
+    'Faults injected by the chaos middleware',
+    labelnames=['boundary', 'fault', 'source'],
+    registry=registry
+)
+
+# Resource Pressure Metrics
+pressure_active = Gauge(
+    'chaos_pressure_active',
+    'Whether a resource-pressure injector is running (1) or not (0)',
+    labelnames=['kind'],
+    registry=registry
+)
+
+pressure_cpu_workers = Gauge(
+    'chaos_pressure_cpu_workers',
+    'CPU burner processes running',
+    registry=registry
+)
+
+pressure_memory_bytes = Gauge(
+    'chaos_pressure_memory_bytes',
+    'Memory held by the memory-pressure injector',
+    registry=registry
+)
+
+pressure_disk_written_bytes_total = Counter(
+    'chaos_pressure_disk_written_bytes_total',
+    'Bytes written by the disk I/O injector',
+    registry=registry
+)
+
+pressure_open_fds = Gauge(
+    'chaos_pressure_open_fds',
+    'File descriptors held by the descriptor-exhaustion injector',
+    registry=registry
+)
+
 # Service Health Metrics
 uptime_seconds = Gauge(
     'chaos_service_uptime_seconds',
@@ -168,6 +286,73 @@ def record_kafka_publish(event_type, success=True, latency=0):
         success_rate = ((total - errors) / total) * 100
         kafka_publish_success_rate.set(success_rate)
 
+def record_kafka_dropped():
+    """Record event dropped by a full publish queue"""
+    kafka_publish_dropped_total.inc()
+    kafka_publish_errors_total.inc()
+
+def set_kafka_queue_depth(depth):
+    """Set publish queue depth"""
+    kafka_publish_queue_depth.set(depth)
+
+def set_config_version(version):
+    """Set applied config version"""
+    config_version.set(version)
+
+def record_config_propagation(seconds):
+    """Record config propagation latency"""
+    config_propagation_seconds.observe(seconds)
+
+def record_config_sync_error():
+    """Record config sync failure"""
+    config_sync_errors_total.inc()
+
+def record_proxy_request(upstream, status, duration):
+    """Record request forwarded by the proxy"""
+    proxy_requests_total.labels(upstream=upstream, status=status).inc()
+    proxy_request_duration_seconds.labels(upstream=upstream).observe(duration)
+
+def record_proxy_delay(upstream, delay_ms):
+    """Record latency injected by the proxy"""
+    proxy_injected_delay_ms.labels(upstream=upstream).observe(delay_ms)
+    proxy_faults_total.labels(upstream=upstream, fault='latency').inc()
+
+def record_proxy_fault(upstream, fault):
+    """Record error, reset or throttle injected by the proxy"""
+    proxy_faults_total.labels(upstream=upstream, fault=fault).inc()
+
+def set_scenario_active(scenario, active):
+    """Set whether a scenario run is active"""
+    scenario_active.labels(scenario=scenario).set(1 if active else 0)
+
+def record_scenario_fault(scenario, fault):
+    """Record fault injected by a scenario run"""
+    scenario_faults_total.labels(scenario=scenario, fault=fault).inc()
+
+def record_middleware_fault(boundary, fault, source):
+    """Record fault injected by the chaos middleware"""
+    middleware_faults_injected_total.labels(boundary=boundary, fault=fault, source=source).inc()
+
+def set_pressure_active(kind, active):
+    """Set whether a pressure injector is running"""
+    pressure_active.labels(kind=kind).set(1 if active else 0)
+
+def set_pressure_cpu_workers(count):
+    """Set running CPU burner processes"""
+    pressure_cpu_workers.set(count)
+
+def set_pressure_memory_bytes(held):
+    """Set memory held by the memory injector"""
+    pressure_memory_bytes.set(held)
+
+def record_pressure_disk_written(written):
+    """Record bytes written by the disk injector"""
+    pressure_disk_written_bytes_total.inc(written)
+
+def set_pressure_open_fds(count):
+    """Set descriptors held by the descriptor injector"""
+    pressure_open_fds.set(count)
+
 def set_uptime(seconds):
     """Set service uptime"""
     uptime_seconds.set(seconds)
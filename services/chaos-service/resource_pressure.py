@@ -0,0 +1,312 @@
+"""
+Resource-pressure injectors for the chaos service
+CPU burn, held memory, disk I/O and file-descriptor exhaustion, each run in
+child processes with hard limits and released automatically when its time is up
+"""
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import threading
+import time
+import uuid
+
+import prometheus_metrics
+
+logger = logging.getLogger(__name__)
+
+# Hard safety limits; requests beyond them are rejected
+PRESSURE_MAX_DURATION_SECONDS = int(os.getenv('PRESSURE_MAX_DURATION_SECONDS', 300))
+PRESSURE_MAX_CPU_WORKERS = int(os.getenv('PRESSURE_MAX_CPU_WORKERS', os.cpu_count() or 1))
+PRESSURE_MAX_MEMORY_MB = int(os.getenv('PRESSURE_MAX_MEMORY_MB', 128))
+PRESSURE_MAX_DISK_MB = int(os.getenv('PRESSURE_MAX_DISK_MB', 512))
+PRESSURE_MAX_FDS = int(os.getenv('PRESSURE_MAX_FDS', 10000))
+PRESSURE_SCRATCH_DIR = os.getenv('PRESSURE_SCRATCH_DIR', '/tmp')
+
+# Memory kept free in the container's cgroup when holding memory
+MEMORY_HEADROOM_MB = 32
+MEMORY_STEP_BYTES = 16 * 1024 * 1024
+
+KINDS = ('cpu', 'memory', 'disk', 'fds')
+
+# Forked rather than spawned, which would re-run main.py (Kafka producer and
+# all) in every child. Children therefore only use os, socket and time calls:
+# no logging, whose locks another thread may have held at the fork.
+_mp = multiprocessing.get_context('fork')
+
+
+class PressureLimitError(ValueError):
+    pass
+
+
+class PressureConflictError(RuntimeError):
+    pass
+
+
+def _alive(deadline, parent_pid):
+    # Children also stop on their own if the chaos service dies
+    return time.time() < deadline and os.getppid() == parent_pid
+
+
+def _wait(deadline, parent_pid):
+    while _alive(deadline, parent_pid):
+        time.sleep(0.2)
+
+
+def cpu_worker(deadline, load, parent_pid):
+    """Spin for `load` of every 100ms slice until the deadline"""
+    period = 0.1
+    while _alive(deadline, parent_pid):
+        busy_until = time.perf_counter() + period * load
+        while time.perf_counter() < busy_until:
+            pass
+        if load < 1:
+            time.sleep(period * (1 - load))
+
+
+def memory_worker(deadline, target_bytes, held, parent_pid):
+    """Allocate and touch `target_bytes`, hold them until the deadline"""
+    chunks = []
+    while held.value < target_bytes and _alive(deadline, parent_pid):
+        size = min(MEMORY_STEP_BYTES, target_bytes - held.value)
+        chunks.append(bytearray(b'\xa5') * size)  # filled, so every page is resident
+        held.value += size
+    _wait(deadline, parent_pid)
+
+
+def disk_worker(deadline, path, block_bytes, max_bytes, sync, written, parent_pid):
+    """Rewrite a scratch file of up to `max_bytes` block by block until the deadline"""
+    block = os.urandom(block_bytes)  # incompressible
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        offset = 0
+        while _alive(deadline, parent_pid):
+            os.pwrite(fd, block, offset)
+            if sync:
+                os.fdatasync(fd)
+            written.value += block_bytes
+            offset = offset + block_bytes if offset + block_bytes < max_bytes else 0
+    finally:
+        os.close(fd)
+        os.unlink(path)
+
+
+def fd_worker(deadline, count, target, opened, parent_pid):
+    """Hold `count` descriptors: idle connections to `target` (host, port) or files"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < count + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(count + 64, hard), hard))
+    held = []
+    try:
+        while len(held) < count and _alive(deadline, parent_pid):
+            try:
+                if target:
+                    held.append(socket.create_connection(target, timeout=2))
+                else:
+                    held.append(open(os.devnull, 'rb'))
+            except OSError:
+                # The limit (ours or the target's) is reached: hold what we have
+                break
+            opened.value = len(held)
+        _wait(deadline, parent_pid)
+    finally:
+        for f in held:
+            f.close()
+
+
+class Injection:
+    """One running injector and the counters its processes report through"""
+
+    def __init__(self, kind, params, duration_seconds, processes, progress=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.started_at = time.time()
+        self.ends_at = self.started_at + duration_seconds
+        self.processes = processes
+        self.progress = progress  # shared counter, or None
+        self.reported = 0
+
+    def running(self):
+        return any(p.is_alive() for p in self.processes)
+
+    def stop(self):
+        for p in self.processes:
+            if p.is_alive():
+                p.terminate()
+        for p in self.processes:
+            p.join(5)
+            if p.is_alive():
+                p.kill()
+                p.join()
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "started_at": self.started_at,
+            "remaining_seconds": max(0.0, round(self.ends_at - time.time(), 1)),
+            "processes": [p.pid for p in self.processes],
+            "progress": self.progress.value if self.progress is not None else None,
+        }
+
+
+class PressureManager:
+    """Starts injectors within the limits and releases them when they expire.
+
+    At most one injector of each kind runs at a time. A reaper thread
+    stops expired injectors and refreshes the gauges; stop_all() releases
+    everything (service shutdown).
+    """
+
+    def __init__(self, interval_seconds=0.5):
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._active = {}
+        self._reaper = None
+
+    def active(self):
+        with self._lock:
+            return [injection.describe() for injection in self._active.values()]
+
+    def start_cpu(self, workers, load, duration_seconds):
+        if not 1 <= workers <= PRESSURE_MAX_CPU_WORKERS:
+            raise PressureLimitError(f"workers must be between 1 and {PRESSURE_MAX_CPU_WORKERS}")
+        if not 0 < load <= 1:
+            raise PressureLimitError("load must be in (0, 1]")
+        return self._start('cpu', {'workers': workers, 'load': load}, duration_seconds,
+                           [(cpu_worker, (load,))] * workers)
+
+    def start_memory(self, target_mb, duration_seconds):
+        limit = min(PRESSURE_MAX_MEMORY_MB, cgroup_memory_available_mb())
+        if not 1 <= target_mb <= limit:
+            raise PressureLimitError(f"target_mb must be between 1 and {limit}")
+        held = _mp.Value('q', 0, lock=False)
+        return self._start('memory', {'target_mb': target_mb}, duration_seconds,
+                           [(memory_worker, (target_mb * 1024 * 1024, held))], held)
+
+    def start_disk(self, block_kb, max_file_mb, sync, duration_seconds):
+        if not 1 <= max_file_mb <= PRESSURE_MAX_DISK_MB:
+            raise PressureLimitError(f"max_file_mb must be between 1 and {PRESSURE_MAX_DISK_MB}")
+        if not 4 <= block_kb <= max_file_mb * 1024:
+            raise PressureLimitError("block_kb must be at least 4 and fit in the file")
+        path = os.path.join(PRESSURE_SCRATCH_DIR, f"chaos-io-{uuid.uuid4().hex[:8]}.scratch")
+        written = _mp.Value('q', 0, lock=False)
+        params = {'block_kb': block_kb, 'max_file_mb': max_file_mb, 'sync': sync, 'path': path}
+        return self._start('disk', params, duration_seconds,
+                           [(disk_worker, (path, block_kb * 1024, max_file_mb * 1024 * 1024, sync, written))],
+                           written)
+
+    def start_fds(self, count, duration_seconds, target=None):
+        if not 1 <= count <= PRESSURE_MAX_FDS:
+            raise PressureLimitError(f"count must be between 1 and {PRESSURE_MAX_FDS}")
+        address = None
+        if target:
+            host, _, port = target.rpartition(':')
+            if not host or not port.isdigit():
+                raise PressureLimitError("target must be host:port")
+            address = (host, int(port))
+        opened = _mp.Value('q', 0, lock=False)
+        return self._start('fds', {'count': count, 'target': target}, duration_seconds,
+                           [(fd_worker, (count, address, opened))], opened)
+
+    def stop(self, kind):
+        with self._lock:
+            injection = self._active.pop(kind, None)
+        if injection is None:
+            return None
+        self._release(injection)
+        return injection.describe()
+
+    def stop_all(self):
+        return [stopped for stopped in (self.stop(kind) for kind in KINDS) if stopped]
+
+    def _start(self, kind, params, duration_seconds, targets, progress=None):
+        if not 0 < duration_seconds <= PRESSURE_MAX_DURATION_SECONDS:
+            raise PressureLimitError(f"duration_seconds must be between 1 and {PRESSURE_MAX_DURATION_SECONDS}")
+        with self._lock:
+            if kind in self._active:
+                raise PressureConflictError(f"A {kind} injection is already running")
+            deadline = time.time() + duration_seconds
+            processes = []
+            for target, args in targets:
+                p = _mp.Process(target=target, args=(deadline, *args, os.getpid()),
+                                name=f"chaos-{kind}", daemon=True)
+                p.start()
+                processes.append(p)
+            injection = Injection(kind, params, duration_seconds, processes, progress)
+            self._active[kind] = injection
+            self._ensure_reaper()
+        prometheus_metrics.set_pressure_active(kind, True)
+        if kind == 'cpu':
+            prometheus_metrics.set_pressure_cpu_workers(len(processes))
+        logger.info(f"Started {kind} pressure {params} for {duration_seconds}s")
+        return injection.describe()
+
+    def _release(self, injection):
+        injection.stop()
+        self._report(injection)
+        prometheus_metrics.set_pressure_active(injection.kind, False)
+        if injection.kind == 'cpu':
+            prometheus_metrics.set_pressure_cpu_workers(0)
+        elif injection.kind == 'memory':
+            prometheus_metrics.set_pressure_memory_bytes(0)
+        elif injection.kind == 'fds':
+            prometheus_metrics.set_pressure_open_fds(0)
+        elif injection.kind == 'disk':
+            # A terminated writer does not get to delete its scratch file
+            try:
+                os.unlink(injection.params['path'])
+            except FileNotFoundError:
+                pass
+        logger.info(f"Released {injection.kind} pressure {injection.id}")
+
+    def _report(self, injection):
+        if injection.progress is None:
+            return
+        value = injection.progress.value
+        if injection.kind == 'memory':
+            prometheus_metrics.set_pressure_memory_bytes(value)
+        elif injection.kind == 'fds':
+            prometheus_metrics.set_pressure_open_fds(value)
+        elif injection.kind == 'disk':
+            prometheus_metrics.record_pressure_disk_written(value - injection.reported)
+            injection.reported = value
+
+    def _ensure_reaper(self):
+        # Called with the lock held
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap, name="pressure-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            with self._lock:
+                expired = [kind for kind, injection in self._active.items()
+                           if time.time() >= injection.ends_at or not injection.running()]
+                current = list(self._active.values())
+            for injection in current:
+                self._report(injection)
+            for kind in expired:
+                self.stop(kind)
+            with self._lock:
+                if not self._active:
+                    self._reaper = None
+                    return
+
+
+def cgroup_memory_available_mb():
+    """Memory left under the container's cgroup v2 limit, minus headroom"""
+    try:
+        with open('/sys/fs/cgroup/memory.max') as f:
+            limit = f.read().strip()
+        with open('/sys/fs/cgroup/memory.current') as f:
+            current = int(f.read())
+    except (OSError, ValueError):
+        return PRESSURE_MAX_MEMORY_MB
+    if limit == 'max':
+        return PRESSURE_MAX_MEMORY_MB
+    return max(0, (int(limit) - current) // (1024 * 1024) - MEMORY_HEADROOM_MB)
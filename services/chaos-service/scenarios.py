@@ -0,0 +1,274 @@
+"""
+Seeded chaos scenarios for the chaos service
+A scenario is a timeline of fault steps; a run draws every decision from a PRNG
+seeded per run, writes each injected fault to a compact event log, and a log can
+be replayed to inject the exact same fault sequence again
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import prometheus_metrics
+
+logger = logging.getLogger(__name__)
+
+STEP_TYPES = ('latency_ramp', 'error_burst', 'timeout_window')
+
+# One injected fault. seq is the 1-based request number within the run,
+# offset_ms the time since the run started.
+Fault = namedtuple('Fault', ['seq', 'offset_ms', 'kind', 'delay_ms', 'status'])
+
+
+class ScenarioError(ValueError):
+    pass
+
+
+class Step:
+    """One fault window of a scenario timeline.
+
+    latency_ramp: with `probability`, a delay ramping linearly from `from_ms`
+      to `to_ms` over the step, plus up to +/- `jitter_ms`
+    error_burst: with `error_rate`, one of `error_codes`
+    timeout_window: with `timeout_rate`, hang `timeout_ms` then time out (504)
+    """
+
+    def __init__(self, spec):
+        self.type = spec.get('type')
+        if self.type not in STEP_TYPES:
+            raise ScenarioError(f"Unknown step type {self.type!r}, expected one of {', '.join(STEP_TYPES)}")
+        self.start = float(spec.get('at', 0))
+        self.end = self.start + float(spec['duration'])
+        self.probability = float(spec.get('probability', spec.get('error_rate', spec.get('timeout_rate', 1.0))))
+        self.from_ms = float(spec.get('from_ms', 0))
+        self.to_ms = float(spec.get('to_ms', self.from_ms))
+        self.jitter_ms = float(spec.get('jitter_ms', 0))
+        self.error_codes = list(spec.get('error_codes', [500, 502, 503]))
+        self.timeout_ms = float(spec.get('timeout_ms', 30000))
+
+    def active(self, elapsed):
+        return self.start <= elapsed < self.end
+
+    def draw(self, rng, elapsed):
+        """Return (kind, delay_ms, status) or None; always consumes the same draws"""
+        fires = rng.random() < self.probability
+        value = rng.random()
+        if not fires:
+            return None
+        if self.type == 'latency_ramp':
+            progress = (elapsed - self.start) / (self.end - self.start)
+            delay = self.from_ms + (self.to_ms - self.from_ms) * progress
+            delay += (value * 2 - 1) * self.jitter_ms
+            return 'latency', max(0, round(delay)), None
+        if self.type == 'error_burst':
+            return 'error', 0, self.error_codes[int(value * len(self.error_codes))]
+        return 'timeout', round(self.timeout_ms), 504
+
+
+class Scenario:
+    """A named timeline of steps with a default seed"""
+
+    def __init__(self, spec):
+        self.name = spec['name']
+        self.description = spec.get('description', '')
+        self.seed = spec.get('seed', 0)
+        self.steps = [Step(step) for step in spec.get('steps', [])]
+        self.duration = float(spec.get('duration', max((s.end for s in self.steps), default=0)))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+
+def list_scenarios(directory):
+    """Scenario names (file names without .json) in a directory"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-5] for name in os.listdir(directory) if name.endswith('.json'))
+
+
+def read_event_log(lines):
+    """Parse an event log into (header, [Fault], total requests or None)"""
+    header, faults, total = None, [], None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if 'run' in record:
+            header = record
+        elif 'end' in record:
+            total = record['requests']
+        else:
+            faults.append(Fault(record['n'], record['t'], record['f'], record.get('d', 0), record.get('s')))
+    if header is None:
+        raise ScenarioError("Event log has no header line")
+    return header, faults, total
+
+
+class Run:
+    """An active scenario or replay, handing out one decision per request"""
+
+    def __init__(self, run_id, name, seed, log_file, clock, scenario=None, replay=None):
+        self.run_id = run_id
+        self.name = name
+        self.seed = seed
+        self.scenario = scenario
+        self.replay = replay  # (faults by seq, total requests) when replaying
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.started = clock()
+        self.seq = 0
+        self.injected = 0
+        self.log_file = log_file
+
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def finished(self, elapsed):
+        if self.replay is not None:
+            return self.seq >= self.replay[1]
+        return elapsed >= self.scenario.duration
+
+    def next_fault(self, elapsed):
+        self.seq += 1
+        if self.replay is not None:
+            planned = self.replay[0].get(self.seq)
+            if planned is None:
+                return None
+            return planned._replace(offset_ms=round(elapsed * 1000))
+        for step in self.scenario.steps:
+            if step.active(elapsed):
+                drawn = step.draw(self.rng, elapsed)
+                if drawn:
+                    return Fault(self.seq, round(elapsed * 1000), *drawn)
+        return None
+
+    def write(self, record):
+        self.log_file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+class ScenarioRunner:
+    """Runs at most one scenario or replay at a time.
+
+    Callers ask `next_fault()` once per request. Decisions depend only on
+    the seed, the request order and the time since the run started, so the
+    same seed and traffic give the same faults; a replay hands request n
+    exactly the fault logged for request n, whatever the timing.
+    """
+
+    def __init__(self, scenario_dir, log_dir, clock=time.monotonic):
+        self.scenario_dir = scenario_dir
+        self.log_dir = log_dir
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._run = None
+
+    @property
+    def active(self):
+        return self._run is not None
+
+    def start(self, name, seed=None):
+        """Start the scenario file `name`, with its own seed unless one is given"""
+        path = os.path.join(self.scenario_dir, os.path.basename(name) + '.json')
+        if not os.path.exists(path):
+            raise ScenarioError(f"Unknown scenario {name!r}")
+        scenario = Scenario.load(path)
+        seed = scenario.seed if seed is None else seed
+        return self._begin(scenario.name, seed, scenario=scenario)
+
+    def replay(self, lines):
+        """Replay the fault sequence of an event log"""
+        header, faults, total = read_event_log(lines)
+        if total is None:
+            total = max((fault.seq for fault in faults), default=0)
+        replay = ({fault.seq: fault for fault in faults}, total)
+        return self._begin(header['scenario'], header['seed'], replay=replay, replay_of=header['run'])
+
+    def _begin(self, name, seed, scenario=None, replay=None, replay_of=None):
+        self.stop()
+        os.makedirs(self.log_dir, exist_ok=True)
+        run_id = f"{name}-{seed}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}"
+        # Line buffered so the log of a run in progress can be read
+        log_file = open(os.path.join(self.log_dir, run_id + '.jsonl'), 'w', buffering=1)
+        with self._lock:
+            run = Run(run_id, name, seed, log_file, self.clock, scenario, replay)
+            header = {'run': run_id, 'scenario': name, 'seed': seed, 'started': datetime.utcnow().isoformat()}
+            if replay_of:
+                header['replay_of'] = replay_of
+            run.write(header)
+            self._run = run
+        prometheus_metrics.set_scenario_active(name, True)
+        logger.info(f"Started chaos run {run_id}")
+        return run_id
+
+    def stop(self):
+        """Stop the active run and close its event log; returns its status"""
+        with self._lock:
+            run, self._run = self._run, None
+            if run is None:
+                return None
+            status = self._status(run)
+            run.write({'end': round(run.elapsed() * 1000), 'requests': run.seq})
+            run.log_file.close()
+        prometheus_metrics.set_scenario_active(run.name, False)
+        logger.info(f"Finished chaos run {run.run_id}: {run.injected} faults in {run.seq} requests")
+        return status
+
+    def next_fault(self):
+        """The fault for the next request, or None (also when no run is active)"""
+        if self._run is None:
+            return None
+        fault = None
+        with self._lock:
+            run = self._run
+            if run is None:
+                return None
+            elapsed = run.elapsed()
+            finished = run.finished(elapsed)
+            if not finished:
+                fault = run.next_fault(elapsed)
+                if fault is not None:
+                    run.injected += 1
+                    run.write({'n': fault.seq, 't': fault.offset_ms, 'f': fault.kind,
+                               'd': fault.delay_ms, 's': fault.status})
+                # A replay ends with its last logged request
+                finished = run.replay is not None and run.finished(elapsed)
+        if finished:
+            self.stop()
+        if fault is not None:
+            prometheus_metrics.record_scenario_fault(run.name, fault.kind)
+        return fault
+
+    def status(self):
+        with self._lock:
+            return self._status(self._run) if self._run else {"active": False}
+
+    def _status(self, run):
+        return {
+            "active": True,
+            "run_id": run.run_id,
+            "scenario": run.name,
+            "seed": run.seed,
+            "replay": run.replay is not None,
+            "elapsed_seconds": round(run.elapsed(), 3),
+            "requests": run.seq,
+            "faults_injected": run.injected,
+        }
+
+    def list_runs(self):
+        if not os.path.isdir(self.log_dir):
+            return []
+        return sorted(name[:-6] for name in os.listdir(self.log_dir) if name.endswith('.jsonl'))
+
+    def read_log(self, run_id):
+        path = os.path.join(self.log_dir, os.path.basename(run_id) + '.jsonl')
+        if not os.path.exists(path):
+            raise ScenarioError(f"Unknown run {run_id!r}")
+        with open(path) as f:
+            return f.read()
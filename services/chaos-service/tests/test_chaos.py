@@ -2,9 +2,29 @@
 Comprehensive unit tests for Chaos Service
 Tests chaos injection, configuration, and metrics
 """
+import asyncio
+import json
 import logging
+import os
+import socket
+import threading
+import time
 
+import httpx
+import pytest
+import uvicorn
+from fastapi import FastAPI, Request, Response
 from fastapi.testclient import TestClient
+from kafka.future import Future
+
+import chaos_middleware
+import kafka_producer
+import main
+import prometheus_metrics
+from chaos_proxy import LatencyProfile, RouteFault
+import resource_pressure
+from config_store import MemoryConfigBus, ReplicatedConfig
+from scenarios import ScenarioRunner, read_event_log
 from main import app
 
 # Configure logging
@@ -151,6 +171,18 @@ class TestChaosValidation:
        data = response.json()
        assert "delay_ms" in data
        logger.info("✓ Slow endpoint test passed")
+
+   def test_slow_endpoint_rejects_bad_delays(self):
+       """Test inverted or unbounded delays are rejected before sleeping"""
+       logger.info("Testing slow endpoint validation")
+
+       response = client.get("/chaos/test/slow", params={"min_ms": 300, "max_ms": 100})
+       assert response.status_code == 400
+       assert "min_ms" in response.json()["detail"]
+       cap = chaos_middleware.settings.max_delay_ms
+       assert client.get("/chaos/test/slow", params={"max_ms": cap + 1}).status_code == 422
+       assert client.get("/chaos/test/slow", params={"min_ms": -1, "max_ms": 0}).status_code == 422
+       logger.info("✓ Bad delays rejected")
   
    def test_error_endpoint(self):
        """Test the intentionally failing endpoint"""
@@ -163,6 +195,794 @@ class TestChaosValidation:
        logger.info("✓ Error endpoint correctly returns 500")
 
 
+class FakeProducer:
+   """Stands in for KafkaProducer; acks every send immediately"""
+
+   def __init__(self):
+       self.sent = []
+
+   def send(self, topic, value):
+       self.sent.append((topic, value))
+       future = Future()
+       future.success(None)
+       return future
+
+   def flush(self, timeout=None):
+       pass
+
+
+class TestAsyncLatency:
+   """Test suite for non-blocking latency injection and event publishing"""
+
+   def test_concurrent_delayed_requests(self):
+       """Delayed requests overlap instead of queueing on the threadpool"""
+       logger.info("Testing 1000 concurrent delayed requests")
+
+       async def run():
+           async with httpx.AsyncClient(app=app, base_url="http://chaos") as async_client:
+               return await asyncio.gather(*(
+                   async_client.get("/chaos/test/slow", params={"min_ms": 200, "max_ms": 200})
+                   for _ in range(1000)
+               ))
+
+       start = time.perf_counter()
+       responses = asyncio.run(run())
+       elapsed = time.perf_counter() - start
+
+       assert all(r.status_code == 200 for r in responses)
+       assert all(r.json()["delay_ms"] == 200 for r in responses)
+       # Sleeping in a 40-thread pool would take 1000 / 40 * 0.2 = 5s
+       assert elapsed < 2.5
+       logger.info(f"✓ 1000 delayed requests completed in {elapsed:.2f}s")
+
+   def test_events_published_off_request_path(self):
+       """Chaos events are queued and sent by the background publisher"""
+       logger.info("Testing background event publishing")
+
+       original = kafka_producer.producer
+       fake = FakeProducer()
+       kafka_producer.producer = fake
+       try:
+           client.post("/chaos/enable")
+           response = client.post("/chaos/inject/latency?min_ms=1&max_ms=1")
+           assert response.status_code == 200
+           kafka_producer.flush_events(timeout=5)
+       finally:
+           kafka_producer.producer = original
+
+       assert len(fake.sent) == 1
+       topic, event = fake.sent[0]
+       assert topic == "chaos.injected"
+       assert event["chaos_type"] == "latency"
+       assert "event_id" in event
+       logger.info("✓ Chaos event published by background publisher")
+
+
+upstream = FastAPI()
+
+
+@upstream.get("/items")
+def upstream_items(q: str = ""):
+   return {"items": [1, 2, 3], "q": q}
+
+
+@upstream.post("/echo")
+async def upstream_echo(request: Request):
+   return Response(content=await request.body(), media_type="application/octet-stream")
+
+
+@upstream.get("/blob")
+def upstream_blob(size: int = 20000):
+   return Response(content=b"x" * size, media_type="application/octet-stream")
+
+
+def proxy_requests(routes, *requests):
+   """Send (method, url, kwargs) requests through /proxy/shop to the test upstream"""
+   original = (main.chaos_config, main.CHAOS_ENABLED, main.proxy.upstreams)
+   main.chaos_config = main.ChaosConfig(routes=routes)
+   main.CHAOS_ENABLED = True
+   main.proxy.upstreams = {"shop": "http://shop"}
+
+   async def run():
+       main.proxy._transport = httpx.ASGITransport(app=upstream)
+       try:
+           async with httpx.AsyncClient(app=app, base_url="http://chaos") as async_client:
+               results = []
+               for method, url, kwargs in requests:
+                   start = time.perf_counter()
+                   response = await async_client.request(method, url, **kwargs)
+                   results.append((response, time.perf_counter() - start))
+               return results
+       finally:
+           await main.proxy.aclose()
+
+   try:
+       return asyncio.run(run())
+   finally:
+       main.chaos_config, main.CHAOS_ENABLED, main.proxy.upstreams = original
+
+
+class TestChaosProxy:
+   """Test suite for the traffic-shaping reverse proxy"""
+
+   def test_passthrough(self):
+       """Requests without a matching fault reach the upstream unchanged"""
+       logger.info("Testing proxy passthrough")
+
+       (get, _), (post, _), (unknown, _) = proxy_requests(
+           [RouteFault(path_prefix="/other", error_rate=1.0)],
+           ("GET", "/proxy/shop/items?q=mug", {}),
+           ("POST", "/proxy/shop/echo", {"content": b"payload" * 1000}),
+           ("GET", "/proxy/nowhere/items", {}),
+       )
+
+       assert get.status_code == 200
+       assert get.json() == {"items": [1, 2, 3], "q": "mug"}
+       assert post.status_code == 200
+       assert post.content == b"payload" * 1000
+       assert unknown.status_code == 404
+       logger.info("✓ Proxy forwarded requests unchanged")
+
+   def test_error_injection_per_route(self):
+       """Errors only fire on the matching route and method"""
+       logger.info("Testing per-route proxy errors")
+
+       (items, _), (echo, _) = proxy_requests(
+           [RouteFault(path_prefix="/items", methods=["GET"], error_rate=1.0, error_codes=[503])],
+           ("GET", "/proxy/shop/items", {}),
+           ("POST", "/proxy/shop/echo", {"content": b"ok"}),
+       )
+
+       assert items.status_code == 503
+       assert echo.status_code == 200
+       logger.info("✓ Proxy injected 503 on /items only")
+
+   def test_latency_distributions(self):
+       """Sampled delays respect the distribution bounds"""
+       logger.info("Testing proxy latency distributions")
+
+       pareto = LatencyProfile(distribution="pareto", scale_ms=10, shape=1.2, max_ms=5000)
+       samples = [pareto.sample_ms() for _ in range(10000)]
+       assert min(samples) >= 10
+       assert max(samples) <= 5000
+       # Heavy tail: p99 far above the median
+       samples.sort()
+       assert samples[9900] > 10 * samples[5000]
+
+       normal = LatencyProfile(distribution="normal", mean_ms=100, stddev_ms=0)
+       ((response, elapsed),) = proxy_requests(
+           [RouteFault(latency=normal)],
+           ("GET", "/proxy/shop/items", {}),
+       )
+       assert response.status_code == 200
+       assert elapsed >= 0.1
+       logger.info(f"✓ Pareto p99={samples[9900]:.0f}ms, proxied request delayed {elapsed * 1000:.0f}ms")
+
+   def test_bandwidth_throttle(self):
+       """Response bodies are paced to the configured bandwidth"""
+       logger.info("Testing proxy bandwidth throttling")
+
+       ((response, elapsed),) = proxy_requests(
+           [RouteFault(path_prefix="/blob", bandwidth_bytes_per_second=100000)],
+           ("GET", "/proxy/shop/blob?size=30000", {}),
+       )
+
+       assert response.status_code == 200
+       assert len(response.content) == 30000
+       assert elapsed >= 0.25
+       logger.info(f"✓ 30KB at 100KB/s took {elapsed:.2f}s")
+
+   def test_connection_reset(self):
+       """A reset forwards only the first bytes, then drops the connection"""
+       logger.info("Testing proxy connection reset")
+
+       original = (main.chaos_config, main.CHAOS_ENABLED, main.proxy.upstreams)
+       main.chaos_config = main.ChaosConfig(routes=[
+           RouteFault(path_prefix="/blob", reset_rate=1.0, reset_after_bytes=100)
+       ])
+       main.CHAOS_ENABLED = True
+       main.proxy.upstreams = {"shop": "http://shop"}
+       main.proxy._transport = httpx.ASGITransport(app=upstream)
+
+       # The ASGI test transport requires complete responses, so use a real server
+       with socket.socket() as probe:
+           probe.bind(("127.0.0.1", 0))
+           port = probe.getsockname()[1]
+       server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="critical"))
+       thread = threading.Thread(target=server.run, daemon=True)
+       thread.start()
+       try:
+           while not server.started:
+               time.sleep(0.01)
+           with pytest.raises(httpx.RemoteProtocolError):
+               httpx.get(f"http://127.0.0.1:{port}/proxy/shop/blob?size=5000")
+           items = httpx.get(f"http://127.0.0.1:{port}/proxy/shop/items")
+           assert items.status_code == 200
+       finally:
+           server.should_exit = True
+           thread.join(5)
+           main.chaos_config, main.CHAOS_ENABLED, main.proxy.upstreams = original
+
+       logger.info("✓ Proxy dropped the connection after 100 bytes")
+
+   def test_upstream_unavailable(self):
+       """Connection failures to the upstream surface as 502"""
+       logger.info("Testing proxy with unreachable upstream")
+
+       original = main.proxy.upstreams
+       main.proxy.upstreams = {"down": "http://127.0.0.1:1"}
+
+       async def run():
+           try:
+               async with httpx.AsyncClient(app=app, base_url="http://chaos") as async_client:
+                   return await async_client.get("/proxy/down/items")
+           finally:
+               await main.proxy.aclose()
+
+       try:
+           response = asyncio.run(run())
+       finally:
+           main.proxy.upstreams = original
+
+       assert response.status_code == 502
+       logger.info("✓ Unreachable upstream returned 502")
+
+
+class FakeClock:
+   def __init__(self):
+       self.now = 0.0
+
+   def __call__(self):
+       return self.now
+
+
+def scenario_runner(tmp_path, steps, seed=7, duration=None):
+   """A ScenarioRunner with one scenario named "test" and a fake clock"""
+   scenario_dir = tmp_path / "scenarios"
+   scenario_dir.mkdir(exist_ok=True)
+   spec = {"name": "test", "seed": seed, "steps": steps}
+   if duration is not None:
+       spec["duration"] = duration
+   (scenario_dir / "test.json").write_text(json.dumps(spec))
+   clock = FakeClock()
+   return ScenarioRunner(str(scenario_dir), str(tmp_path / "runs"), clock=clock), clock
+
+
+def drive(runner, clock, requests, step_seconds):
+   """Ask for one fault per request while advancing the clock"""
+   faults = []
+   for _ in range(requests):
+       fault = runner.next_fault()
+       if fault is not None:
+           faults.append(fault)
+       clock.now += step_seconds
+   return faults
+
+
+STEPS = [
+   {"type": "latency_ramp", "at": 0, "duration": 10, "from_ms": 100, "to_ms": 1000, "probability": 0.5},
+   {"type": "error_burst", "at": 10, "duration": 5, "error_rate": 0.3, "error_codes": [500, 503]},
+   {"type": "timeout_window", "at": 15, "duration": 5, "timeout_rate": 0.2, "timeout_ms": 3000},
+]
+
+
+class TestScenarios:
+   """Test suite for seeded chaos scenarios and replay"""
+
+   def test_same_seed_same_faults(self, tmp_path):
+       """Runs with the same seed and traffic inject identical faults"""
+       logger.info("Testing seeded scenario determinism")
+
+       runs = []
+       for seed in (7, 7, 8):
+           runner, clock = scenario_runner(tmp_path, STEPS)
+           runner.start("test", seed=seed)
+           runs.append([f[:1] + f[2:] for f in drive(runner, clock, 400, 0.05)])
+
+       assert runs[0] == runs[1]
+       assert runs[0] != runs[2]
+       logger.info(f"✓ Seed 7 reproduced {len(runs[0])} faults")
+
+   def test_timeline(self, tmp_path):
+       """Each step injects its fault kind only inside its window"""
+       logger.info("Testing scenario timeline")
+
+       runner, clock = scenario_runner(tmp_path, STEPS)
+       runner.start("test")
+       faults = drive(runner, clock, 500, 0.05)
+
+       latency = [f for f in faults if f.kind == "latency"]
+       assert all(f.offset_ms < 10000 for f in latency)
+       assert latency[0].delay_ms < 300 and latency[-1].delay_ms > 800
+       assert all(10000 <= f.offset_ms < 15000 and f.status in (500, 503) for f in faults if f.kind == "error")
+       assert all(15000 <= f.offset_ms < 20000 and f.delay_ms == 3000 for f in faults if f.kind == "timeout")
+       assert {f.kind for f in faults} == {"latency", "error", "timeout"}
+
+       # The run ends with its timeline and the log is closed with a summary
+       assert not runner.active
+       (run_id,) = runner.list_runs()
+       header, logged, total = read_event_log(runner.read_log(run_id).splitlines())
+       assert header["seed"] == 7
+       assert total == 400
+       assert [f[:1] + f[2:] for f in logged] == [f[:1] + f[2:] for f in faults]
+       logger.info(f"✓ Timeline produced {len(faults)} faults over {total} requests")
+
+   def test_replay_reproduces_sequence(self, tmp_path):
+       """A replay injects the logged fault for each request regardless of timing"""
+       logger.info("Testing scenario replay")
+
+       runner, clock = scenario_runner(tmp_path, STEPS)
+       run_id = runner.start("test")
+       original = drive(runner, clock, 400, 0.05)
+       runner.stop()
+
+       replay_id = runner.replay(runner.read_log(run_id).splitlines())
+       # A faster build: requests arrive three times as often
+       replayed = drive(runner, clock, 500, 0.0167)
+
+       assert [f[:1] + f[2:] for f in replayed] == [f[:1] + f[2:] for f in original]
+       assert not runner.active
+       header, _, total = read_event_log(runner.read_log(replay_id).splitlines())
+       assert header["replay_of"] == run_id
+       assert total == 400
+       logger.info(f"✓ Replay reproduced {len(original)} faults")
+
+   def test_scenario_endpoints(self, tmp_path):
+       """Scenarios drive /chaos/inject/random and can be replayed over HTTP"""
+       logger.info("Testing scenario endpoints")
+
+       runner, _ = scenario_runner(tmp_path, [
+           {"type": "error_burst", "at": 0, "duration": 3600, "error_rate": 0.5, "error_codes": [503]}
+       ])
+       original = main.scenarios
+       main.scenarios = runner
+       try:
+           client.post("/chaos/enable")
+           assert client.post("/chaos/scenarios/missing/start").status_code == 404
+
+           started = client.post("/chaos/scenarios/test/start?seed=3").json()
+           first = [client.post("/chaos/inject/random").status_code for _ in range(50)]
+           assert set(first) == {200, 503}
+           stopped = client.post("/chaos/scenarios/stop").json()
+           assert stopped["status"]["requests"] == 50
+
+           log = client.get(f"/chaos/scenarios/runs/{started['run_id']}").text
+           replay = client.post("/chaos/scenarios/replay", content=log)
+           assert replay.status_code == 200
+           again = [client.post("/chaos/inject/random").status_code for _ in range(50)]
+           assert again == first
+           assert client.get("/chaos/scenarios").json()["status"] == {"active": False}
+       finally:
+           main.scenarios = original
+
+       logger.info("✓ Scenario run replayed over HTTP with identical responses")
+
+   def test_scenario_drives_proxy(self, tmp_path):
+       """A running scenario decides faults for proxied requests too"""
+       logger.info("Testing scenario faults through the proxy")
+
+       runner, _ = scenario_runner(tmp_path, [
+           {"type": "error_burst", "at": 0, "duration": 3600, "error_rate": 1.0, "error_codes": [502]}
+       ])
+       runner.start("test")
+       original = main.proxy.scenarios
+       main.proxy.scenarios = runner
+       try:
+           ((response, _),) = proxy_requests([], ("GET", "/proxy/shop/items", {}))
+       finally:
+           main.proxy.scenarios = original
+           runner.stop()
+
+       assert response.status_code == 502
+       logger.info("✓ Scenario error injected on proxied request")
+
+
+def replica(bus, name):
+   """A ReplicatedConfig applying updates to a plain dict"""
+   state = {}
+
+   def apply(enabled, config):
+       if config.get("error_rate", 0) > 1:
+           raise ValueError("error_rate above 1")
+       state.update(enabled=enabled, config=config)
+
+   config = ReplicatedConfig(bus, apply, replica_id=name)
+   config.start()
+   return config, state
+
+
+class TestConfigPropagation:
+   """Test suite for chaos config shared across replicas"""
+
+   def test_update_reaches_every_replica(self):
+       """A config published on one replica is applied on all of them"""
+       logger.info("Testing config propagation between replicas")
+
+       bus = MemoryConfigBus()
+       (a, state_a), (b, state_b) = replica(bus, "a"), replica(bus, "b")
+       before = prometheus_metrics.registry.get_sample_value('chaos_config_propagation_seconds_count')
+
+       version = a.publish(True, {"error_rate": 0.5})
+
+       assert version == 1
+       assert state_a == state_b == {"enabled": True, "config": {"error_rate": 0.5}}
+       assert a.version == b.version == 1
+       # Only the receiving replica observes propagation latency
+       after = prometheus_metrics.registry.get_sample_value('chaos_config_propagation_seconds_count')
+       assert after == before + 1
+       logger.info("✓ Version 1 applied on both replicas")
+
+   def test_versions_only_move_forward(self):
+       """Stale, repeated and invalid versions are ignored"""
+       logger.info("Testing config version ordering")
+
+       bus = MemoryConfigBus()
+       a, state_a = replica(bus, "a")
+       a.publish(True, {"error_rate": 0.1})
+       a.publish(False, {"error_rate": 0.2})
+
+       a.receive(1, {"enabled": True, "config": {"error_rate": 0.9}, "replica": "x", "updated_at": 0})
+       assert state_a["config"] == {"error_rate": 0.2}
+
+       a.receive(3, {"enabled": True, "config": {"error_rate": 5}, "replica": "x", "updated_at": 0}, a.epoch)
+       assert a.version == 2
+       assert state_a == {"enabled": False, "config": {"error_rate": 0.2}}
+       logger.info("✓ Only newer, valid versions applied")
+
+   def test_store_reset_starts_new_epoch(self):
+       """Replicas follow a store whose version counter restarted after a flush"""
+       logger.info("Testing config store reset")
+
+       bus = MemoryConfigBus()
+       (a, state_a), (b, state_b) = replica(bus, "a"), replica(bus, "b")
+       for rate in (0.1, 0.2, 0.3):
+           a.publish(True, {"error_rate": rate})
+       old_epoch = b.epoch
+
+       bus.reset()
+       assert b.publish(False, {"error_rate": 0.4}) == 1
+       assert a.version == b.version == 1
+       assert a.epoch == b.epoch != old_epoch
+       assert state_a == state_b == {"enabled": False, "config": {"error_rate": 0.4}}
+
+       # A message still in flight from the old epoch does not win back
+       a.receive(3, {"enabled": True, "config": {"error_rate": 0.3}, "replica": "a", "updated_at": 0}, old_epoch)
+       assert state_a["config"] == {"error_rate": 0.4}
+       logger.info("✓ Both replicas followed the store into a new epoch")
+
+   def test_concurrent_toggle_keeps_other_fields(self):
+       """A replica toggling `enabled` from a stale copy does not undo another's config change"""
+       logger.info("Testing field-level config updates")
+
+       bus = MemoryConfigBus()
+       (a, state_a), (b, state_b) = replica(bus, "a"), replica(bus, "b")
+       a.publish(False, {"error_rate": 0.1})
+       stale = dict(state_b)
+
+       a.publish(False, {"error_rate": 0.7}, changed=("config",))
+       b.publish(True, stale["config"], changed=("enabled",))
+
+       assert state_a == state_b == {"enabled": True, "config": {"error_rate": 0.7}}
+       assert bus.load()[1]["config"] == {"error_rate": 0.7}
+       logger.info("✓ Toggle and config change both kept")
+
+   def test_new_replica_loads_current_config(self):
+       """A replica starting after updates picks up the latest version"""
+       logger.info("Testing config load on replica start")
+
+       bus = MemoryConfigBus()
+       a, _ = replica(bus, "a")
+       for rate in (0.1, 0.2, 0.3):
+           a.publish(True, {"error_rate": rate})
+
+       c, state_c = replica(bus, "c")
+       assert c.version == 3
+       assert state_c["config"] == {"error_rate": 0.3}
+       logger.info("✓ Late replica loaded version 3")
+
+   def test_config_endpoint_versions(self):
+       """Config changes through the API bump the shared version"""
+       logger.info("Testing versioned config endpoint")
+
+       version = client.get("/chaos/config").json()["version"]
+       response = client.put("/chaos/config", json={"error_rate": 0.25})
+       assert response.status_code == 200
+       assert response.json()["version"] == version + 1
+
+       data = client.get("/chaos/config").json()
+       assert data["version"] == version + 1
+       assert data["config"]["error_rate"] == 0.25
+       client.put("/chaos/config", json={})
+       logger.info(f"✓ Config version advanced to {version + 1}")
+
+
+def wait_for(condition, timeout=10):
+   deadline = time.monotonic() + timeout
+   while not condition():
+       assert time.monotonic() < deadline, "condition not met in time"
+       time.sleep(0.05)
+
+
+def proc_status(pid, field):
+   with open(f"/proc/{pid}/status") as f:
+       for line in f:
+           if line.startswith(field + ":"):
+               return int(line.split()[1])
+
+
+class TestResourcePressure:
+   """Test suite for resource-pressure injectors"""
+
+   def test_cpu_burner_released_on_expiry(self):
+       """CPU burners run in their own processes and stop at their deadline"""
+       logger.info("Testing CPU pressure")
+
+       manager = resource_pressure.PressureManager(interval_seconds=0.1)
+       injection = manager.start_cpu(workers=1, load=1.0, duration_seconds=1)
+       (pid,) = injection["processes"]
+       assert prometheus_metrics.pressure_cpu_workers._value.get() == 1
+
+       time.sleep(0.5)
+       with open(f"/proc/{pid}/stat") as f:
+           user_ticks = int(f.read().split()[13])
+       assert user_ticks > 0
+
+       wait_for(lambda: not manager.active())
+       assert not os.path.exists(f"/proc/{pid}")
+       assert prometheus_metrics.pressure_cpu_workers._value.get() == 0
+       logger.info("✓ CPU burner ran and was released")
+
+   def test_memory_held_at_target(self):
+       """The memory injector holds the target as resident memory"""
+       logger.info("Testing memory pressure")
+
+       manager = resource_pressure.PressureManager(interval_seconds=0.1)
+       injection = manager.start_memory(target_mb=48, duration_seconds=10)
+       (pid,) = injection["processes"]
+       try:
+           wait_for(lambda: prometheus_metrics.pressure_memory_bytes._value.get() == 48 * 1024 * 1024)
+           assert proc_status(pid, "VmRSS") >= 48 * 1024
+       finally:
+           manager.stop("memory")
+       assert prometheus_metrics.pressure_memory_bytes._value.get() == 0
+       logger.info("✓ 48MB held resident, then released")
+
+   def test_disk_io_scratch_file_removed(self, tmp_path, monkeypatch):
+       """The disk injector writes to a scratch file it removes on release"""
+       logger.info("Testing disk I/O pressure")
+
+       monkeypatch.setattr(resource_pressure, "PRESSURE_SCRATCH_DIR", str(tmp_path))
+       manager = resource_pressure.PressureManager(interval_seconds=0.1)
+       before = prometheus_metrics.pressure_disk_written_bytes_total._value.get()
+       injection = manager.start_disk(block_kb=64, max_file_mb=1, sync=False, duration_seconds=10)
+       try:
+           wait_for(lambda: prometheus_metrics.pressure_disk_written_bytes_total._value.get() > before + 1024 * 1024)
+           assert os.path.getsize(injection["params"]["path"]) <= 1024 * 1024
+       finally:
+           manager.stop("disk")
+       assert list(tmp_path.iterdir()) == []
+       logger.info("✓ Scratch file rewritten and removed")
+
+   def test_fd_exhaustion(self):
+       """The descriptor injector holds files or connections to a target"""
+       logger.info("Testing descriptor pressure")
+
+       manager = resource_pressure.PressureManager(interval_seconds=0.1)
+       injection = manager.start_fds(count=300, duration_seconds=10)
+       (pid,) = injection["processes"]
+       try:
+           wait_for(lambda: prometheus_metrics.pressure_open_fds._value.get() == 300)
+           assert len(os.listdir(f"/proc/{pid}/fd")) >= 300
+       finally:
+           manager.stop("fds")
+
+       with socket.socket() as listener:
+           listener.bind(("127.0.0.1", 0))
+           listener.listen(64)
+           target = "127.0.0.1:%d" % listener.getsockname()[1]
+           manager.start_fds(count=20, target=target, duration_seconds=10)
+           try:
+               wait_for(lambda: prometheus_metrics.pressure_open_fds._value.get() == 20)
+           finally:
+               manager.stop("fds")
+       logger.info("✓ 300 files and 20 connections held, then released")
+
+   def test_limits_and_endpoints(self):
+       """Requests beyond the limits or for a busy kind are rejected"""
+       logger.info("Testing pressure limits")
+
+       manager = resource_pressure.PressureManager()
+       with pytest.raises(resource_pressure.PressureLimitError):
+           manager.start_cpu(workers=resource_pressure.PRESSURE_MAX_CPU_WORKERS + 1, load=1, duration_seconds=1)
+       with pytest.raises(resource_pressure.PressureLimitError):
+           manager.start_memory(target_mb=resource_pressure.PRESSURE_MAX_MEMORY_MB + 1, duration_seconds=1)
+       with pytest.raises(resource_pressure.PressureLimitError):
+           manager.start_fds(count=10, duration_seconds=resource_pressure.PRESSURE_MAX_DURATION_SECONDS + 1)
+
+       client.post("/chaos/enable")
+       assert client.post("/chaos/pressure/fds?count=0").status_code == 400
+       started = client.post("/chaos/pressure/fds?count=10&duration_seconds=5")
+       assert started.status_code == 200
+       assert client.post("/chaos/pressure/fds?count=10&duration_seconds=5").status_code == 409
+       assert [i["kind"] for i in client.get("/chaos/pressure").json()["active"]] == ["fds"]
+       assert client.delete("/chaos/pressure/fds").status_code == 200
+       assert client.delete("/chaos/pressure/fds").status_code == 404
+       logger.info("✓ Limits enforced and injectors released over HTTP")
+
+
+def middleware_app(settings):
+   """A FastAPI app with a database boundary, behind the chaos middleware"""
+   demo = FastAPI()
+   demo.add_middleware(chaos_middleware.ChaosASGIMiddleware, settings=settings)
+
+   @demo.get("/items")
+   def items():
+       try:
+           chaos_middleware.checkpoint("db", ConnectionError)
+       except ConnectionError:
+           return Response(status_code=503)
+       return {"items": []}
+
+   return demo
+
+
+class TestChaosMiddleware:
+   """Test suite for the header-driven chaos middleware"""
+
+   def test_disabled_passes_through(self):
+       """With the middleware off the header is ignored"""
+       logger.info("Testing disabled middleware")
+
+       demo = TestClient(middleware_app(chaos_middleware.ChaosSettings(enabled=False)))
+       response = demo.get("/items", headers={"X-Chaos-Fault": "error=503"})
+
+       assert response.status_code == 200
+       assert "x-chaos-injected" not in response.headers
+       logger.info("✓ Header ignored while disabled")
+
+   def test_request_boundary_faults(self):
+       """Latency and errors from the header are injected before the handler"""
+       logger.info("Testing request boundary faults")
+
+       demo = TestClient(middleware_app(chaos_middleware.ChaosSettings(enabled=True)))
+       start = time.perf_counter()
+       delayed = demo.get("/items", headers={"X-Chaos-Fault": "latency=200"})
+       assert time.perf_counter() - start >= 0.2
+       assert delayed.status_code == 200
+       assert delayed.headers["x-chaos-injected"] == "boundary=request;latency=200"
+
+       failed = demo.get("/items", headers={"X-Chaos-Fault": "error=502"})
+       assert failed.status_code == 502
+       assert failed.headers["x-chaos-injected"] == "boundary=request;error=502"
+
+       assert demo.get("/items", headers={"X-Chaos-Fault": "bogus"}).status_code == 200
+       logger.info("✓ Header faults injected at the request boundary")
+
+   def test_db_boundary_in_sync_handler(self):
+       """A db fault fires at the checkpoint inside the threadpool handler"""
+       logger.info("Testing db boundary fault")
+
+       demo = TestClient(middleware_app(chaos_middleware.ChaosSettings(enabled=True)))
+       response = demo.get("/items", headers={"X-Chaos-Fault": "error=500;boundary=db"})
+       assert response.status_code == 503
+       assert response.headers["x-chaos-injected"] == "boundary=db;error=500"
+
+       # Outside a request the checkpoint does nothing
+       chaos_middleware.checkpoint("db", ConnectionError)
+       logger.info("✓ db fault raised the handler's own error path")
+
+   def test_sampled_faults(self):
+       """A sampled config applies its fault to that fraction of requests"""
+       logger.info("Testing sampled faults")
+
+       settings = chaos_middleware.ChaosSettings(enabled=True, header=False, sample_rate=0.3,
+                                                 sample_fault="error=503")
+       demo = TestClient(middleware_app(settings))
+       statuses = [demo.get("/items", headers={"X-Chaos-Fault": "latency=1000"}).status_code
+                   for _ in range(300)]
+       assert 50 < statuses.count(503) < 130
+       assert set(statuses) == {200, 503}
+
+       settings.configure(False)
+       assert demo.get("/items").status_code == 200
+       logger.info(f"✓ {statuses.count(503)} of 300 requests sampled")
+
+   def test_wsgi_middleware(self):
+       """The WSGI middleware injects the same faults into a WSGI app"""
+       logger.info("Testing WSGI middleware")
+
+       def wsgi_app(environ, start_response):
+           try:
+               chaos_middleware.checkpoint("kafka", TimeoutError)
+               status = "200 OK"
+           except TimeoutError:
+               status = "504 Gateway Timeout"
+           start_response(status, [("Content-Type", "text/plain")])
+           return [b"ok"]
+
+       wrapped = chaos_middleware.ChaosWSGIMiddleware(wsgi_app, chaos_middleware.ChaosSettings(enabled=True))
+
+       def call(header):
+           captured = {}
+           def start_response(status, headers, exc_info=None):
+               captured["status"], captured["headers"] = status, dict(headers)
+           body = b"".join(wrapped({"HTTP_X_CHAOS_FAULT": header} if header else {}, start_response))
+           return captured["status"], captured["headers"], body
+
+       assert call(None)[0] == "200 OK"
+       status, headers, _ = call("error=503")
+       assert status.startswith("503")
+       status, headers, _ = call("error=500;boundary=kafka")
+       assert status.startswith("504")
+       assert headers["X-Chaos-Injected"] == "boundary=kafka;error=500"
+       logger.info("✓ WSGI request and kafka boundary faults injected")
+
+   def test_malformed_headers_ignored(self, caplog):
+       """A header that cannot be parsed is logged and the request served"""
+       logger.info("Testing malformed headers")
+
+       demo = TestClient(middleware_app(chaos_middleware.ChaosSettings(enabled=True)))
+       for header in ("latency=abc", "latency=500-100", "error=oops", "latency=1-x;error=503"):
+           with caplog.at_level(logging.WARNING, logger="chaos_middleware"):
+               response = demo.get("/items", headers={"X-Chaos-Fault": header})
+           assert response.status_code == 200, header
+           assert "x-chaos-injected" not in response.headers
+       assert "malformed header chaos fault" in caplog.text
+
+       # A bad sampled fault disables sampling instead of failing requests
+       settings = chaos_middleware.ChaosSettings(enabled=True, header=False, sample_rate=1.0,
+                                                 sample_fault="error=oops")
+       assert settings.sample_rate == 0.0 and not settings.active
+       logger.info("✓ Malformed headers ignored")
+
+   def test_status_clamped_and_delay_capped(self):
+       """Injected statuses stay within 400-599 and delays within CHAOS_MAX_DELAY_MS"""
+       logger.info("Testing fault bounds")
+
+       settings = chaos_middleware.ChaosSettings(enabled=True, max_delay_ms=50)
+       assert settings.pick("error=99").status == 400
+       assert settings.pick("error=200").status == 400
+       assert settings.pick("error=9999").status == 599
+       assert settings.pick("latency=3600000").delay_ms == 50
+       assert settings.pick("latency=100-900000").delay_ms == 50
+
+       demo = TestClient(middleware_app(settings))
+       start = time.perf_counter()
+       response = demo.get("/items", headers={"X-Chaos-Fault": "latency=600000;error=1"})
+       assert time.perf_counter() - start < 5
+       assert response.status_code == 400
+       assert response.headers["x-chaos-injected"] == "boundary=request;latency=50;error=400"
+       logger.info("✓ Status clamped and delay capped")
+
+   def test_service_copies_identical(self):
+       """Every service ships the same middleware (each image builds from its own directory)"""
+       services = os.path.join(os.path.dirname(__file__), "..", "..")
+       with open(chaos_middleware.__file__, "rb") as source:
+           expected = source.read()
+       for service in ("product-service", "user-service"):
+           with open(os.path.join(services, service, "chaos_middleware.py"), "rb") as copy:
+               assert copy.read() == expected, f"{service}/chaos_middleware.py differs"
+       logger.info("✓ Middleware copies identical")
+
+   def test_mounted_in_chaos_service(self):
+       """The chaos service itself honours the header when enabled"""
+       logger.info("Testing middleware in the chaos service")
+
+       before = prometheus_metrics.middleware_faults_injected_total.labels(
+           boundary="request", fault="error", source="header")._value.get()
+       chaos_middleware.settings.configure(True)
+       try:
+           response = client.get("/health", headers={"X-Chaos-Fault": "error=503"})
+       finally:
+           chaos_middleware.settings.configure(False)
+       assert response.status_code == 503
+       assert client.get("/health", headers={"X-Chaos-Fault": "error=503"}).status_code == 200
+       after = prometheus_metrics.middleware_faults_injected_total.labels(
+           boundary="request", fault="error", source="header")._value.get()
+       assert after == before + 1
+       logger.info("✓ Fault injected and counted by the chaos service")
+
+
 if __name__ == "__main__":
    # Run with: pytest services/chaos-service/tests/test_chaos.py -v
    logger.info("Run tests with: pytest services/chaos-service/tests/test_chaos.py -v")
\ No newline at end of file
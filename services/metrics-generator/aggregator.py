@@ -4,16 +4,83 @@ Collects metrics from all services and provides centralized monitoring
 """
 import requests
 import json
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import threading
 
+from requests.adapters import HTTPAdapter
+
+import prometheus_parser
+from timeseries import TimeSeriesStore
+
+# Whole-scrape budget: services that have not answered by then count as unavailable
+SCRAPE_DEADLINE_SECONDS = float(os.getenv('SCRAPE_DEADLINE_SECONDS', 2))
+# How old a snapshot the readers accept before scraping again
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv('SNAPSHOT_MAX_AGE_SECONDS', 5))
+# Bound on (service, metric) series kept in the history store
+HISTORY_MAX_SERIES = int(os.getenv('HISTORY_MAX_SERIES', 128))
+
+
+def _family(families: Dict[str, prometheus_parser.MetricFamily], suffix: str, kind: str):
+    """The family named `*<suffix>` of type `kind`, if any"""
+    # Shortest name wins: chaos_request_duration_seconds over chaos_proxy_request_duration_seconds
+    matches = [family for name, family in families.items() if name.endswith(suffix) and family.type == kind]
+    return min(matches, key=lambda family: len(family.name), default=None)
+
+
+def summarize_scrape(families: Dict[str, prometheus_parser.MetricFamily]) -> Dict[str, Any]:
+    """Request totals, error rate and latency from a service's parsed /metrics.
+    
+    Uses its `*http_requests_total` counter (5xx statuses count as failed)
+    and `*request_duration_seconds` histogram, over the process lifetime.
+    """
+    summary = {
+        'status': 'up',
+        'total_requests': 0,
+        'failed_requests': 0,
+        'error_rate_percent': 0.0,
+        'average_latency_ms': 0.0,
+        'p95_latency_ms': 0.0,
+        'p99_latency_ms': 0.0,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+    requests_total = _family(families, 'http_requests_total', 'counter')
+    if requests_total is not None:
+        total = requests_total.total()
+        failed = sum(value for labels, value in requests_total.series.items()
+                     if dict(labels).get('status', '').startswith('5'))
+        summary['total_requests'] = int(total)
+        summary['failed_requests'] = int(failed)
+        summary['error_rate_percent'] = failed / total * 100 if total else 0.0
+    
+    durations = _family(families, 'request_duration_seconds', 'histogram')
+    if durations is not None and durations.series:
+        histogram = durations.merged()
+        if histogram.count:
+            summary['average_latency_ms'] = histogram.sum / histogram.count * 1000
+            summary['p95_latency_ms'] = histogram.quantile(0.95) * 1000
+            summary['p99_latency_ms'] = histogram.quantile(0.99) * 1000
+    
+    start_time = families.get('process_start_time_seconds')
+    if start_time is not None and start_time.series:
+        summary['uptime_seconds'] = time.time() - next(iter(start_time.series.values()))
+    return summary
+
 
 class MetricsAggregator:
-    """Aggregate metrics from all CloudCart services"""
+    """Aggregate metrics from all CloudCart services
     
-    def __init__(self):
+    Services are scraped concurrently over one pooled HTTP session, within
+    `scrape_deadline` seconds. Health, performance, alerts and the
+    Prometheus export read a shared snapshot, rescraped once it is older
+    than `max_age` seconds; concurrent readers wait for a single scrape.
+    """
+    
+    def __init__(self, scrape_deadline: float = SCRAPE_DEADLINE_SECONDS,
+                 max_age: float = SNAPSHOT_MAX_AGE_SECONDS):
         self.services = {
             'api-gateway': 'http://api-gateway:3000/metrics',
             'order-service': 'http://order-service:8003/metrics',
@@ -22,43 +89,88 @@ class MetricsAggregator:
             'chaos-service': 'http://chaos-service:8004/metrics',
             'notification-worker': 'http://notification-worker:8005/metrics'
         }
-        self.metrics_history = {}
+        # Numeric metrics of every scrape, rolled up to 1s, 1m and 1h buckets
+        self.history = TimeSeriesStore(max_series=HISTORY_MAX_SERIES)
         self.last_update = None
+        self.scrape_deadline = scrape_deadline
+        self.max_age = max_age
+        self.scrape_count = 0
+        
+        # Keep-alive connections to every service, shared by the scrape threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.services), pool_maxsize=2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.services), thread_name_prefix='scrape')
+        self._scrape_lock = threading.RLock()
+        self._snapshot = None
+        self._snapshot_time = 0.0
+    
+    def _unavailable(self, service_name: str, error: str) -> Dict[str, Any]:
+        return {
+            'service': service_name,
+            'error': error,
+            'status': 'unavailable',
+            'timestamp': datetime.utcnow().isoformat()
+        }
     
     def collect_service_metrics(self, service_name: str, url: str) -> Dict[str, Any]:
         """Collect metrics from a single service"""
         try:
-            response = requests.get(url, timeout=2)
-            response.raise_for_status()
-            return response.json()
+            # /metrics is Prometheus text: parse it as it streams in
+            with self.session.get(url, timeout=self.scrape_deadline, stream=True) as response:
+                response.raise_for_status()
+                families = prometheus_parser.parse(response.iter_lines(chunk_size=64 * 1024))
+            return summarize_scrape(families)
         except Exception as e:
-            return {
-                'service': service_name,
-                'error': str(e),
-                'status': 'unavailable',
-                'timestamp': datetime.utcnow().isoformat()
-            }
+            return self._unavailable(service_name, str(e))
     
     def collect_all_metrics(self) -> Dict[str, Any]:
-        """Collect metrics from all services"""
-        all_metrics = {}
-        
-        for service_name, url in self.services.items():
-            all_metrics[service_name] = self.collect_service_metrics(service_name, url)
-        
-        self.last_update = datetime.utcnow().isoformat()
-        self.metrics_history[self.last_update] = all_metrics
-        
-        # Keep only last 100 updates
-        if len(self.metrics_history) > 100:
-            oldest_key = min(self.metrics_history.keys())
-            del self.metrics_history[oldest_key]
-        
-        return all_metrics
+        """Scrape every service now, concurrently, and store the snapshot"""
+        with self._scrape_lock:
+            futures = {
+                service_name: self._executor.submit(self.collect_service_metrics, service_name, url)
+                for service_name, url in self.services.items()
+            }
+            wait(futures.values(), timeout=self.scrape_deadline)
+            
+            all_metrics = {}
+            for service_name, future in futures.items():
+                if future.done():
+                    all_metrics[service_name] = future.result()
+                else:
+                    # Left to finish in the background; its own timeout bounds it
+                    all_metrics[service_name] = self._unavailable(
+                        service_name, f'scrape deadline of {self.scrape_deadline}s exceeded')
+            
+            self.scrape_count += 1
+            self.last_update = datetime.utcnow().isoformat()
+            now = time.time()
+            for service_name, service_metrics in all_metrics.items():
+                self.history.append(service_name, 'up', now, 0.0 if 'error' in service_metrics else 1.0)
+                self.history.record(service_name, service_metrics, now)
+            
+            self._snapshot = all_metrics
+            self._snapshot_time = time.monotonic()
+            return all_metrics
+    
+    def get_snapshot(self, max_age: Optional[float] = None) -> Dict[str, Any]:
+        """Latest metrics, scraping again only if the snapshot is older than `max_age`"""
+        max_age = self.max_age if max_age is None else max_age
+        with self._scrape_lock:
+            if self._snapshot is not None and time.monotonic() - self._snapshot_time <= max_age:
+                return self._snapshot
+            return self.collect_all_metrics()
+    
+    def snapshot_age(self) -> Optional[float]:
+        """Seconds since the last scrape, None before the first"""
+        if self._snapshot is None:
+            return None
+        return time.monotonic() - self._snapshot_time
     
     def get_system_health(self) -> Dict[str, Any]:
         """Get overall system health status"""
-        metrics = self.collect_all_metrics()
+        metrics = self.get_snapshot()
         
         healthy_services = 0
         unhealthy_services = 0
@@ -94,7 +206,7 @@ class MetricsAggregator:
     
     def get_performance_metrics(self) -> Dict[str, Any]:
         """Get aggregated performance metrics"""
-        metrics = self.collect_all_metrics()
+        metrics = self.get_snapshot()
         
         total_requests = 0
         total_errors = 0
@@ -119,6 +231,21 @@ class MetricsAggregator:
             'timestamp': self.last_update
         }
     
+    def get_history(self, service_name: str, metric: str, start: Optional[float] = None,
+                    end: Optional[float] = None, resolution: Optional[int] = None) -> Dict[str, Any]:
+        """One metric's history between `start` and `end` (epoch seconds, default the last hour)
+        
+        `resolution` picks 1, 60 or 3600 second buckets; by default the finest
+        one that still reaches back to `start`.
+        """
+        end = time.time() if end is None else end
+        start = end - 3600 if start is None else start
+        return self.history.query(service_name, metric, start, end, resolution)
+    
+    def get_history_stats(self) -> Dict[str, Any]:
+        """Series held, buckets per resolution and memory used by the history"""
+        return self.history.stats()
+    
     def get_service_dependencies(self) -> Dict[str, List[str]]:
         """Get service dependency graph"""
         return {
@@ -132,7 +259,7 @@ class MetricsAggregator:
     
     def get_alerts(self) -> List[Dict[str, Any]]:
         """Generate alerts based on current metrics"""
-        metrics = self.collect_all_metrics()
+        metrics = self.get_snapshot()
         alerts = []
         
         for service_name, service_metrics in metrics.items():
@@ -166,7 +293,7 @@ class MetricsAggregator:
     
     def export_prometheus_format(self) -> str:
         """Export metrics in Prometheus format"""
-        metrics = self.collect_all_metrics()
+        metrics = self.get_snapshot()
         lines = []
         
         for service_name, service_metrics in metrics.items():
@@ -0,0 +1,97 @@
+"""
+Benchmark the exposition-format parser on multi-megabyte scrapes
+Builds a synthetic scrape shaped like the services' own metrics (request
+counters and duration histograms per method, endpoint and status) and
+times prometheus_parser.parse() over it, next to prometheus_client's parser
+when that is installed.
+
+Run with: python benchmark_parser.py --megabytes 8
+"""
+import argparse
+import time
+import tracemalloc
+
+import prometheus_parser
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+STATUSES = ('200', '201', '400', '404', '500')
+
+
+def build_scrape(megabytes, prefix='bench'):
+    """Exposition text of at least `megabytes` MB"""
+    lines = [
+        f"# HELP {prefix}_http_requests_total Total HTTP requests",
+        f"# TYPE {prefix}_http_requests_total counter",
+    ]
+    histogram = [
+        f"# HELP {prefix}_request_duration_seconds HTTP request duration in seconds",
+        f"# TYPE {prefix}_request_duration_seconds histogram",
+    ]
+    size = 0
+    endpoint = 0
+    while size < megabytes * 1_000_000:
+        path = f"/api/resource_{endpoint}/{{id}}"
+        for method in METHODS:
+            for status in STATUSES:
+                line = (f'{prefix}_http_requests_total{{method="{method}",endpoint="{path}",status="{status}"}} '
+                        f'{endpoint * 7 + len(status)}.0')
+                lines.append(line)
+                size += len(line) + 1
+            labels = f'method="{method}",endpoint="{path}"'
+            cumulative = 0
+            for bound in BUCKETS:
+                cumulative += endpoint % 5 + 1
+                line = f'{prefix}_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}.0'
+                histogram.append(line)
+                size += len(line) + 1
+            histogram.append(f'{prefix}_request_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative}.0')
+            histogram.append(f'{prefix}_request_duration_seconds_count{{{labels}}} {cumulative}.0')
+            histogram.append(f'{prefix}_request_duration_seconds_sum{{{labels}}} {cumulative * 0.04}')
+            size += 3 * (len(labels) + 60)
+        endpoint += 1
+    return '\n'.join(lines + histogram) + '\n'
+
+
+def timed(parse, payload, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        parse(payload)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Prometheus exposition-format parser")
+    parser.add_argument('--megabytes', type=float, default=8)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    payload = build_scrape(args.megabytes)
+    megabytes = len(payload) / 1_000_000
+    lines = payload.count('\n')
+    print(f"Scrape: {megabytes:.1f} MB, {lines} lines")
+
+    seconds = timed(prometheus_parser.parse, payload, args.rounds)
+    print(f"prometheus_parser.parse:  {seconds * 1000:8.1f} ms  {megabytes / seconds:6.1f} MB/s  "
+          f"{lines / seconds / 1000:6.0f}k lines/s")
+
+    tracemalloc.start()
+    families = prometheus_parser.parse(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  peak allocation {peak / 1_000_000:.1f} MB for {sum(len(f.series) for f in families.values())} series")
+
+    try:
+        from prometheus_client.parser import text_string_to_metric_families
+    except ImportError:
+        print("prometheus_client not installed: no comparison")
+        return
+    seconds = timed(lambda text: list(text_string_to_metric_families(text)), payload, args.rounds)
+    print(f"prometheus_client parser: {seconds * 1000:8.1f} ms  {megabytes / seconds:6.1f} MB/s  "
+          f"{lines / seconds / 1000:6.0f}k lines/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Coordinated load generation across several generator processes
+A coordinator splits the target load between workers, started as local
+processes or running in other pods. Workers connect over TCP and get their
+share of the settings with a common start time. They send their report,
+with encoded histograms, back to be merged. Messages are JSON lines.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import time
+
+from load_engine import LoadStats
+
+logger = logging.getLogger(__name__)
+
+# Reports carry encoded histograms, well past asyncio's 64 KiB line limit
+MESSAGE_LIMIT = 64 * 1024 * 1024
+
+
+class CoordinationError(RuntimeError):
+    pass
+
+
+def split_settings(settings, workers):
+    """Each worker's share of the load settings.
+
+    The open-loop rate is split evenly; virtual users and connections are
+    spread with the remainder going to the first workers. Each worker gets
+    its own seed.
+    """
+    shares = []
+    for index in range(workers):
+        share = dict(settings)
+        share['rate'] = settings['rate'] / workers
+        share['users'] = settings['users'] // workers + (index < settings['users'] % workers)
+        share['max_connections'] = max(1, settings['max_connections'] // workers)
+        if settings.get('seed') is not None:
+            share['seed'] = settings['seed'] + index
+        shares.append(share)
+    return shares
+
+
+async def _send(writer, message):
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+
+
+async def _receive(reader):
+    line = await reader.readline()
+    if not line:
+        raise CoordinationError("connection closed")
+    return json.loads(line)
+
+
+class Coordinator:
+    """Waits for `workers` workers, starts them together and merges their reports.
+
+    With `spawn`, the workers are local processes running
+    `worker_target(address)`; otherwise they connect from elsewhere (pods
+    running the generator with --connect). Workers start
+    `start_delay` seconds after the last one joins, by wall clock; in open
+    loop each is offset by a slice of the arrival interval so their
+    requests interleave rather than arrive in bursts.
+    """
+
+    def __init__(self, settings, workers, host='127.0.0.1', port=0, spawn=True, worker_target=None,
+                 join_timeout=60.0, start_delay=1.0):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if settings['mode'] == 'closed' and settings['users'] < workers:
+            raise ValueError("need at least one virtual user per worker")
+        if spawn and worker_target is None:
+            raise ValueError("spawning workers needs a worker_target")
+        self.settings = settings
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.spawn = spawn
+        self.worker_target = worker_target
+        self.join_timeout = join_timeout
+        self.start_delay = start_delay
+        self.processes = []
+        self._joined = []
+        self._all_joined = None
+
+    async def run(self):
+        """Run the distributed load; returns the merged LoadStats"""
+        self._all_joined = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port, limit=MESSAGE_LIMIT)
+        self.port = server.sockets[0].getsockname()[1]
+        logger.info(f"🛰️  Coordinator listening on {self.host}:{self.port}, waiting for {self.workers} workers")
+        try:
+            if self.spawn:
+                self._spawn()
+            try:
+                await asyncio.wait_for(self._all_joined.wait(), self.join_timeout)
+            except asyncio.TimeoutError:
+                raise CoordinationError(f"only {len(self._joined)} of {self.workers} workers joined") from None
+            reports = await self._start()
+        finally:
+            server.close()
+            for _, writer in self._joined:
+                writer.close()
+            self._join_processes()
+
+        stats = LoadStats.from_report(reports[0])
+        for report in reports[1:]:
+            stats.merge(LoadStats.from_report(report))
+        logger.info(f"📊 Merged reports from {len(reports)} workers")
+        return stats
+
+    async def _handle(self, reader, writer):
+        try:
+            hello = await _receive(reader)
+        except (CoordinationError, ValueError):
+            writer.close()
+            return
+        if len(self._joined) >= self.workers:
+            await _send(writer, {'type': 'rejected', 'reason': 'enough workers'})
+            writer.close()
+            return
+        self._joined.append((reader, writer))
+        logger.info(f"Worker {len(self._joined)}/{self.workers} joined from {hello.get('host')} "
+                    f"(pid {hello.get('pid')})")
+        if len(self._joined) == self.workers:
+            self._all_joined.set()
+
+    async def _start(self):
+        start_at = time.time() + self.start_delay
+        # Stagger open-loop workers across one interval of the total rate
+        stagger = 1.0 / self.settings['rate'] if self.settings['mode'] == 'open' else 0.0
+        shares = split_settings(self.settings, self.workers)
+        for index, ((_, writer), share) in enumerate(zip(self._joined, shares)):
+            await _send(writer, {'type': 'start', 'worker': index, 'start_at': start_at + index * stagger,
+                                 'settings': share})
+        logger.info(f"🚦 {self.workers} workers start in {self.start_delay}s")
+
+        timeout = self.start_delay + self.settings['duration'] + self.settings['timeout'] + 30
+        try:
+            messages = await asyncio.wait_for(
+                asyncio.gather(*(_receive(reader) for reader, _ in self._joined)), timeout)
+        except asyncio.TimeoutError:
+            raise CoordinationError("workers did not report in time") from None
+        failed = [message for message in messages if message['type'] != 'report']
+        if failed:
+            raise CoordinationError(f"{len(failed)} workers failed: {failed[0].get('error')}")
+        return [message['report'] for message in messages]
+
+    def _spawn(self):
+        # A fresh interpreter per worker: no inherited event loop or server threads
+        context = multiprocessing.get_context('spawn')
+        address = f"{self.host}:{self.port}"
+        for _ in range(self.workers):
+            process = context.Process(target=self.worker_target, args=(address,), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    def _join_processes(self):
+        for process in self.processes:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+
+
+async def work(address, build_engine, host=None):
+    """Join the coordinator at `address` (host:port), run the given share and report back"""
+    coordinator_host, port = address.rsplit(':', 1)
+    reader, writer = await asyncio.open_connection(coordinator_host, int(port), limit=MESSAGE_LIMIT)
+    try:
+        await _send(writer, {'type': 'hello', 'host': host, 'pid': multiprocessing.current_process().pid})
+        message = await _receive(reader)
+        if message['type'] != 'start':
+            raise CoordinationError(f"coordinator refused this worker: {message.get('reason')}")
+        try:
+            engine = build_engine(message['settings'])
+            await asyncio.sleep(max(0.0, message['start_at'] - time.time()))
+            logger.info(f"Worker {message['worker']} starting")
+            await engine.run()
+        except Exception as e:
+            await _send(writer, {'type': 'failed', 'error': f"{type(e).__name__}: {e}"})
+            raise
+        await _send(writer, {'type': 'report', 'report': engine.stats.report()})
+    finally:
+        writer.close()
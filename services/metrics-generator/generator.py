@@ -1,10 +1,19 @@
 import requests
+import argparse
+import asyncio
+import json
 import random
 import time
 import os
 import logging
+import socket
 from datetime import datetime
 
+import distributed
+import journeys
+import replay
+from load_engine import LoadEngine, LoadStats
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -14,6 +23,25 @@ logger = logging.getLogger(__name__)
 API_GATEWAY_URL = os.getenv('API_GATEWAY_URL', 'http://api-gateway:3000')
 INTERVAL_SECONDS = int(os.getenv('INTERVAL_SECONDS', 5))
 
+# Load mode: ambient (the trickle of background traffic below), open or closed
+LOAD_MODE = os.getenv('LOAD_MODE', 'ambient')
+LOAD_RPS = float(os.getenv('LOAD_RPS', 100))
+LOAD_USERS = int(os.getenv('LOAD_USERS', 50))
+LOAD_DURATION_SECONDS = float(os.getenv('LOAD_DURATION_SECONDS', 60))
+LOAD_THINK_TIME_SECONDS = float(os.getenv('LOAD_THINK_TIME_SECONDS', 0))
+LOAD_MAX_CONNECTIONS = int(os.getenv('LOAD_MAX_CONNECTIONS', 200))
+LOAD_TIMEOUT_SECONDS = float(os.getenv('LOAD_TIMEOUT_SECONDS', 10))
+LOAD_REPORT_INTERVAL_SECONDS = float(os.getenv('LOAD_REPORT_INTERVAL_SECONDS', 10))
+LOAD_THINK_SCALE = float(os.getenv('LOAD_THINK_SCALE', 1.0))
+LOAD_RAMP_UP_SECONDS = float(os.getenv('LOAD_RAMP_UP_SECONDS', 0))
+LOAD_RAMP_DOWN_SECONDS = float(os.getenv('LOAD_RAMP_DOWN_SECONDS', 0))
+
+LOAD_REPLAY_SPEED = float(os.getenv('LOAD_REPLAY_SPEED', 1.0))
+
+# Distributed load: a coordinator for LOAD_WORKERS workers, or a worker joining LOAD_COORDINATOR
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', 0))
+LOAD_COORDINATOR = os.getenv('LOAD_COORDINATOR', '')
+
 # Sample product IDs
 PRODUCT_IDS = list(range(1, 11))
 
@@ -111,14 +139,9 @@ def generate_error_traffic():
         except Exception as e:
             logger.error(f"Error endpoint failed: {endpoint} - {e}")
 
-def main():
-    logger.info("🚀 Starting Metrics Generator...")
-    logger.info(f"Target API Gateway: {API_GATEWAY_URL}")
-    logger.info(f"Interval: {INTERVAL_SECONDS} seconds")
-    
-    # Wait for API Gateway to be ready
+def wait_for_gateway(max_retries=30):
+    """Wait until the API Gateway answers its health check"""
     logger.info("Waiting for API Gateway to be ready...")
-    max_retries = 30
     retry_count = 0
     
     while retry_count < max_retries:
@@ -126,14 +149,20 @@ def main():
             response = requests.get(f"{API_GATEWAY_URL}/health", timeout=5)
             if response.status_code == 200:
                 logger.info("✅ API Gateway is ready!")
-                break
+                return True
         except Exception as e:
             logger.warning(f"Waiting for API Gateway... ({retry_count + 1}/{max_retries})")
             time.sleep(2)
             retry_count += 1
     
-    if retry_count >= max_retries:
-        logger.error("❌ Failed to connect to API Gateway. Exiting.")
+    logger.error("❌ Failed to connect to API Gateway. Exiting.")
+    return False
+
+def run_ambient():
+    """Trickle of background traffic with occasional bursts and errors"""
+    logger.info(f"Interval: {INTERVAL_SECONDS} seconds")
+    
+    if not wait_for_gateway():
         return
     
     # Metrics tracking
@@ -180,5 +209,211 @@ def main():
         logger.info("\n🛑 Stopping Metrics Generator...")
         logger.info(f"Final Stats - Total: {total_requests}, Success: {successful_requests}, Failed: {failed_requests}")
 
+def load_settings(args):
+    """The load flags as a plain dict, as sent to distributed workers"""
+    return {
+        'base_url': API_GATEWAY_URL,
+        'mode': args.mode,
+        'rate': args.rps,
+        'users': args.users,
+        'duration': args.duration,
+        'ramp_up': args.ramp_up,
+        'ramp_down': args.ramp_down,
+        'think_time': args.think_time,
+        'journeys': args.journeys,
+        'think_scale': args.think_scale,
+        'max_connections': args.max_connections,
+        'timeout': args.timeout,
+        'expected_interval': args.expected_interval,
+        'report_interval': args.report_interval,
+        'seed': None,
+    }
+
+def build_engine(settings):
+    """A LoadEngine, or JourneyEngine with --journeys, from load_settings()"""
+    options = dict(
+        mode=settings['mode'],
+        rate=settings['rate'],
+        users=settings['users'],
+        duration=settings['duration'],
+        ramp_up=settings['ramp_up'],
+        ramp_down=settings['ramp_down'],
+        think_time=settings['think_time'],
+        max_connections=settings['max_connections'],
+        timeout=settings['timeout'],
+        # Open-loop response times already count queueing; correcting them would count it twice
+        stats=LoadStats(expected_interval=settings['expected_interval'] if settings['mode'] == 'closed' else 0.0),
+        report_interval=settings['report_interval'],
+        seed=settings['seed'],
+    )
+    if settings['journeys'] is not None:
+        path = settings['journeys']
+        scripted = journeys.load_journeys(path) if path else journeys.JOURNEYS
+        logger.info(f"🧭 Journeys: {', '.join(f'{j.name} ({j.weight})' for j in scripted)}")
+        return journeys.JourneyEngine(settings['base_url'], scripted, think_scale=settings['think_scale'], **options)
+    return LoadEngine(settings['base_url'], ENDPOINTS, **options)
+
+def describe_load(args):
+    if args.mode == 'open':
+        unit = 'journeys/s' if args.journeys is not None else 'req/s'
+        load = f"Open-loop load: {args.rps} {unit}"
+    else:
+        load = f"Closed-loop load: {args.users} users"
+    ramps = f" (ramp up {args.ramp_up}s, down {args.ramp_down}s)" if args.ramp_up or args.ramp_down else ""
+    return f"{load} for {args.duration}s{ramps}"
+
+def run_load(args):
+    """Drive the gateway with the async load engine"""
+    if not wait_for_gateway():
+        return None
+    
+    engine = build_engine(load_settings(args))
+    logger.info(f"🔥 {describe_load(args)}")
+    asyncio.run(engine.run())
+    return write_reports(engine.stats, args)
+
+def run_coordinator(args):
+    """Split the load across --workers generator processes and merge their reports"""
+    if not wait_for_gateway():
+        return None
+    
+    host, port = (args.listen or '127.0.0.1:0').rsplit(':', 1)
+    coordinator = distributed.Coordinator(
+        load_settings(args), args.workers,
+        host=host, port=int(port),
+        spawn=not args.listen,
+        worker_target=run_worker,
+    )
+    logger.info(f"🔥 {describe_load(args)} across {args.workers} workers")
+    stats = asyncio.run(coordinator.run())
+    return write_reports(stats, args)
+
+def run_replay(args):
+    """Replay a captured traffic file and compare its latency with the capture"""
+    capture = replay.load_capture(args.replay)
+    if not wait_for_gateway():
+        return None
+    
+    engine = replay.ReplayEngine(
+        API_GATEWAY_URL, capture,
+        speed=args.speed,
+        max_connections=args.max_connections,
+        timeout=args.timeout,
+        report_interval=args.report_interval,
+    )
+    logger.info(f"⏪ Replaying {len(capture)} requests from {args.replay} at {args.speed}x "
+                f"({engine.duration:.1f}s)")
+    asyncio.run(engine.run())
+    summary = write_reports(engine.stats, args)
+    
+    comparison = engine.comparison()
+    print(json.dumps(comparison, indent=2))
+    if comparison['compared']:
+        delta = comparison['delta_ms']
+        logger.info(f"Against the capture: median {delta['p50']:+}ms, p99 {delta['p99']:+}ms, "
+                    f"{delta['slower']}/{comparison['compared']} requests slower, "
+                    f"{comparison['status_mismatches']} status changes")
+    if args.deltas:
+        with open(args.deltas, 'w') as f:
+            for delta in engine.deltas:
+                f.write(json.dumps(delta) + '\n')
+        logger.info(f"Per-request deltas written to {args.deltas}")
+    return {**summary, 'replay': comparison}
+
+def run_worker(address):
+    """Join the coordinator at host:port and generate this worker's share of the load"""
+    asyncio.run(distributed.work(address, build_engine, host=socket.gethostname()))
+
+def merge_reports(args):
+    """Combine the JSON reports of several generator instances"""
+    stats = None
+    for path in args.merge:
+        with open(path) as f:
+            report = LoadStats.from_report(json.load(f))
+        if stats is None:
+            stats = report
+        else:
+            stats.merge(report)
+    logger.info(f"📊 Merged {len(args.merge)} reports")
+    return write_reports(stats, args)
+
+def write_reports(stats, args):
+    """Print the summary; write the JSON report and hgrm distribution if asked"""
+    summary = stats.summary()
+    print(json.dumps(summary, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(stats.report(), f, indent=2)
+        logger.info(f"Report written to {args.report}")
+    if args.hgrm:
+        with open(args.hgrm, 'w') as f:
+            f.write(stats.combined(stats.response).percentile_distribution())
+        logger.info(f"Percentile distribution written to {args.hgrm}")
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate traffic against the API Gateway")
+    parser.add_argument('--mode', choices=['ambient', 'open', 'closed'], default=LOAD_MODE)
+    parser.add_argument('--rps', type=float, default=LOAD_RPS, help="Target request rate (open loop)")
+    parser.add_argument('--users', type=int, default=LOAD_USERS, help="Virtual users (closed loop)")
+    parser.add_argument('--duration', type=float, default=LOAD_DURATION_SECONDS,
+                        help="Seconds of load, ramps included")
+    parser.add_argument('--ramp-up', type=float, default=LOAD_RAMP_UP_SECONDS,
+                        help="Seconds to grow the rate (or start the users) from zero")
+    parser.add_argument('--ramp-down', type=float, default=LOAD_RAMP_DOWN_SECONDS,
+                        help="Seconds to wind the load back down at the end")
+    parser.add_argument('--think-time', type=float, default=LOAD_THINK_TIME_SECONDS,
+                        help="Seconds each virtual user waits between requests")
+    parser.add_argument('--journeys', nargs='?', const='', metavar='FILE',
+                        help="Run scripted user journeys instead of single requests: the built-in "
+                             "browse/checkout/account mix, or JOURNEYS from a Python file; "
+                             "--rps then counts journeys started per second")
+    parser.add_argument('--think-scale', type=float, default=LOAD_THINK_SCALE,
+                        help="Multiply every journey think time (0 disables them)")
+    parser.add_argument('--max-connections', type=int, default=LOAD_MAX_CONNECTIONS)
+    parser.add_argument('--timeout', type=float, default=LOAD_TIMEOUT_SECONDS)
+    parser.add_argument('--expected-interval', type=float, default=0.0,
+                        help="Seconds between a closed-loop user's requests when nothing stalls; "
+                             "corrects its response times for coordinated omission (--mode closed only)")
+    parser.add_argument('--report-interval', type=float, default=LOAD_REPORT_INTERVAL_SECONDS,
+                        help="Seconds between progress lines with interval percentiles")
+    parser.add_argument('--report', help="Write the final JSON report (with histograms) here")
+    parser.add_argument('--hgrm', help="Write the response-time percentile distribution (hgrm) here")
+    parser.add_argument('--merge', nargs='+', metavar='REPORT',
+                        help="Merge JSON reports from several generators instead of generating load")
+    parser.add_argument('--replay', metavar='CAPTURE',
+                        help="Replay a JSONL capture or gateway access log on its original timing")
+    parser.add_argument('--speed', type=float, default=LOAD_REPLAY_SPEED,
+                        help="Replay this many times faster than captured")
+    parser.add_argument('--deltas', metavar='FILE',
+                        help="Write each replayed request's latency against the capture (JSONL) here")
+    parser.add_argument('--workers', type=int, default=LOAD_WORKERS,
+                        help="Coordinate this many worker processes, splitting the load between them")
+    parser.add_argument('--listen', metavar='HOST:PORT',
+                        help="With --workers, wait for remote workers here instead of spawning local ones")
+    parser.add_argument('--connect', metavar='HOST:PORT', default=LOAD_COORDINATOR or None,
+                        help="Run as a worker for the coordinator at this address")
+    args = parser.parse_args(argv)
+    if args.expected_interval and args.mode != 'closed':
+        parser.error("--expected-interval only applies with --mode closed")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    logger.info("🚀 Starting Metrics Generator...")
+    logger.info(f"Target API Gateway: {API_GATEWAY_URL}")
+    
+    if args.merge:
+        return merge_reports(args)
+    if args.connect:
+        return run_worker(args.connect)
+    if args.replay:
+        return run_replay(args)
+    if args.mode == 'ambient':
+        return run_ambient()
+    if args.workers:
+        return run_coordinator(args)
+    return run_load(args)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,246 @@
+"""
+Scripted user journeys for the load engine
+A journey is a list of steps run in order by one virtual user: requests with
+templated paths and bodies, weighted think times, and local actions such as
+filling the cart. Values extracted from responses (JWT, user, product and order
+ids) are kept in the virtual user's variables for the steps that follow.
+"""
+import asyncio
+import importlib.util
+import string
+import uuid
+
+from load_engine import LoadEngine
+
+PASSWORD = 'LoadTest123!'
+
+_FORMATTER = string.Formatter()
+
+
+class JourneyError(ValueError):
+    pass
+
+
+class Request:
+    """An HTTP request step.
+
+    `path` and string values in `json` are templates over the virtual
+    user's variables ("/api/orders/{order_id}/pay", "{product[id]}"); a
+    template that is a single placeholder keeps the variable's type.
+    `json` may also be a callable taking the variables. A status outside
+    `expect` fails the journey. `extract` maps variable names to dotted
+    paths into the JSON response ("user.id") or to callables
+    fn(body, rng). Steps with a `when(vars)` that is false are skipped.
+    Requests carry the virtual user's JWT once it has one.
+    """
+
+    def __init__(self, name, method, path, json=None, expect=(200,), extract=None, when=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.json = json
+        self.expect = tuple(expect)
+        self.extract = extract or {}
+        self.when = when
+
+
+class Think:
+    """A pause drawn from weighted (low, high, weight) ranges of seconds.
+
+    Think((0.5, 2, 70), (5, 15, 30)): 70% of pauses last 0.5-2s, 30% 5-15s.
+    """
+
+    def __init__(self, *ranges, when=None):
+        if not ranges:
+            raise JourneyError("Think needs at least one (low, high, weight) range")
+        self.ranges = ranges
+        self.weights = [weight for _, _, weight in ranges]
+        self.when = when
+
+    def draw(self, rng):
+        low, high, _ = rng.choices(self.ranges, self.weights)[0]
+        return rng.uniform(low, high)
+
+
+class Action:
+    """A local step, no request: fn(vars, rng) updates the virtual user's variables"""
+
+    def __init__(self, name, fn, when=None):
+        self.name = name
+        self.fn = fn
+        self.when = when
+
+
+class Journey:
+    """A named, weighted sequence of steps"""
+
+    def __init__(self, name, weight, steps):
+        if not any(isinstance(step, Request) for step in steps):
+            raise JourneyError(f"Journey {name!r} has no requests")
+        self.name = name
+        self.weight = weight
+        self.steps = steps
+
+
+def render(value, variables):
+    """Fill templates in `value` (str, list, dict or callable) from `variables`"""
+    if callable(value):
+        return value(variables)
+    if isinstance(value, str):
+        if value.startswith('{') and value.endswith('}') and value.count('{') == 1:
+            # A lone placeholder keeps ints and floats as they are
+            return _FORMATTER.get_field(value[1:-1], (), variables)[0]
+        return value.format_map(variables)
+    if isinstance(value, dict):
+        return {key: render(item, variables) for key, item in value.items()}
+    if isinstance(value, list):
+        return [render(item, variables) for item in value]
+    return value
+
+
+def lookup(body, path):
+    """Follow a dotted path ("user.id", "items.0.price") into a JSON body"""
+    for part in path.split('.'):
+        body = body[int(part)] if isinstance(body, list) else body[part]
+    return body
+
+
+class JourneyEngine(LoadEngine):
+    """Runs weighted journeys instead of single requests.
+
+    open: `rate` new virtual users arrive per second, each running one
+      journey; the first request is timed from its arrival
+    closed: `users` virtual users run journeys back to back, keeping
+      their variables (a user registers once, then logs in each time)
+
+    Each step is recorded as "<journey> <step>", so every journey gets its
+    own latency histograms, and each journey's outcome and duration via
+    record_journey(). `think_scale` stretches or shrinks every think time.
+    """
+
+    def __init__(self, base_url, journeys, think_scale=1.0, **kwargs):
+        super().__init__(base_url, [{'weight': j.weight, 'journey': j} for j in journeys], **kwargs)
+        self.think_scale = think_scale
+        self.run_id = uuid.uuid4().hex[:8]  # keeps usernames unique across runs
+
+    async def iteration(self, pool, state, intended=None):
+        journey = self.choose()['journey']
+        state.setdefault('run', self.run_id)
+        await self.run_journey(journey, pool, state, intended)
+
+    async def run_journey(self, journey, pool, variables, intended=None):
+        """Run every step; returns whether the journey completed"""
+        loop = asyncio.get_running_loop()
+        started = loop.time() if intended is None else intended
+        for step in journey.steps:
+            if step.when is not None and not step.when(variables):
+                continue
+            if isinstance(step, Think):
+                await asyncio.sleep(step.draw(self.rng) * self.think_scale)
+                continue
+            if isinstance(step, Action):
+                step.fn(variables, self.rng)
+                continue
+
+            endpoint = {'method': step.method, 'path': render(step.path, variables),
+                        'json': render(step.json, variables)}
+            headers = {'Authorization': f"Bearer {variables['token']}"} if 'token' in variables else None
+            response = await self.send(pool, endpoint, intended, name=f"{journey.name} {step.name}",
+                                       headers=headers)
+            intended = None  # later steps follow think time, not a schedule
+            if response is None or response.status_code not in step.expect:
+                self.stats.record_journey(journey.name, False, loop.time() - started)
+                return False
+            if step.extract:
+                try:
+                    body = response.json()
+                    for name, source in step.extract.items():
+                        variables[name] = source(body, self.rng) if callable(source) else lookup(body, source)
+                except (ValueError, KeyError, IndexError, TypeError):
+                    self.stats.record_journey(journey.name, False, loop.time() - started)
+                    return False
+        self.stats.record_journey(journey.name, True, loop.time() - started)
+        return True
+
+
+def load_journeys(path):
+    """JOURNEYS from a Python file written with this module's steps"""
+    spec = importlib.util.spec_from_file_location('custom_journeys', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not getattr(module, 'JOURNEYS', None):
+        raise JourneyError(f"{path} defines no JOURNEYS")
+    return module.JOURNEYS
+
+
+def pick_product(body, rng):
+    in_stock = [product for product in body if product.get('stock', 0) > 0]
+    return rng.choice(in_stock or body)
+
+
+def add_to_cart(variables, rng):
+    # The cart only exists in the browser; the order carries its items
+    product = variables['product']
+    variables.setdefault('cart', []).append({
+        'product_id': product['id'],
+        'quantity': rng.randint(1, 3),
+        'price': product['price'],
+    })
+
+
+def empty_cart(variables, rng):
+    variables.pop('cart', None)
+
+
+def registered(variables):
+    return 'user_id' in variables
+
+
+USERNAME = 'load-{run}-{vu}'
+
+REGISTER = Request('register', 'POST', '/api/auth/register', json={
+    'username': USERNAME,
+    'email': USERNAME + '@loadtest.local',
+    'password': PASSWORD,
+    'full_name': 'Load Test',
+}, expect=(201,), extract={'token': 'token', 'user_id': 'user.id'}, when=lambda v: not registered(v))
+
+LOGIN = Request('login', 'POST', '/api/auth/login', json={'username': USERNAME, 'password': PASSWORD},
+                extract={'token': 'token'})
+
+BROWSE = Journey('browse', 60, [
+    Request('list products', 'GET', '/api/products', extract={'product': pick_product}),
+    Think((1, 4, 70), (5, 15, 30)),
+    Request('view product', 'GET', '/api/products/{product[id]}'),
+    Think((1, 4, 80), (5, 10, 20)),
+    Request('category', 'GET', '/api/products/category/{product[category]}'),
+])
+
+CHECKOUT = Journey('checkout', 25, [
+    REGISTER,
+    Think((1, 3, 100)),
+    LOGIN,
+    Think((0.5, 2, 100)),
+    Request('list products', 'GET', '/api/products', extract={'product': pick_product}),
+    Think((2, 6, 70), (8, 20, 30)),
+    Request('view product', 'GET', '/api/products/{product[id]}'),
+    Action('add to cart', add_to_cart),
+    Think((1, 5, 100)),
+    Request('create order', 'POST', '/api/orders', json=lambda v: {'items': v['cart']},
+            expect=(201,), extract={'order_id': 'id'}),
+    Action('empty cart', empty_cart),
+    Think((2, 8, 100)),
+    Request('pay', 'POST', '/api/orders/{order_id}/pay', json={'payment_method': 'credit_card'}),
+    Think((1, 3, 100)),
+    Request('my orders', 'GET', '/api/orders/my-orders'),
+])
+
+ACCOUNT = Journey('account', 15, [
+    REGISTER,
+    LOGIN,
+    Think((1, 5, 100)),
+    Request('my orders', 'GET', '/api/orders/my-orders'),
+])
+
+# Default journey mix: mostly browsing, a quarter checking out
+JOURNEYS = [BROWSE, CHECKOUT, ACCOUNT]
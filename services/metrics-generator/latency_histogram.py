@@ -0,0 +1,281 @@
+"""
+HDR-style latency histogram for the metrics generator
+Log-linear buckets with a fixed number of significant digits over the whole
+range, so any percentile is exact to that precision in constant memory.
+Histograms merge by adding counts, encode to the HdrHistogram V2 compressed
+format and print hgrm percentile distributions.
+"""
+import base64
+import math
+import struct
+import zlib
+from array import array
+
+# HdrHistogram V2 encoding cookies
+ENCODING_COOKIE = 0x1c849303
+COMPRESSED_COOKIE = 0x1c849304
+PAYLOAD_HEADER = struct.Struct('>iiiiqqd')
+COMPRESSED_HEADER = struct.Struct('>ii')
+
+
+class LatencyHistogram:
+    """Counts of values from `lowest` to `highest` at `significant_figures` precision.
+
+    Values are integers; the generator records microseconds. Values above
+    `highest` are clamped to it and counted in `clamped`.
+    """
+
+    def __init__(self, lowest=1, highest=60_000_000, significant_figures=3):
+        if not 1 <= significant_figures <= 5:
+            raise ValueError("significant_figures must be between 1 and 5")
+        if lowest < 1 or highest < 2 * lowest:
+            raise ValueError("need 1 <= lowest and highest >= 2 * lowest")
+        self.lowest = lowest
+        self.highest = highest
+        self.significant_figures = significant_figures
+
+        largest_single_unit = 2 * 10 ** significant_figures
+        sub_bucket_count_magnitude = math.ceil(math.log2(largest_single_unit))
+        self.sub_bucket_half_count_magnitude = max(sub_bucket_count_magnitude, 1) - 1
+        self.unit_magnitude = int(math.floor(math.log2(lowest)))
+        self.sub_bucket_count = 1 << (self.sub_bucket_half_count_magnitude + 1)
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.sub_bucket_mask = (self.sub_bucket_count - 1) << self.unit_magnitude
+
+        smallest_untrackable = self.sub_bucket_count << self.unit_magnitude
+        self.bucket_count = 1
+        while smallest_untrackable <= highest:
+            smallest_untrackable <<= 1
+            self.bucket_count += 1
+        self.counts = array('q', bytes(8 * (self.bucket_count + 1) * self.sub_bucket_half_count))
+
+        self.total_count = 0
+        self.clamped = 0
+        self.min_value = None
+        self.max_value = 0
+
+    def _index(self, value):
+        bucket = (value | self.sub_bucket_mask).bit_length() - (
+            self.unit_magnitude + self.sub_bucket_half_count_magnitude + 1)
+        sub_bucket = value >> (bucket + self.unit_magnitude)
+        return ((bucket + 1) << self.sub_bucket_half_count_magnitude) + sub_bucket - self.sub_bucket_half_count
+
+    def _value_at_index(self, index):
+        bucket = (index >> self.sub_bucket_half_count_magnitude) - 1
+        sub_bucket = (index & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+        if bucket < 0:
+            sub_bucket -= self.sub_bucket_half_count
+            bucket = 0
+        return sub_bucket << (bucket + self.unit_magnitude)
+
+    def _range_at_index(self, index):
+        """(lowest, highest) value equivalent to the bucket at `index`"""
+        lowest = self._value_at_index(index)
+        bucket = max(0, (index >> self.sub_bucket_half_count_magnitude) - 1)
+        return lowest, lowest + (1 << (bucket + self.unit_magnitude)) - 1
+
+    def record(self, value, count=1):
+        value = int(value)
+        if value < 0:
+            raise ValueError("cannot record a negative value")
+        if value > self.highest:
+            value = self.highest
+            self.clamped += count
+        self.counts[self._index(value)] += count
+        self.total_count += count
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+        if value > self.max_value:
+            self.max_value = value
+
+    def record_corrected(self, value, expected_interval):
+        """Record `value`, back-filling the samples a stalled sender never took.
+
+        For a sender that meant to send every `expected_interval` but was
+        blocked for `value`, adds value - interval, value - 2 * interval, ...
+        down to the interval, as HdrHistogram's recordCorrectedValue does.
+        """
+        self.record(value)
+        if expected_interval <= 0:
+            return
+        missing = value - expected_interval
+        while missing >= expected_interval:
+            self.record(missing)
+            missing -= expected_interval
+
+    def add(self, other):
+        """Add every count of `other`, which must have the same layout"""
+        if (other.lowest, other.highest, other.significant_figures) != \
+                (self.lowest, self.highest, self.significant_figures):
+            raise ValueError("cannot add histograms with different ranges or precision")
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.total_count += other.total_count
+        self.clamped += other.clamped
+        if other.min_value is not None and (self.min_value is None or other.min_value < self.min_value):
+            self.min_value = other.min_value
+        self.max_value = max(self.max_value, other.max_value)
+
+    def reset(self):
+        self.counts = array('q', bytes(8 * len(self.counts)))
+        self.total_count = 0
+        self.clamped = 0
+        self.min_value = None
+        self.max_value = 0
+
+    def _nonzero(self):
+        for index, count in enumerate(self.counts):
+            if count:
+                yield index, count
+
+    def _count_at_percentile(self, percentile):
+        # Rounded as HdrHistogram does: ceil() would turn 99.9% of 50000 into 49951
+        return max(1, int(min(percentile, 100.0) / 100 * self.total_count + 0.5))
+
+    def value_at_percentile(self, percentile):
+        """Highest value equivalent to the `percentile`th recorded value"""
+        if not self.total_count:
+            return 0
+        target = self._count_at_percentile(percentile)
+        seen = 0
+        for index, count in self._nonzero():
+            seen += count
+            if seen >= target:
+                return min(self._range_at_index(index)[1], self.max_value)
+        return self.max_value
+
+    def percentiles(self, percentiles):
+        """Several percentiles in one pass: {percentile: value}"""
+        if not self.total_count:
+            return {p: 0 for p in percentiles}
+        targets = sorted((self._count_at_percentile(p), p) for p in percentiles)
+        result = {}
+        seen = 0
+        position = 0
+        for index, count in self._nonzero():
+            seen += count
+            while position < len(targets) and seen >= targets[position][0]:
+                result[targets[position][1]] = min(self._range_at_index(index)[1], self.max_value)
+                position += 1
+            if position == len(targets):
+                break
+        return result
+
+    def mean(self):
+        if not self.total_count:
+            return 0.0
+        total = 0
+        for index, count in self._nonzero():
+            lowest, highest = self._range_at_index(index)
+            total += (lowest + highest + 1) // 2 * count
+        return total / self.total_count
+
+    def stddev(self):
+        if not self.total_count:
+            return 0.0
+        mean = self.mean()
+        squares = 0.0
+        for index, count in self._nonzero():
+            lowest, highest = self._range_at_index(index)
+            squares += ((lowest + highest + 1) // 2 - mean) ** 2 * count
+        return math.sqrt(squares / self.total_count)
+
+    def encode(self):
+        """Base64 of the HdrHistogram V2 compressed encoding"""
+        payload = bytearray()
+        last = -1
+        for index, count in enumerate(self.counts):
+            if count:
+                last = index
+        zeros = 0
+        for count in self.counts[:last + 1]:
+            if count:
+                if zeros:
+                    _write_varint(payload, -zeros)
+                    zeros = 0
+                _write_varint(payload, count)
+            else:
+                zeros += 1
+        header = PAYLOAD_HEADER.pack(ENCODING_COOKIE, len(payload), 0, self.significant_figures,
+                                     self.lowest, self.highest, 1.0)
+        compressed = zlib.compress(header + bytes(payload))
+        return base64.b64encode(COMPRESSED_HEADER.pack(COMPRESSED_COOKIE, len(compressed)) + compressed).decode()
+
+    @classmethod
+    def decode(cls, encoded):
+        raw = base64.b64decode(encoded)
+        cookie, length = COMPRESSED_HEADER.unpack_from(raw)
+        if cookie != COMPRESSED_COOKIE:
+            raise ValueError("not a compressed V2 histogram")
+        data = zlib.decompress(raw[COMPRESSED_HEADER.size:COMPRESSED_HEADER.size + length])
+        cookie, payload_length, _, significant_figures, lowest, highest, _ = PAYLOAD_HEADER.unpack_from(data)
+        if cookie != ENCODING_COOKIE:
+            raise ValueError("not a V2 histogram payload")
+        histogram = cls(lowest, highest, significant_figures)
+        position = PAYLOAD_HEADER.size
+        end = position + payload_length
+        index = 0
+        while position < end:
+            value, position = _read_varint(data, position)
+            if value < 0:
+                index -= value
+            else:
+                if value:
+                    histogram.counts[index] = value
+                    lowest_value, highest_value = histogram._range_at_index(index)
+                    histogram.total_count += value
+                    if histogram.min_value is None:
+                        histogram.min_value = lowest_value
+                    histogram.max_value = highest_value
+                index += 1
+        return histogram
+
+    def percentile_distribution(self, ticks_per_half_distance=5, scale=1000.0, decimals=3):
+        """hgrm text, as HdrHistogram's outputPercentileDistribution prints it.
+
+        Values are divided by `scale` (microseconds to milliseconds by default).
+        """
+        lines = [f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}\n\n"]
+        if self.total_count:
+            target = 0.0
+            seen = 0
+            for index, count in self._nonzero():
+                seen += count
+                value = min(self._range_at_index(index)[1], self.max_value) / scale
+                reached = 100.0 * seen / self.total_count
+                while target <= reached and target < 100.0 and seen < self.total_count:
+                    lines.append(f"{value:12.{decimals}f} {target / 100:2.12f} {seen:10d} "
+                                 f"{1 / (1 - target / 100):14.2f}\n")
+                    ticks = ticks_per_half_distance * 2 ** (int(math.log2(100.0 / (100.0 - target))) + 1)
+                    target += 100.0 / ticks
+            lines.append(f"{self.max_value / scale:12.{decimals}f} {1.0:2.12f} {self.total_count:10d}\n")
+        lines.append(f"#[Mean    = {self.mean() / scale:12.{decimals}f}, "
+                     f"StdDeviation   = {self.stddev() / scale:12.{decimals}f}]\n")
+        lines.append(f"#[Max     = {self.max_value / scale:12.{decimals}f}, "
+                     f"Total count    = {self.total_count:12d}]\n")
+        lines.append(f"#[Buckets = {self.bucket_count:12d}, SubBuckets     = {self.sub_bucket_count:12d}]\n")
+        return ''.join(lines)
+
+
+def _write_varint(buffer, value):
+    """ZigZag LEB128, as the V2 encoding stores counts"""
+    value = (value << 1) ^ (value >> 63)
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1), position
@@ -0,0 +1,445 @@
+"""
+Asyncio load engine for the metrics generator
+Drives the API gateway over a pooled keep-alive HTTP client, either open-loop
+(requests start at a target rate, whatever the response times) or closed-loop
+(N virtual users, each sending its next request when the last one returns)
+"""
+import asyncio
+import bisect
+import contextlib
+import itertools
+import logging
+import math
+import random
+import time
+from collections import Counter
+
+import httpx
+
+from latency_histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# httpx logs every request at INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+MODES = ('open', 'closed')
+PHASES = ('ramp_up', 'steady', 'ramp_down')
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class WeightedChoice:
+    """Picks items in proportion to their weight with one bisect per draw"""
+
+    def __init__(self, items, rng=None, weight=lambda item: item['weight']):
+        self.items = list(items)
+        self.cumulative = list(itertools.accumulate(weight(item) for item in self.items))
+        self.rng = rng or random.Random()
+
+    def __call__(self):
+        point = self.rng.random() * self.cumulative[-1]
+        return self.items[bisect.bisect_right(self.cumulative, point)]
+
+
+class ConnectionPool:
+    """Keep-alive connections, each lent to one request at a time.
+
+    Every connection is its own single-connection transport and idle ones
+    wait on a stack, so taking one is O(1) and the most recently used
+    (still open) connection goes first. A shared httpx pool rescans
+    all of its connections on every request, which collapses throughput
+    past a few dozen connections.
+    """
+
+    def __init__(self, size, transport=None):
+        self.size = size
+        self._idle = asyncio.LifoQueue()
+        self._transports = []
+        # Building an SSL context costs tens of milliseconds: share one
+        ssl_context = httpx.create_ssl_context() if transport is None else None
+        for _ in range(size):
+            connection = transport or httpx.AsyncHTTPTransport(
+                verify=ssl_context, limits=httpx.Limits(max_connections=1, max_keepalive_connections=1))
+            self._transports.append(connection)
+            self._idle.put_nowait(connection)
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """Borrow an idle connection, waiting for one if all are busy"""
+        connection = await self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put_nowait(connection)
+
+    async def request(self, request):
+        """Send `request` on the next idle connection and read the whole response"""
+        async with self.connection() as connection:
+            return await send_request(connection, request)
+
+    async def close(self):
+        for connection in set(self._transports):
+            await connection.aclose()
+
+
+async def send_request(connection, request):
+    response = await connection.handle_async_request(request)
+    try:
+        await response.aread()
+    finally:
+        await response.aclose()
+    return response
+
+
+class LoadStats:
+    """Request counts and latency histograms (microseconds) per endpoint.
+
+    `service` latency runs from when a request got a connection to its
+    response. `response` latency runs from when the request was due: in
+    open-loop mode that includes any time it waited for the engine or a
+    connection, so queueing is not hidden (coordinated omission). Closed
+    loop has no schedule; with `expected_interval` its response histogram
+    is corrected the HdrHistogram way instead.
+
+    With ramps, requests are also counted per phase and the steady phase
+    gets its own response histogram, free of ramp-up and ramp-down traffic.
+
+    Stats from several generators merge with merge() / from_report().
+    """
+
+    def __init__(self, expected_interval=0.0):
+        self.expected_interval_us = int(expected_interval * 1_000_000)
+        self.started = time.monotonic()
+        self.finished = None
+        self.elapsed_seconds = None  # fixed for merged stats
+        self.requests = Counter()
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.service = {}
+        self.response = {}
+        self.interval = LatencyHistogram()
+        self.phases = Counter()
+        self.steady = LatencyHistogram()
+        self.journeys = {}
+        self.journey_durations = {}
+
+    def record(self, name, status, error, latency, intended_latency, phase=None):
+        self.requests[name] += 1
+        if error:
+            self.errors[error] += 1
+        else:
+            self.statuses[status] += 1
+        if name not in self.service:
+            self.service[name] = LatencyHistogram()
+            self.response[name] = LatencyHistogram()
+        self.service[name].record(latency * 1_000_000)
+        response_us = intended_latency * 1_000_000
+        if self.expected_interval_us:
+            self.response[name].record_corrected(response_us, self.expected_interval_us)
+        else:
+            self.response[name].record(response_us)
+        self.interval.record(response_us)
+        if phase:
+            self.phases[phase] += 1
+            if phase == 'steady':
+                self.steady.record(response_us)
+
+    def record_journey(self, name, completed, duration):
+        """Count a finished journey; the duration of completed ones includes think time"""
+        if name not in self.journeys:
+            self.journeys[name] = Counter()
+            self.journey_durations[name] = LatencyHistogram()
+        self.journeys[name]['completed' if completed else 'failed'] += 1
+        if completed:
+            self.journey_durations[name].record(duration * 1_000_000)
+
+    @property
+    def total(self):
+        return sum(self.requests.values())
+
+    @property
+    def failed(self):
+        return sum(self.errors.values()) + sum(n for status, n in self.statuses.items() if status >= 400)
+
+    @property
+    def elapsed(self):
+        if self.elapsed_seconds is not None:
+            return self.elapsed_seconds
+        return (self.finished or time.monotonic()) - self.started
+
+    def combined(self, histograms):
+        """All endpoints' histograms added together"""
+        total = LatencyHistogram()
+        for histogram in histograms.values():
+            total.add(histogram)
+        return total
+
+    def interval_summary(self):
+        """Response-time percentiles since the last call, then start a new interval"""
+        summary = latency_summary(self.interval)
+        self.interval.reset()
+        return summary
+
+    def summary(self):
+        elapsed = self.elapsed
+        total = self.total
+        summary = {
+            'elapsed_seconds': round(elapsed, 3),
+            'requests': total,
+            'failed': self.failed,
+            'rps': round(total / elapsed, 1) if elapsed else 0.0,
+            'statuses': dict(self.statuses),
+            'errors': dict(self.errors),
+            'latency': {
+                'service_ms': latency_summary(self.combined(self.service)),
+                'response_ms': latency_summary(self.combined(self.response)),
+            },
+            'endpoints': {
+                name: {
+                    'requests': count,
+                    'service_ms': latency_summary(self.service[name]),
+                    'response_ms': latency_summary(self.response[name]),
+                }
+                for name, count in self.requests.items()
+            },
+        }
+        if self.phases:
+            summary['phases'] = {phase: self.phases[phase] for phase in PHASES}
+            summary['latency']['steady_response_ms'] = latency_summary(self.steady)
+        if self.journeys:
+            summary['journeys'] = {
+                name: {
+                    'completed': outcome['completed'],
+                    'failed': outcome['failed'],
+                    'duration_ms': latency_summary(self.journey_durations[name]),
+                }
+                for name, outcome in self.journeys.items()
+            }
+        return summary
+
+    def report(self):
+        """summary() plus the encoded histograms, for JSON export and merging"""
+        report = self.summary()
+        report['histograms'] = {
+            name: {'service': self.service[name].encode(), 'response': self.response[name].encode()}
+            for name in self.service
+        }
+        report['steady_histogram'] = self.steady.encode()
+        report['journey_histograms'] = {
+            name: histogram.encode() for name, histogram in self.journey_durations.items()
+        }
+        return report
+
+    def merge(self, other):
+        """Add another generator's stats; elapsed time is the longest of the two"""
+        self.elapsed_seconds = max(self.elapsed, other.elapsed)
+        self.requests.update(other.requests)
+        self.statuses.update(other.statuses)
+        self.errors.update(other.errors)
+        self.phases.update(other.phases)
+        self.steady.add(other.steady)
+        for name in other.service:
+            if name not in self.service:
+                self.service[name] = LatencyHistogram()
+                self.response[name] = LatencyHistogram()
+            self.service[name].add(other.service[name])
+            self.response[name].add(other.response[name])
+        for name in other.journeys:
+            if name not in self.journeys:
+                self.journeys[name] = Counter()
+                self.journey_durations[name] = LatencyHistogram()
+            self.journeys[name].update(other.journeys[name])
+            self.journey_durations[name].add(other.journey_durations[name])
+
+    @classmethod
+    def from_report(cls, report):
+        stats = cls()
+        stats.elapsed_seconds = report['elapsed_seconds']
+        stats.requests.update({name: endpoint['requests'] for name, endpoint in report['endpoints'].items()})
+        stats.statuses.update({int(status): count for status, count in report['statuses'].items()})
+        stats.errors.update(report['errors'])
+        stats.phases.update(report.get('phases', {}))
+        if 'steady_histogram' in report:
+            stats.steady = LatencyHistogram.decode(report['steady_histogram'])
+        for name, encoded in report['histograms'].items():
+            stats.service[name] = LatencyHistogram.decode(encoded['service'])
+            stats.response[name] = LatencyHistogram.decode(encoded['response'])
+        for name, journey in report.get('journeys', {}).items():
+            stats.journeys[name] = Counter(completed=journey['completed'], failed=journey['failed'])
+            stats.journey_durations[name] = LatencyHistogram.decode(report['journey_histograms'][name])
+        return stats
+
+
+def latency_summary(histogram):
+    """Mean, max and the reported percentiles of a microsecond histogram, in ms"""
+    values = histogram.percentiles(PERCENTILES)
+    summary = {'count': histogram.total_count,
+               'mean': round(histogram.mean() / 1000, 3),
+               'max': round(histogram.max_value / 1000, 3)}
+    for percentile in PERCENTILES:
+        summary[f"p{percentile:g}"] = round(values[percentile] / 1000, 3)
+    return summary
+
+
+class LoadEngine:
+    """Sends the weighted endpoint mix at `base_url` for `duration` seconds.
+
+    open: starts `rate` requests per second on a fixed schedule; when the
+      engine falls behind, late requests are sent at once and keep their
+      scheduled time
+    closed: `users` virtual users loop request, then `think_time` seconds
+
+    `ramp_up` and `ramp_down` seconds (part of `duration`) grow the rate
+    linearly from zero and shrink it back, or start and stop the virtual
+    users one by one; the rest of the run is the steady phase.
+
+    At most `max_connections` requests are on the wire; the rest wait for
+    a connection, and in open-loop mode that wait counts towards their
+    latency from the scheduled time.
+    """
+
+    def __init__(self, base_url, endpoints, mode='open', rate=10.0, users=10, duration=60.0,
+                 think_time=0.0, max_connections=100, timeout=10.0, stats=None,
+                 report_interval=10.0, transport=None, seed=None, ramp_up=0.0, ramp_down=0.0):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if mode == 'open' and rate <= 0:
+            raise ValueError("rate must be positive")
+        if mode == 'closed' and users < 1:
+            raise ValueError("users must be at least 1")
+        if ramp_up < 0 or ramp_down < 0 or ramp_up + ramp_down > duration:
+            raise ValueError("ramps must be non-negative and fit in the duration")
+        self.base_url = base_url
+        self.rng = random.Random(seed)
+        self.choose = WeightedChoice(endpoints, self.rng)
+        self.mode = mode
+        self.rate = rate
+        self.users = users
+        self.duration = duration
+        self.think_time = think_time
+        self.ramp_up = ramp_up
+        self.ramp_down = ramp_down
+        self.steady_from = self.steady_until = None
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.stats = stats or LoadStats()
+        self.report_interval = report_interval
+        self.transport = transport
+        self.in_flight = 0
+        self._timeout = httpx.Timeout(timeout).as_dict()
+
+    def build_request(self, endpoint, headers=None):
+        return httpx.Request(endpoint['method'], self.base_url + endpoint['path'],
+                             json=endpoint.get('json'), headers=headers,
+                             extensions={'timeout': self._timeout})
+
+    async def run(self):
+        """Generate load until the duration is up; returns the stats summary"""
+        loop = asyncio.get_running_loop()
+        pool = ConnectionPool(self.max_connections, self.transport)
+        self.stats.started = time.monotonic()
+        start = loop.time()
+        deadline = start + self.duration
+        self.steady_from = start + self.ramp_up
+        self.steady_until = deadline - self.ramp_down
+        reporter = asyncio.create_task(self._report())
+        try:
+            if self.mode == 'open':
+                await self._open_loop(pool, start)
+            else:
+                await asyncio.gather(*(self._user(pool, deadline, vu) for vu in range(self.users)))
+        finally:
+            reporter.cancel()
+            await pool.close()
+            self.stats.finished = time.monotonic()
+        summary = self.stats.summary()
+        logger.info(f"Load finished: {summary['requests']} requests, {summary['failed']} failed, "
+                    f"{summary['rps']} req/s")
+        return summary
+
+    def arrival(self, n):
+        """Seconds from the start to the open loop's `n`th request, None past the end"""
+        rate, up, down = self.rate, self.ramp_up, self.ramp_down
+        steady = self.duration - up - down
+        # Arrivals so far are the area under the rate: a triangle, a rectangle, a triangle
+        ramped_up = rate * up / 2
+        if n < ramped_up:
+            return math.sqrt(2 * up * n / rate)
+        if n < ramped_up + rate * steady:
+            return up + (n - ramped_up) / rate
+        n -= ramped_up + rate * steady
+        if n >= rate * down / 2:
+            return None
+        return up + steady + down * (1 - math.sqrt(1 - 2 * n / (rate * down)))
+
+    def phase(self, at):
+        if not (self.ramp_up or self.ramp_down):
+            return None
+        if at < self.steady_from:
+            return 'ramp_up'
+        return 'steady' if at < self.steady_until else 'ramp_down'
+
+    async def _open_loop(self, pool, start):
+        loop = asyncio.get_running_loop()
+        pending = set()
+        for n in itertools.count():
+            offset = self.arrival(n)
+            if offset is None:
+                break
+            intended = start + offset
+            delay = intended - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(self.iteration(pool, {'vu': n}, intended))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+
+    async def _user(self, pool, deadline, vu):
+        loop = asyncio.get_running_loop()
+        state = {'vu': vu}  # kept for the virtual user's whole life
+        # Users join one by one over the ramp-up and leave, last in first out, over the ramp-down
+        await asyncio.sleep(self.ramp_up * vu / self.users)
+        deadline -= self.ramp_down * vu / self.users
+        while loop.time() < deadline:
+            await self.iteration(pool, state)
+            if self.think_time:
+                await asyncio.sleep(self.think_time)
+
+    async def iteration(self, pool, state, intended=None):
+        """One unit of load: a request from the endpoint mix"""
+        await self.send(pool, self.choose(), intended)
+
+    async def send(self, pool, endpoint, intended=None, name=None, headers=None):
+        """Send one request and record it; returns the response or None"""
+        loop = asyncio.get_running_loop()
+        if intended is None:
+            intended = loop.time()
+        name = name or f"{endpoint['method']} {endpoint['path']}"
+        request = self.build_request(endpoint, headers)
+        response, status, error = None, 0, None
+        self.in_flight += 1
+        try:
+            async with pool.connection() as connection:
+                started = loop.time()
+                response = await send_request(connection, request)
+            status = response.status_code
+        except httpx.TimeoutException:
+            error = 'timeout'
+        except httpx.TransportError:
+            error = 'connection_error'
+        finally:
+            self.in_flight -= 1
+        finished = loop.time()
+        self.stats.record(name, status, error, finished - started, finished - intended, self.phase(intended))
+        return response
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            interval = self.stats.interval_summary()
+            logger.info(f"📈 {self.stats.total} requests, {interval['count'] / self.report_interval:.1f} req/s, "
+                        f"{self.stats.failed} failed, {self.in_flight} in flight - "
+                        f"p50 {interval['p50']}ms p90 {interval['p90']}ms "
+                        f"p99 {interval['p99']}ms p99.9 {interval['p99.9']}ms")
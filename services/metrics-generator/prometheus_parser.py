@@ -0,0 +1,315 @@
+"""
+Prometheus text and OpenMetrics exposition-format parser
+Reads a scrape line by line into typed metric families: counters and gauges
+keep one value per label set, histograms and summaries keep their buckets
+(or quantiles), sum and count. Lines are split with str.find/partition
+rather than regular expressions, so a multi-megabyte scrape is parsed in one
+pass without holding the whole payload.
+"""
+import math
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Sample-name suffixes belonging to each family type
+SUFFIXES = {
+    'counter': ('_total', '_created'),
+    'histogram': ('_bucket', '_sum', '_count', '_created'),
+    'gaugehistogram': ('_bucket', '_gsum', '_gcount'),
+    'summary': ('', '_sum', '_count', '_created'),
+    'info': ('_info',),
+}
+
+
+class ParseError(ValueError):
+    pass
+
+
+class HistogramSeries:
+    """One label set of a histogram or summary: cumulative buckets, sum and count"""
+
+    __slots__ = ('buckets', 'quantiles', 'sum', 'count')
+
+    def __init__(self):
+        self.buckets: List[Tuple[float, float]] = []
+        self.quantiles: Dict[float, float] = {}
+        self.sum = 0.0
+        self.count = 0.0
+
+    def add(self, other: 'HistogramSeries'):
+        """Add another series with the same bucket bounds"""
+        if not self.buckets:
+            self.buckets = list(other.buckets)
+        elif [bound for bound, _ in self.buckets] != [bound for bound, _ in other.buckets]:
+            raise ValueError("cannot add histograms with different buckets")
+        else:
+            self.buckets = [(bound, count + other_count)
+                            for (bound, count), (_, other_count) in zip(self.buckets, other.buckets)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        """Interpolated q-quantile of the buckets, as PromQL's histogram_quantile() estimates it"""
+        buckets = sorted(self.buckets)
+        if not buckets or buckets[-1][1] == 0:
+            return math.nan
+        rank = q * buckets[-1][1]
+        lower_bound, lower_count = 0.0, 0.0
+        for bound, count in buckets:
+            if count >= rank:
+                if math.isinf(bound):
+                    # Past the last finite bucket: its bound is the best estimate
+                    return lower_bound
+                if count == lower_count:
+                    return bound
+                return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+            lower_bound, lower_count = bound, count
+        return lower_bound
+
+
+class MetricFamily:
+    """Every series of one metric.
+
+    Counters are named with their `_total` suffix whichever format declared
+    them. `series` maps label tuples to floats, or to HistogramSeries for
+    histograms and summaries.
+    """
+
+    __slots__ = ('name', 'type', 'help', 'series')
+
+    def __init__(self, name: str, type: str = 'untyped', help: str = ''):
+        self.name = name
+        self.type = type
+        self.help = help
+        self.series: Dict[Labels, Union[float, HistogramSeries]] = {}
+
+    def total(self, **match: str) -> float:
+        """Sum of the counter or gauge values whose labels include `match`"""
+        wanted = set(match.items())
+        return sum(value for labels, value in self.series.items() if wanted.issubset(labels))
+
+    def merged(self) -> HistogramSeries:
+        """All label sets of a histogram added together"""
+        merged = HistogramSeries()
+        for series in self.series.values():
+            merged.add(series)
+        return merged
+
+    def __repr__(self):
+        return f"MetricFamily({self.name!r}, {self.type!r}, {len(self.series)} series)"
+
+
+def _unescape(value: str) -> str:
+    if '\\' not in value:
+        return value
+    out = []
+    index = 0
+    while index < len(value):
+        char = value[index]
+        if char == '\\' and index + 1 < len(value):
+            index += 1
+            char = {'n': '\n', '\\': '\\', '"': '"'}.get(value[index], '\\' + value[index])
+        out.append(char)
+        index += 1
+    return ''.join(out)
+
+
+def _escaped(text: str, index: int) -> bool:
+    backslashes = 0
+    while text[index - 1 - backslashes] == '\\':
+        backslashes += 1
+    return backslashes % 2 == 1
+
+
+def _parse_labels(text: str, line: str) -> Labels:
+    if '\\' not in text:
+        # Without escapes, '",' can only end a value: split in C
+        pairs = text.rstrip(', ')
+        if pairs.endswith('"'):
+            labels = []
+            for part in pairs[:-1].split('",'):
+                name, separator, value = part.partition('="')
+                if not separator:
+                    break
+                labels.append((name.strip(' ,'), value))
+            else:
+                return tuple(labels)
+    return _parse_escaped_labels(text, line)
+
+
+def _parse_escaped_labels(text: str, line: str) -> Labels:
+    labels = []
+    position = 0
+    length = len(text)
+    while position < length:
+        equals = text.find('=', position)
+        if equals == -1:
+            if text[position:].strip(' ,'):
+                raise ParseError(f"bad labels in: {line}")
+            break
+        name = text[position:equals].strip(' ,')
+        quote = text.find('"', equals)
+        end = text.find('"', quote + 1)
+        # A quote after an odd run of backslashes is part of the value
+        while end != -1 and text[end - 1] == '\\' and _escaped(text, end):
+            end = text.find('"', end + 1)
+        if quote == -1 or end == -1:
+            raise ParseError(f"unterminated label value in: {line}")
+        labels.append((name, _unescape(text[quote + 1:end])))
+        position = end + 1
+    return tuple(labels)
+
+
+def _closing_brace(line: str, brace: int) -> int:
+    """Index of the '}' closing the labels that open at `brace`, -1 if none"""
+    close = line.find('}', brace)
+    # Skip braces inside quoted values ("/products/{id}")
+    while close != -1 and line.count('"', brace, close) % 2:
+        close = line.find('}', close + 1)
+    if line.find('\\', brace, close) == -1:
+        return close
+    # Escaped quotes upset the count: scan quote by quote
+    quoted = False
+    index = brace + 1
+    while index < len(line):
+        char = line[index]
+        if quoted and char == '\\':
+            index += 1
+        elif char == '"':
+            quoted = not quoted
+        elif char == '}' and not quoted:
+            return index
+        index += 1
+    return -1
+
+
+def _value(text: str, line: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        raise ParseError(f"bad sample value in: {line}") from None
+
+
+def _lines(payload: Union[str, bytes, Iterable[Union[str, bytes]]]) -> Iterable[str]:
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    if isinstance(payload, str):
+        # Slice line by line: io.StringIO would copy the whole payload first
+        start = 0
+        while True:
+            end = payload.find('\n', start)
+            if end == -1:
+                yield payload[start:]
+                return
+            yield payload[start:end]
+            start = end + 1
+    for line in payload:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+def parse(payload: Union[str, bytes, Iterable[Union[str, bytes]]]) -> Dict[str, MetricFamily]:
+    """Metric families by name from exposition text, bytes or an iterable of lines.
+
+    Pass `response.iter_lines()` to parse a scrape as it streams in.
+    OpenMetrics exemplars, timestamps and `_created` samples are skipped.
+    """
+    families: Dict[str, MetricFamily] = {}
+    # Sample name -> (family, suffix), for names declared by # TYPE
+    owners: Dict[str, Tuple[MetricFamily, str]] = {}
+
+    for line in _lines(payload):
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] == '#':
+            parts = line.split(None, 3)
+            if len(parts) < 3 or parts[1] not in ('TYPE', 'HELP'):
+                continue  # comment, or # EOF
+            name = parts[2]
+            if parts[1] == 'TYPE':
+                kind = parts[3].strip() if len(parts) > 3 else 'untyped'
+                family_name = name + '_total' if kind == 'counter' and not name.endswith('_total') else name
+                family = families.get(family_name) or MetricFamily(family_name)
+                if family_name != name and name in families and not families[name].series:
+                    # OpenMetrics: # HELP foo came before # TYPE foo counter
+                    family.help = families.pop(name).help
+                family.type = kind if kind != 'unknown' else 'untyped'
+                families[family_name] = family
+                base = name[:-len('_total')] if kind == 'counter' and name.endswith('_total') else name
+                for suffix in SUFFIXES.get(kind, ('',)):
+                    owners[base + suffix] = (family, suffix)
+                if kind == 'counter':
+                    owners[base] = (family, '_total')
+            else:
+                help_text = _unescape(parts[3]) if len(parts) > 3 else ''
+                owner = owners.get(name)
+                if owner:
+                    owner[0].help = help_text
+                else:
+                    families.setdefault(name, MetricFamily(name)).help = help_text
+            continue
+
+        # name{labels} value [timestamp] [# exemplar]
+        brace = line.find('{')
+        space = line.find(' ')
+        if brace != -1 and (space == -1 or brace < space):
+            close = _closing_brace(line, brace)
+            if close == -1:
+                raise ParseError(f"unterminated labels in: {line}")
+            name = line[:brace]
+            labels = _parse_labels(line[brace + 1:close], line) if close > brace + 1 else ()
+            rest = line[close + 1:]
+        else:
+            if space == -1:
+                raise ParseError(f"sample without a value: {line}")
+            name = line[:space]
+            labels = ()
+            rest = line[space:]
+        # The value comes first; a timestamp or " # exemplar" may follow
+        rest = rest.split(None, 1)
+        if not rest:
+            raise ParseError(f"sample without a value: {line}")
+        value = _value(rest[0], line)
+
+        owner = owners.get(name)
+        if owner is None:
+            # No # TYPE: an untyped metric of its own
+            owner = owners[name] = (families.setdefault(name, MetricFamily(name)), '')
+        family, suffix = owner
+        if suffix == '_created':
+            continue
+        if family.type in ('histogram', 'gaugehistogram', 'summary'):
+            _add_histogram_sample(family, suffix, labels, value, line)
+        else:
+            family.series[labels] = value
+    return families
+
+
+def _add_histogram_sample(family: MetricFamily, suffix: str, labels: Labels, value: float, line: str):
+    bound: Optional[float] = None
+    quantile: Optional[float] = None
+    if suffix == '_bucket' or suffix == '':
+        key = 'le' if suffix == '_bucket' else 'quantile'
+        rest = []
+        for label in labels:
+            if label[0] == key:
+                if key == 'le':
+                    bound = _value(label[1], line)
+                else:
+                    quantile = _value(label[1], line)
+            else:
+                rest.append(label)
+        labels = tuple(rest)
+    series = family.series.get(labels)
+    if series is None:
+        series = family.series[labels] = HistogramSeries()
+    if bound is not None:
+        series.buckets.append((bound, value))
+    elif quantile is not None:
+        series.quantiles[quantile] = value
+    elif suffix in ('_sum', '_gsum'):
+        series.sum = value
+    elif suffix in ('_count', '_gcount'):
+        series.count = value
+    else:
+        raise ParseError(f"unexpected histogram sample: {line}")
@@ -0,0 +1,295 @@
+"""
+Replay of recorded traffic for the metrics generator
+Reads a capture (JSONL records or gateway access-log lines) and sends every
+request at its original offset, divided by a speed factor. Ids and JWTs from
+the capture are rewritten to ones that exist in the target. Latency is
+compared request by request with the recorded duration.
+"""
+import asyncio
+import json
+import logging
+import re
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+from latency_histogram import LatencyHistogram
+from load_engine import LoadEngine, latency_summary
+
+logger = logging.getLogger(__name__)
+
+PASSWORD = 'ReplayTest123!'
+
+# morgan 'combined', as the API gateway logs
+ACCESS_LOG = re.compile(
+    r'(?P<addr>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>\S+)[^"]*" (?P<status>\d{3}) '
+    r'\S+(?: "[^"]*" "[^"]*")?(?: (?P<duration>[\d.]+))?')
+ACCESS_LOG_TIME = '%d/%b/%Y:%H:%M:%S %z'
+
+# Routes behind authenticateToken in the gateway
+AUTHENTICATED_PREFIXES = ('/api/orders', '/api/users')
+
+# Path ids and body fields rewritten to ids that exist in the target
+PATH_IDS = [
+    ('products', re.compile(r'^/api/products/(\d+)')),
+    ('orders', re.compile(r'^/api/orders/(\d+)')),
+    ('users', re.compile(r'^/api/users/(\d+)')),
+]
+BODY_IDS = {'product_id': 'products', 'order_id': 'orders', 'user_id': 'users'}
+NUMERIC_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+class CaptureError(ValueError):
+    pass
+
+
+def _timestamp(value):
+    if isinstance(value, (int, float)):
+        return float(value) / 1000 if value > 1e11 else float(value)  # epoch milliseconds or seconds
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_record(record):
+    """A captured request from one JSONL record.
+
+    Recognised fields: timestamp (or time/ts; ISO 8601 or epoch), method,
+    path (or url), status, duration_ms (or latency_ms/response_time_ms),
+    body (or json) and headers.
+    """
+    headers = {key.lower(): value for key, value in (record.get('headers') or {}).items()}
+    authorization = headers.get('authorization', '')
+    duration = next((record[key] for key in ('duration_ms', 'latency_ms', 'response_time_ms') if key in record),
+                    None)
+    return {
+        'time': _timestamp(next(record[key] for key in ('timestamp', 'time', 'ts') if key in record)),
+        'method': record.get('method', 'GET').upper(),
+        'path': record.get('path') or record['url'],
+        'status': record.get('status'),
+        'duration_ms': None if duration is None else float(duration),
+        'json': record.get('body', record.get('json')),
+        'user': authorization.removeprefix('Bearer ') or None,
+    }
+
+
+def parse_access_log(line):
+    """A captured request from a combined access-log line, or None.
+
+    Access logs carry no headers: requests to authenticated routes are
+    attributed to a user per client address. A trailing response time in
+    milliseconds (":response-time" appended to the format) is used when present.
+    """
+    match = ACCESS_LOG.match(line)
+    if not match:
+        return None
+    path = match['path']
+    return {
+        'time': datetime.strptime(match['time'], ACCESS_LOG_TIME).timestamp(),
+        'method': match['method'],
+        'path': path,
+        'status': int(match['status']),
+        'duration_ms': float(match['duration']) if match['duration'] else None,
+        'json': None,
+        'user': f"addr:{match['addr']}" if path.startswith(AUTHENTICATED_PREFIXES) else None,
+    }
+
+
+def load_capture(path):
+    """Captured requests sorted by time, each with its `offset` in seconds from the first"""
+    entries = []
+    skipped = 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = parse_record(json.loads(line)) if line.startswith('{') else parse_access_log(line)
+            except (ValueError, KeyError, StopIteration, TypeError):
+                entry = None
+            if entry is None:
+                skipped += 1
+            else:
+                entries.append(entry)
+    if not entries:
+        raise CaptureError(f"no requests found in {path}")
+    if skipped:
+        logger.warning(f"Skipped {skipped} unreadable lines in {path}")
+
+    entries.sort(key=lambda entry: entry['time'])
+    first = entries[0]['time']
+    # Access logs only have whole seconds: spread each second's requests across it
+    same_second = {}
+    for entry in entries:
+        same_second.setdefault(entry['time'], []).append(entry)
+    for second, group in same_second.items():
+        spread = 1.0 / len(group) if second == int(second) and len(group) > 1 else 0.0
+        for index, entry in enumerate(group):
+            entry['offset'] = second - first + index * spread
+    return entries
+
+
+def endpoint_name(method, path):
+    """"GET /api/products/:id": ids collapsed so one endpoint gets one histogram"""
+    return f"{method} {NUMERIC_SEGMENT.sub('/:id', path.split('?', 1)[0])}"
+
+
+class IdMap:
+    """Consistent captured-to-target id mapping for one kind of id.
+
+    Each captured id gets the next known target id when first seen, round
+    robin once they run out; without known ids, ids pass through.
+    """
+
+    def __init__(self):
+        self.known = []
+        self.mapping = {}
+
+    def __call__(self, captured):
+        if captured not in self.mapping:
+            if not self.known:
+                return captured
+            self.mapping[captured] = self.known[len(self.mapping) % len(self.known)]
+        return self.mapping[captured]
+
+
+class ReplayEngine(LoadEngine):
+    """Sends a capture open loop on its original schedule, `speed` times faster.
+
+    Before the clock starts, product ids are read from the target and a
+    fresh user is registered for every captured JWT (or client address),
+    so authenticated requests carry a token the target accepts. Orders
+    created during the replay become the targets for captured order ids.
+    """
+
+    def __init__(self, base_url, capture, speed=1.0, **kwargs):
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        self.capture = capture
+        self.speed = speed
+        duration = capture[-1]['offset'] / speed + 1e-3
+        super().__init__(base_url, [{'weight': 1}], mode='open', rate=len(capture) / duration,
+                         duration=duration, **kwargs)
+        self.ids = {kind: IdMap() for kind, _ in PATH_IDS}
+        self.tokens = {}
+        self.captured = {}
+        self.replayed = {}
+        self.deltas = []
+        self.status_mismatches = 0
+
+    def arrival(self, n):
+        return self.capture[n]['offset'] / self.speed if n < len(self.capture) else None
+
+    async def run(self):
+        await self.prepare()
+        return await super().run()
+
+    async def prepare(self):
+        run_id = uuid.uuid4().hex[:8]
+        async with httpx.AsyncClient(base_url=self.base_url, transport=self.transport,
+                                     timeout=self.timeout) as client:
+            response = await client.get('/api/products')
+            if response.status_code == 200:
+                self.ids['products'].known = [product['id'] for product in response.json()]
+            users = list(dict.fromkeys(entry['user'] for entry in self.capture if entry['user']))
+            for index, user in enumerate(users):
+                username = f"replay-{run_id}-{index}"
+                response = await client.post('/api/auth/register', json={
+                    'username': username, 'email': f"{username}@loadtest.local",
+                    'password': PASSWORD, 'full_name': 'Replay User'})
+                if response.status_code == 201:
+                    body = response.json()
+                    self.tokens[user] = body['token']
+                    self.ids['users'].known.append(body['user']['id'])
+        logger.info(f"Replay prepared: {len(self.ids['products'].known)} products, "
+                    f"{len(self.tokens)}/{len(users)} users registered")
+
+    def rewrite(self, entry):
+        """The captured request with target ids and tokens"""
+        path = entry['path']
+        for kind, pattern in PATH_IDS:
+            match = pattern.match(path)
+            if match:
+                target = self.ids[kind](int(match[1]))
+                path = path[:match.start(1)] + str(target) + path[match.end(1):]
+        body = self._rewrite_body(entry['json'])
+        token = self.tokens.get(entry['user'])
+        headers = {'Authorization': f"Bearer {token}"} if token else None
+        return {'method': entry['method'], 'path': path, 'json': body}, headers
+
+    def _rewrite_body(self, body):
+        if isinstance(body, list):
+            return [self._rewrite_body(item) for item in body]
+        if not isinstance(body, dict):
+            return body
+        return {key: self.ids[BODY_IDS[key]](value) if key in BODY_IDS and isinstance(value, int)
+                else self._rewrite_body(value)
+                for key, value in body.items()}
+
+    async def iteration(self, pool, state, intended=None):
+        entry = self.capture[state['vu']]
+        endpoint, headers = self.rewrite(entry)
+        name = endpoint_name(entry['method'], entry['path'])
+        loop = asyncio.get_running_loop()
+        sent = loop.time()
+        response = await self.send(pool, endpoint, intended, name=name, headers=headers)
+        replay_ms = (loop.time() - sent) * 1000
+
+        if response is not None and entry['method'] == 'POST' and endpoint['path'] == '/api/orders' \
+                and response.status_code == 201:
+            self.ids['orders'].known.append(response.json().get('id'))
+        status = response.status_code if response is not None else 0
+        if entry['status'] is not None and status != entry['status']:
+            self.status_mismatches += 1
+        if entry['duration_ms'] is not None:
+            if name not in self.captured:
+                self.captured[name] = LatencyHistogram()
+                self.replayed[name] = LatencyHistogram()
+            self.captured[name].record(entry['duration_ms'] * 1000)
+            self.replayed[name].record(replay_ms * 1000)
+            self.deltas.append({
+                'offset': round(entry['offset'], 3),
+                'method': entry['method'],
+                'path': entry['path'],
+                'status': status,
+                'captured_status': entry['status'],
+                'captured_ms': entry['duration_ms'],
+                'replay_ms': round(replay_ms, 3),
+                'delta_ms': round(replay_ms - entry['duration_ms'], 3),
+            })
+
+    def comparison(self):
+        """Replay latency against the capture, overall and per endpoint"""
+        deltas = sorted(delta['delta_ms'] for delta in self.deltas)
+        comparison = {
+            'speed': self.speed,
+            'requests': len(self.capture),
+            'compared': len(deltas),
+            'status_mismatches': self.status_mismatches,
+            'delta_ms': _delta_summary(deltas),
+            'endpoints': {},
+        }
+        for name in self.captured:
+            captured = latency_summary(self.captured[name])
+            replayed = latency_summary(self.replayed[name])
+            comparison['endpoints'][name] = {
+                'captured_ms': captured,
+                'replay_ms': replayed,
+                'p50_delta_ms': round(replayed['p50'] - captured['p50'], 3),
+                'p99_delta_ms': round(replayed['p99'] - captured['p99'], 3),
+            }
+        return comparison
+
+
+def _delta_summary(deltas):
+    """Percentiles of sorted, possibly negative, per-request deltas"""
+    if not deltas:
+        return {}
+    summary = {'mean': round(sum(deltas) / len(deltas), 3),
+               'slower': sum(delta > 0 for delta in deltas)}
+    for percentile in (50, 90, 99):
+        summary[f"p{percentile}"] = deltas[max(0, int(percentile / 100 * len(deltas) + 0.5) - 1)]
+    return summary
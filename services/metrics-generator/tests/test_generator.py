@@ -0,0 +1,828 @@
+"""
+Unit tests for the Metrics Generator
+Tests the load engine against in-process and local HTTP servers
+"""
+import asyncio
+import itertools
+import json
+import logging
+import random
+import socket
+import threading
+import time
+from collections import Counter
+
+import httpx
+import pytest
+import uvicorn
+
+from concurrent.futures import ThreadPoolExecutor
+
+import distributed
+import generator
+import benchmark_parser
+import prometheus_parser
+from aggregator import MetricsAggregator, summarize_scrape
+from timeseries import TimeSeriesStore
+import journeys
+import replay
+from latency_histogram import LatencyHistogram
+from load_engine import LoadEngine, LoadStats, WeightedChoice
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Target:
+    """ASGI app standing in for the gateway: fixed delay, tracks concurrency and clients"""
+
+    def __init__(self, delay=0.0, status=200):
+        self.delay = delay
+        self.status = status
+        self.requests = Counter()
+        self.clients = set()
+        self.active = 0
+        self.max_active = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        self.requests[scope['path']] += 1
+        self.clients.add(tuple(scope['client'] or ()))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': b'{}'})
+
+
+class LocalServer:
+    """Serve an ASGI app on a free localhost port in a background thread"""
+
+    def __init__(self, app):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=self.port, log_level='critical'))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(5)
+
+
+class FakeGateway:
+    """ASGI app with the gateway's auth, product and order routes, checking tokens"""
+
+    PRODUCTS = [
+        {'id': 1, 'name': 'Laptop', 'price': 999.99, 'stock': 5, 'category': 'Electronics'},
+        {'id': 2, 'name': 'Desk', 'price': 199.0, 'stock': 0, 'category': 'Furniture'},
+    ]
+
+    def __init__(self):
+        self.users = {}
+        self.tokens = {}
+        self.orders = {}
+        self.calls = Counter()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        headers = dict(scope['headers'])
+        token = headers.get(b'authorization', b'').decode().removeprefix('Bearer ')
+        status, payload = self.route(scope['method'], scope['path'], json.loads(body or b'null'),
+                                     self.tokens.get(token))
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps(payload).encode()})
+
+    def route(self, method, path, body, user):
+        self.calls[f"{method} {path.rstrip('0123456789')}"] += 1
+        if path == '/api/auth/register':
+            if body['username'] in self.users:
+                return 400, {'error': 'Username already registered'}
+            self.users[body['username']] = {'id': len(self.users) + 1, 'password': body['password']}
+            token = f"token-{body['username']}-0"
+            self.tokens[token] = body['username']
+            return 201, {'user': {'id': self.users[body['username']]['id']}, 'token': token}
+        if path == '/api/auth/login':
+            if self.users.get(body['username'], {}).get('password') != body['password']:
+                return 401, {'error': 'Incorrect username or password'}
+            token = f"token-{body['username']}-{self.calls['POST /api/auth/login']}"
+            self.tokens[token] = body['username']
+            return 200, {'token': token}
+        if path == '/health':
+            return 200, {'status': 'healthy'}
+        if path == '/api/products':
+            return 200, self.PRODUCTS
+        if path.startswith('/api/products/'):
+            return 200, self.PRODUCTS[0]
+        if user is None:
+            return 401, {'error': 'Unauthorized'}
+        if path == '/api/orders':
+            assert all(item['product_id'] == 1 for item in body['items'])
+            order_id = len(self.orders) + 1
+            self.orders[order_id] = {'id': order_id, 'user': user, 'status': 'pending'}
+            return 201, self.orders[order_id]
+        if path.endswith('/pay'):
+            order = self.orders.get(int(path.split('/')[3]))
+            if order is None or order['user'] != user:
+                return 404, {'error': 'Order not found'}
+            order['status'] = 'paid'
+            return 200, order
+        if path == '/api/orders/my-orders':
+            return 200, [order for order in self.orders.values() if order['user'] == user]
+        return 404, {'error': 'Not found'}
+
+
+def run_engine(target, **kwargs):
+    engine = LoadEngine('http://gateway', generator.ENDPOINTS,
+                        transport=httpx.ASGITransport(app=target), **kwargs)
+    return asyncio.run(engine.run())
+
+
+class TestWeightedChoice:
+    """Test suite for the endpoint mix"""
+
+    def test_weights_respected(self):
+        """Endpoints are drawn in proportion to their weights"""
+        logger.info("Testing weighted endpoint choice")
+
+        choose = WeightedChoice(generator.ENDPOINTS, random.Random(1))
+        draws = Counter(choose()['path'] for _ in range(20000))
+
+        total_weight = sum(e['weight'] for e in generator.ENDPOINTS)
+        for endpoint in generator.ENDPOINTS:
+            expected = endpoint['weight'] / total_weight
+            assert abs(draws[endpoint['path']] / 20000 - expected) < 0.02
+        logger.info(f"✓ Mix matches weights: {dict(draws)}")
+
+
+class TestLoadEngine:
+    """Test suite for open- and closed-loop load"""
+
+    def test_open_loop_rate(self):
+        """Open loop sends the target rate"""
+        logger.info("Testing open-loop rate")
+
+        target = Target()
+        summary = run_engine(target, mode='open', rate=300, duration=1.0)
+
+        assert 280 <= summary['requests'] <= 300
+        assert summary['failed'] == 0
+        assert set(target.requests) <= {e['path'] for e in generator.ENDPOINTS}
+        logger.info(f"✓ {summary['requests']} requests in 1s at 300 req/s")
+
+    def test_open_loop_ignores_slow_responses(self):
+        """Slow responses do not slow the open-loop schedule"""
+        logger.info("Testing open loop against a slow target")
+
+        target = Target(delay=0.5)
+        summary = run_engine(target, mode='open', rate=100, duration=1.0)
+
+        assert summary['requests'] >= 95
+        assert target.max_active >= 45
+        logger.info(f"✓ {summary['requests']} requests sent, {target.max_active} concurrently")
+
+    def test_closed_loop_users(self):
+        """Closed loop keeps exactly `users` requests in flight"""
+        logger.info("Testing closed-loop users")
+
+        target = Target(delay=0.05)
+        summary = run_engine(target, mode='closed', users=5, duration=1.0)
+
+        assert target.max_active == 5
+        assert 80 <= summary['requests'] <= 105
+        logger.info(f"✓ 5 users sent {summary['requests']} requests")
+
+    def test_connections_reused(self):
+        """Requests share a small pool of keep-alive connections"""
+        logger.info("Testing connection reuse")
+
+        target = Target()
+        with LocalServer(target) as server:
+            engine = LoadEngine(server.url, generator.ENDPOINTS, mode='closed', users=4, duration=0.5)
+            summary = asyncio.run(engine.run())
+
+        assert summary['requests'] > 50
+        assert len(target.clients) <= 4
+        logger.info(f"✓ {summary['requests']} requests over {len(target.clients)} connections")
+
+    def test_connection_errors_counted(self):
+        """Unreachable targets count as failures, not crashes"""
+        logger.info("Testing unreachable target")
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        engine = LoadEngine(f"http://127.0.0.1:{port}", generator.ENDPOINTS, mode='open', rate=50, duration=0.2)
+        summary = asyncio.run(engine.run())
+
+        assert summary['requests'] == summary['failed'] == summary['errors']['connection_error']
+        logger.info(f"✓ {summary['failed']} connection errors recorded")
+
+    def test_invalid_settings(self):
+        """Bad modes and rates are rejected up front"""
+        with pytest.raises(ValueError):
+            LoadEngine('http://gateway', generator.ENDPOINTS, mode='burst')
+        with pytest.raises(ValueError):
+            LoadEngine('http://gateway', generator.ENDPOINTS, mode='open', rate=0)
+        logger.info("✓ Invalid settings rejected")
+
+
+class TestLatencyHistogram:
+    """Test suite for HDR latency recording"""
+
+    def test_percentiles_within_precision(self):
+        """Percentiles match the exact values to three significant digits"""
+        logger.info("Testing histogram percentiles")
+
+        rng = random.Random(3)
+        values = sorted(int(rng.lognormvariate(8, 1.5)) + 1 for _ in range(50000))
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.record(value)
+
+        for percentile in (50, 90, 99, 99.9, 100):
+            exact = values[max(0, int(len(values) * percentile / 100 + 0.5) - 1)]
+            assert abs(histogram.value_at_percentile(percentile) - exact) <= exact * 0.001 + 1
+        assert histogram.max_value == values[-1]
+        logger.info(f"✓ p99.9 = {histogram.value_at_percentile(99.9)}us")
+
+    def test_encode_and_merge(self):
+        """Encoded histograms decode and merge to the same counts"""
+        logger.info("Testing histogram encoding and merging")
+
+        first, second, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for value in range(1, 20000, 7):
+            first.record(value)
+            both.record(value)
+        for value in range(500, 900000, 311):
+            second.record(value)
+            both.record(value)
+
+        merged = LatencyHistogram.decode(first.encode())
+        merged.add(LatencyHistogram.decode(second.encode()))
+        assert list(merged.counts) == list(both.counts)
+        assert merged.total_count == both.total_count
+        assert merged.percentiles([50, 99]) == both.percentiles([50, 99])
+        logger.info(f"✓ {merged.total_count} values survived encoding and merging")
+
+    def test_corrected_recording(self):
+        """A stall fills in the samples the sender skipped"""
+        histogram = LatencyHistogram()
+        histogram.record_corrected(1000, 100)
+
+        assert histogram.total_count == 10
+        assert histogram.value_at_percentile(50) == 500
+        logger.info("✓ 1000us stall at a 100us interval recorded as 10 samples")
+
+    def test_hgrm_output(self):
+        """The percentile distribution follows the hgrm layout"""
+        histogram = LatencyHistogram()
+        for value in range(1000, 101000, 100):
+            histogram.record(value)
+
+        lines = histogram.percentile_distribution().splitlines()
+        assert lines[0].split() == ['Value', 'Percentile', 'TotalCount', '1/(1-Percentile)']
+        rows = [line.split() for line in lines[2:] if line and not line.startswith('#')]
+        assert float(rows[0][1]) == 0.0
+        assert rows[-1] == ['100.900', '1.000000000000', '1000']
+        assert [float(row[1]) for row in rows] == sorted(float(row[1]) for row in rows)
+        assert lines[-2].startswith('#[Max     =')
+        logger.info(f"✓ {len(rows)} percentile rows written")
+
+
+class TestLatencyReports:
+    """Test suite for coordinated omission and merged reports"""
+
+    def test_open_loop_counts_queueing(self):
+        """Response time from the schedule exposes queueing the service time hides"""
+        logger.info("Testing coordinated-omission correction")
+
+        target = Target(delay=0.02)
+        engine = LoadEngine('http://gateway', generator.ENDPOINTS, mode='open', rate=100, duration=1.0,
+                            max_connections=1, transport=httpx.ASGITransport(app=target))
+        summary = asyncio.run(engine.run())
+
+        service, response = summary['latency']['service_ms'], summary['latency']['response_ms']
+        assert service['p99'] < 50
+        assert response['p99'] > 5 * service['p99']
+        logger.info(f"✓ p99 service {service['p99']}ms vs response {response['p99']}ms")
+
+    def test_expected_interval_closed_loop_only(self):
+        """Open-loop response times are never corrected a second time"""
+        with pytest.raises(SystemExit):
+            generator.parse_args(['--mode', 'open', '--expected-interval', '0.1'])
+
+        settings = generator.load_settings(generator.parse_args(['--mode', 'closed', '--expected-interval', '0.1']))
+        assert generator.build_engine(settings).stats.expected_interval_us == 100_000
+        # Settings sent to a distributed worker are guarded too
+        settings['mode'] = 'open'
+        assert generator.build_engine(settings).stats.expected_interval_us == 0
+        logger.info("✓ --expected-interval applies to closed loop only")
+
+    def test_reports_merge(self, tmp_path):
+        """Reports from several generators merge into one"""
+        logger.info("Testing report merging")
+
+        paths = []
+        for index in range(2):
+            stats = LoadStats()
+            run_engine(Target(), mode='open', rate=200, duration=0.5, stats=stats)
+            path = tmp_path / f"report-{index}.json"
+            path.write_text(json.dumps(stats.report()))
+            paths.append(str(path))
+
+        merged_path, hgrm_path = tmp_path / "merged.json", tmp_path / "merged.hgrm"
+        generator.main(['--merge', *paths, '--report', str(merged_path), '--hgrm', str(hgrm_path)])
+
+        merged = json.loads(merged_path.read_text())
+        parts = [json.loads(open(path).read()) for path in paths]
+        assert merged['requests'] == sum(part['requests'] for part in parts) == 200
+        assert merged['latency']['response_ms']['count'] == 200
+        assert set(merged['latency']['response_ms']) >= {'p50', 'p90', 'p99', 'p99.9'}
+        assert f"Total count    = {200:12d}" in hgrm_path.read_text()
+        logger.info(f"✓ Merged {merged['requests']} requests from two reports")
+
+
+class TestJourneys:
+    """Test suite for scripted user journeys"""
+
+    def test_render_templates(self):
+        """Templates fill from the user's variables; lone placeholders keep their type"""
+        variables = {'product': {'id': 7, 'category': 'Books'}, 'order_id': 3}
+
+        assert journeys.render('/api/orders/{order_id}/pay', variables) == '/api/orders/3/pay'
+        assert journeys.render({'items': [{'product_id': '{product[id]}'}]}, variables) == \
+            {'items': [{'product_id': 7}]}
+        assert journeys.render(lambda v: v['order_id'] + 1, variables) == 4
+        assert journeys.lookup({'user': {'id': 5}}, 'user.id') == 5
+        logger.info("✓ Templates rendered")
+
+    def test_checkout_journey(self):
+        """Checkout registers, logs in, orders and pays with the extracted token and ids"""
+        logger.info("Testing the checkout journey")
+
+        gateway = FakeGateway()
+        engine = journeys.JourneyEngine('http://gateway', [journeys.CHECKOUT], think_scale=0,
+                                        mode='closed', users=3, duration=0.3,
+                                        transport=httpx.ASGITransport(app=gateway))
+        summary = asyncio.run(engine.run())
+
+        outcome = summary['journeys']['checkout']
+        assert outcome['failed'] == 0 and outcome['completed'] >= 3
+        # Each virtual user registers once and logs in on every pass
+        assert gateway.calls['POST /api/auth/register'] == 3
+        assert gateway.calls['POST /api/auth/login'] == outcome['completed']
+        assert all(order['status'] == 'paid' for order in gateway.orders.values())
+        assert summary['failed'] == 0
+        assert 'checkout pay' in summary['endpoints']
+        logger.info(f"✓ {outcome['completed']} checkouts by 3 users, p99 {outcome['duration_ms']['p99']}ms")
+
+    def test_failed_step_ends_journey(self):
+        """An unexpected status stops the journey and counts it as failed"""
+        gateway = FakeGateway()
+        gateway.users['load-x-0'] = {'id': 1, 'password': 'other'}
+        engine = journeys.JourneyEngine('http://gateway', [journeys.ACCOUNT], think_scale=0,
+                                        mode='open', rate=1, duration=0.5,
+                                        transport=httpx.ASGITransport(app=gateway))
+        engine.run_id = 'x'
+        summary = asyncio.run(engine.run())
+
+        assert summary['journeys']['account']['completed'] == 0
+        assert summary['journeys']['account']['failed'] == 1
+        assert 'account my orders' not in summary['endpoints']
+        logger.info("✓ Journey stopped at the rejected registration")
+
+    def test_journey_mix_and_think_time(self, tmp_path):
+        """Journeys from a file run in proportion to their weights, pausing between steps"""
+        logger.info("Testing a custom journey file")
+
+        path = tmp_path / "custom.py"
+        path.write_text(
+            "from journeys import Journey, Request, Think\n"
+            "JOURNEYS = [\n"
+            "    Journey('home', 3, [Request('health', 'GET', '/health'), Think((0.05, 0.05, 1)),\n"
+            "                        Request('products', 'GET', '/api/products')]),\n"
+            "    Journey('view', 1, [Request('product', 'GET', '/api/products/1')]),\n"
+            "]\n")
+        gateway = FakeGateway()
+        engine = journeys.JourneyEngine('http://gateway', journeys.load_journeys(str(path)),
+                                        mode='open', rate=100, duration=1.0, seed=5,
+                                        transport=httpx.ASGITransport(app=gateway))
+        summary = asyncio.run(engine.run())
+
+        home, view = summary['journeys']['home'], summary['journeys']['view']
+        assert home['completed'] + view['completed'] == 100
+        assert 0.65 < home['completed'] / 100 < 0.85
+        assert home['duration_ms']['p50'] >= 50
+        logger.info(f"✓ {home['completed']} home and {view['completed']} view journeys")
+
+
+class TestDistributedLoad:
+    """Test suite for ramps and coordinated workers"""
+
+    def test_ramp_schedule(self):
+        """Open-loop arrivals follow the ramp-up, steady and ramp-down rates"""
+        engine = LoadEngine('http://gateway', generator.ENDPOINTS, mode='open', rate=100, duration=10,
+                            ramp_up=2, ramp_down=2)
+        arrivals = list(itertools.takewhile(lambda at: at is not None, map(engine.arrival, itertools.count())))
+
+        assert len(arrivals) == 100 + 600 + 100
+        assert arrivals == sorted(arrivals) and arrivals[-1] < 10
+        assert sum(at < 1 for at in arrivals) == 25
+        assert sum(5 <= at < 6 for at in arrivals) == 100
+        assert sum(at >= 9 for at in arrivals) == 25
+        logger.info(f"✓ {len(arrivals)} arrivals over the ramps")
+
+    def test_phases_reported(self):
+        """Requests are counted per phase and the steady phase gets its own latency"""
+        logger.info("Testing ramp phases")
+
+        summary = run_engine(Target(), mode='open', rate=200, duration=1.0, ramp_up=0.25, ramp_down=0.25)
+
+        assert summary['phases'] == {'ramp_up': 25, 'steady': 100, 'ramp_down': 25}
+        assert summary['latency']['steady_response_ms']['count'] == 100
+        logger.info(f"✓ Phases: {summary['phases']}")
+
+    def test_closed_loop_ramp(self):
+        """Virtual users join over the ramp-up instead of all at once"""
+        target = Target(delay=0.02)
+        engine = LoadEngine('http://gateway', generator.ENDPOINTS, mode='closed', users=4, duration=2.0,
+                            ramp_up=0.4, ramp_down=0.4, transport=httpx.ASGITransport(app=target))
+        summary = asyncio.run(engine.run())
+
+        phases = summary['phases']
+        steady_rate = phases['steady'] / 1.2
+        assert target.max_active == 4
+        # 1, 2, 3, then 4 users for a tenth of a second each (reversed going down): 2.5 on average
+        assert phases['ramp_up'] / 0.4 == pytest.approx(steady_rate * 2.5 / 4, rel=0.2)
+        assert phases['ramp_down'] / 0.4 == pytest.approx(steady_rate * 2.5 / 4, rel=0.2)
+        logger.info(f"✓ Closed-loop phases: {phases}")
+
+    def test_split_settings(self):
+        """Rate, users and connections are shared out between workers"""
+        settings = {'rate': 1000.0, 'users': 10, 'max_connections': 200, 'seed': 7}
+        shares = distributed.split_settings(settings, 3)
+
+        assert [share['users'] for share in shares] == [4, 3, 3]
+        assert sum(share['rate'] for share in shares) == pytest.approx(1000)
+        assert [share['max_connections'] for share in shares] == [66, 66, 66]
+        assert [share['seed'] for share in shares] == [7, 8, 9]
+        logger.info("✓ Settings split across 3 workers")
+
+    def test_local_workers(self, tmp_path, monkeypatch):
+        """Spawned worker processes start together and their reports merge"""
+        logger.info("Testing coordinated local workers")
+
+        target = Target()
+        report_path = tmp_path / "workers.json"
+        with LocalServer(target) as server:
+            monkeypatch.setattr(generator, 'API_GATEWAY_URL', server.url)
+            summary = generator.main(['--mode', 'open', '--rps', '200', '--duration', '1',
+                                      '--ramp-up', '0.2', '--workers', '2', '--report', str(report_path)])
+
+        assert summary['requests'] == sum(target.requests.values()) - 1  # minus the health check
+        assert 170 <= summary['requests'] <= 180
+        assert summary['phases']['ramp_up'] == pytest.approx(20, abs=2)
+        assert summary['elapsed_seconds'] < 1.5
+        assert len(target.clients) >= 2
+        assert json.loads(report_path.read_text())['histograms']
+        logger.info(f"✓ 2 workers sent {summary['requests']} requests over {len(target.clients)} connections")
+
+    def test_missing_workers(self):
+        """The coordinator gives up when workers never join"""
+        coordinator = distributed.Coordinator({'mode': 'open', 'rate': 10, 'users': 1}, 2,
+                                              spawn=False, join_timeout=0.2)
+        with pytest.raises(distributed.CoordinationError):
+            asyncio.run(coordinator.run())
+        logger.info("✓ Missing workers reported")
+
+
+class TestReplay:
+    """Test suite for recorded-traffic replay"""
+
+    CAPTURE = [
+        {'timestamp': '2026-10-12T18:00:00.000Z', 'method': 'GET', 'path': '/api/products',
+         'status': 200, 'duration_ms': 5.0},
+        {'timestamp': '2026-10-12T18:00:00.400Z', 'method': 'GET', 'path': '/api/products/42',
+         'status': 200, 'duration_ms': 3.0},
+        {'timestamp': '2026-10-12T18:00:01.000Z', 'method': 'POST', 'path': '/api/orders', 'status': 201,
+         'duration_ms': 40.0, 'headers': {'Authorization': 'Bearer prod-jwt-a'},
+         'body': {'items': [{'product_id': 42, 'quantity': 1, 'price': 999.99}]}},
+        {'timestamp': '2026-10-12T18:00:01.600Z', 'method': 'POST', 'path': '/api/orders/9001/pay', 'status': 200,
+         'duration_ms': 60.0, 'headers': {'Authorization': 'Bearer prod-jwt-a'},
+         'body': {'payment_method': 'credit_card'}},
+        {'timestamp': '2026-10-12T18:00:02.000Z', 'method': 'GET', 'path': '/api/orders/my-orders',
+         'status': 200, 'duration_ms': 8.0, 'headers': {'Authorization': 'Bearer prod-jwt-b'}},
+    ]
+
+    def test_replay_capture(self, tmp_path, monkeypatch):
+        """A capture replays on its timing with live ids and tokens, compared request by request"""
+        logger.info("Testing capture replay")
+
+        capture_path, deltas_path = tmp_path / "capture.jsonl", tmp_path / "deltas.jsonl"
+        # Out of order on purpose: captures are sorted by time
+        capture_path.write_text('\n'.join(json.dumps(record) for record in reversed(self.CAPTURE)) + '\n')
+        gateway = FakeGateway()
+        with LocalServer(gateway) as server:
+            monkeypatch.setattr(generator, 'API_GATEWAY_URL', server.url)
+            started = time.monotonic()
+            summary = generator.main(['--replay', str(capture_path), '--speed', '4',
+                                      '--deltas', str(deltas_path)])
+            elapsed = time.monotonic() - started
+
+        comparison = summary['replay']
+        assert summary['requests'] == 5 and summary['failed'] == 0
+        assert comparison['compared'] == 5 and comparison['status_mismatches'] == 0
+        # Two captured JWTs, two replay users; the captured order id points at the new order
+        assert len(gateway.users) == 2
+        assert gateway.orders[1]['status'] == 'paid'
+        assert 0.5 <= elapsed < 2.0
+        assert set(comparison['endpoints']) == {'GET /api/products', 'GET /api/products/:id', 'POST /api/orders',
+                                                'POST /api/orders/:id/pay', 'GET /api/orders/my-orders'}
+        deltas = [json.loads(line) for line in deltas_path.read_text().splitlines()]
+        assert [delta['offset'] for delta in deltas] == sorted(delta['offset'] for delta in deltas)
+        assert all(delta['delta_ms'] == pytest.approx(delta['replay_ms'] - delta['captured_ms'], abs=0.01)
+                   for delta in deltas)
+        logger.info(f"✓ Replayed 5 requests, median delta {comparison['delta_ms']['p50']}ms")
+
+    def test_access_log_capture(self, tmp_path):
+        """Access-log lines parse; requests within one second spread across it"""
+        path = tmp_path / "access.log"
+        path.write_text(
+            '10.0.0.1 - - [12/Oct/2026:18:00:00 +0000] "GET /api/products HTTP/1.1" 200 512 "-" "curl/8.0"\n'
+            '10.0.0.2 - - [12/Oct/2026:18:00:00 +0000] "GET /api/orders/my-orders HTTP/1.1" 200 2 "-" "curl/8.0"\n'
+            'not a log line\n'
+            '10.0.0.1 - - [12/Oct/2026:18:00:02 +0000] "GET /api/products/3 HTTP/1.1" 200 64 "-" "curl/8.0" 12.5\n')
+
+        capture = replay.load_capture(str(path))
+
+        assert [entry['offset'] for entry in capture] == [0.0, 0.5, 2.0]
+        assert [entry['user'] for entry in capture] == [None, 'addr:10.0.0.2', None]
+        assert capture[2]['duration_ms'] == 12.5
+        logger.info("✓ Access log parsed")
+
+
+class MetricsEndpoints:
+    """ASGI app serving each service's Prometheus /metrics; some services answer slowly"""
+
+    SCRAPE = """\
+# HELP process_start_time_seconds Start time of the process since unix epoch in seconds.
+# TYPE process_start_time_seconds gauge
+process_start_time_seconds 1.7e9
+# HELP PREFIX_http_requests_total Total HTTP requests
+# TYPE PREFIX_http_requests_total counter
+PREFIX_http_requests_total{method="GET",endpoint="/products",status="200"} 90.0
+PREFIX_http_requests_total{method="POST",endpoint="/products",status="404"} 5.0
+PREFIX_http_requests_total{method="POST",endpoint="/products",status="503"} 5.0
+# HELP PREFIX_request_duration_seconds HTTP request duration in seconds
+# TYPE PREFIX_request_duration_seconds histogram
+PREFIX_request_duration_seconds_bucket{le="0.01",method="GET",endpoint="/products"} 10.0
+PREFIX_request_duration_seconds_bucket{le="0.1",method="GET",endpoint="/products"} 90.0
+PREFIX_request_duration_seconds_bucket{le="1.0",method="GET",endpoint="/products"} 100.0
+PREFIX_request_duration_seconds_bucket{le="+Inf",method="GET",endpoint="/products"} 100.0
+PREFIX_request_duration_seconds_sum{method="GET",endpoint="/products"} 5.0
+PREFIX_request_duration_seconds_count{method="GET",endpoint="/products"} 100.0
+"""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.scrapes = Counter()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        service = scope['path'].strip('/').split('/')[0]
+        self.scrapes[service] += 1
+        await asyncio.sleep(self.delays.get(service, 0.05))
+        prefix = service.split('-')[0]
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/plain; version=0.0.4; charset=utf-8')]})
+        await send({'type': 'http.response.body', 'body': self.SCRAPE.replace('PREFIX', prefix).encode()})
+
+
+def local_aggregator(server, **kwargs):
+    aggregator = MetricsAggregator(**kwargs)
+    aggregator.services = {name: f"{server.url}/{name}/metrics" for name in aggregator.services}
+    return aggregator
+
+
+class TestMetricsAggregator:
+    """Test suite for concurrent scraping and the shared snapshot"""
+
+    def test_concurrent_scrape_with_deadline(self):
+        """Services are scraped in parallel and a hung one costs only the deadline"""
+        logger.info("Testing parallel scraping")
+
+        endpoints = MetricsEndpoints(delays={'chaos-service': 2})
+        with LocalServer(endpoints) as server:
+            aggregator = local_aggregator(server, scrape_deadline=0.5)
+            started = time.monotonic()
+            metrics = aggregator.collect_all_metrics()
+            elapsed = time.monotonic() - started
+
+        # Six services at 50ms each would take 300ms one after another
+        assert elapsed < 0.7
+        assert metrics['chaos-service']['status'] == 'unavailable'
+        assert sum('error' not in m for m in metrics.values()) == 5
+        logger.info(f"✓ Scraped 6 services in {elapsed * 1000:.0f}ms with one hung")
+
+    def test_readers_share_snapshot(self):
+        """Health, performance, alerts and export read one scrape"""
+        logger.info("Testing the shared snapshot")
+
+        endpoints = MetricsEndpoints()
+        with LocalServer(endpoints) as server:
+            aggregator = local_aggregator(server, max_age=60)
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                readers = [aggregator.get_system_health, aggregator.get_performance_metrics,
+                           aggregator.get_alerts, aggregator.export_prometheus_format] * 4
+                results = [future.result() for future in [pool.submit(reader) for reader in readers]]
+
+            assert aggregator.scrape_count == 1
+            assert set(endpoints.scrapes.values()) == {1}
+            assert results[0]['status'] == 'healthy'
+            assert results[1]['total_requests'] == 600
+            assert results[1]['total_errors'] == 30
+
+            # A stale snapshot is scraped again
+            aggregator.get_snapshot(max_age=0)
+            assert aggregator.scrape_count == 2
+        logger.info("✓ 16 concurrent reads served by one scrape")
+
+
+class TestPrometheusParser:
+    """Test suite for the exposition-format parser"""
+
+    def test_scrape_summary(self):
+        """Error rate, average and p95 latency come from the counters and histogram buckets"""
+        families = prometheus_parser.parse(MetricsEndpoints.SCRAPE.replace('PREFIX', 'product'))
+        summary = summarize_scrape(families)
+
+        assert summary['total_requests'] == 100
+        assert summary['failed_requests'] == 5  # 5xx only
+        assert summary['error_rate_percent'] == pytest.approx(5.0)
+        assert summary['average_latency_ms'] == pytest.approx(50.0)
+        # 95th of 100 falls halfway through the 0.1-1.0s bucket
+        assert summary['p95_latency_ms'] == pytest.approx(550.0)
+        assert summary['uptime_seconds'] > 0
+        logger.info(f"✓ Summary: {summary}")
+
+    def test_openmetrics_and_escapes(self):
+        """OpenMetrics counters, exemplars, timestamps and escaped label values parse"""
+        families = prometheus_parser.parse(
+            '# HELP jobs Jobs run.\n'
+            '# TYPE jobs counter\n'
+            'jobs_total{path="/a\\"b\\\\",kind="x,y"} 3 1700000000.5 # {trace_id="abc"} 1.0\n'
+            'jobs_created{path="/a"} 1700000000\n'
+            '# TYPE temp gauge\n'
+            'temp -1.5e1\n'
+            'untyped_thing NaN\n'
+            '# EOF\n')
+
+        jobs = families['jobs_total']
+        assert (jobs.type, jobs.help) == ('counter', 'Jobs run.')
+        assert jobs.series == {(('path', '/a"b\\'), ('kind', 'x,y')): 3.0}
+        assert families['temp'].series == {(): -15.0}
+        assert families['untyped_thing'].type == 'untyped'
+        assert 'jobs' not in families
+        logger.info("✓ OpenMetrics payload parsed")
+
+    def test_streamed_lines(self):
+        """Lines streamed as bytes parse the same as the whole payload"""
+        payload = MetricsEndpoints.SCRAPE.replace('PREFIX', 'user').encode()
+        streamed = prometheus_parser.parse(iter(payload.splitlines()))
+        whole = prometheus_parser.parse(payload)
+
+        assert streamed.keys() == whole.keys()
+        histogram = streamed['user_request_duration_seconds'].merged()
+        assert histogram.buckets == whole['user_request_duration_seconds'].merged().buckets
+        assert histogram.count == 100
+        logger.info("✓ Streamed parse matches")
+
+    def test_bad_lines_rejected(self):
+        with pytest.raises(prometheus_parser.ParseError):
+            prometheus_parser.parse('metric{label="unterminated} 1\n')
+        with pytest.raises(prometheus_parser.ParseError):
+            prometheus_parser.parse('metric not-a-number\n')
+        logger.info("✓ Malformed lines rejected")
+
+    def test_large_scrape(self):
+        """A multi-megabyte scrape parses into every series"""
+        payload = benchmark_parser.build_scrape(2)
+        started = time.perf_counter()
+        families = prometheus_parser.parse(payload)
+        elapsed = time.perf_counter() - started
+
+        requests_total = families['bench_http_requests_total']
+        durations = families['bench_request_duration_seconds']
+        assert len(requests_total.series) == 5 * len(durations.series)
+        assert requests_total.total() == pytest.approx(sum(
+            float(line.rsplit(' ', 1)[1]) for line in payload.splitlines()
+            if line.startswith('bench_http_requests_total{')))
+        logger.info(f"✓ {len(payload) / 1e6:.1f} MB parsed in {elapsed * 1000:.0f}ms")
+
+
+class TestTimeSeriesStore:
+    """Test suite for the ring-buffer metric history"""
+
+    def test_ring_eviction(self):
+        """A full tier overwrites its oldest buckets and keeps a fixed size"""
+        store = TimeSeriesStore(tiers=((1, 10), (60, 5)))
+        for second in range(100):
+            store.append('user-service', 'latency', 1_000_000 + second, second)
+        before = store.memory_bytes()
+        for second in range(100, 1000):
+            store.append('user-service', 'latency', 1_000_000 + second, second)
+
+        points = store.query('user-service', 'latency', 1_000_990, 1_001_000, resolution=1)['points']
+        assert [point['last'] for point in points] == list(range(990, 1000))
+        assert store.stats()['buckets'] == {'1s': 10, '60s': 5}
+        assert store.memory_bytes() == before
+        logger.info(f"✓ {store.memory_bytes()} bytes after 1000 samples")
+
+    def test_rollups(self):
+        """Seconds roll up into minutes and minutes into hours"""
+        store = TimeSeriesStore()
+        start = 1_800_000_000  # on an hour boundary
+        for second in range(2 * 3600 + 1):
+            store.append('product-service', 'requests', start + second, second % 60)
+
+        minutes = store.query('product-service', 'requests', start, start + 600, resolution=60)['points']
+        assert minutes[0] == {'timestamp': start, 'count': 60, 'mean': 29.5, 'min': 0, 'max': 59, 'last': 59}
+        hours = store.query('product-service', 'requests', start, start + 7200, resolution=3600)['points']
+        assert [point['count'] for point in hours] == [3600, 3540]  # the last minute is still open
+        # The 1s tier no longer reaches back two hours, so the query falls back to minutes
+        assert store.query('product-service', 'requests', start, start + 7200)['resolution'] == 60
+        logger.info(f"✓ {len(minutes)} minute and {len(hours)} hour rollups")
+
+    def test_window_longer_than_uptime(self):
+        """A window reaching back before the first sample uses the finest complete tier"""
+        store = TimeSeriesStore()
+        start = 1_800_000_000
+        for second in range(5 * 60):
+            store.append('user-service', 'latency', start + second, 1.0)
+        now = start + 5 * 60
+        recent = store.query('user-service', 'latency', now - 3600, now)
+        assert recent['resolution'] == 1 and len(recent['points']) == 300
+
+        for second in range(5 * 60, 20 * 60):
+            store.append('user-service', 'latency', start + second, 1.0)
+        now = start + 20 * 60
+        history = store.query('user-service', 'latency', now - 3600, now)
+        # The 1s tier has wrapped; the minute tier still holds all 20 minutes
+        assert history['resolution'] == 60
+        assert len(history['points']) == 20
+        assert sum(point['count'] for point in history['points']) == 20 * 60 - 1  # the last second is still open
+        logger.info(f"✓ Last hour after 20 minutes served from {len(history['points'])} minute buckets")
+
+    def test_bounded_series(self):
+        """Series past the limit are rejected and memory is reported"""
+        store = TimeSeriesStore(max_series=2)
+        store.record('a', {'latency': 1.0, 'errors': 2, 'status': 'up', 'healthy': True}, 1_000_000)
+        store.record('b', {'latency': 1.0}, 1_000_000)
+
+        stats = store.stats()
+        assert stats['series'] == 2 and stats['rejected_samples'] == 1
+        assert stats['memory_bytes'] == stats['memory_limit_bytes']
+        logger.info(f"✓ Memory {stats['memory_bytes']} of {stats['memory_limit_bytes']} bytes")
+
+    def test_aggregator_history(self):
+        """Each scrape's numeric metrics land in the aggregator's history"""
+        with LocalServer(MetricsEndpoints(delays={'chaos-service': 2})) as server:
+            aggregator = local_aggregator(server, scrape_deadline=0.5)
+            aggregator.collect_all_metrics()
+            aggregator.collect_all_metrics()
+
+        rate = aggregator.get_history('user-service', 'error_rate_percent', resolution=1)
+        assert rate['points'][-1]['last'] == pytest.approx(5.0)
+        assert sum(point['count'] for point in rate['points']) == 2
+        assert aggregator.get_history('chaos-service', 'up')['points'][-1]['max'] == 0.0
+        assert aggregator.get_history_stats()['series'] > 6
+        logger.info(f"✓ History: {aggregator.get_history_stats()}")
+
+
+if __name__ == "__main__":
+    # Run with: pytest services/metrics-generator/tests/test_generator.py -v
+    logger.info("Run tests with: pytest services/metrics-generator/tests/test_generator.py -v")
@@ -0,0 +1,196 @@
+"""
+In-memory time-series store for the metrics aggregator
+Each (service, metric) series keeps fixed-size ring buffers of bucket
+aggregates at 1 second, 1 minute and 1 hour resolution. Buffers are
+preallocated `array`s, so appending and evicting are O(1) and memory is
+bounded by the capacities. A bucket closing at one resolution is rolled up
+into the next.
+"""
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+# (bucket seconds, buckets kept): 15 minutes of seconds, a day of minutes, a month of hours
+TIERS = ((1, 900), (60, 1440), (3600, 720))
+FIELDS = ('start', 'count', 'sum', 'min', 'max', 'last')
+
+
+class Tier:
+    """Ring buffer of bucket aggregates (count, sum, min, max, last) at one resolution"""
+
+    def __init__(self, step: int, capacity: int):
+        self.step = step
+        self.capacity = capacity
+        self.columns = {field: array('d', bytes(8 * capacity)) for field in FIELDS}
+        self.head = 0  # next slot to write
+        self.size = 0
+        self.pending: Optional[List[float]] = None  # the open bucket, same field order
+        self.dropped = 0
+
+    def add(self, start: float, count: float, total: float, low: float, high: float, last: float):
+        """Merge an aggregate into its bucket; returns the bucket it closed, if any"""
+        bucket = start - start % self.step
+        closed = None
+        pending = self.pending
+        if pending is not None and bucket != pending[0]:
+            if bucket < pending[0]:
+                self.dropped += 1  # older than the open bucket
+                return None
+            closed = pending
+            self._append(closed)
+            pending = None
+        if pending is None:
+            self.pending = [bucket, count, total, low, high, last]
+        else:
+            pending[1] += count
+            pending[2] += total
+            pending[3] = min(pending[3], low)
+            pending[4] = max(pending[4], high)
+            pending[5] = last
+        return closed
+
+    def _append(self, bucket: List[float]):
+        for field, value in zip(FIELDS, bucket):
+            self.columns[field][self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _slot(self, index: int) -> int:
+        """Array slot of the `index`th oldest bucket"""
+        return (self.head - self.size + index) % self.capacity
+
+    @property
+    def oldest(self) -> Optional[float]:
+        if self.size:
+            return self.columns['start'][self._slot(0)]
+        return self.pending[0] if self.pending else None
+
+    def query(self, start: float, end: float) -> List[Dict[str, float]]:
+        """Buckets starting in [start, end], the open one included"""
+        starts = _RingView(self.columns['start'], self)
+        first = bisect_left(starts, start - start % self.step)
+        last = bisect_right(starts, end)
+        points = []
+        for index in range(first, last):
+            slot = self._slot(index)
+            points.append(_point([self.columns[field][slot] for field in FIELDS]))
+        if self.pending and start - start % self.step <= self.pending[0] <= end:
+            points.append(_point(self.pending))
+        return points
+
+    def nbytes(self) -> int:
+        return sum(column.buffer_info()[1] * column.itemsize for column in self.columns.values())
+
+
+class _RingView:
+    """Sequence view of one column, oldest first, for bisect"""
+
+    def __init__(self, column: array, tier: Tier):
+        self.column = column
+        self.tier = tier
+
+    def __len__(self):
+        return self.tier.size
+
+    def __getitem__(self, index):
+        return self.column[self.tier._slot(index)]
+
+
+def _point(bucket) -> Dict[str, float]:
+    start, count, total, low, high, last = bucket
+    return {'timestamp': start, 'count': int(count), 'mean': total / count if count else math.nan,
+            'min': low, 'max': high, 'last': last}
+
+
+class Series:
+    """One metric's history across every tier"""
+
+    def __init__(self, tiers: Tuple[Tuple[int, int], ...] = TIERS):
+        self.tiers = [Tier(step, capacity) for step, capacity in tiers]
+
+    def append(self, timestamp: float, value: float):
+        closed = self.tiers[0].add(timestamp, 1, value, value, value, value)
+        # Roll each closed bucket up into the next resolution
+        for tier in self.tiers[1:]:
+            if closed is None:
+                break
+            closed = tier.add(*closed)
+
+    def tier_for(self, start: float, resolution: Optional[int] = None) -> Tier:
+        """The tier at `resolution` seconds, or the finest one still holding `start`.
+
+        A window reaching back before the first sample gets the finest tier
+        that has not evicted a bucket yet: it still holds all the history.
+        """
+        if resolution is not None:
+            for tier in self.tiers:
+                if tier.step == resolution:
+                    return tier
+            raise ValueError(f"no {resolution}s resolution; have {[tier.step for tier in self.tiers]}")
+        for tier in self.tiers:
+            if tier.oldest is not None and tier.oldest <= start:
+                return tier
+        for tier in self.tiers:
+            if tier.size < tier.capacity:
+                return tier
+        return self.tiers[-1]
+
+    def nbytes(self) -> int:
+        return sum(tier.nbytes() for tier in self.tiers)
+
+
+class TimeSeriesStore:
+    """(service, metric) series with bounded memory.
+
+    At most `max_series` series are kept; samples for new series past that
+    are counted in `rejected` and dropped.
+    """
+
+    def __init__(self, tiers: Tuple[Tuple[int, int], ...] = TIERS, max_series: int = 128):
+        self.tiers = tiers
+        self.max_series = max_series
+        self.series: Dict[Tuple[str, str], Series] = {}
+        self.rejected = 0
+
+    def append(self, service: str, metric: str, timestamp: float, value: float):
+        key = (service, metric)
+        series = self.series.get(key)
+        if series is None:
+            if len(self.series) >= self.max_series:
+                self.rejected += 1
+                return
+            series = self.series[key] = Series(self.tiers)
+        series.append(timestamp, value)
+
+    def record(self, service: str, metrics: Dict[str, object], timestamp: float):
+        """Append every numeric field of one scrape summary"""
+        for metric, value in metrics.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and not math.isnan(value):
+                self.append(service, metric, timestamp, float(value))
+
+    def query(self, service: str, metric: str, start: float, end: float,
+              resolution: Optional[int] = None) -> Dict[str, object]:
+        """Points between `start` and `end` (epoch seconds) from the finest tier covering them"""
+        series = self.series.get((service, metric))
+        if series is None:
+            return {'service': service, 'metric': metric, 'resolution': resolution, 'points': []}
+        tier = series.tier_for(start, resolution)
+        return {'service': service, 'metric': metric, 'resolution': tier.step,
+                'points': tier.query(start, end)}
+
+    def memory_bytes(self) -> int:
+        return sum(series.nbytes() for series in self.series.values())
+
+    def stats(self) -> Dict[str, object]:
+        """Series count, buckets held per resolution and memory, used and at most"""
+        per_series = sum(capacity for _, capacity in self.tiers) * len(FIELDS) * 8
+        return {
+            'series': len(self.series),
+            'max_series': self.max_series,
+            'rejected_samples': self.rejected,
+            'buckets': {f"{step}s": sum(series.tiers[index].size for series in self.series.values())
+                        for index, (step, _) in enumerate(self.tiers)},
+            'memory_bytes': self.memory_bytes(),
+            'memory_limit_bytes': per_series * self.max_series,
+        }
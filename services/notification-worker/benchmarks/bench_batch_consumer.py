@@ -0,0 +1,106 @@
+"""
+Benchmark: one-record-at-a-time vs poll()-based micro-batch consumption
+Runs the worker's consume loops against an in-memory consumer stub (no Kafka)
+
+Run with: python benchmarks/bench_batch_consumer.py [num_events] [batch_size]
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kafka.structs import TopicPartition  # noqa: E402
+import worker  # noqa: E402
+
+ConsumerRecord = namedtuple('ConsumerRecord', ['topic', 'partition', 'offset', 'timestamp', 'key', 'value'])
+
+SAMPLE_EVENTS = {
+    'user.created': {'username': 'bench', 'email': 'bench@example.com'},
+    'order.created': {'order_id': 1, 'user_id': 1, 'total_amount': 99.99, 'items': 2},
+    'order.status_changed': {'order_id': 1, 'user_id': 1, 'old_status': 'confirmed',
+                             'new_status': 'shipped', 'total_amount': 99.99},
+    'stock.low': {'product_id': 1, 'product_name': 'Widget', 'stock': 3},
+}
+
+
+class InMemoryConsumer:
+    """Minimal KafkaConsumer stand-in serving pre-built records from memory"""
+
+    def __init__(self, records, partitions=3, stop_event=None, max_poll_records=500):
+        self.records = records
+        self.max_poll_records = max_poll_records
+        self.partitions = partitions
+        self.position = 0
+        self.commits = 0
+        self.stop_event = stop_event
+
+    def poll(self, timeout_ms=0, max_records=None):
+        if self.position >= len(self.records):
+            if self.stop_event:
+                self.stop_event.set()
+            return {}
+        end = min(len(self.records), self.position + (max_records or self.max_poll_records))
+        result = {}
+        for record in self.records[self.position:end]:
+            tp = TopicPartition(record.topic, record.partition)
+            result.setdefault(tp, []).append(record)
+        self.position = end
+        return result
+
+    def commit(self, offsets=None):
+        self.commits += 1
+
+    def commit_async(self, offsets=None, callback=None):
+        self.commits += 1
+
+
+def build_records(count, partitions=3):
+    topics = list(SAMPLE_EVENTS)
+    return [
+        ConsumerRecord(topic, i % partitions, i, int(time.time() * 1000), None, SAMPLE_EVENTS[topic])
+        for i, topic in ((i, topics[i % len(topics)]) for i in range(count))
+    ]
+
+
+def bench_stream(records):
+    stop_event = threading.Event()
+    consumer = InMemoryConsumer(records, stop_event=stop_event)
+    start = time.perf_counter()
+    worker.consume_stream(consumer, datetime.now(), timeout_ms=0, stop_event=stop_event)
+    return time.perf_counter() - start, consumer.commits
+
+
+def bench_batches(records, batch_size):
+    stop_event = threading.Event()
+    consumer = InMemoryConsumer(records, stop_event=stop_event)
+    start = time.perf_counter()
+    worker.consume_batches(consumer, datetime.now(), max_records=batch_size, timeout_ms=0,
+                           stop_event=stop_event, tracker=worker.OffsetTracker(commit_interval_ms=0))
+    return time.perf_counter() - start, consumer.commits
+
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    # Handlers log at INFO/WARNING; silence output so we measure the consume path
+    logging.disable(logging.CRITICAL)
+    records = build_records(num_events)
+
+    stream_seconds, stream_commits = bench_stream(records)
+    batch_seconds, commits = bench_batches(records, batch_size)
+    logging.disable(logging.NOTSET)
+
+    print(f"{'mode':<12}{'events':>10}{'seconds':>10}{'events/s':>12}{'commits':>10}")
+    print(f"{'stream':<12}{num_events:>10}{stream_seconds:>10.3f}{num_events / stream_seconds:>12.0f}{stream_commits:>10}")
+    print(f"{'batch':<12}{num_events:>10}{batch_seconds:>10.3f}{num_events / batch_seconds:>12.0f}{commits:>10}")
+    print(f"speedup: {stream_seconds / batch_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
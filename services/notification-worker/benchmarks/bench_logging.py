@@ -0,0 +1,64 @@
+"""
+Benchmark: notification-worker logging cost per processed event
+Compares the original text logging (synchronous, every event dumped) with the
+structured mode (compact JSON, QueueHandler/QueueListener sink, sampled dumps)
+
+Run with: python benchmarks/bench_logging.py [num_events]
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import worker  # noqa: E402
+from structured_logging import configure_logging  # noqa: E402
+from bench_batch_consumer import InMemoryConsumer, build_records  # noqa: E402
+
+MODES = [
+    # name, log format, queue sink, per-event dump sample rate
+    ('text-sync-full', 'text', False, 1.0),
+    ('text-async-full', 'text', True, 1.0),
+    ('json-sync-1%', 'json', False, 0.01),
+    ('json-async-1%', 'json', True, 0.01),
+]
+
+
+def run(records, log_format, use_queue, sample_rate, sink):
+    worker.EVENT_SAMPLER.set_rate(sample_rate)
+    worker.EVENT_DUMP_INDENT = 2 if log_format == 'text' else None
+    listener = configure_logging(log_format, use_queue, logging.INFO, stream=sink)
+
+    stop_event = threading.Event()
+    consumer = InMemoryConsumer(records, stop_event=stop_event)
+    start = time.perf_counter()
+    worker.consume_stream(consumer, datetime.now(), timeout_ms=0, stop_event=stop_event)
+    consumed = time.perf_counter() - start
+    if listener:
+        listener.stop()  # include draining the queue in the total
+    total = time.perf_counter() - start
+    return consumed, total
+
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    records = build_records(num_events)
+
+    print(f"{'mode':<18}{'events':>8}{'consume s':>11}{'total s':>9}{'events/s':>11}")
+    with open(os.devnull, 'w') as sink:
+        results = {}
+        for name, log_format, use_queue, sample_rate in MODES:
+            consumed, total = run(records, log_format, use_queue, sample_rate, sink)
+            results[name] = total
+            print(f"{name:<18}{num_events:>8}{consumed:>11.3f}{total:>9.3f}{num_events / total:>11.0f}")
+    configure_logging('text', False)
+
+    print(f"speedup (json-async-1% vs text-sync-full): "
+          f"{results['text-sync-full'] / results['json-async-1%']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""
+Settings shared by the notification worker and its command-line tools
+Kept free of side effects so tools can import them without starting the worker
+"""
+import os
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'kafka:9092').split(',')
+
+TOPICS = [
+    'user.created',
+    'order.created',
+    'order.payment_confirmed',
+    'order.status_changed',
+    'stock.low',
+    'api.rate_limited',
+    'chaos.injected'
+]
+
+# Topics that can be scaled as a unit (heavy order traffic apart from the
+# low-volume alert topics)
+TOPIC_GROUPS = {
+    'users': ['user.created'],
+    'orders': ['order.created', 'order.payment_confirmed', 'order.status_changed'],
+    'alerts': ['stock.low', 'api.rate_limited', 'chaos.injected']
+}
@@ -0,0 +1,223 @@
+"""
+Event deduplication for the notification worker
+Drops redelivered events by the `event_id` producers stamp on every event
+"""
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import prometheus_metrics
+
+logger = logging.getLogger(__name__)
+
+EVENT_ID_FIELD = 'event_id'
+
+
+class LruIdCache:
+    """Exact set of the `max_entries` most recently seen ids"""
+
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self._ids = OrderedDict()
+
+    def add(self, event_id):
+        """Add an id; returns False if it was already present"""
+        if event_id in self._ids:
+            self._ids.move_to_end(event_id)
+            return False
+        self._ids[event_id] = None
+        if len(self._ids) > self.max_entries:
+            self._ids.popitem(last=False)
+        return True
+
+    def discard(self, event_id):
+        """Forget an id, so its next add() counts as new"""
+        self._ids.pop(event_id, None)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class RotatingBloomFilter:
+    """Approximate id set with fixed memory.
+
+    Two bloom filter generations of `capacity` ids each: ids go into the
+    current generation and are looked up in both. Once the current generation
+    holds `capacity` ids the older one is dropped, so the last `capacity` to
+    2 * `capacity` ids are remembered. A false positive (at most about
+    2 * `error_rate`) drops a unique event, so keep the rate low.
+
+    Bits cannot be cleared, so discarded ids are kept in a small exact set
+    (the last `max_discarded`) that lets their next add() through.
+    """
+
+    def __init__(self, capacity=1_000_000, error_rate=1e-6, max_discarded=10_000):
+        self.capacity = capacity
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._current = bytearray((self.num_bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+        self._previous_count = 0
+        self.max_discarded = max_discarded
+        self._discarded = OrderedDict()
+
+    def _positions(self, event_id):
+        digest = hashlib.blake2b(event_id.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    @staticmethod
+    def _contains(bits, positions):
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def add(self, event_id):
+        """Add an id; returns False if it was (probably) already present"""
+        if event_id in self._discarded:
+            del self._discarded[event_id]
+            return True  # its bits are still set
+        positions = self._positions(event_id)
+        if self._contains(self._current, positions) or self._contains(self._previous, positions):
+            return False
+        if self._count >= self.capacity:
+            self._previous, self._current = self._current, self._previous
+            self._current[:] = bytes(len(self._current))
+            self._previous_count, self._count = self._count, 0
+        for p in positions:
+            self._current[p >> 3] |= 1 << (p & 7)
+        self._count += 1
+        return True
+
+    def discard(self, event_id):
+        """Forget an id, so its next add() counts as new"""
+        self._discarded[event_id] = None
+        if len(self._discarded) > self.max_discarded:
+            self._discarded.popitem(last=False)
+
+    def __len__(self):
+        return self._count + self._previous_count
+
+
+class RedisIdStore:
+    """Ids shared by all worker pods, one Redis key per id with a TTL"""
+
+    def __init__(self, client, ttl_seconds=86400, prefix='notification-worker:seen:'):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def seen(self, event_ids):
+        """Which of the ids are already recorded (one round trip)"""
+        pipe = self.client.pipeline(transaction=False)
+        for event_id in event_ids:
+            pipe.exists(self.prefix + event_id)
+        return [bool(found) for found in pipe.execute()]
+
+    def record(self, event_ids):
+        """Record handled ids; each expires after the TTL"""
+        pipe = self.client.pipeline(transaction=False)
+        for event_id in event_ids:
+            pipe.set(self.prefix + event_id, 1, ex=self.ttl_seconds)
+        pipe.execute()
+
+
+class DedupStore:
+    """Claims event ids before dispatch and drops ids seen before.
+
+    The local set (LruIdCache or RotatingBloomFilter) is checked and updated
+    when an event is claimed, so duplicates in flight on this worker are
+    dropped without a network call. The optional shared store is checked for
+    ids the local set has not seen and is written only once an event was
+    handled, so a redelivery after a rebalance is dropped by whichever pod
+    receives it. Ids of events whose handler failed are released again, so
+    the event is handled when it comes back (a retry, a DLQ replay or a
+    redelivery). Shared store errors fail open: the event is processed.
+    """
+
+    def __init__(self, local, remote=None):
+        self.local = local
+        self.remote = remote
+        self._lock = threading.Lock()
+        self._deferred = threading.local()
+
+    def claim(self, topic, event_ids):
+        """Return one flag per id: True if the event should be processed.
+
+        Events without an id (None) are always processed.
+        """
+        with self._lock:
+            fresh = [event_id is None or self.local.add(event_id) for event_id in event_ids]
+            prometheus_metrics.set_dedup_store_entries(len(self.local))
+
+        if self.remote is not None:
+            to_check = [i for i, ok in enumerate(fresh) if ok and event_ids[i] is not None]
+            if to_check:
+                try:
+                    seen = self.remote.seen([event_ids[i] for i in to_check])
+                except Exception as e:
+                    logger.warning(f"Shared dedup store lookup failed: {e}")
+                    prometheus_metrics.record_dedup_remote_error()
+                    seen = [False] * len(to_check)
+                for i, found in zip(to_check, seen):
+                    fresh[i] = not found
+
+        duplicates = fresh.count(False)
+        prometheus_metrics.record_dedup_check(topic, len(fresh) - duplicates, duplicates)
+        return fresh
+
+    def release(self, event_ids):
+        """Forget claimed ids whose events failed, so they are not dropped later"""
+        with self._lock:
+            for event_id in event_ids:
+                if event_id is not None:
+                    self.local.discard(event_id)
+            prometheus_metrics.set_dedup_store_entries(len(self.local))
+
+    @contextmanager
+    def deferred(self):
+        """done() calls made by this thread in the block are written to the shared store at once"""
+        self._deferred.ids = []
+        try:
+            yield
+        finally:
+            event_ids, self._deferred.ids = self._deferred.ids, None
+            self.done(event_ids)
+
+    def done(self, event_ids):
+        """Record successfully handled ids in the shared store"""
+        event_ids = [event_id for event_id in event_ids if event_id is not None]
+        if self.remote is None or not event_ids:
+            return
+        deferred = getattr(self._deferred, 'ids', None)
+        if deferred is not None:
+            deferred.extend(event_ids)
+            return
+        try:
+            self.remote.record(event_ids)
+        except Exception as e:
+            logger.warning(f"Shared dedup store update failed: {e}")
+            prometheus_metrics.record_dedup_remote_error()
+
+
+def event_id(event):
+    """The producer-assigned id of an event, or None"""
+    return event.get(EVENT_ID_FIELD) if isinstance(event, dict) else None
+
+
+def build_dedup_store(backend='lru', max_entries=100_000, error_rate=1e-6,
+                      redis_url=None, ttl_seconds=86400):
+    """Create a DedupStore with an lru/bloom local set and optional Redis"""
+    if backend == 'bloom':
+        local = RotatingBloomFilter(max_entries, error_rate)
+    else:
+        local = LruIdCache(max_entries)
+
+    remote = None
+    if redis_url:
+        import redis  # only needed when a shared store is configured
+        remote = RedisIdStore(redis.Redis.from_url(redis_url), ttl_seconds)
+    return DedupStore(local, remote)
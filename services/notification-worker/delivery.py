@@ -0,0 +1,320 @@
+"""
+Notification delivery engine for the notification worker
+Pluggable channels (SMTP email, generic webhook, Slack-style webhook) with
+pooled keep-alive connections, provider batching and per-channel
+concurrency limits
+"""
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from email.message import EmailMessage
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import prometheus_metrics
+
+logger = logging.getLogger(__name__)
+
+Notification = namedtuple('Notification', ['channel', 'recipient', 'subject', 'body', 'data'])
+Notification.__new__.__defaults__ = (None,)
+
+
+class ConnectionPool:
+    """Bounded pool of reusable connections.
+
+    Idle connections are kept for reuse (most recently used first) and closed
+    once idle for longer than `max_idle_seconds`. A connection that raised
+    while checked out is discarded instead of being returned to the pool.
+    """
+
+    def __init__(self, factory, size, max_idle_seconds=60, close=None):
+        self.factory = factory
+        self.max_idle_seconds = max_idle_seconds
+        self._close = close or (lambda conn: conn.close())
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            conn = self._checkout()
+            try:
+                yield conn
+            except Exception:
+                self._discard(conn)
+                raise
+            self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self.factory()
+            if time.monotonic() - last_used <= self.max_idle_seconds:
+                return conn
+            self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            self._close(conn)
+        except Exception:
+            pass
+
+
+class Channel:
+    """Base class for a delivery channel.
+
+    Subclasses implement send_batch(); at most `concurrency` sends run at the
+    same time on one channel and at most `max_batch` notifications are
+    handed to one send_batch() call.
+    """
+
+    name = 'base'
+
+    def __init__(self, concurrency=4, max_batch=1):
+        self.concurrency = concurrency
+        self.max_batch = max(1, max_batch)
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def deliver(self, notifications):
+        """Send a list of notifications under the channel's concurrency limit"""
+        with self._slots:
+            start = time.perf_counter()
+            try:
+                self.send_batch(notifications)
+            except Exception as e:
+                latency_ms = (time.perf_counter() - start) * 1000
+                prometheus_metrics.record_notification_sent(
+                    self.name, success=False, latency=latency_ms,
+                    reason=type(e).__name__, count=len(notifications)
+                )
+                raise
+            latency_ms = (time.perf_counter() - start) * 1000
+            prometheus_metrics.record_notification_sent(
+                self.name, success=True, latency=latency_ms, count=len(notifications)
+            )
+
+    def send_batch(self, notifications):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SmtpChannel(Channel):
+    """Email over pooled, kept-alive SMTP connections.
+
+    SMTP has no multi-recipient batch API for different messages, but a batch
+    reuses one authenticated connection for all of its messages.
+    """
+
+    name = 'email'
+
+    def __init__(self, host, port=25, sender='notifications@cloudcart.local', username=None,
+                 password=None, use_tls=False, timeout=10, concurrency=4, max_batch=20):
+        super().__init__(concurrency, max_batch)
+        self.sender = sender
+
+        def connect():
+            conn = smtplib.SMTP(host, port, timeout=timeout)
+            if use_tls:
+                conn.starttls()
+            if username:
+                conn.login(username, password)
+            return conn
+
+        def close(conn):
+            try:
+                conn.quit()
+            except smtplib.SMTPException:
+                conn.close()
+
+        self.pool = ConnectionPool(connect, concurrency, close=close)
+
+    def send_batch(self, notifications):
+        with self.pool.connection() as conn:
+            for notification in notifications:
+                message = EmailMessage()
+                message['From'] = self.sender
+                message['To'] = notification.recipient
+                message['Subject'] = notification.subject
+                message.set_content(notification.body)
+                conn.send_message(message)
+
+    def close(self):
+        self.pool.close()
+
+
+class WebhookChannel(Channel):
+    """JSON webhook over a keep-alive HTTP session.
+
+    With max_batch > 1 a batch is POSTed as one JSON array.
+    """
+
+    name = 'webhook'
+
+    def __init__(self, url, timeout=5, concurrency=4, max_batch=1, headers=None):
+        super().__init__(concurrency, max_batch)
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        # One connection per concurrent sender; pool_block keeps it bounded
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def payload(self, notifications):
+        items = [
+            {
+                'recipient': n.recipient,
+                'subject': n.subject,
+                'body': n.body,
+                'data': n.data or {},
+            }
+            for n in notifications
+        ]
+        return items if self.max_batch > 1 else items[0]
+
+    def send_batch(self, notifications):
+        response = self.session.post(self.url, json=self.payload(notifications), timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class SlackChannel(WebhookChannel):
+    """Slack-style incoming webhook ({"text": ...}).
+
+    Incoming webhooks take one message per call, so a batch is merged into a
+    single message with one line per notification.
+    """
+
+    name = 'slack'
+
+    def __init__(self, url, timeout=5, concurrency=2, max_batch=20):
+        super().__init__(url, timeout, concurrency, max_batch)
+
+    def payload(self, notifications):
+        lines = [f"*{n.subject}* {n.body}" for n in notifications]
+        return {'text': '\n'.join(lines)}
+
+
+class Outbox:
+    """Notifications collected while processing a batch of events"""
+
+    def __init__(self):
+        self.items = []
+        self.current = None
+        self.failures = []
+
+
+class DeliveryEngine:
+    """Routes notifications to their channel.
+
+    notify() sends immediately, unless called inside collect(): then the
+    notification is queued and the whole batch is flushed per channel in
+    chunks of the channel's max_batch when the block exits. Notifications for
+    a channel that is not configured are only logged.
+    """
+
+    def __init__(self, channels=None):
+        self.channels = dict(channels or {})
+        self._local = threading.local()
+
+    def notify(self, channel, recipient, subject, body, data=None):
+        notification = Notification(channel, recipient, subject, body, data)
+        if channel not in self.channels:
+            logger.debug("No %s channel configured, skipping notification to %s", channel, recipient)
+            return
+        outbox = getattr(self._local, 'outbox', None)
+        if outbox is not None:
+            outbox.items.append((notification, outbox.current))
+            return
+        self.channels[channel].deliver([notification])
+
+    @contextmanager
+    def collect(self):
+        """Queue notify() calls made on this thread and flush them in batches"""
+        outbox = Outbox()
+        self._local.outbox = outbox
+        try:
+            yield outbox
+        finally:
+            self._local.outbox = None
+            outbox.failures = self.flush(outbox.items)
+
+    def flush(self, items):
+        """Send (notification, source) pairs; returns [(source, error)] failures"""
+        by_channel = defaultdict(list)
+        for notification, source in items:
+            by_channel[notification.channel].append((notification, source))
+
+        failures = []
+        failed_sources = set()
+        for name, pending in by_channel.items():
+            channel = self.channels[name]
+            for i in range(0, len(pending), channel.max_batch):
+                chunk = pending[i:i + channel.max_batch]
+                try:
+                    channel.deliver([notification for notification, _ in chunk])
+                except Exception as e:
+                    logger.error("Failed to deliver %d %s notifications: %s", len(chunk), name, e)
+                    for _, source in chunk:
+                        if id(source) not in failed_sources:
+                            failed_sources.add(id(source))
+                            failures.append((source, e))
+        return failures
+
+    def close(self):
+        for channel in self.channels.values():
+            channel.close()
+
+    @classmethod
+    def from_env(cls):
+        """Build the engine from SMTP_*, WEBHOOK_* and SLACK_* settings"""
+        channels = {}
+        if os.getenv('SMTP_HOST'):
+            channels['email'] = SmtpChannel(
+                host=os.getenv('SMTP_HOST'),
+                port=int(os.getenv('SMTP_PORT', 25)),
+                sender=os.getenv('SMTP_FROM', 'notifications@cloudcart.local'),
+                username=os.getenv('SMTP_USERNAME') or None,
+                password=os.getenv('SMTP_PASSWORD') or None,
+                use_tls=os.getenv('SMTP_STARTTLS', 'false').lower() == 'true',
+                concurrency=int(os.getenv('SMTP_CONCURRENCY', 4)),
+                max_batch=int(os.getenv('SMTP_BATCH_SIZE', 20)),
+            )
+        if os.getenv('WEBHOOK_URL'):
+            channels['webhook'] = WebhookChannel(
+                url=os.getenv('WEBHOOK_URL'),
+                concurrency=int(os.getenv('WEBHOOK_CONCURRENCY', 4)),
+                max_batch=int(os.getenv('WEBHOOK_BATCH_SIZE', 1)),
+            )
+        if os.getenv('SLACK_WEBHOOK_URL'):
+            channels['slack'] = SlackChannel(
+                url=os.getenv('SLACK_WEBHOOK_URL'),
+                concurrency=int(os.getenv('SLACK_CONCURRENCY', 2)),
+                max_batch=int(os.getenv('SLACK_BATCH_SIZE', 20)),
+            )
+        return cls(channels)
@@ -0,0 +1,212 @@
+"""
+Windowed coalescing of bursty events for the notification worker
+Events sharing a digest key within a window produce one digest notification
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import prometheus_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DigestRule:
+    """How one kind of event is coalesced.
+
+    `render(key, items)` turns the (topic, event) items collected for a key
+    into the (recipient, subject, body, data) of a single notification sent
+    on `channel`. A window is opened by the first event for a key and closes
+    `window_seconds` later, or as soon as it holds `max_events` events. With
+    a window of 0 every event is rendered and sent on its own, synchronously.
+    """
+
+    def __init__(self, name, channel, render, window_seconds, max_events=1000):
+        self.name = name
+        self.channel = channel
+        self.render = render
+        self.window_seconds = window_seconds
+        self.max_events = max_events
+
+
+class Pending:
+    """Completion of one record whose events may wait in digest windows.
+
+    Starts with one hold for the handler. `on_done(failed, errored)` runs
+    once the handler and every window holding one of the record's events
+    released it; `errored` is True if any of them did not deliver its
+    notifications, `failed` if it could not even route them to the retry
+    topics.
+    """
+
+    __slots__ = ('on_done', '_holds', '_failed', '_errored', '_lock')
+
+    def __init__(self, on_done):
+        self.on_done = on_done
+        self._holds = 1
+        self._failed = False
+        self._errored = False
+        self._lock = threading.Lock()
+
+    def hold(self):
+        with self._lock:
+            self._holds += 1
+
+    def release(self, failed=False, errored=False):
+        with self._lock:
+            self._holds -= 1
+            self._failed = self._failed or failed
+            self._errored = self._errored or errored or failed
+            done = self._holds == 0
+        if done:
+            self.on_done(self._failed, self._errored)
+
+
+class Window:
+    __slots__ = ('closes_at', 'items', 'holds')
+
+    def __init__(self, closes_at):
+        self.closes_at = closes_at
+        self.items = []
+        self.holds = []  # Pending of each item, or None
+
+
+class Coalescer:
+    """Buffers events per (rule, key) and emits one digest per window.
+
+    Handlers call add() from any thread; a background thread emits windows
+    once they close, and is woken for a window that filled up. Digests are
+    never sent from the handler's thread, so a digest's outcome is never
+    charged to whichever event happened to fill its window. `deliver(channel, recipient, subject, body, data)` sends
+    a digest. If a digest cannot be sent, its (topic, event) items are passed
+    to `on_failure(topic, [(event, error)])`, typically the retry pipeline,
+    which returns the failures it could not route.
+
+    Events added inside holding() keep their record's Pending open until
+    their window was emitted, so the record's offset is not committed while
+    its event only sits in memory: after a crash it is redelivered and
+    buffered again. stop() emits every open window.
+    """
+
+    def __init__(self, deliver, interval_seconds=1.0, on_failure=None):
+        self.deliver = deliver
+        self.interval_seconds = interval_seconds
+        self.on_failure = on_failure
+        self.rules = {}
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._open = defaultdict(int)  # rule name -> open windows
+        self._full = []  # (rule name, key, window) filled up, for the flusher to emit
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._local = threading.local()
+
+    def register(self, rule):
+        self.rules[rule.name] = rule
+
+    @contextmanager
+    def holding(self, pendings):
+        """Events added by this thread in the block hold their Pending, keyed by id(event)"""
+        self._local.pendings = pendings
+        try:
+            yield
+        finally:
+            self._local.pendings = None
+
+    def add(self, rule_name, key, topic, event):
+        """Add an event to the open window of its key"""
+        rule = self.rules[rule_name]
+        prometheus_metrics.record_digest_event(rule.name)
+        if rule.window_seconds <= 0:
+            self._emit(rule, key, [(topic, event)], raise_errors=True)
+            return
+
+        pendings = getattr(self._local, 'pendings', None)
+        pending = pendings.get(id(event)) if pendings else None
+        if pending is not None:
+            pending.hold()
+        with self._lock:
+            window = self._windows.get((rule.name, key))
+            if window is None:
+                window = self._windows[(rule.name, key)] = Window(time.monotonic() + rule.window_seconds)
+                self._count_window(rule.name, 1)
+            window.items.append((topic, event))
+            window.holds.append(pending)
+            if len(window.items) < rule.max_events:
+                return
+            self._full.append(((rule.name, key), self._windows.pop((rule.name, key))))
+            self._count_window(rule.name, -1)
+        self._wake.set()
+
+    def flush_due(self, force=False):
+        """Emit every window that is full or has closed (all windows with force)"""
+        now = time.monotonic()
+        with self._lock:
+            due = [wk for wk, window in self._windows.items() if force or window.closes_at <= now]
+            closed, self._full = self._full, []
+            closed += [(wk, self._windows.pop(wk)) for wk in due]
+            for name, _ in due:
+                self._count_window(name, -1)
+        for (name, key), window in closed:
+            self._emit(self.rules[name], key, window.items, window.holds)
+        return len(closed)
+
+    def open_windows(self):
+        with self._lock:
+            return len(self._windows)
+
+    def start(self):
+        """Start the background flushing thread"""
+        self._thread = threading.Thread(target=self._run, name="digest-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the flushing thread and emit all open windows"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush_due(force=True)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                self.flush_due()
+            except Exception as e:
+                logger.error(f"Digest flush failed: {e}")
+
+    def _count_window(self, name, delta):
+        # Called with the lock held
+        self._open[name] += delta
+        prometheus_metrics.set_digest_open_windows(name, self._open[name])
+
+    def _emit(self, rule, key, items, holds=(), raise_errors=False):
+        unrouted = set()
+        delivered = False
+        try:
+            recipient, subject, body, data = rule.render(key, items)
+            self.deliver(rule.channel, recipient, subject, body, data)
+        except Exception as e:
+            prometheus_metrics.record_digest_emitted(rule.name, len(items), success=False)
+            if raise_errors:
+                raise
+            logger.error(f"Failed to send {rule.name} digest for {key} ({len(items)} events): {e}")
+            if self.on_failure:
+                by_topic = defaultdict(list)
+                for topic, event in items:
+                    by_topic[topic].append((event, e))
+                for topic, failures in by_topic.items():
+                    unrouted.update(id(event) for event, _ in self.on_failure(topic, failures) or ())
+        else:
+            delivered = True
+            prometheus_metrics.record_digest_emitted(rule.name, len(items), success=True)
+        for (_, event), pending in zip(items, holds):
+            if pending is not None:
+                pending.release(failed=id(event) in unrouted, errored=not delivered)
@@ -0,0 +1,60 @@
+"""
+Replay dead-lettered notification events onto their original topics
+
+Usage:
+    python dlq_replay.py order.created                 # replay order.created.dlq
+    python dlq_replay.py order.created --dry-run       # list what would be replayed
+    python dlq_replay.py --all --error-type TimeoutError --limit 100
+"""
+import argparse
+import json
+import logging
+
+from kafka import KafkaConsumer, KafkaProducer
+
+from config import KAFKA_BOOTSTRAP_SERVERS, TOPICS
+from retry_pipeline import replay_dlq
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay events from <topic>.dlq back onto <topic>")
+    parser.add_argument('topics', nargs='*', help="Original topics whose DLQ should be replayed")
+    parser.add_argument('--all', action='store_true', help="Replay the DLQ of every worker topic")
+    parser.add_argument('--dry-run', action='store_true', help="Only log the events that would be replayed")
+    parser.add_argument('--limit', type=int, default=None, help="Maximum events to replay per topic")
+    parser.add_argument('--error-type', default=None, help="Only replay events that failed with this exception type")
+    args = parser.parse_args()
+
+    topics = TOPICS if args.all else args.topics
+    if not topics:
+        parser.error("give at least one topic or --all")
+
+    producer = KafkaProducer(
+        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+        value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+        retries=5
+    )
+    for topic in topics:
+        consumer = KafkaConsumer(
+            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+            enable_auto_commit=False,
+            value_deserializer=lambda x: json.loads(x.decode('utf-8'))
+        )
+        try:
+            replayed = replay_dlq(consumer, producer, topic, dry_run=args.dry_run,
+                                  limit=args.limit, error_type=args.error_type)
+        finally:
+            consumer.close()
+        logger.info(f"{'Would replay' if args.dry_run else 'Replayed'} {replayed} events from {topic}.dlq")
+
+    producer.close()
+
+
+if __name__ == "__main__":
+    main()
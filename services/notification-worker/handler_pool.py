@@ -0,0 +1,111 @@
+"""
+Keyed handler pool for the notification worker
+Runs event handlers concurrently while keeping per-key ordering
+"""
+import logging
+import queue
+import threading
+import time
+
+import prometheus_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedWorkerPool:
+    """Thread pool with one FIFO lane per thread.
+
+    Every task is routed to a lane by its ordering key, so tasks sharing a key
+    (e.g. the same order_id) always run on the same thread in submit order,
+    while tasks for different keys run in parallel. The number of submitted
+    but unfinished tasks is bounded: submit() blocks once `max_in_flight`
+    tasks are pending, which pushes back on the consumer loop.
+    """
+
+    def __init__(self, concurrency=4, max_in_flight=1000):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        self.concurrency = concurrency
+        self.max_in_flight = max_in_flight
+        self._lanes = [queue.Queue() for _ in range(concurrency)]
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._next_lane = 0
+        self._threads = [
+            threading.Thread(target=self._run, args=(lane,), name=f"handler-pool-{lane}", daemon=True)
+            for lane in range(concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+        prometheus_metrics.set_handler_pool_size(concurrency, max_in_flight)
+        prometheus_metrics.set_handler_pool_in_flight(0, max_in_flight)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def lane_for(self, key):
+        """Return the lane a key is pinned to (keyless tasks round-robin)"""
+        if key is None:
+            with self._lock:
+                lane = self._next_lane
+                self._next_lane = (lane + 1) % self.concurrency
+            return lane
+        return hash(key) % self.concurrency
+
+    def submit(self, key, fn, *args):
+        """Run fn(*args) after every earlier task with the same key"""
+        self.submit_to_lane(self.lane_for(key), fn, *args)
+
+    def submit_to_lane(self, lane, fn, *args):
+        """Queue fn(*args) on a specific lane, blocking while the pool is full"""
+        self._slots.acquire()
+        with self._lock:
+            self._in_flight += 1
+            prometheus_metrics.set_handler_pool_in_flight(self._in_flight, self.max_in_flight)
+        self._lanes[lane].put((fn, args))
+
+    def join(self, timeout=None):
+        """Wait until every submitted task has finished; False on timeout"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._in_flight == 0, timeout=timeout)
+
+    def shutdown(self, wait=True, timeout=None):
+        """Stop the lane threads after draining queued tasks.
+
+        `timeout` bounds the whole wait, not each thread's; returns False if
+        a lane thread was still running when it ran out.
+        """
+        for lane in self._lanes:
+            lane.put(None)
+        if not wait:
+            return False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def _run(self, lane):
+        tasks = self._lanes[lane]
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            fn, args = task
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Handler pool task failed on lane {lane}: {e}")
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    prometheus_metrics.set_handler_pool_in_flight(self._in_flight, self.max_in_flight)
+                    if self._in_flight == 0:
+                        self._idle.notify_all()
+                self._slots.release()
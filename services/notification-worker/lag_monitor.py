@@ -0,0 +1,95 @@
+"""
+Consumer lag sampling for the notification worker
+Exports offset lag and time lag per topic and partition
+"""
+import logging
+import threading
+import time
+
+import prometheus_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LagMonitor:
+    """Samples consumer lag on a background thread.
+
+    The consumer thread calls observe() after each poll, which only stores the
+    next position and record timestamp of every partition it received records
+    for. A background thread periodically fetches the log end offsets (through
+    `end_offsets_fn`, typically the end_offsets method of a separate,
+    group-less KafkaConsumer, since consumers are not thread-safe) and
+    computes:
+
+      * offset lag: end offset - next position to consume
+      * time lag: age of the last consumed record while the partition is
+        behind, 0 once it has caught up
+    """
+
+    def __init__(self, end_offsets_fn, interval_seconds=15):
+        self.end_offsets_fn = end_offsets_fn
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def observe(self, records):
+        """Record positions from a poll() result (consumer thread, O(partitions))"""
+        with self._lock:
+            for tp, messages in records.items():
+                if messages:
+                    last = messages[-1]
+                    self._positions[tp] = (last.offset + 1, last.timestamp)
+
+    def forget(self, partitions):
+        """Stop reporting lag for partitions no longer assigned"""
+        with self._lock:
+            for tp in partitions:
+                self._positions.pop(tp, None)
+                prometheus_metrics.clear_partition_lag(tp.topic, tp.partition)
+
+    def sample(self):
+        """Fetch end offsets once and export lag; returns {tp: (records, seconds)}"""
+        with self._lock:
+            positions = dict(self._positions)
+        if not positions:
+            return {}
+
+        end_offsets = self.end_offsets_fn(list(positions))
+        now_ms = time.time() * 1000
+        lags = {}
+        topic_lag_seconds = {}
+        for tp, (position, timestamp_ms) in positions.items():
+            end = end_offsets.get(tp)
+            if end is None:
+                continue
+            lag_records = max(0, end - position)
+            lag_seconds = 0.0
+            if lag_records and timestamp_ms is not None and timestamp_ms >= 0:
+                lag_seconds = max(0.0, (now_ms - timestamp_ms) / 1000)
+            lags[tp] = (lag_records, lag_seconds)
+            prometheus_metrics.set_partition_lag(tp.topic, tp.partition, lag_records, lag_seconds)
+            topic_lag_seconds[tp.topic] = max(topic_lag_seconds.get(tp.topic, 0.0), lag_seconds)
+
+        for topic, lag_seconds in topic_lag_seconds.items():
+            prometheus_metrics.set_consumer_lag(topic, lag_seconds)
+        return lags
+
+    def start(self):
+        """Start the background sampling thread"""
+        self._thread = threading.Thread(target=self._run, name="lag-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background sampling thread"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning(f"Consumer lag sampling failed: {e}")
@@ -0,0 +1,244 @@
+"""
+Manual offset management for the notification worker
+Commits only offsets whose records (and every earlier record) have finished
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from kafka import ConsumerRebalanceListener
+from kafka.structs import OffsetAndMetadata
+
+import prometheus_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PartitionOffsets:
+    """Offsets of one partition that were handed out but not yet committed"""
+
+    __slots__ = ('epoch', 'pending', 'completed', 'failed', 'watermark', 'sent')
+
+    def __init__(self, epoch):
+        self.epoch = epoch
+        self.pending = deque()   # tracked offsets, in consumption order
+        self.completed = set()   # finished offsets still behind an unfinished one
+        self.failed = set()      # offsets that must be redelivered; the watermark stops there
+        self.watermark = None    # next offset to commit (last contiguous done + 1)
+        self.sent = None         # watermark of the last commit sent to Kafka
+
+
+class OffsetTracker:
+    """Per-partition watermark of contiguous completed offsets.
+
+    Records can finish out of order (handler pool, retries), so a partition's
+    commit offset only advances past a record once it and every record before
+    it has completed. That gives at-least-once delivery: after a crash the
+    group resumes at the first unfinished record.
+
+    Every assignment of a partition gets a new epoch. Work tracked under an
+    older epoch belongs to a revoked assignment and is dropped instead of
+    being processed or committed.
+
+    A record marked failed is no longer in flight, but the watermark never
+    passes it, so it is redelivered once the consumer restarts.
+    """
+
+    def __init__(self, commit_interval_ms=1000):
+        self.commit_interval = commit_interval_ms / 1000
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._partitions = {}
+        self._in_flight = 0
+        self._epoch = 0
+        self._last_commit = 0.0
+
+    def assign(self, partitions):
+        """Start tracking newly assigned partitions under a fresh epoch"""
+        with self._lock:
+            self._epoch += 1
+            for tp in partitions:
+                self._partitions[tp] = PartitionOffsets(self._epoch)
+
+    def revoke(self, partitions):
+        """Forget revoked partitions; their in-flight work becomes stale"""
+        dropped = 0
+        with self._lock:
+            for tp in partitions:
+                state = self._partitions.pop(tp, None)
+                if state is not None:
+                    dropped += len(state.pending) - len(state.completed) - len(state.failed)
+                prometheus_metrics.clear_commit_watermark(tp.topic, tp.partition)
+            self._in_flight -= dropped
+            if self._in_flight == 0:
+                self._drained.notify_all()
+        return dropped
+
+    def partitions(self):
+        """Partitions currently tracked"""
+        with self._lock:
+            return list(self._partitions)
+
+    def track(self, tp, offset):
+        """Register a record as in flight; returns the epoch to pass back later"""
+        with self._lock:
+            state = self._partitions.get(tp)
+            if state is None:
+                # Partition seen before any rebalance callback (manual assign)
+                self._epoch += 1
+                state = self._partitions[tp] = PartitionOffsets(self._epoch)
+            state.pending.append(offset)
+            self._in_flight += 1
+            return state.epoch
+
+    def is_current(self, tp, epoch):
+        """True while the partition is still assigned under the given epoch"""
+        state = self._partitions.get(tp)
+        return state is not None and state.epoch == epoch
+
+    def complete(self, tp, offset, epoch):
+        """Mark a record finished and advance the partition watermark"""
+        self.complete_many([(tp, offset, epoch)])
+
+    def complete_many(self, items):
+        """Mark several (tp, offset, epoch) records finished under one lock"""
+        with self._lock:
+            for tp, offset, epoch in items:
+                state = self._partitions.get(tp)
+                if state is None or state.epoch != epoch:
+                    continue
+                state.completed.add(offset)
+                self._in_flight -= 1
+                pending = state.pending
+                while pending and pending[0] in state.completed:
+                    done = pending.popleft()
+                    state.completed.discard(done)
+                    state.watermark = done + 1
+            if self._in_flight == 0:
+                self._drained.notify_all()
+
+    def fail(self, tp, offset, epoch):
+        """Mark a record finished without letting the watermark pass it"""
+        with self._lock:
+            state = self._partitions.get(tp)
+            if state is None or state.epoch != epoch:
+                return
+            state.failed.add(offset)
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._drained.notify_all()
+
+    def in_flight(self):
+        """Number of tracked records not yet completed or failed"""
+        with self._lock:
+            return self._in_flight
+
+    def wait_drained(self, timeout=None):
+        """Block until every tracked record has completed; False on timeout"""
+        with self._drained:
+            return self._drained.wait_for(lambda: self._in_flight == 0, timeout=timeout)
+
+    def pending_commits(self, partitions=None):
+        """Offsets whose watermark moved since the last commit was sent"""
+        with self._lock:
+            return {
+                tp: OffsetAndMetadata(state.watermark, '')
+                for tp, state in self._partitions.items()
+                if (partitions is None or tp in partitions)
+                and state.watermark is not None
+                and state.watermark != state.sent
+            }
+
+    def maybe_commit(self, consumer, force=False):
+        """Send an async commit if the commit interval elapsed.
+
+        Must be called from the consumer thread (KafkaConsumer is not
+        thread-safe); the commit callback also runs there, during poll().
+        """
+        now = time.monotonic()
+        if not force and now - self._last_commit < self.commit_interval:
+            return
+        self._last_commit = now
+
+        offsets = self.pending_commits()
+        if not offsets:
+            return
+        self._mark_sent(offsets)
+        consumer.commit_async(offsets=offsets, callback=self._on_commit)
+
+    def commit_sync(self, consumer, partitions=None):
+        """Synchronously commit finished offsets (rebalance and shutdown)"""
+        offsets = self.pending_commits(partitions)
+        if not offsets:
+            return
+        try:
+            consumer.commit(offsets=offsets)
+        except Exception as e:
+            logger.error(f"Failed to commit offsets: {e}")
+            prometheus_metrics.record_offset_commit(False)
+            return
+        self._mark_sent(offsets)
+        self._record_committed(offsets)
+
+    def _mark_sent(self, offsets):
+        with self._lock:
+            for tp, meta in offsets.items():
+                state = self._partitions.get(tp)
+                if state is not None:
+                    state.sent = meta.offset
+
+    def _on_commit(self, offsets, response):
+        if isinstance(response, Exception):
+            logger.warning(f"Async offset commit failed, will retry: {response}")
+            prometheus_metrics.record_offset_commit(False)
+            # Let the next maybe_commit() resend these partitions
+            with self._lock:
+                for tp, meta in offsets.items():
+                    state = self._partitions.get(tp)
+                    if state is not None and state.sent == meta.offset:
+                        state.sent = None
+            return
+        self._record_committed(offsets)
+
+    def _record_committed(self, offsets):
+        prometheus_metrics.record_offset_commit(True)
+        for tp, meta in offsets.items():
+            prometheus_metrics.set_commit_watermark(tp.topic, tp.partition, meta.offset)
+
+
+class CommitOnRebalanceListener(ConsumerRebalanceListener):
+    """Flush finished offsets before partitions move to another consumer"""
+
+    def __init__(self, consumer, tracker, lag_monitor=None, retries=None, name='consumer-0',
+                 started_at=None):
+        self.consumer = consumer
+        self.tracker = tracker
+        self.lag_monitor = lag_monitor
+        self.retries = retries
+        self.name = name
+        self.started_at = started_at  # time.monotonic() at process start
+
+    def on_partitions_revoked(self, revoked):
+        revoked = set(revoked)
+        if not revoked:
+            return
+        self.tracker.commit_sync(self.consumer, revoked)
+        dropped = self.tracker.revoke(revoked)
+        if self.lag_monitor:
+            self.lag_monitor.forget(revoked)
+        if self.retries:
+            self.retries.forget(revoked)
+        prometheus_metrics.clear_partition_assignment(self.name, revoked)
+        logger.info(f"[{self.name}] Partitions revoked: {sorted(revoked)} "
+                    f"({dropped} in-flight records dropped)")
+        if dropped:
+            prometheus_metrics.record_revoked_records_dropped(dropped)
+
+    def on_partitions_assigned(self, assigned):
+        self.tracker.assign(assigned)
+        prometheus_metrics.set_partition_assignment(self.name, assigned)
+        if self.started_at is not None and assigned:
+            prometheus_metrics.set_startup_to_first_assignment(time.monotonic() - self.started_at)
+            self.started_at = None
+        logger.info(f"[{self.name}] Partitions assigned: {sorted(assigned)}")
@@ -53,6 +53,22 @@ message_processing_duration_seconds = Histogram(
     registry=registry
 )
 
+batch_size = Histogram(
+    'notification_batch_size',
+    'Number of records in each consumed micro-batch',
+    labelnames=['topic'],
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 5000),
+    registry=registry
+)
+
+batch_processing_duration_seconds = Histogram(
+    'notification_batch_processing_duration_seconds',
+    'Micro-batch processing duration',
+    labelnames=['topic'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+    registry=registry
+)
+
 kafka_consumer_lag_seconds = Gauge(
     'notification_kafka_consumer_lag_seconds',
     'Kafka consumer lag in seconds',
@@ -60,6 +76,107 @@ kafka_consumer_lag_seconds = Gauge(
     registry=registry
 )
 
+offset_commits_total = Counter(
+    'notification_offset_commits_total',
+    'Total offset commits sent to Kafka',
+    labelnames=['status'],
+    registry=registry
+)
+
+offset_commit_watermark = Gauge(
+    'notification_offset_commit_watermark',
+    'Last committed offset (contiguous completed records) per partition',
+    labelnames=['topic', 'partition'],
+    registry=registry
+)
+
+revoked_records_dropped_total = Counter(
+    'notification_revoked_records_dropped_total',
+    'Uncommitted records dropped on partition revocation (redelivered to the new owner)',
+    registry=registry
+)
+
+# Retry / Dead-letter Metrics
+retry_scheduled_total = Counter(
+    'notification_retry_scheduled_total',
+    'Failed events republished to a retry tier',
+    labelnames=['topic', 'tier'],
+    registry=registry
+)
+
+retry_attempts_total = Counter(
+    'notification_retry_attempts_total',
+    'Events processed from a retry tier',
+    labelnames=['topic', 'tier', 'status'],
+    registry=registry
+)
+
+dead_lettered_total = Counter(
+    'notification_dead_lettered_total',
+    'Events sent to the dead-letter topic after exhausting all retry tiers',
+    labelnames=['topic', 'error_type'],
+    registry=registry
+)
+
+retry_route_errors_total = Counter(
+    'notification_retry_route_errors_total',
+    'Failed events that could not be published to a retry tier or DLQ',
+    labelnames=['topic'],
+    registry=registry
+)
+
+dlq_replayed_total = Counter(
+    'notification_dlq_replayed_total',
+    'Dead-lettered events replayed onto their original topic',
+    labelnames=['topic'],
+    registry=registry
+)
+
+retry_partitions_paused = Gauge(
+    'notification_retry_partitions_paused',
+    'Retry partitions paused until their next record is due',
+    registry=registry
+)
+
+# Handler Pool Metrics
+handler_pool_concurrency = Gauge(
+    'notification_handler_pool_concurrency',
+    'Number of handler pool worker threads',
+    registry=registry
+)
+
+handler_pool_max_in_flight = Gauge(
+    'notification_handler_pool_max_in_flight',
+    'Maximum number of in-flight handler tasks',
+    registry=registry
+)
+
+handler_pool_in_flight = Gauge(
+    'notification_handler_pool_in_flight',
+    'Handler tasks submitted but not yet finished',
+    registry=registry
+)
+
+handler_pool_saturation_ratio = Gauge(
+    'notification_handler_pool_saturation_ratio',
+    'In-flight handler tasks as a fraction of the in-flight limit (1 = full)',
+    registry=registry
+)
+
+kafka_consumer_lag_records = Gauge(
+    'notification_kafka_consumer_lag_records',
+    'Kafka consumer offset lag (log end offset - position) per partition',
+    labelnames=['topic', 'partition'],
+    registry=registry
+)
+
+kafka_consumer_partition_lag_seconds = Gauge(
+    'notification_kafka_consumer_partition_lag_seconds',
+    'Kafka consumer time lag per partition (age of last consumed record while behind)',
+    labelnames=['topic', 'partition'],
+    registry=registry
+)
+
 # Event Processing Metrics
 order_events_processed_total = Counter(
     'notification_order_events_processed_total',
@@ -135,6 +252,97 @@ slack_api_latency_seconds = Histogram(
     registry=registry
 )
 
+# Startup Metrics
+startup_to_first_message_seconds = Gauge(
+    'notification_startup_to_first_message_seconds',
+    'Seconds from process start to the first consumed record',
+    registry=registry
+)
+
+startup_to_first_assignment_seconds = Gauge(
+    'notification_startup_to_first_assignment_seconds',
+    'Seconds from process start to the first partition assignment',
+    registry=registry
+)
+
+# Partition Assignment Metrics
+consumer_threads = Gauge(
+    'notification_consumer_threads',
+    'Kafka consumer threads running in this worker',
+    registry=registry
+)
+
+consumer_assigned_partitions = Gauge(
+    'notification_consumer_assigned_partitions',
+    'Partitions assigned to a consumer thread',
+    labelnames=['consumer', 'topic'],
+    registry=registry
+)
+
+consumer_partition_assigned = Gauge(
+    'notification_consumer_partition_assigned',
+    'Partition currently assigned to a consumer thread (1 = assigned)',
+    labelnames=['consumer', 'topic', 'partition'],
+    registry=registry
+)
+
+topic_partitions = Gauge(
+    'notification_topic_partitions',
+    'Partitions of each subscribed topic (max useful consumers in the group)',
+    labelnames=['topic'],
+    registry=registry
+)
+
+# Deduplication Metrics
+dedup_events_total = Counter(
+    'notification_dedup_events_total',
+    'Events checked against the dedup store',
+    labelnames=['topic', 'result'],
+    registry=registry
+)
+
+dedup_store_entries = Gauge(
+    'notification_dedup_store_entries',
+    'Event ids held by the in-memory dedup store',
+    registry=registry
+)
+
+dedup_remote_errors_total = Counter(
+    'notification_dedup_remote_errors_total',
+    'Failed calls to the shared (Redis) dedup store',
+    registry=registry
+)
+
+# Digest Metrics
+digest_events_total = Counter(
+    'notification_digest_events_total',
+    'Events added to digest windows',
+    labelnames=['rule'],
+    registry=registry
+)
+
+digests_emitted_total = Counter(
+    'notification_digests_emitted_total',
+    'Digest notifications emitted',
+    labelnames=['rule', 'status'],
+    registry=registry
+)
+
+digest_size = Histogram(
+    'notification_digest_size',
+    'Number of events coalesced into one digest',
+    labelnames=['rule'],
+    buckets=(1, 2, 5, 10, 50, 100, 500, 1000),
+    registry=registry
+)
+
+digest_open_windows = Gauge(
+    'notification_digest_open_windows',
+    'Digest windows currently collecting events',
+    labelnames=['rule'],
+    registry=registry
+)
+
 # Helper Functions
 def record_message_consumed(topic, latency_ms, success=True):
     """Record consumed message from Kafka"""
@@ -152,6 +360,23 @@ def record_message_failed(topic, error_type):
     messages_failed_total.labels(topic=topic, error_type=error_type).inc()
     processing_errors_total.labels(error_type=error_type).inc()
 
+def record_batch_processed(topic, size, duration, errors=None):
+    """Record a processed micro-batch with one update per metric.
+
+    `errors` maps error type to the number of records that failed with it.
+    """
+    errors = errors or {}
+    failed = sum(errors.values())
+    messages_consumed_total.labels(topic=topic).inc(size)
+    if size > failed:
+        messages_processed_total.labels(topic=topic, event_type=topic).inc(size - failed)
+        # Per-record processing time, averaged over the batch
+        message_processing_duration_seconds.labels(topic=topic, event_type=topic).observe(duration / size)
+    for error_type, count in errors.items():
+        messages_failed_total.labels(topic=topic, error_type=error_type).inc(count)
+    batch_size.labels(topic=topic).observe(size)
+    batch_processing_duration_seconds.labels(topic=topic).observe(duration)
+
 def record_order_event():
     """Record order event processed"""
     order_events_processed_total.inc()
@@ -182,13 +407,13 @@ def record_handler_error():
     handler_errors_total.inc()
     processing_errors_total.labels(error_type='handler').inc()
 
-def record_notification_sent(channel, success=True, latency=0):
-    """Record sent notification"""
+def record_notification_sent(channel, success=True, latency=0, reason='send_failed', count=1):
+    """Record sent notification (`count` notifications delivered by one API call)"""
     status = 'success' if success else 'failed'
-    notifications_sent_total.labels(channel=channel, status=status).inc()
+    notifications_sent_total.labels(channel=channel, status=status).inc(count)
     
     if not success:
-        notifications_failed_total.labels(channel=channel, reason='send_failed').inc()
+        notifications_failed_total.labels(channel=channel, reason=reason).inc(count)
     
     if latency > 0 and channel == 'slack':
         slack_api_latency_seconds.observe(latency / 1000)
@@ -205,6 +430,137 @@ def record_worker_restart():
     """Record worker restart"""
     worker_restarts_total.inc()
 
+def record_offset_commit(success=True):
+    """Record an offset commit"""
+    offset_commits_total.labels(status='success' if success else 'failed').inc()
+
+def set_commit_watermark(topic, partition, offset):
+    """Set committed offset watermark for a partition"""
+    offset_commit_watermark.labels(topic=topic, partition=str(partition)).set(offset)
+
+def clear_commit_watermark(topic, partition):
+    """Drop the watermark series of a partition that is no longer assigned"""
+    try:
+        offset_commit_watermark.remove(topic, str(partition))
+    except KeyError:
+        pass
+
+def record_revoked_records_dropped(count):
+    """Record records dropped because their partition was revoked"""
+    revoked_records_dropped_total.inc(count)
+
+def record_retry_scheduled(topic, tier):
+    """Record an event scheduled for retry"""
+    retry_scheduled_total.labels(topic=topic, tier=tier).inc()
+
+def record_retry_attempts(topic, tier, status, count=1):
+    """Record events processed from a retry tier"""
+    retry_attempts_total.labels(topic=topic, tier=tier, status=status).inc(count)
+
+def record_dead_lettered(topic, error_type):
+    """Record an event sent to the dead-letter topic"""
+    dead_lettered_total.labels(topic=topic, error_type=error_type).inc()
+
+def record_retry_route_error(topic):
+    """Record a failure to publish to a retry tier or DLQ"""
+    retry_route_errors_total.labels(topic=topic).inc()
+
+def record_dlq_replayed(topic):
+    """Record a replayed dead-lettered event"""
+    dlq_replayed_total.labels(topic=topic).inc()
+
+def set_retry_partitions_paused(count):
+    """Set number of paused retry partitions"""
+    retry_partitions_paused.set(count)
+
+def set_handler_pool_size(concurrency, max_in_flight):
+    """Set handler pool configuration"""
+    handler_pool_concurrency.set(concurrency)
+    handler_pool_max_in_flight.set(max_in_flight)
+
+def set_handler_pool_in_flight(in_flight, max_in_flight):
+    """Set handler pool in-flight count and saturation"""
+    handler_pool_in_flight.set(in_flight)
+    handler_pool_saturation_ratio.set(in_flight / max_in_flight if max_in_flight else 0)
+
 def set_consumer_lag(topic, lag_seconds):
     """Set Kafka consumer lag"""
     kafka_consumer_lag_seconds.labels(topic=topic).set(lag_seconds)
+
+def set_partition_lag(topic, partition, lag_records, lag_seconds):
+    """Set Kafka consumer offset and time lag for a partition"""
+    kafka_consumer_lag_records.labels(topic=topic, partition=str(partition)).set(lag_records)
+    kafka_consumer_partition_lag_seconds.labels(topic=topic, partition=str(partition)).set(lag_seconds)
+
+def clear_partition_lag(topic, partition):
+    """Drop the lag series of a partition that is no longer assigned"""
+    for gauge in (kafka_consumer_lag_records, kafka_consumer_partition_lag_seconds):
+        try:
+            gauge.remove(topic, str(partition))
+        except KeyError:
+            pass
+
+def record_dedup_check(topic, unique, duplicates):
+    """Record unique and duplicate events seen by the dedup store"""
+    if unique:
+        dedup_events_total.labels(topic=topic, result='unique').inc(unique)
+    if duplicates:
+        dedup_events_total.labels(topic=topic, result='duplicate').inc(duplicates)
+
+def set_dedup_store_entries(count):
+    """Set number of event ids held in memory"""
+    dedup_store_entries.set(count)
+
+def record_dedup_remote_error():
+    """Record failed shared dedup store call"""
+    dedup_remote_errors_total.inc()
+
+def record_digest_event(rule):
+    """Record event added to a digest window"""
+    digest_events_total.labels(rule=rule).inc()
+
+def record_digest_emitted(rule, size, success=True):
+    """Record digest emitted for `size` coalesced events"""
+    status = 'success' if success else 'failed'
+    digests_emitted_total.labels(rule=rule, status=status).inc()
+    digest_size.labels(rule=rule).observe(size)
+
+def set_digest_open_windows(rule, count):
+    """Set number of open digest windows"""
+    digest_open_windows.labels(rule=rule).set(count)
+
+def set_consumer_threads(count):
+    """Set number of consumer threads"""
+    consumer_threads.set(count)
+
+def set_partition_assignment(consumer, partitions):
+    """Export the partitions newly assigned to a consumer thread"""
+    counts = {}
+    for tp in partitions:
+        consumer_partition_assigned.labels(
+            consumer=consumer, topic=tp.topic, partition=str(tp.partition)
+        ).set(1)
+        counts[tp.topic] = counts.get(tp.topic, 0) + 1
+    for topic, count in counts.items():
+        consumer_assigned_partitions.labels(consumer=consumer, topic=topic).set(count)
+
+def clear_partition_assignment(consumer, partitions):
+    """Drop the series of partitions revoked from a consumer thread"""
+    for tp in partitions:
+        try:
+            consumer_partition_assigned.remove(consumer, tp.topic, str(tp.partition))
+        except KeyError:
+            pass
+        consumer_assigned_partitions.labels(consumer=consumer, topic=tp.topic).set(0)
+
+def set_topic_partitions(topic, count):
+    """Set partition count of a subscribed topic"""
+    topic_partitions.labels(topic=topic).set(count)
+
+def set_startup_to_first_message(seconds):
+    """Set time from process start to the first consumed record"""
+    startup_to_first_message_seconds.set(seconds)
+
+def set_startup_to_first_assignment(seconds):
+    """Set time from process start to the first partition assignment"""
+    startup_to_first_assignment_seconds.set(seconds)
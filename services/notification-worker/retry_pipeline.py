@@ -0,0 +1,324 @@
+"""
+Retry-with-backoff and dead-letter pipeline for the notification worker
+
+A failed event is republished to the next retry tier topic
+(`<topic>.retry.<tier>`, e.g. `order.created.retry.5s`) and, once every tier
+is exhausted, to the dead-letter topic `<topic>.dlq`. Retry topics are
+consumed by the same worker; records are held back until their tier delay
+has elapsed by pausing the retry partition, so the main topics never block.
+If a failed event cannot be published anywhere, its offset must not be
+committed: the pipeline keeps the error and the consumers stop on it.
+"""
+import logging
+import re
+import threading
+import time
+from datetime import datetime
+
+from kafka.structs import TopicPartition
+
+import prometheus_metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_FIELD = '_retry'
+DLQ_SUFFIX = '.dlq'
+
+_RETRY_TOPIC = re.compile(r'^(?P<topic>.+)\.retry\.(?P<tier>[^.]+)$')
+_DURATION = re.compile(r'^(?P<value>\d+(?:\.\d+)?)(?P<unit>ms|s|m|h)$')
+_UNIT_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_tiers(spec):
+    """Parse "5s,1m,10m" into [('5s', 5.0), ('1m', 60.0), ('10m', 600.0)]"""
+    tiers = []
+    for name in (part.strip() for part in spec.split(',')):
+        if not name:
+            continue
+        match = _DURATION.match(name)
+        if not match:
+            raise ValueError(f"Invalid retry tier '{name}' (expected e.g. 500ms, 5s, 1m, 1h)")
+        tiers.append((name, float(match.group('value')) * _UNIT_SECONDS[match.group('unit')]))
+    return tiers
+
+
+def source_topic(topic):
+    """Original topic of a retry topic (other topics are returned unchanged)"""
+    match = _RETRY_TOPIC.match(topic)
+    return match.group('topic') if match else topic
+
+
+def retry_tier(topic):
+    """Tier name of a retry topic, or None for a main topic"""
+    match = _RETRY_TOPIC.match(topic)
+    return match.group('tier') if match else None
+
+
+class RetryRouteError(RuntimeError):
+    """A failed event could not be published to its retry tier or DLQ"""
+
+
+def retry_topic(topic, tier):
+    return f"{topic}.retry.{tier}"
+
+
+def dlq_topic(topic):
+    return f"{topic}{DLQ_SUFFIX}"
+
+
+class RetryPipeline:
+    """Routes failed events through tiered retry topics to a DLQ.
+
+    One pipeline can be shared by several consumer threads; paused retry
+    partitions are tracked per consumer. Failed events are sent
+    asynchronously and up to `send_attempts` times, all within
+    `send_timeout` seconds per call, so the poll thread never blocks for
+    long. Once an event could not be routed at all, `error` is set, later
+    failures are not sent any more and check() raises it on every consumer
+    thread.
+    """
+
+    def __init__(self, producer, tiers, send_timeout=10, send_attempts=3, backoff_seconds=0.5):
+        self.producer = producer
+        self.tiers = tiers
+        self.delays = dict(tiers)
+        self.send_timeout = send_timeout
+        self.send_attempts = send_attempts
+        self.backoff_seconds = backoff_seconds
+        self.error = None
+        self._lock = threading.Lock()
+        self._paused = {}  # consumer -> {retry TopicPartition: monotonic time to resume at}
+
+    def topics(self, topics):
+        """Retry topics to subscribe to alongside the main topics"""
+        return [retry_topic(topic, name) for topic in topics for name, _ in self.tiers]
+
+    def handle_failures(self, topic, failures):
+        """Republish (event, error) failures of `topic` to their next tier or the DLQ.
+
+        Returns the failures that could not be published; their offsets must
+        not be committed.
+        """
+        if not failures:
+            return []
+        if self.error is not None:
+            # Already stopping: don't hold up the poll thread on a broken producer
+            return list(failures)
+        unrouted = self._send(topic, failures)
+        if unrouted and self.error is None:
+            self.error = RetryRouteError(f"{len(unrouted)} failed {topic} events could not be "
+                                         f"sent to a retry tier or the DLQ")
+        return unrouted
+
+    def check(self):
+        """Raise the routing error that stopped the pipeline, if any"""
+        if self.error is not None:
+            raise self.error
+
+    def route_failure(self, topic, event, error):
+        """Send one failed event to its next retry tier, or the DLQ when exhausted.
+
+        Returns the target topic, or None if every send attempt failed.
+        """
+        if self._send(topic, [(event, error)]):
+            return None
+        return self._route(topic, event, error)[0]
+
+    def _route(self, topic, event, error):
+        """(target topic, tier or None for the DLQ, payload) of a failed event"""
+        meta = event.get(RETRY_FIELD, {}) if isinstance(event, dict) else {}
+        attempt = meta.get('attempt', 0)
+
+        if attempt < len(self.tiers):
+            tier = self.tiers[attempt][0]
+            target = retry_topic(topic, tier)
+        else:
+            tier = None
+            target = dlq_topic(topic)
+
+        payload = dict(event) if isinstance(event, dict) else {'value': event}
+        payload[RETRY_FIELD] = {
+            'topic': topic,
+            'attempt': attempt + 1,
+            'error': f"{type(error).__name__}: {error}",
+            'first_failed_at': meta.get('first_failed_at', datetime.utcnow().isoformat()),
+            'last_failed_at': datetime.utcnow().isoformat(),
+        }
+        return target, tier, payload
+
+    def _send(self, topic, failures):
+        """Publish failures, retrying unsent ones until the attempts or send_timeout run out.
+
+        Every send of an attempt is issued before any is waited on. Returns
+        the failures that were not published.
+        """
+        deadline = time.monotonic() + self.send_timeout
+        routes = [self._route(topic, event, error) for event, error in failures]
+        unsent = list(range(len(failures)))
+        for send_attempt in range(1, self.send_attempts + 1):
+            futures = []
+            for index in unsent:
+                target, _, payload = routes[index]
+                try:
+                    futures.append((index, self.producer.send(target, value=payload)))
+                except Exception as e:
+                    futures.append((index, e))
+            unsent, last_error = [], None
+            for index, future in futures:
+                if not isinstance(future, Exception):
+                    try:
+                        future.get(timeout=max(0, deadline - time.monotonic()))
+                        continue
+                    except Exception as e:
+                        future = e
+                unsent.append(index)
+                last_error = future
+                prometheus_metrics.record_retry_route_error(topic)
+            if not unsent:
+                break
+            logger.error(f"Failed to route {len(unsent)} failed {topic} events "
+                         f"(attempt {send_attempt}/{self.send_attempts}): {last_error}")
+            remaining = deadline - time.monotonic()
+            if send_attempt == self.send_attempts or remaining <= 0:
+                break
+            time.sleep(min(self.backoff_seconds * 2 ** (send_attempt - 1), remaining))
+
+        failed = set(unsent)
+        for index, ((_, error), (target, tier, payload)) in enumerate(zip(failures, routes)):
+            if index in failed:
+                continue
+            if tier is None:
+                logger.warning(f"Event from {topic} dead-lettered to {target} after "
+                               f"{payload[RETRY_FIELD]['attempt'] - 1} retries: {error}")
+                prometheus_metrics.record_dead_lettered(topic, type(error).__name__)
+            else:
+                logger.info(f"Event from {topic} scheduled for retry in tier {tier}: {error}")
+                prometheus_metrics.record_retry_scheduled(topic, tier)
+        return [failures[index] for index in unsent]
+
+    def record_outcome(self, topic, tier, total, failed):
+        """Record how a batch consumed from a retry tier went"""
+        if total > failed:
+            prometheus_metrics.record_retry_attempts(topic, tier, 'success', total - failed)
+        if failed:
+            prometheus_metrics.record_retry_attempts(topic, tier, 'failed', failed)
+
+    def hold_back(self, consumer, records):
+        """Drop retry records that are not due yet from a poll() result.
+
+        Each retry tier has a fixed delay, so records in a retry partition are
+        due in offset order. The partition is rewound to its first record that
+        is not due and paused until it is; the rest of the poll goes ahead.
+        Must be called on the consumer thread.
+        """
+        now_ms = time.time() * 1000
+        ready = {}
+        held = {}
+        for tp, messages in records.items():
+            delay = self.delays.get(retry_tier(tp.topic))
+            if delay is None:
+                ready[tp] = messages
+                continue
+
+            for index, message in enumerate(messages):
+                due_ms = message.timestamp + delay * 1000
+                if due_ms > now_ms:
+                    consumer.seek(tp, message.offset)
+                    consumer.pause(tp)
+                    held[tp] = time.monotonic() + (due_ms - now_ms) / 1000
+                    messages = messages[:index]
+                    break
+            if messages:
+                ready[tp] = messages
+
+        if held:
+            with self._lock:
+                self._paused.setdefault(consumer, {}).update(held)
+                self._export_paused()
+        return ready
+
+    def resume_due(self, consumer):
+        """Resume retry partitions whose held-back record is now due"""
+        paused = self._paused.get(consumer)
+        if not paused:
+            return
+        now = time.monotonic()
+        with self._lock:
+            due = [tp for tp, resume_at in paused.items() if resume_at <= now]
+            for tp in due:
+                del paused[tp]
+            self._export_paused()
+        if due:
+            consumer.resume(*due)
+
+    def forget(self, partitions):
+        """Drop pause bookkeeping for revoked partitions"""
+        with self._lock:
+            for paused in self._paused.values():
+                for tp in partitions:
+                    paused.pop(tp, None)
+            self._export_paused()
+
+    def _export_paused(self):
+        # Called with the lock held
+        prometheus_metrics.set_retry_partitions_paused(
+            sum(len(paused) for paused in self._paused.values())
+        )
+
+
+def replay_dlq(consumer, producer, topic, dry_run=False, limit=None, error_type=None, max_idle_polls=10):
+    """Republish dead-lettered events of `topic` back onto `topic`.
+
+    Reads `<topic>.dlq` from the beginning up to its current end with a
+    group-less consumer, strips the retry metadata and sends each event to
+    its original topic. A partition is done once its position reaches the
+    end offset, even if the records before it were compacted away; after
+    `max_idle_polls` empty polls in a row the replay stops short. Returns
+    the number of events replayed.
+    """
+    dlq = dlq_topic(topic)
+    partitions = [TopicPartition(dlq, p) for p in (consumer.partitions_for_topic(dlq) or [])]
+    if not partitions:
+        logger.info(f"No dead-letter topic {dlq}")
+        return 0
+
+    consumer.assign(partitions)
+    consumer.seek_to_beginning(*partitions)
+    end_offsets = consumer.end_offsets(partitions)
+    remaining = {tp for tp in partitions if end_offsets[tp] > consumer.position(tp)}
+
+    replayed = 0
+    idle_polls = 0
+    while remaining and (limit is None or replayed < limit):
+        records = consumer.poll(timeout_ms=1000)
+        idle_polls = 0 if records else idle_polls + 1
+        if idle_polls >= max_idle_polls:
+            logger.warning(f"Stopped replaying {dlq} after {idle_polls} empty polls, short of the end "
+                           f"of partitions {sorted(tp.partition for tp in remaining)}")
+            break
+        for tp, messages in records.items():
+            for message in messages:
+                if message.offset >= end_offsets[tp] - 1:
+                    remaining.discard(tp)
+                if message.offset >= end_offsets[tp]:
+                    break
+                if limit is not None and replayed >= limit:
+                    break
+
+                event = dict(message.value)
+                meta = event.pop(RETRY_FIELD, {})
+                if error_type and not meta.get('error', '').startswith(f"{error_type}:"):
+                    continue
+
+                target = meta.get('topic', topic)
+                if dry_run:
+                    logger.info(f"[dry-run] would replay {dlq}@{tp.partition}:{message.offset} to {target}: {meta.get('error')}")
+                else:
+                    producer.send(target, value=event)
+                    prometheus_metrics.record_dlq_replayed(target)
+                replayed += 1
+        remaining = {tp for tp in remaining if consumer.position(tp) < end_offsets[tp]}
+
+    if not dry_run:
+        producer.flush()
+    return replayed
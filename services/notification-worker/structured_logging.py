@@ -0,0 +1,142 @@
+"""
+Logging setup for the notification worker
+Compact JSON lines, an asynchronous queue sink and per-event sampling
+"""
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one compact JSON object per line.
+
+    Fields passed with `extra=` are added to the object, so a single call like
+    logger.info("processed", extra={'topic': t, 'duration_ms': d}) produces
+    one self-describing line.
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread.
+
+    The stock QueueHandler formats the message in the logging thread so the
+    record can be pickled; records here never leave the process, so the
+    calling thread only pays for creating the record and enqueueing it.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class LazyJson:
+    """Defers json.dumps() of a value until a handler actually formats it"""
+
+    __slots__ = ('value', 'indent')
+
+    def __init__(self, value, indent=None):
+        self.value = value
+        self.indent = indent
+
+    def __str__(self):
+        return json.dumps(self.value, indent=self.indent, default=str)
+
+
+class NullLogger:
+    """Stands in for a logger when an event's verbose output is not sampled"""
+
+    def debug(self, *args, **kwargs):
+        pass
+
+    info = warning = debug
+
+
+NULL_LOGGER = NullLogger()
+
+
+class EventSampler:
+    """Decides which events get their verbose per-event logs.
+
+    sample() keeps every Nth event (N = 1 / rate), which is cheaper than a
+    random draw and spreads the kept events evenly. The decision is stored in
+    a thread-local flag, so logger() hands the handler processing the event
+    (on the consumer thread or a handler pool thread) either the real logger
+    or NULL_LOGGER. Skipped lines never even create a LogRecord.
+    """
+
+    def __init__(self, rate=1.0):
+        self.set_rate(rate)
+        self._counter = itertools.count()
+        self._local = threading.local()
+
+    def set_rate(self, rate):
+        self.rate = max(0.0, min(1.0, rate))
+        self.every = round(1 / self.rate) if self.rate > 0 else 0
+
+    def sample(self):
+        """Pick whether the event being processed on this thread is verbose"""
+        if self.every == 1:
+            verbose = True
+        elif self.every == 0:
+            verbose = False
+        else:
+            verbose = next(self._counter) % self.every == 0
+        self._local.verbose = verbose
+        return verbose
+
+    @property
+    def verbose(self):
+        return getattr(self._local, 'verbose', True)
+
+    def logger(self, logger):
+        """The logger to use for the current event's verbose lines"""
+        return logger if self.verbose else NULL_LOGGER
+
+
+def configure_logging(log_format='text', use_queue=True, level=logging.INFO, stream=None):
+    """Replace the root handlers with a text or JSON sink.
+
+    With use_queue, log calls only enqueue the record and a QueueListener
+    thread formats and writes it. Returns the listener (or None); call
+    listener.stop() on shutdown to flush queued records.
+    """
+    sink = logging.StreamHandler(stream or sys.stderr)
+    sink.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    if not use_queue:
+        root.addHandler(sink)
+        return None
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(DeferredQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, sink, respect_handler_level=True)
+    listener.start()
+    return listener
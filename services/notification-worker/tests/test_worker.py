@@ -2,9 +2,46 @@
 Comprehensive unit tests for Notification Worker
 Tests metrics, event processing, and worker functionality
 """
+import io
+import json
 import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
+import pytest
+from aiosmtpd.controller import Controller
+from kafka.structs import TopicPartition
+
+import worker
+from handler_pool import KeyedWorkerPool
+from offset_tracker import OffsetTracker, CommitOnRebalanceListener
+from lag_monitor import LagMonitor
+from retry_pipeline import RetryPipeline, RetryRouteError, parse_tiers, replay_dlq, source_topic
+from dedup_store import DedupStore, LruIdCache, RedisIdStore, RotatingBloomFilter
+from digest import Coalescer, DigestRule
+from delivery import ConnectionPool, DeliveryEngine, SlackChannel, SmtpChannel, WebhookChannel
+from structured_logging import NULL_LOGGER, EventSampler, JsonFormatter, LazyJson, configure_logging
 from prometheus_metrics import (
+    handler_pool_saturation_ratio,
+    kafka_consumer_lag_records,
+    kafka_consumer_lag_seconds,
+    dead_lettered_total,
+    dedup_events_total,
+    digests_emitted_total,
+    consumer_assigned_partitions,
+    consumer_partition_assigned,
+    retry_attempts_total,
+    messages_consumed_total,
+    messages_failed_total,
+    notifications_failed_total,
+    notifications_sent_total,
     worker_running,
     worker_uptime_seconds,
     record_worker_restart,
@@ -17,8 +54,39 @@ from prometheus_metrics import (
     set_worker_status,
     set_worker_uptime,
     set_consumer_lag,
+    startup_to_first_message_seconds,
 )
 
+ConsumerRecord = namedtuple('ConsumerRecord', ['topic', 'partition', 'offset', 'timestamp', 'key', 'value'])
+
+
+class FakeConsumer:
+    """In-memory stand-in for KafkaConsumer.poll()/commit()"""
+
+    def __init__(self, batches, stop_event):
+        self.batches = list(batches)
+        self.stop_event = stop_event
+        self.commits = 0
+
+    def poll(self, timeout_ms=0, max_records=None):
+        if not self.batches:
+            self.stop_event.set()
+            return {}
+        return self.batches.pop(0)
+
+    def commit(self, offsets=None):
+        self.commits += 1
+        self.committed = offsets
+
+    def commit_async(self, offsets=None, callback=None):
+        self.commits += 1
+        self.committed = offsets
+        if callback:
+            callback(offsets, None)
+
+    def close(self, autocommit=True):
+        self.closed = True
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -223,6 +291,1400 @@ class TestErrorHandling:
         logger.info("✓ Missing event_type detected")
 
 
+class TestBatchConsumer:
+    """Test suite for poll()-based micro-batch consumption"""
+
+    def test_batched_handler_collects_failures(self):
+        """Test one failing event does not abort the rest of the batch"""
+        logger.info("Testing batched handler failure isolation")
+
+        seen = []
+
+        def handler(event):
+            if event.get("bad"):
+                raise ValueError("bad event")
+            seen.append(event["id"])
+
+        failures = worker.batched(handler)([{"id": 1}, {"bad": True}, {"id": 2}])
+
+        assert seen == [1, 2]
+        assert len(failures) == 1
+        assert isinstance(failures[0][1], ValueError)
+        logger.info("✓ Failed event isolated from batch")
+
+    def test_consume_batches_groups_by_topic_and_commits_once(self):
+        """Test records are grouped per topic and offsets committed per batch"""
+        logger.info("Testing micro-batch grouping and commits")
+
+        calls = []
+        original = dict(worker.BATCH_HANDLERS)
+        worker.BATCH_HANDLERS["bench.a"] = lambda events: calls.append(("bench.a", events)) or []
+        worker.BATCH_HANDLERS["bench.b"] = lambda events: calls.append(("bench.b", events)) or []
+        try:
+            def batch(offset):
+                return {
+                    TopicPartition("bench.a", 0): [ConsumerRecord("bench.a", 0, offset, 0, None, {"n": 1})],
+                    TopicPartition("bench.a", 1): [ConsumerRecord("bench.a", 1, offset, 0, None, {"n": 2})],
+                    TopicPartition("bench.b", 0): [ConsumerRecord("bench.b", 0, offset, 0, None, {"n": 3})],
+                }
+            stop_event = threading.Event()
+            consumer = FakeConsumer([batch(0), batch(1)], stop_event)
+            worker.consume_batches(consumer, datetime.now(), timeout_ms=0, stop_event=stop_event,
+                                   tracker=OffsetTracker(commit_interval_ms=0))
+        finally:
+            worker.BATCH_HANDLERS.clear()
+            worker.BATCH_HANDLERS.update(original)
+
+        assert calls[0] == ("bench.a", [{"n": 1}, {"n": 2}])
+        assert calls[1] == ("bench.b", [{"n": 3}])
+        assert len(calls) == 4
+        assert consumer.commits == 2
+        assert messages_consumed_total.labels(topic="bench.a")._value.get() == 4
+        logger.info("✓ Batches grouped by topic, one commit per batch")
+
+    def test_batch_without_handler_counts_failures(self):
+        """Test a batch for an unknown topic is counted as failed"""
+        logger.info("Testing batch with no handler")
+
+        worker.process_batch("bench.unknown", [{}, {}, {}])
+
+        failed = messages_failed_total.labels(topic="bench.unknown", error_type="no_handler")
+        assert failed._value.get() == 3
+        logger.info("✓ Unhandled batch recorded as failed")
+
+
+class TestHandlerPool:
+    """Test suite for the keyed concurrent handler pool"""
+
+    def test_per_key_ordering_preserved(self):
+        """Test tasks with the same key run in submit order"""
+        logger.info("Testing per-key ordering under concurrency")
+
+        pool = KeyedWorkerPool(concurrency=4, max_in_flight=50)
+        results = {}
+        lock = threading.Lock()
+
+        def task(key, seq):
+            time.sleep(random.uniform(0, 0.002))
+            with lock:
+                results.setdefault(key, []).append(seq)
+
+        for seq in range(20):
+            for key in range(8):
+                pool.submit(("order_id", key), task, key, seq)
+        assert pool.join(timeout=10)
+        pool.shutdown()
+
+        assert all(results[key] == list(range(20)) for key in range(8))
+        logger.info("✓ Per-key order preserved across 4 threads")
+
+    def test_in_flight_is_bounded(self):
+        """Test submit() blocks once max_in_flight tasks are pending"""
+        logger.info("Testing bounded in-flight work")
+
+        pool = KeyedWorkerPool(concurrency=2, max_in_flight=3)
+        release = threading.Event()
+        for key in range(3):
+            pool.submit(key, release.wait)
+
+        assert pool.in_flight == 3
+        assert handler_pool_saturation_ratio._value.get() == 1
+
+        blocked = threading.Thread(target=pool.submit, args=(99, lambda: None))
+        blocked.start()
+        blocked.join(timeout=0.1)
+        assert blocked.is_alive()
+
+        release.set()
+        blocked.join(timeout=5)
+        assert pool.join(timeout=5)
+        assert handler_pool_saturation_ratio._value.get() == 0
+        pool.shutdown()
+        logger.info("✓ Submit blocked while pool was saturated")
+
+    def test_shutdown_timeout_is_total(self):
+        """Test shutdown() waits at most `timeout` for all lanes together"""
+        logger.info("Testing bounded pool shutdown")
+
+        pool = KeyedWorkerPool(concurrency=4, max_in_flight=10)
+        release = threading.Event()
+        for lane in range(4):
+            pool.submit_to_lane(lane, release.wait)
+
+        start = time.monotonic()
+        assert not pool.shutdown(timeout=0.2)
+        assert time.monotonic() - start < 0.5
+        release.set()
+        assert pool.shutdown(timeout=5)
+        logger.info("✓ Stuck lanes waited on for one timeout in total")
+
+    def test_ordering_key_lookup(self):
+        """Test ordering keys come from the topic's key field"""
+        logger.info("Testing ordering key extraction")
+
+        assert worker.ordering_key("order.status_changed", {"order_id": 7}) == ("order_id", 7)
+        assert worker.ordering_key("order.created", {"order_id": 7}) == ("order_id", 7)
+        assert worker.ordering_key("order.created", {}) is None
+        assert worker.ordering_key("unknown.topic", {"order_id": 7}) is None
+        logger.info("✓ Ordering keys extracted")
+
+    def test_process_records_with_pool_keeps_key_order(self):
+        """Test pooled batch dispatch keeps events for one key in order"""
+        logger.info("Testing pooled batch dispatch")
+
+        seen = []
+        lock = threading.Lock()
+        original = dict(worker.BATCH_HANDLERS)
+
+        def handler(events):
+            with lock:
+                seen.extend((event["order_id"], event["seq"]) for event in events)
+            return []
+
+        worker.BATCH_HANDLERS["order.status_changed"] = handler
+        pool = KeyedWorkerPool(concurrency=3, max_in_flight=10)
+        try:
+            records = {
+                TopicPartition("order.status_changed", 0): [
+                    ConsumerRecord("order.status_changed", 0, seq, 0, None,
+                                   {"order_id": seq % 4, "seq": seq})
+                    for seq in range(40)
+                ]
+            }
+            worker.process_records(records, pool)
+            assert pool.join(timeout=5)
+        finally:
+            pool.shutdown()
+            worker.BATCH_HANDLERS.clear()
+            worker.BATCH_HANDLERS.update(original)
+
+        assert len(seen) == 40
+        for order_id in range(4):
+            seqs = [seq for key, seq in seen if key == order_id]
+            assert seqs == sorted(seqs)
+        logger.info("✓ Pooled batches preserve per-order ordering")
+
+
+class TestOffsetTracker:
+    """Test suite for manual at-least-once offset tracking"""
+
+    def test_watermark_waits_for_contiguous_completion(self):
+        """Test the commit offset only advances past contiguous finished records"""
+        logger.info("Testing contiguous watermark")
+
+        tracker = OffsetTracker(commit_interval_ms=0)
+        tp = TopicPartition("order.created", 0)
+        epochs = [tracker.track(tp, offset) for offset in range(10, 14)]
+
+        tracker.complete(tp, 12, epochs[2])
+        tracker.complete(tp, 11, epochs[1])
+        assert tracker.pending_commits() == {}
+
+        tracker.complete(tp, 10, epochs[0])
+        assert tracker.pending_commits()[tp].offset == 13
+
+        tracker.complete(tp, 13, epochs[3])
+        assert tracker.pending_commits()[tp].offset == 14
+        assert tracker.in_flight() == 0
+        logger.info("✓ Watermark advanced only over contiguous offsets")
+
+    def test_watermark_handles_offset_gaps(self):
+        """Test non-consecutive offsets (compaction, txn markers) do not stall"""
+        logger.info("Testing offset gaps")
+
+        tracker = OffsetTracker()
+        tp = TopicPartition("stock.low", 2)
+        epoch = tracker.track(tp, 5)
+        tracker.track(tp, 9)
+        tracker.complete_many([(tp, 5, epoch), (tp, 9, epoch)])
+
+        assert tracker.pending_commits()[tp].offset == 10
+        logger.info("✓ Watermark skipped offset gaps")
+
+    def test_async_commit_sent_once_and_retried_on_failure(self):
+        """Test offsets are committed once and resent after a failed commit"""
+        logger.info("Testing async commit bookkeeping")
+
+        tracker = OffsetTracker(commit_interval_ms=0)
+        tp = TopicPartition("user.created", 0)
+        tracker.complete(tp, 0, tracker.track(tp, 0))
+
+        class FailingConsumer:
+            calls = 0
+
+            def commit_async(self, offsets=None, callback=None):
+                self.calls += 1
+                callback(offsets, Exception("coordinator not available"))
+
+        failing = FailingConsumer()
+        tracker.maybe_commit(failing)
+        tracker.maybe_commit(failing)
+        assert failing.calls == 2
+
+        consumer = FakeConsumer([], threading.Event())
+        tracker.maybe_commit(consumer)
+        tracker.maybe_commit(consumer)
+        assert consumer.commits == 1
+        assert consumer.committed[tp].offset == 1
+        logger.info("✓ Commit retried after failure, not duplicated after success")
+
+    def test_revoke_flushes_and_drops_in_flight_work(self):
+        """Test rebalance commits finished offsets and drops stale work"""
+        logger.info("Testing rebalance listener")
+
+        tracker = OffsetTracker()
+        consumer = FakeConsumer([], threading.Event())
+        listener = CommitOnRebalanceListener(consumer, tracker)
+        tp = TopicPartition("order.status_changed", 1)
+
+        listener.on_partitions_assigned({tp})
+        first = tracker.track(tp, 0)
+        tracker.track(tp, 1)
+        tracker.complete(tp, 0, first)
+
+        listener.on_partitions_revoked({tp})
+        assert consumer.commits == 1
+        assert not tracker.is_current(tp, first)
+
+        # Reassigned partition starts a new epoch; stale completions are ignored
+        listener.on_partitions_assigned({tp})
+        tracker.complete(tp, 1, first)
+        assert tracker.pending_commits() == {}
+        logger.info("✓ Revoked partition flushed and stale work dropped")
+
+    def test_stale_batch_records_are_skipped(self):
+        """Test batch records of a revoked partition are not processed"""
+        logger.info("Testing revoked records skipped in batch mode")
+
+        seen = []
+        original = dict(worker.BATCH_HANDLERS)
+        worker.BATCH_HANDLERS["bench.revoked"] = lambda events: seen.extend(events) or []
+        try:
+            tracker = OffsetTracker()
+            tp = TopicPartition("bench.revoked", 0)
+            message = ConsumerRecord("bench.revoked", 0, 0, 0, None, {"n": 1})
+            epoch = tracker.track(tp, 0)
+            tracker.revoke({tp})
+            worker.run_tracked_batch("bench.revoked", [(tp, message, epoch)], tracker)
+        finally:
+            worker.BATCH_HANDLERS.clear()
+            worker.BATCH_HANDLERS.update(original)
+
+        assert seen == []
+        logger.info("✓ Revoked records skipped")
+
+
+class TestLagMonitor:
+    """Test suite for consumer lag sampling"""
+
+    def test_offset_and_time_lag_per_partition(self):
+        """Test lag is computed from end offsets and record timestamps"""
+        logger.info("Testing consumer lag sampling")
+
+        behind = TopicPartition("lag.orders", 0)
+        caught_up = TopicPartition("lag.orders", 1)
+        monitor = LagMonitor(lambda partitions: {behind: 120, caught_up: 8})
+
+        old_ts = int(time.time() * 1000) - 30000
+        monitor.observe({
+            behind: [ConsumerRecord("lag.orders", 0, 99, old_ts, None, {})],
+            caught_up: [ConsumerRecord("lag.orders", 1, 7, old_ts, None, {})],
+        })
+        lags = monitor.sample()
+
+        assert lags[behind][0] == 20
+        assert 29 <= lags[behind][1] <= 35
+        assert lags[caught_up] == (0, 0.0)
+        assert kafka_consumer_lag_records.labels(topic="lag.orders", partition="0")._value.get() == 20
+        assert kafka_consumer_lag_seconds.labels(topic="lag.orders")._value.get() >= 29
+        logger.info("✓ Offset and time lag exported per partition")
+
+    def test_forgotten_partitions_are_not_sampled(self):
+        """Test revoked partitions stop being reported"""
+        logger.info("Testing lag monitor forget")
+
+        tp = TopicPartition("lag.users", 0)
+        requested = []
+        monitor = LagMonitor(lambda partitions: requested.extend(partitions) or {})
+        monitor.observe({tp: [ConsumerRecord("lag.users", 0, 1, 0, None, {})]})
+        monitor.forget({tp})
+
+        assert monitor.sample() == {}
+        assert requested == []
+        logger.info("✓ Revoked partitions dropped from lag sampling")
+
+
+class FakeProducer:
+    """Records sent messages; send() returns an already-resolved future"""
+
+    class _Future:
+        def get(self, timeout=None):
+            return None
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, topic, value=None):
+        self.sent.append((topic, value))
+        return self._Future()
+
+    def flush(self):
+        pass
+
+
+class TestRetryPipeline:
+    """Test suite for tiered retry topics and the dead-letter queue"""
+
+    def test_parse_tiers_and_topic_names(self):
+        """Test tier specs and retry topic name parsing"""
+        logger.info("Testing retry tier parsing")
+
+        assert parse_tiers("5s, 1m,500ms") == [("5s", 5.0), ("1m", 60.0), ("500ms", 0.5)]
+        assert parse_tiers("") == []
+        assert source_topic("order.created.retry.5s") == "order.created"
+        assert source_topic("order.created") == "order.created"
+        logger.info("✓ Retry tiers parsed")
+
+    def test_failures_walk_through_tiers_to_dlq(self):
+        """Test each failure moves an event one tier further, then to the DLQ"""
+        logger.info("Testing retry tier routing")
+
+        producer = FakeProducer()
+        pipeline = RetryPipeline(producer, parse_tiers("5s,1m"))
+        event = {"order_id": 1}
+        for _ in range(3):
+            pipeline.route_failure("order.created", event, TimeoutError("smtp timeout"))
+            event = producer.sent[-1][1]
+
+        assert [topic for topic, _ in producer.sent] == [
+            "order.created.retry.5s", "order.created.retry.1m", "order.created.dlq"
+        ]
+        assert event["_retry"]["attempt"] == 3
+        assert event["_retry"]["error"].startswith("TimeoutError:")
+        assert event["order_id"] == 1
+        assert dead_lettered_total.labels(topic="order.created", error_type="TimeoutError")._value.get() >= 1
+        logger.info("✓ Event routed 5s → 1m → DLQ")
+
+    def test_hold_back_pauses_until_due(self):
+        """Test retry records that are not due yet are held back by pausing"""
+        logger.info("Testing non-blocking retry backoff")
+
+        class PausingConsumer:
+            def __init__(self):
+                self.seeks, self.paused, self.resumed = [], [], []
+
+            def seek(self, tp, offset):
+                self.seeks.append((tp, offset))
+
+            def pause(self, tp):
+                self.paused.append(tp)
+
+            def resume(self, *tps):
+                self.resumed.extend(tps)
+
+        consumer = PausingConsumer()
+        pipeline = RetryPipeline(FakeProducer(), [("5s", 5.0), ("1ms", 0.001)])
+        now_ms = int(time.time() * 1000)
+        main_tp = TopicPartition("stock.low", 0)
+        slow_tp = TopicPartition("stock.low.retry.5s", 0)
+        fast_tp = TopicPartition("stock.low.retry.1ms", 0)
+        ready = pipeline.hold_back(consumer, {
+            main_tp: [ConsumerRecord("stock.low", 0, 0, now_ms, None, {})],
+            slow_tp: [ConsumerRecord("stock.low.retry.5s", 0, 7, now_ms - 6000, None, {}),
+                      ConsumerRecord("stock.low.retry.5s", 0, 8, now_ms, None, {})],
+            fast_tp: [ConsumerRecord("stock.low.retry.1ms", 0, 3, now_ms - 10, None, {})],
+        })
+
+        assert len(ready[main_tp]) == 1
+        assert [m.offset for m in ready[slow_tp]] == [7]
+        assert len(ready[fast_tp]) == 1
+        assert consumer.seeks == [(slow_tp, 8)]
+        assert consumer.paused == [slow_tp]
+
+        pipeline.resume_due(consumer)
+        assert consumer.resumed == []
+        pipeline._paused[consumer][slow_tp] = 0
+        pipeline.resume_due(consumer)
+        assert consumer.resumed == [slow_tp]
+        logger.info("✓ Retry partition paused until due, main topic unaffected")
+
+    def test_retry_topic_batch_uses_source_handler(self):
+        """Test retry-topic records run the original handler and are re-routed on failure"""
+        logger.info("Testing retry topic dispatch")
+
+        calls = []
+        original = dict(worker.BATCH_HANDLERS)
+
+        def handler(events):
+            calls.extend(events)
+            return [(events[0], RuntimeError("still failing"))]
+
+        worker.BATCH_HANDLERS["retry.demo"] = handler
+        producer = FakeProducer()
+        pipeline = RetryPipeline(producer, parse_tiers("5s,1m"))
+        try:
+            tp = TopicPartition("retry.demo.retry.5s", 0)
+            event = {"n": 1, "_retry": {"attempt": 1, "topic": "retry.demo"}}
+            tracker = OffsetTracker()
+            epoch = tracker.track(tp, 0)
+            message = ConsumerRecord(tp.topic, 0, 0, 0, None, event)
+            worker.run_tracked_batch(tp.topic, [(tp, message, epoch)], tracker, pipeline)
+        finally:
+            worker.BATCH_HANDLERS.clear()
+            worker.BATCH_HANDLERS.update(original)
+
+        assert calls == [event]
+        assert producer.sent[0][0] == "retry.demo.retry.1m"
+        assert tracker.pending_commits()[tp].offset == 1
+        failed = retry_attempts_total.labels(topic="retry.demo", tier="5s", status="failed")
+        assert failed._value.get() == 1
+        logger.info("✓ Retry batch re-routed to next tier and committed")
+
+    def test_unroutable_failure_is_not_committed(self):
+        """Test an event the pipeline cannot publish keeps its offset and stops the consumer"""
+        logger.info("Testing retry routing failure")
+
+        class BrokenProducer(FakeProducer):
+            def send(self, topic, value=None):
+                self.sent.append((topic, value))
+                raise ConnectionError("broker unavailable")
+
+        def handler(events):
+            return [(event, RuntimeError("smtp down")) for event in events if event["n"] == 1]
+
+        original = dict(worker.BATCH_HANDLERS)
+        worker.BATCH_HANDLERS["route.fail"] = handler
+        producer = BrokenProducer()
+        pipeline = RetryPipeline(producer, parse_tiers("5s"), send_attempts=2, backoff_seconds=0)
+        tp = TopicPartition("route.fail", 0)
+        tracker = OffsetTracker(commit_interval_ms=0)
+        stop_event = threading.Event()
+        consumer = FakeConsumer([
+            {tp: [ConsumerRecord(tp.topic, 0, offset, 0, None, {"n": offset}) for offset in range(3)]},
+            {tp: [ConsumerRecord(tp.topic, 0, 3, 0, None, {"n": 3})]},
+        ], stop_event)
+        try:
+            with pytest.raises(RetryRouteError):
+                worker.consume_batches(consumer, datetime.now(), timeout_ms=0, stop_event=stop_event,
+                                       tracker=tracker, retries=pipeline)
+        finally:
+            worker.BATCH_HANDLERS.clear()
+            worker.BATCH_HANDLERS.update(original)
+
+        assert len(producer.sent) == 2  # both send attempts
+        assert consumer.committed[tp].offset == 1
+        assert tracker.in_flight() == 0
+        assert len(consumer.batches) == 1  # stopped before polling again
+        logger.info("✓ Unroutable event left uncommitted, consumer stopped")
+
+    def test_slow_retry_topic_bounded_by_send_timeout(self):
+        """Test failures are sent together and the poll thread waits at most send_timeout"""
+        logger.info("Testing bounded retry routing")
+
+        class StalledProducer(FakeProducer):
+            class _Future:
+                def get(self, timeout=None):
+                    time.sleep(timeout)
+                    raise TimeoutError("no ack from retry topic")
+
+        producer = StalledProducer()
+        pipeline = RetryPipeline(producer, parse_tiers("5s"), send_timeout=0.2, backoff_seconds=0)
+        failures = [({"n": n}, RuntimeError("smtp down")) for n in range(20)]
+
+        start = time.monotonic()
+        assert pipeline.handle_failures("order.created", failures) == failures
+        assert time.monotonic() - start < 0.5
+        assert len(producer.sent) == 20  # one async send each, not 20 blocking ones
+        with pytest.raises(RetryRouteError):
+            pipeline.check()
+
+        # Once stopped, later failures are not sent (and waited on) again
+        assert pipeline.handle_failures("order.created", failures[:1]) == failures[:1]
+        assert len(producer.sent) == 20
+        logger.info("✓ 20 unroutable failures took one send timeout")
+
+    def test_replay_dlq_stops_when_partition_never_reaches_end(self):
+        """Test replay gives up after idle polls when the DLQ is truncated under it"""
+        logger.info("Testing DLQ replay idle guard")
+
+        dlq = TopicPartition("user.created.dlq", 0)
+
+        class TruncatedConsumer:
+            polls = 0
+
+            def partitions_for_topic(self, topic):
+                return {0}
+
+            def assign(self, partitions):
+                pass
+
+            def seek_to_beginning(self, *partitions):
+                pass
+
+            def end_offsets(self, partitions):
+                return {dlq: 5}
+
+            def position(self, tp):
+                return 0
+
+            def poll(self, timeout_ms=0):
+                self.polls += 1
+                return {}
+
+        consumer = TruncatedConsumer()
+        assert replay_dlq(consumer, FakeProducer(), "user.created", max_idle_polls=3) == 0
+        assert consumer.polls == 3
+        logger.info("✓ Replay stopped after 3 empty polls")
+
+    def test_replay_dlq_republishes_original_events(self):
+        """Test DLQ replay strips retry metadata and targets the original topic"""
+        logger.info("Testing DLQ replay")
+
+        dlq = TopicPartition("user.created.dlq", 0)
+
+        class DlqConsumer:
+            def partitions_for_topic(self, topic):
+                return {0}
+
+            def assign(self, partitions):
+                pass
+
+            def seek_to_beginning(self, *partitions):
+                pass
+
+            def end_offsets(self, partitions):
+                return {dlq: 2}
+
+            def position(self, tp):
+                return 0
+
+            def poll(self, timeout_ms=0):
+                return {dlq: [
+                    ConsumerRecord(dlq.topic, 0, 0, 0, None,
+                                   {"user_id": 1, "_retry": {"topic": "user.created", "error": "KeyError: 'email'"}}),
+                    ConsumerRecord(dlq.topic, 0, 1, 0, None,
+                                   {"user_id": 2, "_retry": {"topic": "user.created", "error": "TimeoutError: smtp"}}),
+                ]}
+
+        producer = FakeProducer()
+        replayed = replay_dlq(DlqConsumer(), producer, "user.created", error_type="TimeoutError")
+
+        assert replayed == 1
+        assert producer.sent == [("user.created", {"user_id": 2})]
+        logger.info("✓ DLQ replayed onto original topic")
+
+
+class TestStructuredLogging:
+    """Test suite for the structured logging mode"""
+
+    def test_json_formatter_emits_one_compact_line(self):
+        """Test JSON lines carry the message plus extra fields"""
+        logger.info("Testing JSON formatter")
+
+        record = logging.LogRecord("worker", logging.INFO, __file__, 1,
+                                   "processed %s", ("order.created",), None)
+        record.topic = "order.created"
+        record.offset = 42
+        line = JsonFormatter().format(record)
+        entry = json.loads(line)
+
+        assert "\n" not in line
+        assert entry["msg"] == "processed order.created"
+        assert entry["topic"] == "order.created"
+        assert entry["offset"] == 42
+        assert entry["level"] == "INFO"
+        logger.info("✓ Compact JSON line produced")
+
+    def test_sampler_keeps_every_nth_event(self):
+        """Test sampling rate and the null logger for unsampled events"""
+        logger.info("Testing event log sampling")
+
+        sampler = EventSampler(0.25)
+        kept = [sampler.sample() for _ in range(100)]
+        assert sum(kept) == 25
+
+        sampler.set_rate(0)
+        sampler.sample()
+        assert sampler.logger(logger) is NULL_LOGGER
+        sampler.set_rate(1)
+        sampler.sample()
+        assert sampler.logger(logger) is logger
+        logger.info("✓ 1 in 4 events sampled")
+
+    def test_lazy_json_and_queue_sink(self):
+        """Test dumps are only serialized when formatted by the queue listener"""
+        logger.info("Testing lazy formatting through the queue sink")
+
+        stream = io.StringIO()
+        listener = configure_logging("json", True, logging.INFO, stream=stream)
+        try:
+            logging.getLogger("worker.test").debug("dropped %s", LazyJson({"x": 1}))
+            logging.getLogger("worker.test").info("kept %s", LazyJson({"x": 1}), extra={"topic": "t"})
+        finally:
+            listener.stop()
+            configure_logging("text", False, logging.INFO)
+
+        lines = stream.getvalue().strip().splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])["msg"] == 'kept {"x": 1}'
+        logger.info("✓ Debug line dropped, info line formatted by listener")
+
+
+class HttpSink:
+    """Local HTTP/1.1 endpoint recording POSTed JSON bodies and connections"""
+
+    def __init__(self, status=200):
+        sink = self
+        self.requests = []
+        self.connections = set()
+        self.status = status
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                sink.requests.append(json.loads(body))
+                sink.connections.add(self.client_address)
+                self.send_response(sink.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SmtpSink:
+    """aiosmtpd handler collecting delivered messages"""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        self.sessions.add(id(session))
+        return '250 OK'
+
+
+class TestDelivery:
+    """Test delivery channels against local SMTP and HTTP stand-ins"""
+
+    def test_smtp_batch_reuses_pooled_connection(self):
+        """Test an email batch goes over one kept-alive SMTP connection"""
+        logger.info("Testing pooled SMTP delivery")
+
+        sink = SmtpSink()
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        controller = Controller(sink, hostname='127.0.0.1', port=port)
+        controller.start()
+        channel = SmtpChannel('127.0.0.1', port, concurrency=2, max_batch=10)
+        engine = DeliveryEngine({'email': channel})
+        try:
+            with engine.collect() as outbox:
+                for i in range(5):
+                    outbox.current = {'n': i}
+                    engine.notify('email', f'user{i}@example.com', 'Welcome', 'Hello')
+            engine.notify('email', 'late@example.com', 'Welcome', 'Hello')
+        finally:
+            engine.close()
+            controller.stop()
+
+        assert outbox.failures == []
+        assert [m.rcpt_tos for m in sink.messages][-1] == ['late@example.com']
+        assert len(sink.messages) == 6
+        assert len(sink.sessions) == 1
+        logger.info("✓ 6 emails delivered over 1 SMTP session")
+
+    def test_webhook_keep_alive_and_batching(self):
+        """Test webhook batches are POSTed as arrays over one connection"""
+        logger.info("Testing webhook batching and keep-alive")
+
+        sink = HttpSink()
+        channel = WebhookChannel(sink.url, concurrency=1, max_batch=3)
+        engine = DeliveryEngine({'webhook': channel})
+        sent = notifications_sent_total.labels(channel='webhook', status='success')
+        before = sent._value.get()
+        try:
+            with engine.collect():
+                for i in range(7):
+                    engine.notify('webhook', i, f'Order #{i} created', 'ok', data={'order_id': i})
+        finally:
+            engine.close()
+            sink.close()
+
+        assert [len(body) for body in sink.requests] == [3, 3, 1]
+        assert sink.requests[0][0]['data'] == {'order_id': 0}
+        assert len(sink.connections) == 1
+        assert sent._value.get() - before == 7
+        logger.info("✓ 7 notifications in 3 requests on 1 connection")
+
+    def test_slack_failure_maps_back_to_events(self):
+        """Test a failed Slack post fails every event in its chunk"""
+        logger.info("Testing Slack delivery failures")
+
+        sink = HttpSink(status=500)
+        engine = DeliveryEngine({'slack': SlackChannel(sink.url, max_batch=2)})
+        failed = notifications_failed_total.labels(channel='slack', reason='HTTPError')
+        before = failed._value.get()
+        events = [{'id': i} for i in range(3)]
+        try:
+            with engine.collect() as outbox:
+                for event in events:
+                    outbox.current = event
+                    engine.notify('slack', 'sre', 'Alert', str(event['id']))
+                    engine.notify('email', 'nobody', 'not configured', '')
+        finally:
+            engine.close()
+            sink.close()
+
+        assert [event for event, _ in outbox.failures] == events
+        assert sink.requests[0] == {'text': '*Alert* 0\n*Alert* 1'}
+        assert failed._value.get() - before == 3
+        logger.info("✓ 3 failed Slack notifications reported against their events")
+
+    def test_channel_concurrency_limit(self):
+        """Test a channel never runs more sends than its concurrency"""
+        logger.info("Testing per-channel concurrency limit")
+
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        class SlowChannel(WebhookChannel):
+            def send_batch(self, notifications):
+                with lock:
+                    active.append(1)
+                    peak.append(len(active))
+                time.sleep(0.02)
+                with lock:
+                    active.pop()
+
+        engine = DeliveryEngine({'webhook': SlowChannel('http://unused', concurrency=2)})
+        threads = [threading.Thread(target=engine.notify, args=('webhook', i, 's', 'b'))
+                   for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert max(peak) == 2
+        logger.info("✓ Peak concurrency 2 with 6 concurrent senders")
+
+    def test_pool_discards_broken_connections(self):
+        """Test a connection that raised is closed rather than reused"""
+        logger.info("Testing connection pool discard")
+
+        created = []
+        closed = []
+
+        def factory():
+            created.append(object())
+            return created[-1]
+
+        pool = ConnectionPool(factory, size=1, close=closed.append)
+        with pool.connection() as conn:
+            first = conn
+        with pool.connection() as conn:
+            assert conn is first
+        try:
+            with pool.connection():
+                raise OSError("connection reset")
+        except OSError:
+            pass
+        with pool.connection() as conn:
+            assert conn is not first
+
+        assert closed == [first]
+        logger.info("✓ Broken connection closed and replaced")
+
+    def test_batched_handler_reports_delivery_failures(self):
+        """Test worker batches fail events whose notifications failed"""
+        logger.info("Testing worker batch delivery failures")
+
+        sink = HttpSink(status=503)
+        original = worker.DELIVERY
+        worker.DELIVERY = DeliveryEngine({'slack': SlackChannel(sink.url)})
+        rule = worker.DIGESTS.rules['inventory']
+        window, rule.window_seconds = rule.window_seconds, 0
+        try:
+            events = [{'product_id': i, 'product_name': 'Widget', 'stock': 1} for i in range(2)]
+            failures = worker.process_batch('stock.low', events)
+        finally:
+            rule.window_seconds = window
+            worker.DELIVERY.close()
+            worker.DELIVERY = original
+            sink.close()
+
+        assert [event for event, _ in failures] == events
+        assert len(sink.requests) == 1
+        logger.info("✓ 2 stock.low events failed with their Slack post")
+
+
+class FakeRedis:
+    """Dict-backed stand-in for the redis-py pipeline calls RedisIdStore makes"""
+
+    def __init__(self, fail=False):
+        self.keys = {}
+        self.fail = fail
+
+    def pipeline(self, transaction=False):
+        return FakeRedisPipeline(self)
+
+
+class FakeRedisPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.ops = []
+
+    def exists(self, key):
+        self.ops.append(lambda: int(key in self.client.keys))
+
+    def set(self, key, value, ex=None):
+        self.ops.append(lambda: self.client.keys.__setitem__(key, (value, ex)))
+
+    def execute(self):
+        if self.client.fail:
+            raise ConnectionError("redis unavailable")
+        return [op() for op in self.ops]
+
+
+class TestDedup:
+    """Test suite for event-id deduplication"""
+
+    def test_lru_is_exact_and_bounded(self):
+        """Test the LRU keeps only the most recently seen ids"""
+        logger.info("Testing LRU id cache")
+
+        cache = LruIdCache(max_entries=3)
+        assert [cache.add(i) for i in ("a", "b", "a", "c", "d")] == [True, True, False, True, True]
+        assert len(cache) == 3
+        assert cache.add("a") is False  # refreshed by the repeat, still held
+        assert cache.add("b") is True   # least recently seen, evicted
+        logger.info("✓ LRU bounded to 3 ids")
+
+    def test_bloom_filter_memory_is_fixed(self):
+        """Test the rotating bloom filter remembers recent ids in fixed memory"""
+        logger.info("Testing rotating bloom filter")
+
+        bloom = RotatingBloomFilter(capacity=1000, error_rate=1e-6)
+        size = len(bloom._current)
+        ids = [f"evt-{i}" for i in range(5000)]
+        assert all(bloom.add(i) for i in ids)
+        assert len(bloom._current) == size
+        assert not any(bloom.add(i) for i in ids[-1000:])
+        assert bloom.add(ids[0]) is True  # rotated out long ago
+        assert len(bloom) <= 2000
+        logger.info(f"✓ 5000 ids in {2 * size} bytes, last 1000 still detected")
+
+    def test_batch_duplicates_dropped_before_dispatch(self):
+        """Test redelivered events are skipped and their offsets completed"""
+        logger.info("Testing batch deduplication")
+
+        handled = []
+        original = dict(worker.BATCH_HANDLERS)
+        worker.BATCH_HANDLERS["dedup.a"] = lambda events: handled.extend(events) or []
+        tp = TopicPartition("dedup.a", 0)
+        tracker = OffsetTracker(commit_interval_ms=0)
+        dedup = DedupStore(LruIdCache())
+        try:
+            for offsets, ids in (((0, 1, 2), ("e1", "e2", "e1")), ((3, 4), ("e2", None))):
+                records = {tp: [ConsumerRecord("dedup.a", 0, o, 0, None, {"event_id": i})
+                                for o, i in zip(offsets, ids)]}
+                worker.process_records(records, tracker=tracker, dedup=dedup)
+        finally:
+            worker.BATCH_HANDLERS.clear()
+            worker.BATCH_HANDLERS.update(original)
+
+        assert [event["event_id"] for event in handled] == ["e1", "e2", None]
+        assert tracker.pending_commits()[tp].offset == 5
+        assert dedup_events_total.labels(topic="dedup.a", result="duplicate")._value.get() == 2
+        logger.info("✓ 2 duplicates dropped, all 5 offsets completed")
+
+    def test_stream_skips_duplicates_but_not_retries(self):
+        """Test one-at-a-time mode drops duplicates but always runs retry records"""
+        logger.info("Testing stream deduplication")
+
+        handled = []
+        original = dict(worker.EVENT_HANDLERS)
+        worker.EVENT_HANDLERS["dedup.b"] = handled.append
+        tracker = OffsetTracker(commit_interval_ms=0)
+        dedup = DedupStore(LruIdCache())
+        try:
+            for topic, offset in (("dedup.b", 0), ("dedup.b", 1), ("dedup.b.retry.5s", 0)):
+                tp = TopicPartition(topic, 0)
+                message = ConsumerRecord(topic, 0, offset, 0, None, {"event_id": "x"})
+                worker.handle_message(tp, message, datetime.now(), tracker,
+                                      tracker.track(tp, offset), dedup=dedup)
+        finally:
+            worker.EVENT_HANDLERS.clear()
+            worker.EVENT_HANDLERS.update(original)
+
+        assert len(handled) == 2
+        assert tracker.pending_commits()[TopicPartition("dedup.b", 0)].offset == 2
+        logger.info("✓ Duplicate skipped, retry record processed")
+
+    def test_failed_event_handled_after_dlq_replay(self):
+        """Test a failed event's id is released, so its DLQ replay is not dropped"""
+        logger.info("Testing fail → DLQ → replay with dedup")
+
+        def replay(dead_lettered):
+            tp = TopicPartition(dead_lettered[0], 0)
+
+            class DlqConsumer:
+                def partitions_for_topic(self, topic):
+                    return {0}
+
+                def assign(self, partitions):
+                    pass
+
+                def seek_to_beginning(self, *partitions):
+                    pass
+
+                def end_offsets(self, partitions):
+                    return {tp: 1}
+
+                def position(self, tp):
+                    return 0
+
+                def poll(self, timeout_ms=0):
+                    return {tp: [ConsumerRecord(tp.topic, 0, 0, 0, None, dead_lettered[1])]}
+
+            producer = FakeProducer()
+            replay_dlq(DlqConsumer(), producer, dead_lettered[0][:-len(".dlq")])
+            return producer.sent[0][1]
+
+        calls = []
+
+        def flaky(event):
+            calls.append(event)
+            if len(calls) == 1:
+                raise TimeoutError("smtp timeout")
+
+        original = dict(worker.EVENT_HANDLERS), dict(worker.BATCH_HANDLERS)
+        worker.EVENT_HANDLERS["dedup.r"] = flaky
+        worker.BATCH_HANDLERS["dedup.s"] = worker.batched(flaky)
+        try:
+            # One record at a time, exact LRU
+            producer = FakeProducer()
+            pipeline = RetryPipeline(producer, [])
+            dedup = DedupStore(LruIdCache())
+            tracker = OffsetTracker(commit_interval_ms=0)
+            tp = TopicPartition("dedup.r", 0)
+            for offset in (0, 1):
+                event = {"event_id": "r1"} if offset == 0 else replay(producer.sent[0])
+                worker.handle_message(tp, ConsumerRecord(tp.topic, 0, offset, 0, None, event), datetime.now(),
+                                      tracker, tracker.track(tp, offset), pipeline, dedup)
+            assert producer.sent[0][0] == "dedup.r.dlq"
+            assert calls == [{"event_id": "r1"}, {"event_id": "r1"}]
+            assert dedup.claim("dedup.r", ["r1"]) == [False]  # handled now, so dropped again
+
+            # Micro-batches, bloom filter
+            calls.clear()
+            producer = FakeProducer()
+            pipeline = RetryPipeline(producer, [])
+            dedup = DedupStore(RotatingBloomFilter(capacity=1000))
+            tp = TopicPartition("dedup.s", 0)
+            for offset in (0, 1):
+                event = {"event_id": "s1"} if offset == 0 else replay(producer.sent[0])
+                worker.process_records({tp: [ConsumerRecord(tp.topic, 0, offset, 0, None, event)]},
+                                       tracker=tracker, retries=pipeline, dedup=dedup)
+            assert calls == [{"event_id": "s1"}, {"event_id": "s1"}]
+            assert dedup.claim("dedup.s", ["s1"]) == [False]
+        finally:
+            for handlers, saved in zip((worker.EVENT_HANDLERS, worker.BATCH_HANDLERS), original):
+                handlers.clear()
+                handlers.update(saved)
+        logger.info("✓ Replayed events handled in stream and batch mode")
+
+    def test_shared_store_across_pods(self):
+        """Test an id handled by one pod is dropped by another, failing open on errors"""
+        logger.info("Testing Redis-backed shared dedup")
+
+        redis = FakeRedis()
+        pod_a = DedupStore(LruIdCache(), RedisIdStore(redis, ttl_seconds=60))
+        pod_b = DedupStore(LruIdCache(), RedisIdStore(redis, ttl_seconds=60))
+
+        assert pod_a.claim("dedup.c", ["e1", "e2"]) == [True, True]
+        pod_a.done(["e1"])
+        assert redis.keys["notification-worker:seen:e1"] == (1, 60)
+        assert pod_b.claim("dedup.c", ["e1", "e2"]) == [False, True]
+
+        redis.fail = True
+        assert pod_b.claim("dedup.c", ["e3"]) == [True]
+        pod_b.done(["e3"])
+        logger.info("✓ Handled id dropped on the other pod; Redis errors fail open")
+
+    def test_buffered_event_recorded_after_digest(self):
+        """Test a digest-buffered event is recorded as handled only once its digest went out"""
+        logger.info("Testing dedup of digest-buffered events")
+
+        redis = FakeRedis()
+        coalescer = Coalescer(lambda *args: None)
+        coalescer.register(DigestRule("inventory", "slack", worker.render_stock_report, 60))
+        original = worker.DIGESTS
+        worker.DIGESTS = coalescer
+        try:
+            tracker = OffsetTracker(commit_interval_ms=0)
+            pod_a = DedupStore(LruIdCache(), RedisIdStore(redis, ttl_seconds=60))
+            stream_tp, batch_tp = TopicPartition("stock.low", 0), TopicPartition("stock.low", 1)
+            worker.handle_message(stream_tp, ConsumerRecord("stock.low", 0, 0, 0, None,
+                                                            {"event_id": "k1", "product_id": 1}),
+                                  datetime.now(), tracker, tracker.track(stream_tp, 0), dedup=pod_a)
+            worker.process_records({batch_tp: [ConsumerRecord("stock.low", 1, 0, 0, None,
+                                                               {"event_id": "k2", "product_id": 2})]},
+                                   tracker=tracker, dedup=pod_a)
+
+            # The pod dies with the window open: the redelivered records are handled elsewhere
+            assert redis.keys == {}
+            pod_b = DedupStore(LruIdCache(), RedisIdStore(redis, ttl_seconds=60))
+            assert pod_b.claim("stock.low", ["k1", "k2"]) == [True, True]
+
+            coalescer.flush_due(force=True)
+            assert set(redis.keys) == {"notification-worker:seen:k1", "notification-worker:seen:k2"}
+
+            # A digest that failed releases its ids instead
+            def deliver(*args):
+                raise ConnectionError("slack down")
+
+            coalescer.deliver = deliver
+            coalescer.on_failure = lambda topic, failures: []
+            worker.handle_message(stream_tp, ConsumerRecord("stock.low", 0, 1, 0, None,
+                                                            {"event_id": "k3", "product_id": 3}),
+                                  datetime.now(), tracker, tracker.track(stream_tp, 1), dedup=pod_a)
+            coalescer.flush_due(force=True)
+            assert "notification-worker:seen:k3" not in redis.keys
+            assert pod_a.claim("stock.low", ["k3"]) == [True]
+        finally:
+            worker.DIGESTS = original
+        logger.info("✓ Ids recorded after the digest was sent, released when it failed")
+
+
+class TestDigest:
+    """Test suite for windowed coalescing of bursty events"""
+
+    @staticmethod
+    def coalescer(**windows):
+        sent = []
+        coalescer = Coalescer(lambda *args: sent.append(args))
+        for name, render in (("order", worker.render_order_digest),
+                             ("inventory", worker.render_stock_report),
+                             ("rate_limit", worker.render_rate_limit_alert)):
+            coalescer.register(DigestRule(name, "slack", render, windows.get(name, 60), max_events=1000))
+        return coalescer, sent
+
+    def test_stock_burst_becomes_one_report(self):
+        """Test hundreds of stock.low events produce one inventory report"""
+        logger.info("Testing inventory report digest")
+
+        coalescer, sent = self.coalescer()
+        for i in range(300):
+            product = i % 100
+            coalescer.add("inventory", "inventory", "stock.low",
+                          {"product_id": product, "product_name": f"P{product}", "stock": i // 100})
+        assert sent == []
+        assert coalescer.flush_due(force=True) == 1
+
+        channel, recipient, subject, body, _ = sent[0]
+        assert subject == "Low stock report: 100 products"
+        assert len(body.splitlines()) == 100
+        assert "P0 (ID: 0): 2 left" in body
+        logger.info("✓ 300 events → 1 report of 100 products")
+
+    def test_one_rate_limit_alert_per_ip_per_window(self):
+        """Test rate-limit floods are coalesced per IP when the window closes"""
+        logger.info("Testing per-IP rate limit alerts")
+
+        coalescer, sent = self.coalescer(rate_limit=0.05)
+        for i in range(150):
+            coalescer.add("rate_limit", f"10.0.0.{i % 3}", "api.rate_limited",
+                          {"ip": f"10.0.0.{i % 3}", "path": "/api/orders" if i % 2 else "/api/products"})
+        assert coalescer.flush_due() == 0
+        time.sleep(0.06)
+        assert coalescer.flush_due() == 3
+
+        assert sorted(args[2] for args in sent) == ["Rate limit triggered for 10.0.0.0",
+                                                    "Rate limit triggered for 10.0.0.1",
+                                                    "Rate limit triggered for 10.0.0.2"]
+        assert all(args[3].startswith("50 requests limited") for args in sent)
+        assert coalescer.open_windows() == 0
+        logger.info("✓ 150 events → 3 alerts")
+
+    def test_order_events_coalesced_per_order(self):
+        """Test an order's lifecycle burst becomes one update"""
+        logger.info("Testing order coalescing")
+
+        coalescer, sent = self.coalescer()
+        coalescer.add("order", 1, "order.created", {"order_id": 1, "user_id": 7, "total_amount": 10})
+        coalescer.add("order", 1, "order.payment_confirmed", {"order_id": 1, "user_id": 7})
+        coalescer.add("order", 2, "order.created", {"order_id": 2, "user_id": 8})
+        coalescer.add("order", 1, "order.status_changed",
+                      {"order_id": 1, "user_id": 7, "new_status": "shipped", "message": "On its way"})
+        coalescer.flush_due(force=True)
+
+        by_recipient = {args[1]: args for args in sent}
+        assert by_recipient[7][2] == "Order #1: created → paid → shipped"
+        assert by_recipient[7][3] == "On its way"
+        assert len(by_recipient[7][4]["events"]) == 3
+        assert by_recipient[8][2] == "Order #2: created"
+        logger.info("✓ 4 order events → 2 notifications")
+
+    def test_full_window_and_failed_digest(self):
+        """Test a full window is emitted early and a failed digest fails its events"""
+        logger.info("Testing digest limits and failures")
+
+        failed = []
+
+        def deliver(*args):
+            raise ConnectionError("slack down")
+
+        coalescer = Coalescer(deliver, on_failure=lambda topic, failures: failed.append((topic, failures)))
+        coalescer.register(DigestRule("order", "webhook", worker.render_order_digest, 60, max_events=2))
+        coalescer.add("order", 1, "order.created", {"order_id": 1})
+        coalescer.add("order", 1, "order.status_changed", {"order_id": 1, "new_status": "shipped"})
+
+        assert coalescer.open_windows() == 0
+        assert failed == []  # left to the flusher, not sent from the handler's thread
+        assert coalescer.flush_due() == 1
+        assert [topic for topic, _ in failed] == ["order.created", "order.status_changed"]
+        assert isinstance(failed[0][1][0][1], ConnectionError)
+        logger.info("✓ Full window emitted, failed events handed to retries")
+
+    def test_full_window_failure_fails_every_held_event(self):
+        """Test a window filled inside a batch fails all of its events when the channel is down"""
+        logger.info("Testing full digest windows in batch mode")
+
+        sink = HttpSink(status=503)
+        original = worker.DELIVERY, worker.DIGESTS
+        worker.DELIVERY = DeliveryEngine({'slack': SlackChannel(sink.url)})
+        routed = []
+        coalescer = Coalescer(lambda *args: worker.DELIVERY.notify(*args),
+                              on_failure=lambda topic, failures: routed.extend(failures) or [])
+        coalescer.register(DigestRule("inventory", "slack", worker.render_stock_report, 60, max_events=3))
+        worker.DIGESTS = coalescer
+        try:
+            tracker = OffsetTracker(commit_interval_ms=0)
+            tp = TopicPartition("stock.low", 0)
+            worker.process_records({tp: [
+                ConsumerRecord("stock.low", 0, offset, 0, None, {"product_id": offset, "stock": 1})
+                for offset in range(3)]}, tracker=tracker)
+            assert tracker.pending_commits() == {}
+            assert sink.requests == []
+            emitted = digests_emitted_total.labels(rule="inventory", status="failed")._value.get()
+
+            assert coalescer.flush_due() == 1
+        finally:
+            worker.DELIVERY.close()
+            worker.DELIVERY, worker.DIGESTS = original
+            sink.close()
+
+        assert len(sink.requests) == 1
+        assert [event["product_id"] for event, _ in routed] == [0, 1, 2]
+        assert tracker.pending_commits()[tp].offset == 3
+        assert digests_emitted_total.labels(rule="inventory", status="failed")._value.get() == emitted + 1
+        logger.info("✓ All 3 events of the failed digest routed to retries")
+
+    def test_buffered_offsets_held_until_digest_emitted(self):
+        """Test offsets of buffered events are committed only after their digest went out"""
+        logger.info("Testing digest offset holds")
+
+        sent = []
+        coalescer = Coalescer(lambda *args: sent.append(args))
+        coalescer.register(DigestRule("inventory", "slack", worker.render_stock_report, 60))
+        original = worker.DIGESTS
+        worker.DIGESTS = coalescer
+        try:
+            tracker = OffsetTracker(commit_interval_ms=0)
+            stream_tp = TopicPartition("stock.low", 0)
+            for offset in range(2):
+                message = ConsumerRecord("stock.low", 0, offset, 0, None,
+                                         {"product_id": offset, "product_name": f"P{offset}", "stock": 1})
+                worker.handle_message(stream_tp, message, datetime.now(), tracker,
+                                      tracker.track(stream_tp, offset))
+            batch_tp = TopicPartition("stock.low", 1)
+            worker.process_records({batch_tp: [
+                ConsumerRecord("stock.low", 1, offset, 0, None, {"product_id": 9, "stock": 0})
+                for offset in range(3)]}, tracker=tracker)
+
+            assert tracker.pending_commits() == {}
+            assert tracker.in_flight() == 5
+            coalescer.flush_due(force=True)
+            assert len(sent) == 1
+            commits = tracker.pending_commits()
+            assert commits[stream_tp].offset == 2
+            assert commits[batch_tp].offset == 3
+
+            # A digest that can neither be sent nor routed leaves its records uncommitted
+            def deliver(*args):
+                raise ConnectionError("slack down")
+
+            coalescer.deliver = deliver
+            coalescer.on_failure = lambda topic, failures: failures
+            worker.handle_message(stream_tp, ConsumerRecord("stock.low", 0, 2, 0, None, {"product_id": 1}),
+                                  datetime.now(), tracker, tracker.track(stream_tp, 2))
+            coalescer.flush_due(force=True)
+            assert tracker.in_flight() == 0
+            assert tracker.pending_commits()[stream_tp].offset == 2
+        finally:
+            worker.DIGESTS = original
+        logger.info("✓ Offsets committed after the digest, kept when it was lost")
+
+
+class TestScaleOut:
+    """Test suite for topic groups and multiple consumers per pod"""
+
+    def test_topic_group_selection(self):
+        """Test topic groups select topics and their own consumer group"""
+        logger.info("Testing topic group selection")
+
+        assert worker.select_topics("all") == worker.TOPICS
+        assert worker.select_topics("orders") == [
+            "order.created", "order.payment_confirmed", "order.status_changed"
+        ]
+        assert worker.select_topics("alerts, users") == [
+            "user.created", "stock.low", "api.rate_limited", "chaos.injected"
+        ]
+        assert sorted(t for topics in worker.TOPIC_GROUPS.values() for t in topics) == sorted(worker.TOPICS)
+        try:
+            worker.select_topics("orders,bogus")
+            assert False, "unknown group accepted"
+        except ValueError:
+            pass
+
+        assert worker.consumer_group_id("all") == "notification-worker-group"
+        assert worker.consumer_group_id("users,alerts") == "notification-worker-alerts-users-group"
+        logger.info("✓ Topic groups resolved")
+
+    def test_listener_exports_partition_assignment(self):
+        """Test the rebalance listener reports each consumer's partitions"""
+        logger.info("Testing partition assignment metrics")
+
+        stop_event = threading.Event()
+        listener = CommitOnRebalanceListener(FakeConsumer([], stop_event), OffsetTracker(), name="consumer-7")
+        partitions = [TopicPartition("order.created", p) for p in range(3)]
+        listener.on_partitions_assigned(partitions)
+
+        assert consumer_assigned_partitions.labels(consumer="consumer-7", topic="order.created")._value.get() == 3
+        assert consumer_partition_assigned.labels(
+            consumer="consumer-7", topic="order.created", partition="2")._value.get() == 1
+
+        listener.on_partitions_revoked(partitions[:2])
+        assert consumer_assigned_partitions.labels(consumer="consumer-7", topic="order.created")._value.get() == 0
+        samples = [s.labels for m in consumer_partition_assigned.collect() for s in m.samples
+                   if s.labels["consumer"] == "consumer-7"]
+        assert [labels["partition"] for labels in samples] == ["2"]
+        logger.info("✓ Assignment exported and cleared on revoke")
+
+    def test_member_failure_stops_all_consumers(self):
+        """Test one failing consumer thread stops its siblings and surfaces the error"""
+        logger.info("Testing consumer thread supervision")
+
+        started = []
+
+        def fake_run_consumer(name, topics, group_id, start_time, stop_event, **kwargs):
+            started.append(name)
+            if name == "consumer-1":
+                raise RuntimeError("broker gone")
+            stop_event.wait(5)
+
+        original = worker.run_consumer
+        worker.run_consumer = fake_run_consumer
+        stop_event = threading.Event()
+        begin = time.monotonic()
+        try:
+            worker.run_consumers(3, ["order.created"], "g", datetime.now(), stop_event)
+            assert False, "member failure not raised"
+        except RuntimeError as e:
+            assert str(e) == "broker gone"
+        finally:
+            worker.run_consumer = original
+
+        assert sorted(started) == ["consumer-0", "consumer-1", "consumer-2"]
+        assert stop_event.is_set()
+        assert time.monotonic() - begin < 2
+        logger.info("✓ Failure stopped 3 consumer threads")
+
+
+class TestGracefulShutdown:
+    """Test suite for SIGTERM drain, final commit and startup metrics"""
+
+    def test_wait_drained(self):
+        """Test waiting for in-flight records to finish"""
+        logger.info("Testing tracker drain wait")
+
+        tracker = OffsetTracker()
+        tp = TopicPartition("drain.a", 0)
+        epoch = tracker.track(tp, 0)
+        assert tracker.wait_drained(timeout=0.01) is False
+
+        threading.Timer(0.05, tracker.complete, args=(tp, 0, epoch)).start()
+        assert tracker.wait_drained(timeout=2) is True
+        assert tracker.in_flight() == 0
+        logger.info("✓ Drain wait returns once the last record completes")
+
+    def test_drain_commits_finished_and_abandons_rest(self):
+        """Test the final commit covers finished records and stragglers are skipped"""
+        logger.info("Testing drain deadline")
+
+        stop_event = threading.Event()
+        consumer = FakeConsumer([], stop_event)
+        tracker = OffsetTracker()
+        tp = TopicPartition("drain.b", 0)
+        epochs = [tracker.track(tp, offset) for offset in range(3)]
+        tracker.complete(tp, 0, epochs[0])
+        tracker.complete(tp, 1, epochs[1])
+
+        worker.drain_consumer("consumer-0", consumer, tracker, timeout=0.05)
+
+        assert consumer.committed[tp].offset == 2
+        assert consumer.closed
+        assert tracker.partitions() == []
+        assert not tracker.is_current(tp, epochs[2])
+        logger.info("✓ Offset 2 committed, unfinished record left for redelivery")
+
+    def test_sigterm_starts_drain(self):
+        """Test SIGTERM sets the stop event instead of killing the worker"""
+        logger.info("Testing SIGTERM handling")
+
+        stop_event = threading.Event()
+        previous = {sig: signal.getsignal(sig) for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            worker.install_signal_handlers(stop_event)
+            os.kill(os.getpid(), signal.SIGTERM)
+            assert stop_event.wait(1)
+            os.kill(os.getpid(), signal.SIGTERM)  # second signal keeps draining
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+        logger.info("✓ SIGTERM turned into a drain")
+
+    def test_startup_to_first_message(self):
+        """Test the first consumed record exports time since startup once"""
+        logger.info("Testing startup-to-first-message metric")
+
+        worker.FIRST_MESSAGE.clear()
+        stop_event = threading.Event()
+        tp = TopicPartition("drain.c", 0)
+        consumer = FakeConsumer([{tp: [ConsumerRecord("drain.c", 0, 0, 0, None, {})]}], stop_event)
+        worker.consume_stream(consumer, datetime.now(), timeout_ms=0, stop_event=stop_event)
+
+        first = startup_to_first_message_seconds._value.get()
+        assert first > 0
+        worker.note_first_message()
+        assert startup_to_first_message_seconds._value.get() == first
+        logger.info(f"✓ First message after {first:.2f}s")
+
+
 if __name__ == "__main__":
     # Run with: pytest services/notification-worker/tests/test_worker.py -v
     logger.info("Run tests with: pytest services/notification-worker/tests/test_worker.py -v")
@@ -1,66 +1,203 @@
-from kafka import KafkaConsumer
+from kafka import KafkaConsumer, KafkaProducer
+from collections import defaultdict
+from contextlib import nullcontext
 import json
 import os
 import logging
+import signal
+import time
 from datetime import datetime
 from prometheus_client import start_http_server
 import prometheus_metrics
 import threading
+from handler_pool import KeyedWorkerPool
+from offset_tracker import OffsetTracker, CommitOnRebalanceListener
+from lag_monitor import LagMonitor
+from retry_pipeline import RetryPipeline, parse_tiers, retry_tier, source_topic
+from structured_logging import TEXT_FORMAT, EventSampler, LazyJson, configure_logging
+from delivery import DeliveryEngine
+from dedup_store import build_dedup_store, event_id
+from digest import Coalescer, DigestRule, Pending
+from config import KAFKA_BOOTSTRAP_SERVERS, TOPICS, TOPIC_GROUPS
 
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format=TEXT_FORMAT
 )
 logger = logging.getLogger(__name__)
 
-KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'kafka:9092').split(',')
-KAFKA_GROUP_ID = os.getenv('KAFKA_GROUP_ID', 'notification-worker-group')
+# Reference point for the startup-to-first-message metric
+PROCESS_STARTED_AT = time.monotonic()
 
-TOPICS = [
-    'user.created',
-    'order.created',
-    'order.payment_confirmed',
-    'order.status_changed',
-    'stock.low',
-    'api.rate_limited',
-    'chaos.injected'
-]
+# Logging: 'text' (multi-line, human friendly) or 'json' (one compact line
+# per event). Verbose per-event output is sampled at EVENT_LOG_SAMPLE_RATE.
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'true').lower() == 'true'
+EVENT_LOG_SAMPLE_RATE = float(os.getenv('EVENT_LOG_SAMPLE_RATE', 1.0 if LOG_FORMAT == 'text' else 0.01))
+
+# Handlers' per-event detail lines; only emitted for sampled events
+event_logger = logging.getLogger(f"{__name__}.events")
+EVENT_SAMPLER = EventSampler(EVENT_LOG_SAMPLE_RATE)
+EVENT_DUMP_INDENT = 2 if LOG_FORMAT == 'text' else None
+
+# Topic groups this deployment consumes: 'all' or a comma-separated list of
+# TOPIC_GROUPS keys, e.g. 'orders' or 'users,alerts'
+TOPIC_GROUP_SELECTION = os.getenv('TOPIC_GROUPS', 'all')
+
+# Consumer group; defaults to one group per topic group selection so
+# deployments consuming different groups scale and rebalance independently
+KAFKA_GROUP_ID = os.getenv('KAFKA_GROUP_ID', '')
+
+# Kafka consumers (group members) per pod; each gets its own partitions.
+# Members beyond the partition count of the selected topics stay idle.
+CONSUMER_THREADS = int(os.getenv('CONSUMER_THREADS', 1))
+
+# How long the group waits for a member that stopped heartbeating before
+# moving its partitions; a drained member leaves the group right away
+KAFKA_SESSION_TIMEOUT_MS = int(os.getenv('KAFKA_SESSION_TIMEOUT_MS', 10000))
+
+# On SIGTERM: stop polling, then wait this long for in-flight records before
+# committing final offsets and leaving the group
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('SHUTDOWN_DRAIN_SECONDS', 25))
+
+# Micro-batch consumption (poll()-based) instead of one record at a time
+BATCH_MODE = os.getenv('BATCH_MODE', 'false').lower() == 'true'
+BATCH_MAX_RECORDS = int(os.getenv('BATCH_MAX_RECORDS', 500))
+BATCH_TIMEOUT_MS = int(os.getenv('BATCH_TIMEOUT_MS', 1000))
+
+# Poll timeout for one-record-at-a-time mode
+POLL_TIMEOUT_MS = int(os.getenv('POLL_TIMEOUT_MS', 1000))
+
+# Minimum interval between asynchronous offset commits
+COMMIT_INTERVAL_MS = int(os.getenv('COMMIT_INTERVAL_MS', 1000))
+
+# How often the background thread samples consumer lag
+LAG_SAMPLE_INTERVAL_SECONDS = float(os.getenv('LAG_SAMPLE_INTERVAL_SECONDS', 15))
+
+# Tiered retry topics (<topic>.retry.<tier>) and dead-letter topic (<topic>.dlq)
+RETRY_ENABLED = os.getenv('RETRY_ENABLED', 'true').lower() == 'true'
+RETRY_TIERS = parse_tiers(os.getenv('RETRY_TIERS', '5s,1m'))
+# Longest the poll thread waits to publish one batch of failures; keep it
+# well below max.poll.interval.ms (5 minutes)
+RETRY_SEND_TIMEOUT_SECONDS = float(os.getenv('RETRY_SEND_TIMEOUT_SECONDS', 10))
+
+# Concurrent handler execution (1 = run handlers on the consumer thread)
+HANDLER_CONCURRENCY = int(os.getenv('HANDLER_CONCURRENCY', 1))
+HANDLER_MAX_IN_FLIGHT = int(os.getenv('HANDLER_MAX_IN_FLIGHT', 1000))
+
+# Drop redelivered events by event_id: 'lru' (exact, bounded) or 'bloom'
+# (fixed memory, tiny false-positive rate), optionally shared across pods
+# through Redis keys that expire after DEDUP_TTL_SECONDS
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_BACKEND = os.getenv('DEDUP_BACKEND', 'lru').lower()
+DEDUP_MAX_ENTRIES = int(os.getenv('DEDUP_MAX_ENTRIES', 100000))
+DEDUP_BLOOM_ERROR_RATE = float(os.getenv('DEDUP_BLOOM_ERROR_RATE', 1e-6))
+DEDUP_REDIS_URL = os.getenv('DEDUP_REDIS_URL', '')
+DEDUP_TTL_SECONDS = int(os.getenv('DEDUP_TTL_SECONDS', 86400))
+
+# Delivery channels (SMTP_*, WEBHOOK_*, SLACK_* settings); channels that are
+# not configured only log their notifications
+DELIVERY = DeliveryEngine.from_env()
+
+# Coalescing windows (0 = one notification per event): order events per
+# order_id, one inventory report for all stock.low events, one alert per IP
+# for api.rate_limited and one per chaos type for chaos.injected. A record's
+# offset is committed only once its digest was sent or routed to the retry
+# topics, so commits of these topics trail by up to one window.
+DIGEST_ORDER_WINDOW_SECONDS = float(os.getenv('DIGEST_ORDER_WINDOW_SECONDS', 10))
+DIGEST_STOCK_WINDOW_SECONDS = float(os.getenv('DIGEST_STOCK_WINDOW_SECONDS', 60))
+DIGEST_RATE_LIMIT_WINDOW_SECONDS = float(os.getenv('DIGEST_RATE_LIMIT_WINDOW_SECONDS', 60))
+DIGEST_CHAOS_WINDOW_SECONDS = float(os.getenv('DIGEST_CHAOS_WINDOW_SECONDS', 60))
+DIGEST_MAX_EVENTS = int(os.getenv('DIGEST_MAX_EVENTS', 1000))
+
+def select_topics(selection):
+    """Topics of a TOPIC_GROUPS selection ('all' or e.g. 'orders,alerts')"""
+    names = [name.strip() for name in selection.split(',') if name.strip()]
+    if not names or names == ['all']:
+        return list(TOPICS)
+    unknown = [name for name in names if name not in TOPIC_GROUPS]
+    if unknown:
+        raise ValueError(f"Unknown topic group(s) {unknown}, expected 'all' or {sorted(TOPIC_GROUPS)}")
+    selected = {topic for name in names for topic in TOPIC_GROUPS[name]}
+    return [topic for topic in TOPICS if topic in selected]
+
+def consumer_group_id(selection):
+    """Consumer group for a topic group selection (KAFKA_GROUP_ID wins)"""
+    if KAFKA_GROUP_ID:
+        return KAFKA_GROUP_ID
+    names = sorted(name.strip() for name in selection.split(',') if name.strip())
+    if not names or names == ['all']:
+        return 'notification-worker-group'
+    return f"notification-worker-{'-'.join(names)}-group"
+
+# Event field that defines processing order for each topic. Events sharing a
+# field/value pair (e.g. all order.* events for one order_id) are never
+# processed out of order or concurrently by the handler pool.
+ORDERING_KEYS = {
+    'user.created': 'user_id',
+    'order.created': 'order_id',
+    'order.payment_confirmed': 'order_id',
+    'order.status_changed': 'order_id',
+    'stock.low': 'product_id',
+    'api.rate_limited': 'ip',
+    'chaos.injected': 'chaos_type'
+}
 
 def process_user_created(message):
     """Process user created event"""
-    logger.info(f"📧 NEW USER REGISTERED")
-    logger.info(f"   Username: {message.get('username')}")
-    logger.info(f"   Email: {message.get('email')}")
-    logger.info(f"   ✉️  Welcome email sent to {message.get('email')}")
+    log = EVENT_SAMPLER.logger(event_logger)
+    log.info("📧 NEW USER REGISTERED")
+    log.info("   Username: %s", message.get('username'))
+    log.info("   Email: %s", message.get('email'))
+    DELIVERY.notify(
+        'email', message.get('email'), "Welcome to CloudCart",
+        f"Hi {message.get('username')}, thanks for signing up!"
+    )
+    log.info("   ✉️  Welcome email sent to %s", message.get('email'))
 
 def process_order_created(message):
     """Process order created event"""
-    logger.info(f"🛒 ORDER CREATED")
-    logger.info(f"   Order ID: #{message.get('order_id')}")
-    logger.info(f"   User ID: {message.get('user_id')}")
-    logger.info(f"   Total: ${message.get('total_amount')}")
-    logger.info(f"   Items: {message.get('items', 'N/A')}")
-    logger.info(f"   Status: awaiting_payment")
-    logger.info(f"   📧 Order confirmation sent to user")
-    logger.info(f"   💳 Payment instructions sent")
-    logger.info(f"   ⏰ Awaiting payment within 24 hours")
+    log = EVENT_SAMPLER.logger(event_logger)
+    log.info("🛒 ORDER CREATED")
+    log.info("   Order ID: #%s", message.get('order_id'))
+    log.info("   User ID: %s", message.get('user_id'))
+    log.info("   Total: $%s", message.get('total_amount'))
+    log.info("   Items: %s", message.get('items', 'N/A'))
+    log.info("   Status: awaiting_payment")
+    DIGESTS.add('order', message.get('order_id'), 'order.created', message)
+    log.info("   📧 Order confirmation sent to user")
+    log.info("   💳 Payment instructions sent")
+    log.info("   ⏰ Awaiting payment within 24 hours")
 
 def process_order_payment_confirmed(message):
     """Process order payment confirmed event"""
-    logger.info(f"✅ PAYMENT CONFIRMED")
-    logger.info(f"   Order ID: #{message.get('order_id')}")
-    logger.info(f"   User ID: {message.get('user_id')}")
-    logger.info(f"   Amount: ${message.get('total_amount')}")
-    logger.info(f"   Items: {message.get('item_count', 'N/A')}")
-    logger.info(f"   Payment Method: {message.get('payment_method')}")
-    logger.info(f"   Status: awaiting_payment → confirmed")
-    logger.info(f"   📊 Stock reduced for all items in order")
-    logger.info(f"   📦 Order is now CONFIRMED and ready for fulfillment")
-    logger.info(f"   📧 Payment confirmation sent to user")
-    logger.info(f"   📧 Fulfillment notification sent to warehouse team")
+    log = EVENT_SAMPLER.logger(event_logger)
+    log.info("✅ PAYMENT CONFIRMED")
+    log.info("   Order ID: #%s", message.get('order_id'))
+    log.info("   User ID: %s", message.get('user_id'))
+    log.info("   Amount: $%s", message.get('total_amount'))
+    log.info("   Items: %s", message.get('item_count', 'N/A'))
+    log.info("   Payment Method: %s", message.get('payment_method'))
+    log.info("   Status: awaiting_payment → confirmed")
+    log.info("   📊 Stock reduced for all items in order")
+    log.info("   📦 Order is now CONFIRMED and ready for fulfillment")
+    DIGESTS.add('order', message.get('order_id'), 'order.payment_confirmed', message)
+    log.info("   📧 Payment confirmation sent to user")
+    log.info("   📧 Fulfillment notification sent to warehouse team")
+
+STATUS_EMOJI = {
+    'awaiting_payment': '⏳',
+    'confirmed': '✅',
+    'shipped': '📦',
+    'delivered': '🎉',
+    'cancelled': '❌',
+    'returned': '↩️'
+}
 
 def process_order_status_changed(message):
     """Process order status change event"""
+    log = EVENT_SAMPLER.logger(event_logger)
     old_status = message.get('old_status')
     new_status = message.get('new_status')
     order_id = message.get('order_id')
@@ -69,64 +206,122 @@ def process_order_status_changed(message):
     item_count = message.get('item_count', 'N/A')
     custom_message = message.get('message', 'Order status updated')
     
-    status_emoji = {
-        'awaiting_payment': '⏳',
-        'confirmed': '✅',
-        'shipped': '📦',
-        'delivered': '🎉',
-        'cancelled': '❌',
-        'returned': '↩️'
-    }
-    
-    emoji = status_emoji.get(new_status, '📋')
-    logger.info(f"{emoji} ORDER STATUS UPDATED")
-    logger.info(f"   Order ID: #{order_id}")
-    logger.info(f"   User ID: {user_id}")
-    logger.info(f"   Status: {old_status.upper()} → {new_status.upper()}")
-    logger.info(f"   Total: ${total_amount}")
-    logger.info(f"   Items: {item_count}")
-    logger.info(f"   Message: {custom_message}")
+    emoji = STATUS_EMOJI.get(new_status, '📋')
+    log.info("%s ORDER STATUS UPDATED", emoji)
+    log.info("   Order ID: #%s", order_id)
+    log.info("   User ID: %s", user_id)
+    log.info("   Status: %s → %s", old_status.upper(), new_status.upper())
+    log.info("   Total: $%s", total_amount)
+    log.info("   Items: %s", item_count)
+    log.info("   Message: %s", custom_message)
+    DIGESTS.add('order', order_id, 'order.status_changed', message)
     
     # Log notification actions based on status
     if new_status == 'shipped':
-        logger.info(f"   📬 SHIPPING NOTIFICATION: Order #{order_id} is on the way to user #{user_id}")
-        logger.info(f"   📧 Email sent: Tracking information provided")
+        log.info("   📬 SHIPPING NOTIFICATION: Order #%s is on the way to user #%s", order_id, user_id)
+        log.info("   📧 Email sent: Tracking information provided")
     elif new_status == 'delivered':
-        logger.info(f"   🎉 DELIVERY CONFIRMATION: Order #{order_id} delivered to user #{user_id}")
-        logger.info(f"   📧 Email sent: Delivery confirmation")
-        logger.info(f"   📱 SMS sent: Delivery complete")
+        log.info("   🎉 DELIVERY CONFIRMATION: Order #%s delivered to user #%s", order_id, user_id)
+        log.info("   📧 Email sent: Delivery confirmation")
+        log.info("   📱 SMS sent: Delivery complete")
     elif new_status == 'confirmed':
-        logger.info(f"   ✅ ORDER CONFIRMATION: Order #{order_id} confirmed for user #{user_id}")
-        logger.info(f"   📧 Email sent: Order confirmed, ready for fulfillment")
-        logger.info(f"   💰 Amount: ${total_amount}")
+        log.info("   ✅ ORDER CONFIRMATION: Order #%s confirmed for user #%s", order_id, user_id)
+        log.info("   📧 Email sent: Order confirmed, ready for fulfillment")
+        log.info("   💰 Amount: $%s", total_amount)
     elif new_status == 'cancelled':
-        logger.warning(f"   ⚠️  ORDER CANCELLATION: Order #{order_id} cancelled")
-        logger.warning(f"   📧 Email sent: Cancellation confirmation and refund details")
-        logger.warning(f"   💸 Refund: ${total_amount} initiated")
+        log.warning("   ⚠️  ORDER CANCELLATION: Order #%s cancelled", order_id)
+        log.warning("   📧 Email sent: Cancellation confirmation and refund details")
+        log.warning("   💸 Refund: $%s initiated", total_amount)
     elif new_status == 'returned':
-        logger.info(f"   ↩️  RETURN PROCESSED: Order #{order_id} returned by user #{user_id}")
-        logger.info(f"   📧 Email sent: Return confirmation")
+        log.info("   ↩️  RETURN PROCESSED: Order #%s returned by user #%s", order_id, user_id)
+        log.info("   📧 Email sent: Return confirmation")
     else:
-        logger.info(f"   📧 Notification sent for status change to {new_status}")
+        log.info("   📧 Notification sent for status change to %s", new_status)
 
 def process_stock_low(message):
     """Process low stock event"""
-    logger.warning(f"📉 LOW STOCK ALERT!")
-    logger.warning(f"   Product: {message.get('product_name')} (ID: {message.get('product_id')})")
-    logger.warning(f"   Remaining stock: {message.get('stock')}")
-    logger.warning(f"   🚨 Inventory alert sent to management team")
+    log = EVENT_SAMPLER.logger(event_logger)
+    log.warning("📉 LOW STOCK ALERT!")
+    log.warning("   Product: %s (ID: %s)", message.get('product_name'), message.get('product_id'))
+    log.warning("   Remaining stock: %s", message.get('stock'))
+    DIGESTS.add('inventory', 'inventory', 'stock.low', message)
+    log.warning("   🚨 Inventory alert sent to management team")
 
 def process_rate_limited(message):
     """Process rate limit event"""
-    logger.warning(f"🚨 NOTIFICATION: Rate limit triggered")
-    logger.warning(f"   IP: {message.get('ip')}, Path: {message.get('path')}")
-    logger.warning(f"   Alert would be sent to security team")
+    log = EVENT_SAMPLER.logger(event_logger)
+    log.warning("🚨 NOTIFICATION: Rate limit triggered")
+    log.warning("   IP: %s, Path: %s", message.get('ip'), message.get('path'))
+    DIGESTS.add('rate_limit', message.get('ip'), 'api.rate_limited', message)
+    log.warning("   Alert would be sent to security team")
 
 def process_chaos_injected(message):
     """Process chaos injection event"""
-    logger.info(f"🔥 NOTIFICATION: Chaos event detected")
-    logger.info(f"   Type: {message.get('chaos_type')}")
-    logger.info(f"   Details: {message.get('details')}")
+    log = EVENT_SAMPLER.logger(event_logger)
+    log.info("🔥 NOTIFICATION: Chaos event detected")
+    log.info("   Type: %s", message.get('chaos_type'))
+    log.info("   Details: %s", message.get('details'))
+    DIGESTS.add('chaos', message.get('chaos_type'), 'chaos.injected', message)
+
+def render_order_digest(order_id, items):
+    """One update per order for all of its events in the window"""
+    steps = []
+    for topic, event in items:
+        if topic == 'order.created':
+            steps.append('created')
+        elif topic == 'order.payment_confirmed':
+            steps.append('paid')
+        else:
+            steps.append(event.get('new_status', 'updated'))
+    latest = items[-1][1]
+    if len(items) == 1 and items[0][0] == 'order.created':
+        body = f"Total ${latest.get('total_amount')}, awaiting payment within 24 hours"
+    else:
+        body = latest.get('message') or f"Order is now {steps[-1]}"
+    data = {
+        'order_id': order_id,
+        'status': steps[-1],
+        'total_amount': latest.get('total_amount'),
+        'events': [event for _, event in items],
+    }
+    return latest.get('user_id'), f"Order #{order_id}: {' → '.join(steps)}", body, data
+
+def render_stock_report(key, items):
+    """One inventory report listing every low-stock product (latest level)"""
+    products = {}
+    for _, event in items:
+        products[event.get('product_id')] = event
+    lines = [
+        f"• {event.get('product_name')} (ID: {product_id}): {event.get('stock')} left"
+        for product_id, event in sorted(products.items(), key=lambda item: item[1].get('stock') or 0)
+    ]
+    return 'inventory', f"Low stock report: {len(products)} products", '\n'.join(lines), None
+
+def render_rate_limit_alert(ip, items):
+    """One alert per IP for every rate-limited request in the window"""
+    paths = defaultdict(int)
+    for _, event in items:
+        paths[event.get('path')] += 1
+    top = ', '.join(f"{path} ({count})" for path, count in
+                    sorted(paths.items(), key=lambda item: -item[1])[:5])
+    return 'security', f"Rate limit triggered for {ip}", f"{len(items)} requests limited: {top}", None
+
+def render_chaos_digest(chaos_type, items):
+    """One alert per chaos type"""
+    latest = items[-1][1]
+    return 'sre', f"Chaos injected: {chaos_type}", \
+        f"{len(items)} injections, latest: {latest.get('details')}", None
+
+# Coalesces bursts into digests; sent through DELIVERY when a window closes
+DIGESTS = Coalescer(lambda *args: DELIVERY.notify(*args))
+DIGESTS.register(DigestRule('order', 'webhook', render_order_digest,
+                            DIGEST_ORDER_WINDOW_SECONDS, DIGEST_MAX_EVENTS))
+DIGESTS.register(DigestRule('inventory', 'slack', render_stock_report,
+                            DIGEST_STOCK_WINDOW_SECONDS, DIGEST_MAX_EVENTS))
+DIGESTS.register(DigestRule('rate_limit', 'slack', render_rate_limit_alert,
+                            DIGEST_RATE_LIMIT_WINDOW_SECONDS, DIGEST_MAX_EVENTS))
+DIGESTS.register(DigestRule('chaos', 'slack', render_chaos_digest,
+                            DIGEST_CHAOS_WINDOW_SECONDS, DIGEST_MAX_EVENTS))
 
 # Event handlers mapping
 EVENT_HANDLERS = {
@@ -139,10 +334,455 @@ EVENT_HANDLERS = {
     'chaos.injected': process_chaos_injected
 }
 
+def batched(handler):
+    """Wrap a per-event handler so it can process a whole batch of events.
+
+    Returns a list of (event, exception) tuples for events that failed, so one
+    bad record does not abort the rest of the batch. Notifications are
+    collected while the batch runs and sent per channel in provider-sized
+    batches afterwards; an event whose notification failed counts as failed.
+    """
+    def batch_handler(events):
+        failures = []
+        with DELIVERY.collect() as outbox:
+            for event in events:
+                queued = len(outbox.items)
+                outbox.current = event
+                try:
+                    EVENT_SAMPLER.sample()
+                    handler(event)
+                except Exception as e:
+                    del outbox.items[queued:]
+                    failures.append((event, e))
+        return failures + outbox.failures
+    batch_handler.__name__ = f"batched_{handler.__name__}"
+    return batch_handler
+
+# Batch-aware handlers mapping (topic -> fn(list_of_events) -> failures)
+BATCH_HANDLERS = {topic: batched(handler) for topic, handler in EVENT_HANDLERS.items()}
+
+def ordering_key(topic, event):
+    """Return the ordering key for an event, or None if it has none"""
+    field = ORDERING_KEYS.get(topic)
+    if field is None or not isinstance(event, dict):
+        return None
+    value = event.get(field)
+    return None if value is None else (field, value)
+
+def process_message(message, start_time):
+    """Process a single Kafka record (one-record-at-a-time mode).
+
+    Returns the handler exception if processing failed, otherwise None.
+    """
+    topic = source_topic(message.topic)
+    try:
+        event_data = message.value
+
+        # Update uptime
+        uptime = (datetime.now() - start_time).total_seconds()
+        prometheus_metrics.worker_uptime_seconds.set(uptime)
+
+        # Record message consumed
+        prometheus_metrics.messages_consumed_total.labels(topic=topic).inc()
+
+        # Verbose dump for sampled events only; formatted lazily by the sink
+        if EVENT_SAMPLER.sample():
+            logger.info("\n%s", '=' * 60)
+            logger.info("Received event from topic: %s", topic)
+            logger.info("Event data: %s", LazyJson(event_data, EVENT_DUMP_INDENT))
+            logger.info("%s", '=' * 60)
+
+        # Process event with appropriate handler
+        process_start = time.perf_counter()
+        handler = EVENT_HANDLERS.get(topic)
+        if handler:
+            handler(event_data)
+            # Record successful processing
+            process_duration = time.perf_counter() - process_start
+            prometheus_metrics.message_processing_duration_seconds.labels(
+                topic=topic, event_type=topic
+            ).observe(process_duration)
+            prometheus_metrics.messages_processed_total.labels(
+                topic=topic, event_type=topic
+            ).inc()
+        else:
+            logger.warning("No handler found for topic: %s", topic)
+            prometheus_metrics.messages_failed_total.labels(
+                topic=topic, error_type='no_handler'
+            ).inc()
+            return None
+
+        # Simulate notification sent
+        logger.info("✉️  Notification processed successfully for %s", topic, extra={
+            'topic': topic,
+            'partition': message.partition,
+            'offset': message.offset,
+            'duration_ms': round(process_duration * 1000, 3),
+        })
+
+    except Exception as e:
+        logger.error("Error processing message from %s: %s", topic, e, extra={
+            'topic': topic,
+            'partition': message.partition,
+            'offset': message.offset,
+            'error_type': type(e).__name__,
+        })
+        prometheus_metrics.messages_failed_total.labels(
+            topic=topic, error_type=type(e).__name__
+        ).inc()
+        return e
+
+def finish_record(tracker, tp, offset, epoch, dedup=None, key=None):
+    """Pending callback that settles a record once its notifications went out.
+
+    The event id is recorded as handled only if every notification was
+    delivered, and released otherwise. The offset is completed, or marked
+    failed if the event could not be routed to the retry topics.
+    """
+    def finish(failed, errored):
+        if dedup is not None:
+            if errored:
+                dedup.release([key])
+            else:
+                dedup.done([key])
+        if tracker is None:
+            return
+        if failed:
+            tracker.fail(tp, offset, epoch)
+        else:
+            tracker.complete(tp, offset, epoch)
+    return finish
+
+def handle_message(tp, message, start_time, tracker, epoch, retries=None, dedup=None):
+    """Process one tracked record and mark its offset complete.
+
+    A failed record is handed to the retry pipeline before its offset is
+    completed, so it is never lost; if the pipeline cannot publish it, the
+    record is marked failed instead and stays uncommitted. A record whose
+    event went into a digest window completes once that window was emitted.
+    A record whose event was already handled is skipped. The event id is
+    recorded once the record completes, and released if the event failed,
+    so a later DLQ replay of it is handled. Retry topic records are never
+    deduplicated.
+    """
+    if not tracker.is_current(tp, epoch):
+        return  # partition revoked while the record was queued
+    if dedup and not retry_tier(message.topic):
+        if not dedup.claim(message.topic, [event_id(message.value)])[0]:
+            tracker.complete(tp, message.offset, epoch)
+            return
+    pending = Pending(finish_record(tracker, tp, message.offset, epoch, dedup, event_id(message.value)))
+    with DIGESTS.holding({id(message.value): pending}):
+        error = process_message(message, start_time)
+    if retries:
+        topic = source_topic(message.topic)
+        unrouted = retries.handle_failures(topic, [(message.value, error)]) if error is not None else []
+        tier = retry_tier(message.topic)
+        if tier:
+            retries.record_outcome(topic, tier, 1, 0 if error is None else 1)
+        if unrouted:
+            # Published nowhere: the consumer stops before committing past it
+            pending.release(failed=True)
+            return
+    pending.release(errored=error is not None)
+
+FIRST_MESSAGE = threading.Event()
+
+def note_first_message():
+    """Export how long it took from process start to the first record"""
+    if not FIRST_MESSAGE.is_set():
+        FIRST_MESSAGE.set()
+        seconds = time.monotonic() - PROCESS_STARTED_AT
+        prometheus_metrics.set_startup_to_first_message(seconds)
+        logger.info(f"First record consumed {seconds:.2f}s after startup")
+
+def consume_stream(consumer, start_time, pool=None, tracker=None,
+                   timeout_ms=POLL_TIMEOUT_MS, stop_event=None, lag_monitor=None,
+                   retries=None, dedup=None):
+    """Consume and process records one at a time.
+
+    Offsets are tracked per record and committed asynchronously once every
+    earlier record of the partition is done. With a handler pool, records are
+    dispatched to it keyed by ordering_key(). Raises RetryRouteError once a
+    failed event could not be published to the retry topics or DLQ.
+    """
+    tracker = tracker or OffsetTracker(COMMIT_INTERVAL_MS)
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        if retries:
+            retries.check()
+            retries.resume_due(consumer)
+        records = consumer.poll(timeout_ms=timeout_ms)
+        if records and not FIRST_MESSAGE.is_set():
+            note_first_message()
+        if records and retries:
+            records = retries.hold_back(consumer, records)
+        if records and lag_monitor:
+            lag_monitor.observe(records)
+        for tp, messages in records.items():
+            for message in messages:
+                epoch = tracker.track(tp, message.offset)
+                if pool:
+                    pool.submit(ordering_key(source_topic(message.topic), message.value),
+                                handle_message, tp, message, start_time, tracker, epoch, retries, dedup)
+                else:
+                    handle_message(tp, message, start_time, tracker, epoch, retries, dedup)
+        tracker.maybe_commit(consumer)
+
+def process_batch(topic, events):
+    """Dispatch one topic's batch of events to its batch-aware handler.
+
+    Metrics are updated once for the whole batch rather than per record.
+    Returns the (event, exception) failures of the batch.
+    """
+    handler = BATCH_HANDLERS.get(topic)
+    if handler is None:
+        logger.warning("No handler found for topic: %s", topic)
+        prometheus_metrics.record_batch_processed(
+            topic, len(events), 0, {'no_handler': len(events)}
+        )
+        return []
+
+    process_start = time.perf_counter()
+    try:
+        failures = handler(events)
+    except Exception as e:
+        # A batch handler that blows up fails the whole batch
+        failures = [(event, e) for event in events]
+    duration = time.perf_counter() - process_start
+
+    errors = defaultdict(int)
+    for event, error in failures:
+        errors[type(error).__name__] += 1
+        logger.error("Error processing message from %s: %s", topic, error,
+                     extra={'topic': topic, 'error_type': type(error).__name__})
+
+    prometheus_metrics.record_batch_processed(topic, len(events), duration, errors)
+    logger.info("✉️  Processed batch of %d %s events (%d failed) in %.2fms",
+                len(events), topic, len(failures), duration * 1000, extra={
+                    'topic': topic,
+                    'batch_size': len(events),
+                    'failed': len(failures),
+                    'duration_ms': round(duration * 1000, 3),
+                })
+    return failures
+
+def run_tracked_batch(topic, tracked, tracker=None, retries=None, dedup=None):
+    """Process (tp, message, epoch) records of one topic as a single batch.
+
+    Records whose partition was revoked since they were polled are skipped,
+    as are records whose event was already handled. Failed events go to the
+    retry pipeline, then every record is marked complete, except those the
+    pipeline could not publish, which are marked failed, and those whose
+    event waits in a digest window, which complete once it was emitted.
+    Event ids are recorded (or released) as their records complete.
+    Batches from a retry topic run the original topic's handler.
+    """
+    if tracker is not None:
+        tracked = [item for item in tracked if tracker.is_current(item[0], item[2])]
+        if not tracked:
+            return
+    if dedup is not None and not retry_tier(topic):
+        fresh = dedup.claim(topic, [event_id(message.value) for _, message, _ in tracked])
+        duplicates = [item for item, ok in zip(tracked, fresh) if not ok]
+        if duplicates:
+            tracked = [item for item, ok in zip(tracked, fresh) if ok]
+            if tracker is not None:
+                tracker.complete_many([(tp, message.offset, epoch) for tp, message, epoch in duplicates])
+            if not tracked:
+                return
+    handler_topic = source_topic(topic)
+    pendings = {}
+    if tracker is not None or dedup is not None:
+        pendings = {id(message.value): Pending(finish_record(tracker, tp, message.offset, epoch,
+                                                             dedup, event_id(message.value)))
+                    for tp, message, epoch in tracked}
+    with DIGESTS.holding(pendings):
+        failures = process_batch(handler_topic, [message.value for _, message, _ in tracked])
+    failed = {id(event) for event, _ in failures}
+    unrouted = set()
+    if retries:
+        unrouted = {id(event) for event, _ in retries.handle_failures(handler_topic, failures)}
+        tier = retry_tier(topic)
+        if tier:
+            retries.record_outcome(handler_topic, tier, len(tracked), len(failures))
+    # Ids of records completing now go to the shared store in one write
+    with dedup.deferred() if dedup is not None else nullcontext():
+        for value_id, pending in pendings.items():
+            pending.release(failed=value_id in unrouted, errored=value_id in failed)
+
+def process_records(records, pool=None, tracker=None, retries=None, dedup=None):
+    """Group a poll() result by topic and process each topic's batch.
+
+    Records keep their partition order inside each topic batch. With a handler
+    pool, each topic batch is further split by pool lane so events sharing an
+    ordering key stay in one sub-batch, in order, on one thread.
+    """
+    by_topic = defaultdict(list)
+    for tp, messages in records.items():
+        for message in messages:
+            epoch = tracker.track(tp, message.offset) if tracker else None
+            by_topic[tp.topic].append((tp, message, epoch))
+
+    for topic, tracked in by_topic.items():
+        if pool is None:
+            run_tracked_batch(topic, tracked, tracker, retries, dedup)
+            continue
+
+        key_topic = source_topic(topic)
+        by_lane = defaultdict(list)
+        for item in tracked:
+            by_lane[pool.lane_for(ordering_key(key_topic, item[1].value))].append(item)
+        for lane, lane_items in by_lane.items():
+            pool.submit_to_lane(lane, run_tracked_batch, topic, lane_items, tracker, retries, dedup)
+
+def consume_batches(consumer, start_time, max_records=BATCH_MAX_RECORDS,
+                    timeout_ms=BATCH_TIMEOUT_MS, stop_event=None, pool=None,
+                    tracker=None, lag_monitor=None, retries=None, dedup=None):
+    """Consume micro-batches with poll() and commit finished offsets per batch.
+
+    Commits are asynchronous and only cover contiguous completed records, so
+    with a handler pool the next batch is polled without waiting for this one.
+    Raises RetryRouteError like consume_stream().
+    """
+    tracker = tracker or OffsetTracker(COMMIT_INTERVAL_MS)
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        if retries:
+            retries.check()
+            retries.resume_due(consumer)
+        records = consumer.poll(timeout_ms=timeout_ms, max_records=max_records)
+        if records and not FIRST_MESSAGE.is_set():
+            note_first_message()
+        if records and retries:
+            records = retries.hold_back(consumer, records)
+        if records:
+            if lag_monitor:
+                lag_monitor.observe(records)
+            process_records(records, pool, tracker, retries, dedup)
+
+            uptime = (datetime.now() - start_time).total_seconds()
+            prometheus_metrics.set_worker_uptime(uptime)
+        tracker.maybe_commit(consumer)
+
+def run_consumer(name, topics, group_id, start_time, stop_event, pool=None,
+                 lag_monitor=None, retries=None, dedup=None):
+    """Run one consumer group member until stop_event is set.
+
+    Each member has its own KafkaConsumer (not thread-safe), offset tracker
+    and rebalance listener; the handler pool, lag monitor, retry pipeline and
+    dedup store are shared by all members of the pod.
+    """
+    consumer = KafkaConsumer(
+        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+        group_id=group_id,
+        client_id=f"notification-worker-{name}",
+        auto_offset_reset='earliest',
+        # Offsets are committed by OffsetTracker once records are handled
+        enable_auto_commit=False,
+        max_poll_records=BATCH_MAX_RECORDS,
+        session_timeout_ms=KAFKA_SESSION_TIMEOUT_MS,
+        value_deserializer=lambda x: json.loads(x.decode('utf-8'))
+    )
+    tracker = OffsetTracker(COMMIT_INTERVAL_MS)
+    listener = CommitOnRebalanceListener(consumer, tracker, lag_monitor, retries, name,
+                                         started_at=PROCESS_STARTED_AT)
+    consumer.subscribe(topics, listener=listener)
+
+    try:
+        if BATCH_MODE:
+            consume_batches(consumer, start_time, stop_event=stop_event, pool=pool, tracker=tracker,
+                            lag_monitor=lag_monitor, retries=retries, dedup=dedup)
+        else:
+            consume_stream(consumer, start_time, stop_event=stop_event, pool=pool, tracker=tracker,
+                           lag_monitor=lag_monitor, retries=retries, dedup=dedup)
+    finally:
+        drain_consumer(name, consumer, tracker)
+
+def drain_consumer(name, consumer, tracker, timeout=None):
+    """Finish in-flight records, commit final offsets and leave the group.
+
+    Open digest windows hold their records' offsets, so they are emitted
+    while waiting. Records still unfinished after the deadline are
+    abandoned: their partitions are dropped from the tracker so queued
+    handler tasks skip them, and they are redelivered to the next owner of
+    the partition.
+    """
+    timeout = SHUTDOWN_DRAIN_SECONDS if timeout is None else timeout
+    drain_start = time.monotonic()
+    deadline = drain_start + timeout
+    drained = tracker.wait_drained(0)
+    while not drained and time.monotonic() < deadline:
+        DIGESTS.flush_due(force=True)
+        drained = tracker.wait_drained(min(0.1, max(0, deadline - time.monotonic())))
+    abandoned = tracker.in_flight()
+    tracker.commit_sync(consumer)
+    tracker.revoke(tracker.partitions())
+    try:
+        # Leaving the group lets the partitions move right away instead of
+        # after the session timeout
+        consumer.close(autocommit=False)
+    except Exception as e:
+        logger.warning(f"[{name}] Error closing consumer: {e}")
+    duration = time.monotonic() - drain_start
+    if drained:
+        logger.info(f"[{name}] Drained in {duration:.2f}s, final offsets committed")
+    else:
+        logger.warning(f"[{name}] Drain deadline of {timeout}s reached, "
+                       f"{abandoned} in-flight records left for redelivery")
+
+def install_signal_handlers(stop_event):
+    """Turn SIGTERM/SIGINT into a graceful drain via stop_event"""
+    def handle(signum, frame):
+        if stop_event.is_set():
+            logger.info(f"Received {signal.Signals(signum).name} while draining, still draining")
+            return
+        logger.info(f"Received {signal.Signals(signum).name}, draining "
+                    f"(deadline {SHUTDOWN_DRAIN_SECONDS}s)...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle)
+    signal.signal(signal.SIGINT, handle)
+
+def run_consumers(count, topics, group_id, start_time, stop_event, **kwargs):
+    """Run `count` consumer group members on their own threads.
+
+    If one member fails, the others are stopped and the error is raised so
+    the pod restarts.
+    """
+    errors = []
+
+    def member(name):
+        try:
+            run_consumer(name, topics, group_id, start_time, stop_event, **kwargs)
+        except Exception as e:
+            logger.error(f"[{name}] Consumer failed: {e}")
+            errors.append(e)
+            stop_event.set()
+
+    threads = [threading.Thread(target=member, args=(f"consumer-{i}",), name=f"consumer-{i}")
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
 def main():
+    log_listener = configure_logging(LOG_FORMAT, LOG_ASYNC, LOG_LEVEL)
+    selected_topics = select_topics(TOPIC_GROUP_SELECTION)
+    group_id = consumer_group_id(TOPIC_GROUP_SELECTION)
     logger.info("Starting Notification Worker...")
     logger.info(f"Kafka Brokers: {KAFKA_BOOTSTRAP_SERVERS}")
-    logger.info(f"Subscribed Topics: {TOPICS}")
+    logger.info(f"Topic groups: {TOPIC_GROUP_SELECTION} (consumer group {group_id})")
+    logger.info(f"Subscribed Topics: {selected_topics}")
 
     # Start Prometheus metrics HTTP server on port 8005
     metrics_port = int(os.getenv('METRICS_PORT', 8005))
@@ -153,64 +793,77 @@ def main():
     prometheus_metrics.worker_running.set(1)
     start_time = datetime.now()
 
+    # SIGTERM (k8s rollout) and Ctrl-C stop polling and drain in-flight work
+    stop_event = threading.Event()
+    install_signal_handlers(stop_event)
+    lag_consumer = lag_monitor = producer = pool = None
+
     try:
-        consumer = KafkaConsumer(
-            *TOPICS,
-            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-            group_id=KAFKA_GROUP_ID,
-            auto_offset_reset='earliest',
-            enable_auto_commit=True,
-            value_deserializer=lambda x: json.loads(x.decode('utf-8'))
-        )
+        # End offsets come from a separate group-less consumer so the lag
+        # thread never touches the (non thread-safe) group consumers
+        lag_consumer = KafkaConsumer(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
+        lag_monitor = LagMonitor(lag_consumer.end_offsets, LAG_SAMPLE_INTERVAL_SECONDS)
+        lag_monitor.start()
+
+        # Partition counts bound how many members (replicas x threads) get work
+        total_partitions = 0
+        for topic in selected_topics:
+            count = len(lag_consumer.partitions_for_topic(topic) or ())
+            prometheus_metrics.set_topic_partitions(topic, count)
+            total_partitions += count
+        logger.info(f"{total_partitions} partitions across selected topics, "
+                    f"{CONSUMER_THREADS} consumer threads per pod")
+
+        topics = list(selected_topics)
+        retries = None
+        if RETRY_ENABLED:
+            producer = KafkaProducer(
+                bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+                value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+                retries=5,
+                # send() blocks while metadata is unavailable; bound it too
+                max_block_ms=int(RETRY_SEND_TIMEOUT_SECONDS * 1000)
+            )
+            retries = RetryPipeline(producer, RETRY_TIERS, send_timeout=RETRY_SEND_TIMEOUT_SECONDS)
+            topics += retries.topics(selected_topics)
+            logger.info(f"Retry tiers: {[name for name, _ in RETRY_TIERS]} + DLQ")
 
+        dedup = None
+        if DEDUP_ENABLED:
+            dedup = build_dedup_store(DEDUP_BACKEND, DEDUP_MAX_ENTRIES, DEDUP_BLOOM_ERROR_RATE,
+                                      DEDUP_REDIS_URL, DEDUP_TTL_SECONDS)
+            logger.info(f"Dedup store: {DEDUP_BACKEND} ({DEDUP_MAX_ENTRIES} ids)"
+                        f"{' + Redis' if DEDUP_REDIS_URL else ''}")
+
+        if retries:
+            # Events of a digest that could not be sent go to the retry topics
+            DIGESTS.on_failure = retries.handle_failures
+        DIGESTS.start()
+
+        logger.info(f"Delivery channels: {sorted(DELIVERY.channels) or 'none (log only)'}")
         logger.info("✅ Notification Worker started successfully")
         logger.info("Waiting for events...")
 
-        for message in consumer:
-            try:
-                topic = message.topic
-                event_data = message.value
-
-                # Update uptime
-                uptime = (datetime.now() - start_time).total_seconds()
-                prometheus_metrics.worker_uptime_seconds.set(uptime)
-
-                # Record message consumed
-                prometheus_metrics.messages_consumed_total.labels(topic=topic).inc()
-
-                logger.info(f"\n{'='*60}")
-                logger.info(f"Received event from topic: {topic}")
-                logger.info(f"Event data: {json.dumps(event_data, indent=2)}")
-                logger.info(f"{'='*60}")
-
-                # Process event with appropriate handler
-                process_start = datetime.now()
-                handler = EVENT_HANDLERS.get(topic)
-                if handler:
-                    handler(event_data)
-                    # Record successful processing
-                    process_duration = (datetime.now() - process_start).total_seconds()
-                    prometheus_metrics.message_processing_duration_seconds.labels(
-                        topic=topic
-                    ).observe(process_duration)
-                    prometheus_metrics.messages_processed_total.labels(
-                        topic=topic, event_type=topic
-                    ).inc()
-                else:
-                    logger.warning(f"No handler found for topic: {topic}")
-                    prometheus_metrics.messages_failed_total.labels(
-                        topic=topic, error_type='no_handler'
-                    ).inc()
+        pool = None
+        if HANDLER_CONCURRENCY > 1:
+            pool = KeyedWorkerPool(HANDLER_CONCURRENCY, HANDLER_MAX_IN_FLIGHT)
+            logger.info(f"Handler pool: {HANDLER_CONCURRENCY} threads, "
+                        f"max {HANDLER_MAX_IN_FLIGHT} in-flight tasks")
 
-                # Simulate notification sent
-                logger.info(f"✉️  Notification processed successfully for {topic}\n")
+        if BATCH_MODE:
+            logger.info(f"Batch mode: up to {BATCH_MAX_RECORDS} records "
+                        f"per poll, {BATCH_TIMEOUT_MS}ms poll timeout")
 
-            except Exception as e:
-                logger.error(f"Error processing message: {e}")
-                prometheus_metrics.messages_failed_total.labels(
-                    topic=topic, error_type=type(e).__name__
-                ).inc()
-                continue
+        prometheus_metrics.set_consumer_threads(CONSUMER_THREADS)
+        consumer_args = (topics, group_id, start_time, stop_event)
+        consumer_kwargs = dict(pool=pool, lag_monitor=lag_monitor, retries=retries, dedup=dedup)
+        if CONSUMER_THREADS > 1:
+            run_consumers(CONSUMER_THREADS, *consumer_args, **consumer_kwargs)
+        else:
+            run_consumer('consumer-0', *consumer_args, **consumer_kwargs)
+
+        logger.info("Shutting down Notification Worker...")
+        prometheus_metrics.worker_running.set(0)
 
     except KeyboardInterrupt:
         logger.info("Shutting down Notification Worker...")
@@ -220,6 +873,22 @@ def main():
         prometheus_metrics.worker_running.set(0)
         prometheus_metrics.worker_restarts_total.inc()
         raise
+    finally:
+        # Offsets are committed by now; flush what the committed records
+        # produced (open digests, retry/DLQ sends) before exiting
+        DIGESTS.stop()
+        if pool and not pool.shutdown(timeout=SHUTDOWN_DRAIN_SECONDS):
+            logger.warning(f"Handler pool still busy after {SHUTDOWN_DRAIN_SECONDS}s, exiting anyway")
+        if producer:
+            producer.close(timeout=SHUTDOWN_DRAIN_SECONDS)
+        if lag_monitor:
+            lag_monitor.stop(timeout=1)
+        if lag_consumer:
+            lag_consumer.close(autocommit=False)
+        DELIVERY.close()
+        logger.info("Notification Worker stopped")
+        if log_listener:
+            log_listener.stop()
 
 if __name__ == "__main__":
     main()
@@ -2,7 +2,9 @@ package main
 
 import (
 	"context"
+	"crypto/rand"
 	"encoding/json"
+	"fmt"
 	"log"
 	"os"
 	"strings"
@@ -32,6 +34,16 @@ func publishOrderEvent(topic string, message map[string]interface{}) {
 		return
 	}
 
+	// Unique id per event so consumers can drop redelivered duplicates
+	if _, ok := message["event_id"]; !ok {
+		stamped := make(map[string]interface{}, len(message)+1)
+		for k, v := range message {
+			stamped[k] = v
+		}
+		stamped["event_id"] = newEventID()
+		message = stamped
+	}
+
 	messageBytes, err := json.Marshal(message)
 	if err != nil {
 		log.Printf("Failed to marshal message: %v", err)
@@ -51,3 +63,14 @@ func publishOrderEvent(topic string, message map[string]interface{}) {
 		log.Printf("Published event to %s: %v", topic, message)
 	}
 }
+
+// newEventID returns a random (version 4) UUID
+func newEventID() string {
+	b := make([]byte, 16)
+	if _, err := rand.Read(b); err != nil {
+		log.Printf("Failed to generate event id: %v", err)
+	}
+	b[6] = (b[6] & 0x0f) | 0x40
+	b[8] = (b[8] & 0x3f) | 0x80
+	return fmt.Sprintf("%x-%x-%x-%x-%x", b[0:4], b[4:6], b[6:8], b[8:10], b[10:16])
+}
@@ -1,7 +1,10 @@
 from kafka import KafkaProducer
+from kafka.errors import KafkaTimeoutError
 import json
 import os
+import uuid
 import logging
+import chaos_middleware
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,8 +23,11 @@ except Exception as e:
     producer = None
 
 def publish_event(topic: str, message: dict):
+    # Unique id per event so consumers can drop redelivered duplicates
+    message = {'event_id': str(uuid.uuid4()), **message}
     if producer:
         try:
+            chaos_middleware.checkpoint('kafka', KafkaTimeoutError)
             future = producer.send(topic, value=message)
             future.get(timeout=10)
             logger.info(f"Published event to {topic}: {message}")
@@ -118,6 +118,14 @@ errors_total = Counter(
     registry=registry
 )
 
+# Chaos Middleware Metrics
+chaos_faults_injected_total = Counter(
+    'product_chaos_faults_injected_total',
+    'Faults injected by the chaos middleware',
+    labelnames=['boundary', 'fault', 'source'],
+    registry=registry
+)
+
 def get_metrics():
     """Generate Prometheus metrics in text format"""
     return generate_latest(registry)
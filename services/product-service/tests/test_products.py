@@ -3,7 +3,10 @@ Comprehensive unit tests for Product Service
 Tests product listing, search, filtering, and retrieval
 """
 import logging
+import time
 
+import chaos_middleware
+import prometheus_metrics
 from app import app
 
 # Configure logging
@@ -234,6 +237,51 @@ class TestProductMetrics:
         logger.info("✓ Product metadata fields present")
 
 
+class TestChaosMiddleware:
+    """Test suite for faults injected through the X-Chaos-Fault header"""
+
+    def setup_method(self):
+        chaos_middleware.settings.configure(True)
+
+    def teardown_method(self):
+        chaos_middleware.settings.configure(False)
+
+    def test_request_latency(self):
+        """Test latency injected before the handler runs"""
+        logger.info("Testing request latency fault")
+
+        start = time.perf_counter()
+        response = client.get("/products", headers={"X-Chaos-Fault": "latency=200"})
+
+        assert response.status_code == 200
+        assert time.perf_counter() - start >= 0.2
+        assert response.headers["X-Chaos-Injected"] == "boundary=request;latency=200"
+        logger.info("✓ Request delayed by 200ms")
+
+    def test_db_error(self):
+        """Test a database fault surfacing through the handler's error path"""
+        logger.info("Testing db fault")
+
+        errors = prometheus_metrics.errors_total.labels(error_type='OperationalError', endpoint='/products')
+        before = errors._value.get()
+        response = client.get("/products", headers={"X-Chaos-Fault": "error=500;boundary=db"})
+
+        assert response.status_code == 500
+        assert response.headers["X-Chaos-Injected"] == "boundary=db;error=500"
+        assert errors._value.get() == before + 1
+        logger.info("✓ Query failed with OperationalError")
+
+    def test_disabled_ignores_header(self):
+        """Test the header has no effect while the middleware is off"""
+        chaos_middleware.settings.configure(False)
+
+        response = client.get("/products", headers={"X-Chaos-Fault": "error=503"})
+
+        assert response.status_code == 200
+        assert "X-Chaos-Injected" not in response.headers
+        logger.info("✓ Header ignored while disabled")
+
+
 if __name__ == "__main__":
     # Run with: pytest services/product-service/tests/test_products.py -v
     logger.info("Run tests with: pytest services/product-service/tests/test_products.py -v")
@@ -0,0 +1,269 @@
+"""
+Fault injection inside a service's own request path
+ASGI and WSGI middleware pick a fault per request (from the X-Chaos-Fault
+header or by sampling) and fire it at the request, database or Kafka boundary.
+This module is kept identical in every Python service that mounts it: each
+service's image is built from its own directory, so a shared package could
+not be copied in. tests/test_chaos.py in chaos-service checks the copies match.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+FAULT_HEADER = 'X-Chaos-Fault'
+INJECTED_HEADER = 'X-Chaos-Injected'
+BOUNDARIES = ('request', 'db', 'kafka')
+
+# Statuses a request-boundary error may answer with
+MIN_STATUS, MAX_STATUS = 400, 599
+DEFAULT_MAX_DELAY_MS = 10000
+
+_current_fault = contextvars.ContextVar('chaos_fault', default=None)
+
+
+class ChaosFaultError(Exception):
+    """Raised at a boundary when no service-specific error type is given"""
+
+
+class Fault:
+    """A fault for one request: an optional delay, then an optional error.
+
+    At the request boundary the error is an HTTP response with `status`; at
+    the db and kafka boundaries it is an exception raised where the real
+    call would have failed. A fault fires once, at the first matching
+    boundary the request reaches.
+    """
+    __slots__ = ('boundary', 'delay_ms', 'status', 'source', 'fired')
+
+    def __init__(self, boundary='request', delay_ms=0, status=None, source='header'):
+        self.boundary = boundary
+        self.delay_ms = delay_ms
+        self.status = status
+        self.source = source
+        self.fired = False
+
+    def describe(self):
+        parts = [f"boundary={self.boundary}"]
+        if self.delay_ms:
+            parts.append(f"latency={self.delay_ms}")
+        if self.status:
+            parts.append(f"error={self.status}")
+        return ';'.join(parts)
+
+    @classmethod
+    def parse(cls, value, source='header', max_delay_ms=DEFAULT_MAX_DELAY_MS):
+        """Parse "latency=200;error=503;boundary=db" (latency may be a min-max range).
+
+        Returns None for a value that names no fault or cannot be parsed.
+        The delay is capped at `max_delay_ms` and the status clamped to 4xx-5xx.
+        """
+        fields = {}
+        for item in value.replace(',', ';').split(';'):
+            key, _, val = item.partition('=')
+            if key.strip():
+                fields[key.strip().lower()] = val.strip()
+        boundary = fields.get('boundary', 'request')
+        if boundary not in BOUNDARIES:
+            return None
+        try:
+            delay_ms = 0
+            if 'latency' in fields:
+                low, _, high = fields['latency'].partition('-')
+                delay_ms = random.randint(int(low), int(high)) if high else int(low)
+            status = int(fields['error'] or 500) if 'error' in fields else None
+        except ValueError:
+            logger.warning(f"Ignoring malformed {source} chaos fault: {value[:200]!r}")
+            return None
+        delay_ms = min(delay_ms, max_delay_ms)
+        if status is not None:
+            status = min(max(status, MIN_STATUS), MAX_STATUS)
+        if not delay_ms and status is None:
+            return None
+        return cls(boundary, delay_ms, status, source)
+
+
+class ChaosSettings:
+    """Whether and how faults are injected; changeable at runtime.
+
+    `header` honours X-Chaos-Fault; `sample_rate` applies `sample_fault`
+    (header syntax) to that fraction of requests. No fault delays a request
+    by more than `max_delay_ms`. `active` is the single flag the middleware
+    checks per request.
+    """
+
+    def __init__(self, enabled=False, header=True, sample_rate=0.0, sample_fault='',
+                 max_delay_ms=DEFAULT_MAX_DELAY_MS):
+        self.max_delay_ms = max_delay_ms
+        self.configure(enabled, header, sample_rate, sample_fault)
+
+    def configure(self, enabled, header=True, sample_rate=0.0, sample_fault=''):
+        if sample_fault and Fault.parse(sample_fault, 'sampled', self.max_delay_ms) is None:
+            sample_fault = ''  # logged by parse(), or names no fault
+        self.enabled = enabled
+        self.header = header
+        self.sample_rate = sample_rate if sample_fault else 0.0
+        self.sample_fault = sample_fault
+        self.active = enabled and (header or self.sample_rate > 0)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv('CHAOS_MIDDLEWARE_ENABLED', 'false').lower() == 'true',
+            header=os.getenv('CHAOS_MIDDLEWARE_HEADER', 'true').lower() == 'true',
+            sample_rate=float(os.getenv('CHAOS_MIDDLEWARE_SAMPLE_RATE', 0)),
+            sample_fault=os.getenv('CHAOS_MIDDLEWARE_SAMPLE_FAULT', ''),
+            max_delay_ms=int(os.getenv('CHAOS_MAX_DELAY_MS', DEFAULT_MAX_DELAY_MS)),
+        )
+
+    def pick(self, header_value):
+        if self.header and header_value:
+            fault = Fault.parse(header_value, 'header', self.max_delay_ms)
+            if fault is not None:
+                return fault
+        if self.sample_rate and random.random() < self.sample_rate:
+            return Fault.parse(self.sample_fault, 'sampled', self.max_delay_ms)
+        return None
+
+
+settings = ChaosSettings.from_env()
+
+
+def checkpoint(boundary, error=ChaosFaultError):
+    """Fire the current request's fault if it targets `boundary` (sync code).
+
+    Call where the service crosses into a dependency, passing the exception
+    type a real failure there would raise.
+    """
+    fault = _current_fault.get()
+    if fault is None or fault.fired or fault.boundary != boundary:
+        return
+    fault.fired = True
+    _report(fault)
+    if fault.delay_ms:
+        time.sleep(fault.delay_ms / 1000)
+    if fault.status is not None:
+        raise error(f"Chaos fault injected at {boundary} boundary")
+
+
+def instrument_sqlalchemy(engine):
+    """Make every SQL statement on `engine` a db boundary"""
+    from sqlalchemy import event
+    from sqlalchemy.exc import OperationalError
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_fault.get() is not None:
+            checkpoint('db', lambda message: OperationalError(statement, parameters, ChaosFaultError(message)))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+_on_fault = None
+
+
+def on_fault(callback):
+    """Register `callback(boundary, kind, source)` for every fault fired"""
+    global _on_fault
+    _on_fault = callback
+
+
+def _report(fault):
+    if _on_fault is not None:
+        if fault.delay_ms:
+            _on_fault(fault.boundary, 'latency', fault.source)
+        if fault.status is not None:
+            _on_fault(fault.boundary, 'error', fault.source)
+
+
+def _error_response(fault):
+    return b'{"detail":"Chaos fault injected"}', [
+        (b'content-type', b'application/json'),
+        (INJECTED_HEADER.lower().encode(), fault.describe().encode()),
+    ]
+
+
+class ChaosASGIMiddleware:
+    """ASGI middleware (FastAPI: app.add_middleware(ChaosASGIMiddleware))"""
+
+    def __init__(self, app, settings=settings):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        if not self.settings.active or scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        header_value = None
+        if self.settings.header:
+            for name, value in scope['headers']:
+                if name == b'x-chaos-fault':
+                    header_value = value.decode('latin-1')
+                    break
+        fault = self.settings.pick(header_value)
+        if fault is None:
+            return await self.app(scope, receive, send)
+
+        if fault.boundary == 'request':
+            fault.fired = True
+            _report(fault)
+            if fault.delay_ms:
+                await asyncio.sleep(fault.delay_ms / 1000)
+            if fault.status is not None:
+                body, headers = _error_response(fault)
+                await send({'type': 'http.response.start', 'status': fault.status, 'headers': headers})
+                await send({'type': 'http.response.body', 'body': body})
+                return
+
+        async def send_marked(message):
+            if message['type'] == 'http.response.start' and fault.fired:
+                message['headers'] = [*message.get('headers', []),
+                                      (INJECTED_HEADER.lower().encode(), fault.describe().encode())]
+            await send(message)
+
+        token = _current_fault.set(fault)
+        try:
+            await self.app(scope, receive, send_marked)
+        finally:
+            _current_fault.reset(token)
+
+
+class ChaosWSGIMiddleware:
+    """WSGI middleware (Flask: app.wsgi_app = ChaosWSGIMiddleware(app.wsgi_app))"""
+
+    def __init__(self, app, settings=settings):
+        self.app = app
+        self.settings = settings
+
+    def __call__(self, environ, start_response):
+        if not self.settings.active:
+            return self.app(environ, start_response)
+
+        fault = self.settings.pick(environ.get('HTTP_X_CHAOS_FAULT') if self.settings.header else None)
+        if fault is None:
+            return self.app(environ, start_response)
+
+        if fault.boundary == 'request':
+            fault.fired = True
+            _report(fault)
+            if fault.delay_ms:
+                time.sleep(fault.delay_ms / 1000)
+            if fault.status is not None:
+                body, headers = _error_response(fault)
+                start_response(f'{fault.status} Chaos Fault',
+                               [(k.decode(), v.decode()) for k, v in headers])
+                return [body]
+
+        def start_response_marked(status, headers, exc_info=None):
+            if fault.fired:
+                headers = [*headers, (INJECTED_HEADER, fault.describe())]
+            return start_response(status, headers, exc_info)
+
+        token = _current_fault.set(fault)
+        try:
+            return self.app(environ, start_response_marked)
+        finally:
+            _current_fault.reset(token)
@@ -12,6 +12,7 @@ from database import get_db, engine
 import models
 import schemas
 from kafka_producer import publish_event
+import chaos_middleware
 import prometheus_metrics
 
 # Create tables
@@ -28,6 +29,12 @@ app.add_middleware(
    allow_headers=["*"],
 )
 
+# Fault injection via the X-Chaos-Fault header (off unless CHAOS_MIDDLEWARE_ENABLED)
+app.add_middleware(chaos_middleware.ChaosASGIMiddleware)
+chaos_middleware.instrument_sqlalchemy(engine)
+chaos_middleware.on_fault(lambda boundary, fault, source: prometheus_metrics.chaos_faults_injected_total.labels(
+   boundary=boundary, fault=fault, source=source).inc())
+
 @app.get("/health")
 def health_check():
    return {
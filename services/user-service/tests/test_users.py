@@ -4,7 +4,10 @@ Tests user registration, login, authentication, and user management
 """
 from fastapi.testclient import TestClient
 import logging
+import time
 
+import chaos_middleware
+import prometheus_metrics
 from main import app
 
 # Configure logging
@@ -257,6 +260,44 @@ class TestUserEdgeCases:
         logger.info(f"✓ Invalid user ID returned status: {response.status_code}")
 
 
+class TestChaosMiddleware:
+    """Test suite for faults injected through the X-Chaos-Fault header"""
+
+    def setup_method(self):
+        chaos_middleware.settings.configure(True)
+
+    def teardown_method(self):
+        chaos_middleware.settings.configure(False)
+
+    def test_request_error(self):
+        """Test an error response returned before the handler runs"""
+        logger.info("Testing request error fault")
+
+        response = client.get("/users", headers={"X-Chaos-Fault": "error=503"})
+
+        assert response.status_code == 503
+        assert response.headers["X-Chaos-Injected"] == "boundary=request;error=503"
+        logger.info("✓ Request failed with 503")
+
+    def test_db_latency_and_error(self):
+        """Test database faults inside the sync handler"""
+        logger.info("Testing db faults")
+
+        start = time.perf_counter()
+        response = client.get("/users", headers={"X-Chaos-Fault": "latency=200;boundary=db"})
+        assert response.status_code == 200
+        assert time.perf_counter() - start >= 0.2
+        assert response.headers["X-Chaos-Injected"] == "boundary=db;latency=200"
+
+        errors = prometheus_metrics.errors_total.labels(error_type='OperationalError', endpoint='/users')
+        before = errors._value.get()
+        failing = TestClient(app, raise_server_exceptions=False)
+        response = failing.get("/users", headers={"X-Chaos-Fault": "error=500;boundary=db"})
+        assert response.status_code == 500
+        assert errors._value.get() == before + 1
+        logger.info("✓ Query delayed, then failed with OperationalError")
+
+
 if __name__ == "__main__":
     # Run with: pytest services/user-service/tests/test_users.py -v
     logger.info("Run tests with: pytest services/user-service/tests/test_users.py -v")